@@ -75,8 +75,6 @@ from bitdust.logs import lg
 
 from bitdust.automats import automat
 
-from bitdust.system import bpio
-
 from bitdust.lib import strng
 from bitdust.lib import serialization
 from bitdust.lib import packetid
@@ -967,7 +965,7 @@ class SharedAccessCoordinator(automat.Automat):
             key_id=self.key_id,
             path=packetid.MakeIndexFileNamePacketID(),
         )
-        data = bpio.ReadBinaryFile(settings.BackupIndexFilePath(self.customer_idurl, self.key_alias))
+        data = backup_fs.IndexFileData(self.customer_idurl, self.key_alias)
         b = encrypted.Block(
             CreatorID=my_id.getIDURL(),
             BackupID=packetID,
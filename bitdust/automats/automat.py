@@ -99,6 +99,7 @@ _Counter = 0  # : Increment by one for every new object, the idea is to keep uni
 _Index = {}  # : Index dictionary, unique id (string) to index (int)
 _Objects = {}  # : Objects dictionary to store all state machines objects
 _StateChangedCallback = None  # : Called when some state were changed
+_EventCallback = None  # : Called after every event was processed, used to collect metrics
 
 #------------------------------------------------------------------------------
 
@@ -112,6 +113,7 @@ def shutdown():
     global _Index
     global _Objects
     global _StateChangedCallback
+    global _EventCallback
     LifeBegins(0)
     CloseLogFile()
     SetGlobalLogEvents()
@@ -119,6 +121,7 @@ def shutdown():
     SetExceptionsHandler(None)
     SetLogOutputHandler(None)
     _StateChangedCallback = None
+    _EventCallback = None
     _Index.clear()
     _Objects.clear()
     _Counter = 0
@@ -256,6 +259,17 @@ def SetStateChangedCallback(cb):
     _StateChangedCallback = cb
 
 
+def SetEventCallback(cb):
+    """
+    Set callback to be fired after any state machine processed an event,
+    ``duration`` is time in seconds spent inside of ``event()`` method, parameters are::
+
+    cb(class name, event, old state, new state, duration)
+    """
+    global _EventCallback
+    _EventCallback = cb
+
+
 def SetLogOutputHandler(cb):
     """
     Set callback to be fired when a log line is about to be printed from any state machine
@@ -559,6 +573,9 @@ class Automat(object):
         Use ``fast = True`` flag to skip call to reactor.callLater(0, self.event, ...).
         """
         global _StateChangedCallback
+        event_callback = _EventCallback
+        if event_callback is not None:
+            started = time.perf_counter()
         if _GlobalLogEvents or self.log_events:
             if self.log_events or not event.startswith('timer-'):
                 self.log(self.debug_level, '%s fired with event "%s"' % (
@@ -578,6 +595,8 @@ class Automat(object):
                 new_state = self.A(event, *args, **kwargs)
             except Exception as exc:
                 self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
+                if event_callback is not None:
+                    event_callback(self.__class__.__name__, event, old_state, self.state, time.perf_counter() - started)
                 return self
             self.state = new_state
         else:
@@ -585,6 +604,8 @@ class Automat(object):
                 self.A(event, *args, **kwargs)
             except Exception as exc:
                 self.exc(msg='Exception in {}:{} automat, state is {}, event="{}" : {}'.format(self.id, self.name, self.state, event, exc))
+                if event_callback is not None:
+                    event_callback(self.__class__.__name__, event, old_state, self.state, time.perf_counter() - started)
                 return self
             new_state = self.state
         if old_state != new_state:
@@ -608,6 +629,8 @@ class Automat(object):
                 if self.publish_event_state_not_changed:
                     self.pushEvent(old_state, new_state, event)
         self.executeStateChangedCallbacks(old_state, new_state, event, *args, **kwargs)
+        if event_callback is not None:
+            event_callback(self.__class__.__name__, event, old_state, new_state, time.perf_counter() - started)
         return self
 
     def timerEvent(self, name, interval):
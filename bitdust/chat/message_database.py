@@ -27,6 +27,26 @@
 ..
 
 module:: message_database
+
+All new messages are written to the database from a dedicated writer thread.
+`insert_message()` only puts a new record into the queue and returns immediately,
+the writer thread collects all queued records into one transaction.
+Snapshots are pushed to the listeners from the main thread after the transaction was committed.
+
+Database works in WAL mode, so readers in the main thread are not blocked by the writer
+and only see messages which were already committed.
+Other modifications of "history" and "conversations" tables are also executed by the writer thread,
+see `run_in_writer()`, so they are applied in the same order as queued messages.
+When a batch fails, its records are written one by one and failed records are re-tried later.
+Message which was not stored after `MAX_WRITE_ATTEMPTS` is reported with "message-store-failed" event.
+Call `flush()` to wait until all queued records are committed, it blocks and must not be used from the main thread
+while the reactor is running.
+
+Conversation history is read page by page with `query_messages_page()`: every page ends with a cursor
+pointing to the last message, so the next page is selected directly from the index instead of skipping rows with OFFSET.
+Text of all messages is also stored in "history_text" FTS5 table, see `search_messages()`.
+Messages stored before that table was created are indexed in background by the writer thread, batch by batch,
+until then search is done with a slower substring match.
 """
 
 #------------------------------------------------------------------------------
@@ -44,6 +64,13 @@ _DebugLevel = 10
 import os
 import json
 import sqlite3
+import threading
+import collections
+
+try:
+    from queue import Queue, Empty
+except:
+    from Queue import Queue, Empty  # @UnresolvedImport
 
 #------------------------------------------------------------------------------
 
@@ -54,6 +81,10 @@ if __name__ == '__main__':
 
 #------------------------------------------------------------------------------
 
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
 from bitdust.logs import lg
 
 from bitdust.lib import utime
@@ -61,6 +92,7 @@ from bitdust.lib import strng
 
 from bitdust.main import settings
 from bitdust.main import listeners
+from bitdust.main import events
 
 from bitdust.crypt import my_keys
 
@@ -76,6 +108,26 @@ from bitdust.userid import my_id
 
 _HistoryDB = None
 _HistoryCursor = None
+_WriterThread = None
+_WriterQueue = None
+_CommittedWrites = collections.deque()
+_FailedWrites = collections.deque()
+_FullTextSearchEnabled = False
+_FullTextSearchReady = False
+
+#------------------------------------------------------------------------------
+
+MAX_WRITE_BATCH_SIZE = 500
+MAX_WRITE_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 5
+
+# both connections are waiting for each other the same time
+DATABASE_BUSY_TIMEOUT = 10
+
+SCHEMA_VERSION = 2
+
+# task executed in the writer thread can return that to be queued again after the transaction was committed
+TASK_REPEAT = 'repeat'
 
 #------------------------------------------------------------------------------
 
@@ -112,7 +164,7 @@ def init(filepath=None):
     sqlite3.register_converter('JSON', convert_json)
 
     if not os.path.isfile(filepath):
-        _HistoryDB = sqlite3.connect(filepath, timeout=1)
+        _HistoryDB = sqlite3.connect(filepath, timeout=DATABASE_BUSY_TIMEOUT)
         _HistoryDB.execute('PRAGMA case_sensitive_like = 1;')
         _HistoryCursor = _HistoryDB.cursor()
 
@@ -152,12 +204,21 @@ def init(filepath=None):
         _HistoryDB.commit()
         _HistoryDB.close()
 
-    _HistoryDB = sqlite3.connect(filepath, timeout=1)
+    _HistoryDB = sqlite3.connect(filepath, timeout=DATABASE_BUSY_TIMEOUT)
     _HistoryDB.text_factory = str
     _HistoryDB.execute('PRAGMA case_sensitive_like = 1;')
+    _HistoryDB.execute('PRAGMA journal_mode = WAL;')
+    _HistoryDB.execute('PRAGMA synchronous = NORMAL;')
     _HistoryDB.commit()
     _HistoryCursor = _HistoryDB.cursor()
 
+    upgrade_schema()
+
+    start_writer(filepath)
+
+    if _FullTextSearchEnabled and not _FullTextSearchReady:
+        run_in_writer(backfill_text_index)
+
     check_create_keys()
 
 
@@ -167,6 +228,8 @@ def shutdown():
     if _Debug:
         lg.dbg(_DebugLevel, '')
 
+    stop_writer()
+
     _HistoryDB.commit()
     _HistoryDB.close()
     _HistoryDB = None
@@ -189,6 +252,344 @@ def cur(instance='current'):
 #------------------------------------------------------------------------------
 
 
+def upgrade_schema():
+    """
+    Brings existing database to the latest version, current version is stored in "user_version" field.
+    Version 1 adds indexes used to select and paginate messages of a single conversation.
+    Version 2 adds "history_text" full-text index, text of already stored messages is indexed later in background.
+    """
+    global _FullTextSearchEnabled
+    global _FullTextSearchReady
+    version = cur().execute('PRAGMA user_version').fetchone()[0]
+    if version < 1:
+        cur().execute('CREATE INDEX IF NOT EXISTS "sender recipient message id" on history(sender_local_key_id, recipient_local_key_id, payload_message_id)')
+        cur().execute('CREATE INDEX IF NOT EXISTS "recipient type message id" on history(recipient_local_key_id, payload_type, payload_message_id)')
+        cur().execute('CREATE INDEX IF NOT EXISTS "payload time" on history(payload_time)')
+        cur().execute('CREATE INDEX IF NOT EXISTS "last updated time" on conversations(last_updated_time)')
+        cur().execute('PRAGMA user_version = 1')
+        db().commit()
+        lg.info('message history database upgraded to version 1')
+    if version < 2:
+        try:
+            cur().execute('CREATE VIRTUAL TABLE IF NOT EXISTS "history_text" USING fts5(text, content="", tokenize="unicode61 remove_diacritics 2")')
+        except sqlite3.OperationalError as exc:
+            db().rollback()
+            lg.warn('full-text search is not available: %r' % exc)
+        else:
+            # remember which of the messages must be indexed, new messages are indexed by the writer thread
+            cur().execute('CREATE TABLE IF NOT EXISTS "history_text_backfill" ("next_rowid" INTEGER, "last_rowid" INTEGER)')
+            cur().execute('INSERT INTO history_text_backfill (next_rowid, last_rowid) SELECT 0, IFNULL(MAX(rowid), 0) FROM history')
+            cur().execute('PRAGMA user_version = 2')
+            db().commit()
+            lg.info('message history database upgraded to version 2, already stored messages will be indexed in background')
+    _FullTextSearchEnabled = has_text_index(cur())
+    _FullTextSearchReady = _FullTextSearchEnabled and not has_table(cur(), 'history_text_backfill')
+
+
+def has_table(cursor, table_name):
+    cursor.execute('SELECT count(name) FROM sqlite_master WHERE type="table" AND name=?', (table_name, ))
+    return bool(cursor.fetchone()[0])
+
+
+def has_text_index(cursor):
+    return has_table(cursor, 'history_text')
+
+
+def backfill_text_index(cursor):
+    """
+    Executed in the writer thread, indexes text of the next batch of messages stored before "history_text" table was created.
+    Task is queued again after every committed batch, so new messages are written in between.
+    Search is switched to the full-text index only when the whole backfill was committed.
+    """
+    global _FullTextSearchReady
+    if not has_table(cursor, 'history_text_backfill'):
+        _FullTextSearchReady = True
+        lg.info('full-text index of the message history is ready')
+        return None
+    next_rowid, last_rowid = cursor.execute('SELECT next_rowid, last_rowid FROM history_text_backfill').fetchone()
+    rows = list(cursor.execute('SELECT rowid, payload_body FROM history WHERE rowid>=? AND rowid<=? ORDER BY rowid LIMIT ?', (next_rowid, last_rowid, MAX_WRITE_BATCH_SIZE)))
+    batch = []
+    for rowid, payload_body in rows:
+        try:
+            text = extract_message_text(json.loads(payload_body))
+        except:
+            lg.exc()
+            continue
+        batch.append((rowid, text))
+    cursor.executemany('INSERT INTO history_text (rowid, text) VALUES (?, ?)', batch)
+    if rows and rows[-1][0] < last_rowid:
+        cursor.execute('UPDATE history_text_backfill SET next_rowid=?', (rows[-1][0] + 1, ))
+    else:
+        cursor.execute('DROP TABLE history_text_backfill')
+    if _Debug:
+        lg.args(_DebugLevel, next_rowid=next_rowid, last_rowid=last_rowid, indexed=len(batch))
+    return TASK_REPEAT
+
+
+def extract_message_text(data):
+    """
+    Collects all text values from the message payload, keys are not included.
+    """
+    if isinstance(data, dict):
+        return ' '.join([extract_message_text(v) for v in data.values()]).strip()
+    if isinstance(data, (list, tuple)):
+        return ' '.join([extract_message_text(v) for v in data]).strip()
+    if isinstance(data, str):
+        return data
+    return ''
+
+
+#------------------------------------------------------------------------------
+
+
+def start_writer(filepath):
+    global _WriterThread
+    global _WriterQueue
+    if _WriterThread:
+        raise Exception('database writer thread already started')
+    _WriterQueue = Queue()
+    _WriterThread = threading.Thread(
+        target=writer_thread,
+        args=(filepath, _WriterQueue),
+        name='message_database_writer',
+    )
+    _WriterThread.daemon = True
+    _WriterThread.start()
+
+
+def stop_writer():
+    global _WriterThread
+    global _WriterQueue
+    if not _WriterThread:
+        return
+    _WriterQueue.put(None)
+    _WriterThread.join()
+    _WriterThread = None
+    _WriterQueue = None
+    process_committed_writes()
+    process_failed_writes()
+
+
+def writer_thread(filepath, writer_queue):
+    """
+    Takes all records from the queue which are ready and writes them in a single transaction.
+    Stops when None was received from the queue.
+    """
+    writer_db = sqlite3.connect(filepath, timeout=DATABASE_BUSY_TIMEOUT)
+    writer_db.text_factory = str
+    writer_db.execute('PRAGMA case_sensitive_like = 1;')
+    writer_db.execute('PRAGMA synchronous = NORMAL;')
+    writer_cursor = writer_db.cursor()
+    full_text = has_text_index(writer_cursor)
+    stopped = False
+    while not stopped:
+        batch = [
+            writer_queue.get(),
+        ]
+        while len(batch) < MAX_WRITE_BATCH_SIZE:
+            try:
+                batch.append(writer_queue.get_nowait())
+            except Empty:
+                break
+        records = []
+        for record in batch:
+            if record is None:
+                stopped = True
+            else:
+                records.append(record)
+        if records:
+            repeated = []
+            try:
+                committed = write_records(writer_cursor, records, full_text=full_text, repeated=repeated)
+                writer_db.commit()
+            except:
+                lg.exc()
+                writer_db.rollback()
+                # find records which are failing, all others must be written anyway
+                committed = []
+                repeated = []
+                for record in records:
+                    record_repeated = []
+                    try:
+                        committed.extend(write_records(writer_cursor, [record], full_text=full_text, repeated=record_repeated))
+                        writer_db.commit()
+                    except Exception as exc:
+                        writer_db.rollback()
+                        _FailedWrites.append((record, str(exc)))
+                    else:
+                        repeated.extend(record_repeated)
+                if _FailedWrites:
+                    reactor.callFromThread(process_failed_writes)  # @UndefinedVariable
+            if committed:
+                _CommittedWrites.extend(committed)
+                reactor.callFromThread(process_committed_writes)  # @UndefinedVariable
+            for record in repeated:
+                writer_queue.put(record)
+        for _ in batch:
+            writer_queue.task_done()
+    writer_db.close()
+
+
+def write_records(cursor, records, full_text=False, repeated=None):
+    """
+    Writes queued messages and executes queued tasks, returns a list of (message_json, new_conversation_info) tuples.
+    Tasks which returned `TASK_REPEAT` are added to the `repeated` list.
+    """
+    committed = []
+    for record in records:
+        if 'task' in record:
+            result = record['task'](cursor, *record['args'])
+            if result == TASK_REPEAT:
+                if repeated is not None:
+                    repeated.append(record)
+                continue
+            committed.extend(result or [])
+            continue
+        cursor.execute(
+            '''INSERT INTO history (
+                sender_local_key_id,
+                sender_id,
+                recipient_local_key_id,
+                recipient_id,
+                direction,
+                payload_type,
+                payload_time,
+                payload_message_id,
+                payload_body
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', record['row'],
+        )
+        message_json = record['message_json']
+        if full_text:
+            cursor.execute('INSERT INTO history_text (rowid, text) VALUES (?, ?)', (
+                cursor.lastrowid,
+                extract_message_text(message_json['payload']['data']),
+            ))
+        new_conversation = write_conversation(
+            cursor=cursor,
+            conversation_id=message_json['conversation_id'],
+            payload_type=record['row'][5],
+            payload_time=message_json['payload']['time'],
+            payload_message_id=message_json['payload']['message_id'],
+        )
+        new_conversation_info = None
+        if new_conversation:
+            new_conversation_info = dict(
+                conversation_id=message_json['conversation_id'],
+                type=message_json['payload']['msg_type'],
+                started=message_json['payload']['time'],
+                last_updated=message_json['payload']['time'],
+                last_message_id=message_json['payload']['message_id'],
+            )
+        committed.append((message_json, new_conversation_info))
+    return committed
+
+
+def write_conversation(cursor, conversation_id, payload_type, payload_time, payload_message_id):
+    """
+    Returns True if a new conversation record was created.
+    """
+    cursor.execute('UPDATE conversations SET last_updated_time=?, last_message_id=? WHERE conversation_id=?', (
+        payload_time,
+        payload_message_id,
+        conversation_id,
+    ))
+    if cursor.rowcount > 0:
+        return False
+    cursor.execute('INSERT INTO conversations (conversation_id, payload_type, started_time, last_updated_time, last_message_id) VALUES (?, ?, ?, ?, ?)', (
+        conversation_id,
+        payload_type,
+        payload_time,
+        payload_time,
+        payload_message_id,
+    ))
+    return True
+
+
+def process_committed_writes():
+    """
+    Must be called from the main thread, pushes snapshots for all messages which were already committed.
+    """
+    while _CommittedWrites:
+        message_json, new_conversation_info = _CommittedWrites.popleft()
+        if new_conversation_info:
+            snapshot = build_json_conversation(**new_conversation_info)
+            listeners.push_snapshot('conversation', snap_id=new_conversation_info['conversation_id'], data=snapshot)
+        if message_json:
+            payload = message_json['payload']
+            snap_id = '{}/{}'.format(message_json['conversation_id'], payload['message_id'])
+            listeners.push_snapshot('message', snap_id=snap_id, created=payload['time'], data=message_json)
+
+
+def process_failed_writes():
+    """
+    Must be called from the main thread, schedules failed records to be written again or reports them.
+    """
+    while _FailedWrites:
+        record, error = _FailedWrites.popleft()
+        record['attempts'] = record.get('attempts', 0) + 1
+        if record['attempts'] < MAX_WRITE_ATTEMPTS:
+            lg.warn('failed to write %r to the database, attempt %d: %s' % (describe_record(record), record['attempts'], error))
+            reactor.callLater(WRITE_RETRY_DELAY, retry_write, record)  # @UndefinedVariable
+            continue
+        lg.err('failed to write %r to the database after %d attempts: %s' % (describe_record(record), record['attempts'], error))
+        if 'message_json' in record:
+            message_json = record['message_json']
+            events.send('message-store-failed', data=dict(
+                message_id=message_json['payload']['message_id'],
+                conversation_id=message_json['conversation_id'],
+                sender=message_json['sender']['glob_id'],
+                recipient=message_json['recipient']['glob_id'],
+                error=error,
+            ))
+
+
+def retry_write(record):
+    if not _WriterQueue:
+        lg.err('database writer is not running, %r was not written' % describe_record(record))
+        return
+    _WriterQueue.put(record)
+
+
+def describe_record(record):
+    if 'task' in record:
+        return record['task'].__name__
+    return record['message_json']['payload']['message_id']
+
+
+def run_in_writer(task, *args):
+    """
+    Executes `task(cursor, *args)` in the writer thread after all already queued messages are written.
+    Task must return a list of (message_json, new_conversation_info) tuples to be pushed as snapshots or None,
+    or `TASK_REPEAT` to be executed again after the transaction was committed.
+    When writer thread is not running task is executed right away.
+    """
+    if _WriterQueue:
+        _WriterQueue.put({
+            'task': task,
+            'args': args,
+        })
+        return
+    committed = TASK_REPEAT
+    while committed == TASK_REPEAT:
+        committed = task(cur(), *args)
+        db().commit()
+    _CommittedWrites.extend(committed or [])
+    process_committed_writes()
+
+
+def flush():
+    """
+    Blocks until all of the queued messages are written to the database.
+    """
+    if _WriterThread and _WriterThread.is_alive():
+        _WriterQueue.join()
+    process_committed_writes()
+    process_failed_writes()
+
+
+#------------------------------------------------------------------------------
+
+
 def adapt_json(data):
     return (json.dumps(data, sort_keys=True)).encode()
 
@@ -322,7 +723,8 @@ def build_json_conversation(**record):
 
 def insert_message(data, message_id, message_time=None, sender=None, recipient=None, message_type=None, direction=None):
     """
-    Writes JSON message to the message database.
+    Puts JSON message into the writer queue and returns it immediately.
+    Snapshot will be pushed to the listeners after the message was committed to the database.
     """
     payload_time = message_time or utime.utcnow_to_sec1970()
     payload_message_id = strng.to_text(message_id)
@@ -348,32 +750,13 @@ def insert_message(data, message_id, message_time=None, sender=None, recipient=N
     if sender_local_key_id is None or recipient_local_key_id is None:
         lg.err('failed to store message because local_key_id is not found, sender=%r recipient=%r' % (sender_local_key_id, recipient_local_key_id))
         return None
-    cur().execute(
-        '''INSERT INTO history (
-            sender_local_key_id,
-            sender_id,
-            recipient_local_key_id,
-            recipient_id,
-            direction,
-            payload_type,
-            payload_time,
-            payload_message_id,
-            payload_body
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
-            sender_local_key_id,
-            sender,
-            recipient_local_key_id,
-            recipient,
-            0 if direction == 'in' else 1,
-            payload_type,
-            payload_time,
-            payload_message_id,
-            data,
-        )
-    )
-    db().commit()
-    conversation_id = update_conversation(sender_local_key_id, recipient_local_key_id, payload_type, payload_time, payload_message_id)
-    snap_id = '{}/{}'.format(conversation_id, payload_message_id)
+    if not _WriterQueue:
+        lg.err('failed to store message because database writer is not running')
+        return None
+    conversation_id = get_conversation_id(sender_local_key_id, recipient_local_key_id, payload_type)
+    if conversation_id is None:
+        lg.err('failed to store message, local_key_id was not found')
+        return None
     message_json = build_json_message(
         sender=sender,
         recipient=recipient,
@@ -384,7 +767,20 @@ def insert_message(data, message_id, message_time=None, sender=None, recipient=N
         message_id=payload_message_id,
         data=data,
     )
-    listeners.push_snapshot('message', snap_id=snap_id, created=payload_time, data=message_json)
+    _WriterQueue.put({
+        'row': (
+            sender_local_key_id,
+            sender,
+            recipient_local_key_id,
+            recipient,
+            0 if direction == 'in' else 1,
+            payload_type,
+            payload_time,
+            payload_message_id,
+            data,
+        ),
+        'message_json': message_json,
+    })
     return message_json
 
 
@@ -393,54 +789,41 @@ def update_conversation(sender_local_key_id, recipient_local_key_id, payload_typ
     if conversation_id is None:
         lg.err('failed to update conversation, local_key_id was not found')
         return None
-    sql = 'SELECT * FROM conversations WHERE conversation_id=?'
-    params = [
-        conversation_id,
-    ]
-    found_conversation = list(cur().execute(sql, params))
-    if found_conversation:
-        sql = 'UPDATE conversations SET last_updated_time=?, last_message_id=? WHERE conversation_id=?'
-        params = [
-            payload_time,
-            payload_message_id,
-            conversation_id,
-        ]
-    else:
-        sql = 'INSERT INTO conversations (conversation_id, payload_type, started_time, last_updated_time, last_message_id) VALUES (?, ?, ?, ?, ?)'
-        params = [
-            conversation_id,
-            payload_type,
-            payload_time,
-            payload_time,
-            payload_message_id,
+
+    def _write(cursor):
+        new_conversation = write_conversation(cursor, conversation_id, payload_type, payload_time, payload_message_id)
+        if _Debug:
+            lg.args(_DebugLevel, conversation_id=conversation_id, new_conversation=new_conversation)
+        if not new_conversation:
+            return None
+        return [
+            (None, dict(
+                conversation_id=conversation_id,
+                type=MESSAGE_TYPE_CODES.get(int(payload_type), 'private_message'),
+                started=payload_time,
+                last_updated=payload_time,
+                last_message_id=payload_message_id,
+            )),
         ]
-    if _Debug:
-        lg.args(_DebugLevel, conversation_id=conversation_id, found_conversation=len(found_conversation), params=params)
-    cur().execute(sql, params)
-    db().commit()
-    if not found_conversation:
-        snapshot = build_json_conversation(
-            conversation_id=conversation_id,
-            type=MESSAGE_TYPE_CODES.get(int(payload_type), 'private_message'),
-            started=payload_time,
-            last_updated=payload_time,
-            last_message_id=payload_message_id,
-        )
-        listeners.push_snapshot('conversation', snap_id=conversation_id, data=snapshot)
+
+    run_in_writer(_write)
     return conversation_id
 
 
-def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_by_id=True, order_by_time=False, message_types=[], sequence_head=None, sequence_tail=None, offset=None, limit=None, raw_results=False):
-    sql = 'SELECT * FROM history'
-    q = ''
+def build_messages_filter(sender_id=None, recipient_id=None, bidirectional=True, message_types=[], sequence_head=None, sequence_tail=None):
+    """
+    Returns a tuple with list of SQL conditions and list of parameters to select messages from "history" table.
+    Returns None if local_key_id of the sender or recipient was not found.
+    """
+    conditions = []
     params = []
     if bidirectional and sender_id and recipient_id:
         recipient_local_key_id = my_keys.get_local_key_id(recipient_id)
         sender_local_key_id = my_keys.get_local_key_id(sender_id)
         if recipient_local_key_id is None or sender_local_key_id is None:
             lg.warn('local_key_id was not found, recipient_local_key_id=%r sender_local_key_id=%r' % (recipient_local_key_id, sender_local_key_id))
-            return []
-        q += ' sender_local_key_id IN (?, ?) AND recipient_local_key_id IN (?, ?)'
+            return None
+        conditions.append('sender_local_key_id IN (?, ?) AND recipient_local_key_id IN (?, ?)')
         params += [
             sender_local_key_id,
             recipient_local_key_id,
@@ -452,90 +835,205 @@ def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_
             sender_local_key_id = my_keys.get_local_key_id(sender_id)
             if sender_local_key_id is None:
                 lg.warn('local_key_id was not found for sender %r' % sender_id)
-                return []
-            q += ' sender_local_key_id=?'
+                return None
+            conditions.append('sender_local_key_id=?')
             params.append(sender_local_key_id)
         if recipient_id:
             recipient_local_key_id = my_keys.get_local_key_id(recipient_id)
             if recipient_local_key_id is None:
                 lg.warn('local_key_id was not found for recipient %r' % recipient_id)
-                return []
-            q += ' recipient_local_key_id=?'
+                return None
+            conditions.append('recipient_local_key_id=?')
             params.append(recipient_local_key_id)
     if message_types:
-        if params:
-            q += ' AND payload_type IN (%s)' % (','.join([
-                '?',
-            ]*len(message_types)))
-        else:
-            q += ' payload_type IN (%s)' % (','.join([
-                '?',
-            ]*len(message_types)))
+        conditions.append('payload_type IN (%s)' % (','.join([
+            '?',
+        ]*len(message_types))))
         params.extend([MESSAGE_TYPES.get(mt, 1) for mt in message_types])
     if sequence_head is not None:
-        if params:
-            q += ' AND payload_message_id>=?'
-        else:
-            q += ' payload_message_id>=?'
+        conditions.append('payload_message_id>=?')
         params.append(sequence_head)
     if sequence_tail is not None:
-        if params:
-            q += ' AND payload_message_id<=?'
-        else:
-            q += ' payload_message_id<=?'
+        conditions.append('payload_message_id<=?')
         params.append(sequence_tail)
-    if q:
-        sql += ' WHERE %s' % q
-    if order_by_id:
-        sql += ' ORDER BY payload_message_id DESC'
-    else:
-        if order_by_time:
-            sql += ' ORDER BY payload_time DESC'
-    if limit is not None:
+    return conditions, params
+
+
+def make_cursor(row):
+    """
+    Cursor points to the given raw row, next page will start right after it.
+    """
+    return '{}:{}'.format(row[9], row[7])
+
+
+def parse_cursor(cursor):
+    """
+    Returns tuple (rowid, payload_message_id), raises ValueError if cursor is not valid.
+    """
+    rowid, _, payload_message_id = strng.to_text(cursor).partition(':')
+    return int(rowid), payload_message_id
+
+
+def select_messages(sender_id=None, recipient_id=None, bidirectional=True, order_by_id=True, order_by_time=False, message_types=[], sequence_head=None, sequence_tail=None, offset=None, limit=None, cursor=None):
+    """
+    Executes SQL query and returns iterator over raw rows, "rowid" is added as the last column.
+    When `cursor` is given messages are ordered by ID and only those older than the cursor are selected.
+    """
+    filters = build_messages_filter(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        bidirectional=bidirectional,
+        message_types=message_types,
+        sequence_head=sequence_head,
+        sequence_tail=sequence_tail,
+    )
+    if filters is None:
+        return []
+    conditions, params = filters
+    if cursor is not None:
+        cursor_rowid, cursor_message_id = parse_cursor(cursor)
+        conditions.append('payload_message_id<=? AND (payload_message_id<? OR rowid<?)')
+        params += [
+            cursor_message_id,
+            cursor_message_id,
+            cursor_rowid,
+        ]
+    sql = 'SELECT *, rowid FROM history'
+    if conditions:
+        sql += ' WHERE %s' % (' AND '.join(conditions))
+    if order_by_id or cursor is not None:
+        sql += ' ORDER BY payload_message_id DESC, rowid DESC'
+    elif order_by_time:
+        sql += ' ORDER BY payload_time DESC'
+    if limit is not None or offset is not None:
         sql += ' LIMIT ?'
-        params.append(limit)
+        params.append(limit if limit is not None else -1)
     if offset is not None:
         sql += ' OFFSET ?'
         params.append(offset)
     if _Debug:
         lg.args(_DebugLevel, sql=sql, params=params)
-    results = []
+    return cur().execute(sql, params)
+
+
+def build_json_message_from_row(row):
+    return build_json_message(
+        sender=row[1],
+        recipient=row[3],
+        direction='in' if row[4] == 0 else 'out',
+        conversation_id=get_conversation_id(row[0], row[2], int(row[5])),
+        message_type=MESSAGE_TYPE_CODES.get(int(row[5]), 'private_message'),
+        message_time=row[6],
+        message_id=row[7],
+        data=json.loads(row[8]),
+    )
+
+
+def filter_known_rows(rows):
+    """
+    Skips messages from or to unknown local keys.
+    """
     local_key_ids = {}
-    for row in cur().execute(sql, params):
-        sender_local_key_id = row[0]
-        sender_id_recorded = row[1]
-        recipient_local_key_id = row[2]
-        recipient_id_recorded = row[3]
-        if sender_local_key_id not in local_key_ids:
-            local_key_ids[sender_local_key_id] = my_keys.get_local_key(sender_local_key_id)
-        if recipient_local_key_id not in local_key_ids:
-            local_key_ids[recipient_local_key_id] = my_keys.get_local_key(recipient_local_key_id)
-        if not local_key_ids.get(sender_local_key_id) or not local_key_ids.get(recipient_local_key_id):
-            # lg.warn('unknown sender or recipient local key_id')
-            continue
-        if raw_results:
-            if order_by_time:
-                results.insert(0, row)
-            else:
-                results.append(row)
+    for row in rows:
+        for local_key_id in (row[0], row[2]):
+            if local_key_id not in local_key_ids:
+                local_key_ids[local_key_id] = my_keys.get_local_key(local_key_id)
+        if not local_key_ids.get(row[0]) or not local_key_ids.get(row[2]):
             continue
-        json_msg = build_json_message(
-            sender=sender_id_recorded,
-            recipient=recipient_id_recorded,
-            direction='in' if row[4] == 0 else 'out',
-            conversation_id=get_conversation_id(sender_local_key_id, recipient_local_key_id, int(row[5])),
-            message_type=MESSAGE_TYPE_CODES.get(int(row[5]), 'private_message'),
-            message_time=row[6],
-            message_id=row[7],
-            data=json.loads(row[8]),
-        )
-        if order_by_time:
-            results.insert(0, json_msg)
-        else:
-            results.append(json_msg)
+        yield row
+
+
+def query_messages(sender_id=None, recipient_id=None, bidirectional=True, order_by_id=True, order_by_time=False, message_types=[], sequence_head=None, sequence_tail=None, offset=None, limit=None, cursor=None, raw_results=False):
+    """
+    Returns list of stored messages, newest messages first.
+    If `order_by_time` is set, results are returned in chronological order instead.
+    For pagination prefer `query_messages_page()`, unlike `offset` the cursor does not slow down on deep pages.
+    """
+    rows = select_messages(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        bidirectional=bidirectional,
+        order_by_id=order_by_id,
+        order_by_time=order_by_time,
+        message_types=message_types,
+        sequence_head=sequence_head,
+        sequence_tail=sequence_tail,
+        offset=offset,
+        limit=limit,
+        cursor=cursor,
+    )
+    if raw_results:
+        results = list(filter_known_rows(rows))
+    else:
+        results = [build_json_message_from_row(row) for row in filter_known_rows(rows)]
+    if order_by_time:
+        results.reverse()
     return results
 
 
+def query_messages_page(sender_id=None, recipient_id=None, bidirectional=True, message_types=[], cursor=None, limit=100):
+    """
+    Returns tuple with list of messages ordered by ID from newest to oldest and a cursor to be used to read next page.
+    Cursor is None when there are no more messages.
+    """
+    rows = list(select_messages(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        bidirectional=bidirectional,
+        message_types=message_types,
+        limit=limit,
+        cursor=cursor,
+    ))
+    next_cursor = None
+    if rows and len(rows) == limit:
+        next_cursor = make_cursor(rows[-1])
+    return [build_json_message_from_row(row) for row in filter_known_rows(rows)], next_cursor
+
+
+def search_messages(query, sender_id=None, recipient_id=None, bidirectional=True, message_types=[], offset=None, limit=None):
+    """
+    Full-text search over the text of the stored messages.
+    All words from the `query` must be present in the message, results are ordered by relevance.
+    While full-text index is still being filled in background, messages are matched by a substring
+    of the stored JSON body and the most recent messages are returned first.
+    """
+    if not _FullTextSearchEnabled:
+        lg.warn('full-text search is not available')
+        return []
+    words = strng.to_text(query).split()
+    if not words:
+        return []
+    filters = build_messages_filter(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        bidirectional=bidirectional,
+        message_types=message_types,
+    )
+    if filters is None:
+        return []
+    conditions, params = filters
+    if _FullTextSearchReady:
+        conditions.insert(0, 'history_text MATCH ?')
+        params.insert(0, ' '.join(['"%s"' % w.replace('"', '""') for w in words]))
+        sql = 'SELECT history.*, history.rowid FROM history_text JOIN history ON history.rowid=history_text.rowid'
+        sql += ' WHERE %s ORDER BY history_text.rank' % (' AND '.join(conditions))
+    else:
+        for word in reversed(words):
+            conditions.insert(0, 'instr(lower(CAST(history.payload_body AS TEXT)), ?) > 0')
+            params.insert(0, word.lower())
+        sql = 'SELECT history.*, history.rowid FROM history'
+        sql += ' WHERE %s ORDER BY history.rowid DESC' % (' AND '.join(conditions))
+    if limit is not None or offset is not None:
+        sql += ' LIMIT ?'
+        params.append(limit if limit is not None else -1)
+    if offset is not None:
+        sql += ' OFFSET ?'
+        params.append(offset)
+    if _Debug:
+        lg.args(_DebugLevel, sql=sql, params=params)
+    return [build_json_message_from_row(row) for row in filter_known_rows(cur().execute(sql, params))]
+
+
 def list_conversations(order_by_time=True, message_types=[], offset=None, limit=None):
     sql = 'SELECT * FROM conversations'
     q = ''
@@ -576,14 +1074,13 @@ def list_conversations(order_by_time=True, message_types=[], offset=None, limit=
 #------------------------------------------------------------------------------
 
 
-def update_history_with_new_local_key_id(old_id, new_id):
+def update_history_with_new_local_key_id(cursor, old_id, new_id):
     sql = 'UPDATE history SET sender_local_key_id=? WHERE sender_local_key_id=?'
     params = [
         new_id,
         old_id,
     ]
-    cur().execute(sql, params)
-    db().commit()
+    cursor.execute(sql, params)
     if _Debug:
         lg.args(_DebugLevel, sql=sql, params=params)
     sql = 'UPDATE history SET recipient_local_key_id=? WHERE recipient_local_key_id=?'
@@ -591,17 +1088,16 @@ def update_history_with_new_local_key_id(old_id, new_id):
         new_id,
         old_id,
     ]
-    cur().execute(sql, params)
-    db().commit()
+    cursor.execute(sql, params)
     if _Debug:
         lg.args(_DebugLevel, sql=sql, params=params)
 
 
-def update_conversations_with_new_local_key_id(old_id, new_id):
+def update_conversations_with_new_local_key_id(cursor, old_id, new_id):
     sql = 'SELECT * FROM conversations'
     params = []
     modifications = {}
-    for row in cur().execute(sql, params):
+    for row in list(cursor.execute(sql, params)):
         conversation_id = row[0]
         new_conversation_id = conversation_id
         id1, _, id2 = conversation_id.partition('&')
@@ -622,8 +1118,7 @@ def update_conversations_with_new_local_key_id(old_id, new_id):
     for old_conv_id, new_conv_id in modifications.items():
         sql = 'UPDATE conversations SET conversation_id=? WHERE conversation_id=?'
         params = [new_conv_id, old_conv_id]
-        cur().execute(sql, params)
-        db().commit()
+        cursor.execute(sql, params)
         if _Debug:
             lg.args(_DebugLevel, sql=sql, params=params)
 
@@ -733,8 +1228,8 @@ def check_create_rename_key(new_key_id):
         if local_key_id != new_local_key_id:
             changed = True
             lg.warn('found new public key which is re-using already known key with different local key id: %r -> %r' % (local_key_id, new_local_key_id))
-            update_history_with_new_local_key_id(local_key_id, new_local_key_id)
-            update_conversations_with_new_local_key_id(local_key_id, new_local_key_id)
+            run_in_writer(update_history_with_new_local_key_id, local_key_id, new_local_key_id)
+            run_in_writer(update_conversations_with_new_local_key_id, local_key_id, new_local_key_id)
             sql = 'UPDATE keys SET local_key_id=? WHERE public_key=?'
             params = [
                 new_local_key_id,
@@ -834,20 +1329,10 @@ def populate_messages(recipient_id=None, sender_id=None, message_types=[], offse
         limit=limit,
         raw_results=True,
     ):
-        conversation_id = get_conversation_id(row[0], row[2], int(row[5]))
-        if conversation_id is None:
+        snapshot = build_json_message_from_row(row)
+        if snapshot['conversation_id'] is None:
             continue
-        snap_id = '{}/{}'.format(conversation_id, row[7])
-        snapshot = build_json_message(
-            sender=row[1],
-            recipient=row[3],
-            direction='in' if row[4] == 0 else 'out',
-            conversation_id=conversation_id,
-            message_type=MESSAGE_TYPE_CODES.get(int(row[5]), 'private_message'),
-            message_time=row[6],
-            message_id=row[7],
-            data=json.loads(row[8]),
-        )
+        snap_id = '{}/{}'.format(snapshot['conversation_id'], row[7])
         listeners.push_snapshot('message', snap_id=snap_id, created=row[6], data=snapshot)
 
 
@@ -82,6 +82,8 @@ _CustomersMetaInfo = {}
 _SuppliersMetaInfo = {}
 _CorrespondentsMetaInfo = {}
 
+_ContactsKeys = {}  # name -> (source list, keys generation, list length, set of identity keys)
+
 #-------------------------------------------------------------------------------
 
 
@@ -471,13 +473,26 @@ def populate_correspondents():
 #-------------------------------------------------------------------------------
 
 
+def contacts_keys(name, source, idlist=None):
+    """
+    Returns a set of identity keys for given list of contacts, see `id_url.keys_set()`.
+    The set is kept in memory until the list is replaced or changed its size or identity history was changed.
+    """
+    global _ContactsKeys
+    generation = id_url.keys_generation()
+    cached = _ContactsKeys.get(name)
+    if cached is None or cached[0] is not source or cached[1] != generation or cached[2] != len(source):
+        cached = _ContactsKeys[name] = (source, generation, len(source), id_url.keys_set(source if idlist is None else idlist))
+    return cached[3]
+
+
 def is_customer(idurl):
     """
     Return True if given ID is found in customers list.
     """
     if id_url.is_empty(idurl):
         return False
-    return id_url.field(idurl).to_bin() in id_url.to_bin_list(customers())
+    return id_url.is_in_keys(idurl, contacts_keys('customers', customers()))
 
 
 def is_supplier(idurl, customer_idurl=None):
@@ -486,16 +501,20 @@ def is_supplier(idurl, customer_idurl=None):
     """
     if id_url.is_empty(idurl):
         return False
-    return id_url.field(idurl).to_bin() in id_url.to_bin_list(suppliers(customer_idurl=customer_idurl))
+    if not customer_idurl:
+        customer_idurl = my_id.getIDURL()
+    customer_idurl = id_url.field(customer_idurl)
+    return id_url.is_in_keys(idurl, contacts_keys(('suppliers', customer_idurl.to_bin()), suppliers(customer_idurl=customer_idurl)))
 
 
 def is_correspondent(idurl):
     """
     Return True if given ID is found in correspondents list.
     """
+    global _CorrespondentsList
     if id_url.is_empty(idurl):
         return False
-    return id_url.field(idurl).to_bin() in id_url.to_bin_list(correspondents_ids())
+    return id_url.is_in_keys(idurl, contacts_keys('correspondents', _CorrespondentsList, [tupl[0] for tupl in _CorrespondentsList]))
 
 
 #------------------------------------------------------------------------------
@@ -39,6 +39,12 @@ Packet Fields are all strings (no integers, objects, etc)
     - RemoteID : want full IDURL for other party so troublemaker could not
                 use his packets to mess up other nodes by sending it to them
     - Signature : signature on Hash is always by CreatorID
+
+Identity() packets with PacketID started with "broadcast:" prefix are signed without RemoteID field,
+so one signature can be re-used for many recipients: see ``Packet.Envelope()``.
+This is safe only because payload of such packet is a public identity file which is signed by itself.
+Older nodes always verify RemoteID, so such packets are only sent to the nodes which have "identity-broadcast"
+capability in the identity version string and accepted only from the nodes which announced it as well.
 """
 
 #------------------------------------------------------------------------------
@@ -75,11 +81,17 @@ from bitdust.contacts import contactsdb
 
 from bitdust.crypt import key
 
+from bitdust.userid import identity
 from bitdust.userid import my_id
 from bitdust.userid import id_url
 
 #------------------------------------------------------------------------------
 
+BROADCAST_PACKET_ID_PREFIX = 'broadcast:'
+BROADCAST_CAPABILITY = 'identity-broadcast'
+
+#------------------------------------------------------------------------------
+
 
 class Packet(object):
 
@@ -177,7 +189,8 @@ class Packet(object):
             stufftosum += sep
             stufftosum += strng.to_bin(self.Payload)
             stufftosum += sep
-            stufftosum += self.RemoteID.original()
+            if not self.IsBroadcast():
+                stufftosum += self.RemoteID.original()
             stufftosum += sep
             stufftosum += strng.to_bin(self.KeyID)
         except Exception as exc:
@@ -241,6 +254,11 @@ class Packet(object):
                 raise Exception('can not verify signed packet, unknown identity %r' % self.CreatorID)
             lg.err('could not get Identity for %r so returning False' % self.CreatorID)
             return False
+        if self.IsBroadcast() and not self.BroadcastExpected(CreatorIdentity):
+            if raise_signature_invalid:
+                raise Exception('broadcast packet %r was not expected from %r' % (self, self.CreatorID))
+            lg.warn('broadcast packet %r was not expected from %r' % (self, self.CreatorID))
+            return False
 
 
 #         if _Debug:
@@ -267,6 +285,49 @@ class Packet(object):
 
         return Result
 
+    def IsBroadcast(self):
+        """
+        Signature of broadcast packet does not include RemoteID field, only Identity() packets can be broadcasted.
+        """
+        return self.Command == commands.Identity() and self.PacketID.startswith(BROADCAST_PACKET_ID_PREFIX)
+
+    def BroadcastExpected(self, CreatorIdentity):
+        """
+        Broadcast packets are accepted only if both nodes announced "identity-broadcast" capability.
+        Payload is the creator identity, it can be newer than the cached copy and already have the capability.
+        """
+        if BROADCAST_CAPABILITY not in my_id.CAPABILITIES:
+            return False
+        if CreatorIdentity.hasCapability(BROADCAST_CAPABILITY):
+            return True
+        try:
+            new_ident = identity.identity(xmlsrc=self.Payload)
+        except:
+            return False
+        if not new_ident.isCorrect() or not new_ident.Valid():
+            return False
+        if new_ident.getPublicKey() != CreatorIdentity.getPublicKey():
+            return False
+        return new_ident.hasCapability(BROADCAST_CAPABILITY)
+
+    def Envelope(self, RemoteID):
+        """
+        Returns a copy of broadcast packet addressed to another recipient, signature is not generated again.
+        """
+        if not self.IsBroadcast():
+            raise Exception('packet %r is not a broadcast packet' % self)
+        return Packet(
+            Command=self.Command,
+            OwnerID=self.OwnerID,
+            CreatorID=self.CreatorID,
+            PacketID=self.PacketID,
+            Date=self.Date,
+            Payload=self.Payload,
+            RemoteID=RemoteID,
+            KeyID=self.KeyID,
+            Signature=self.Signature,
+        )
+
     def Ready(self):
         """
         I was playing with generating signatures in separate thread, so this is
@@ -420,6 +481,18 @@ def Unserialize(data):
     return newobject
 
 
+def BroadcastSupported(RemoteID):
+    """
+    Older nodes always verify RemoteID field, so broadcast packet can be sent only if remote node announced support of it.
+    """
+    if BROADCAST_CAPABILITY not in my_id.CAPABILITIES:
+        return False
+    RemoteIdentity = contactsdb.get_contact_identity(RemoteID)
+    if not RemoteIdentity:
+        return False
+    return RemoteIdentity.hasCapability(BROADCAST_CAPABILITY)
+
+
 def MakePacket(Command, OwnerID, CreatorID, PacketID, Payload, RemoteID):
     """
     Just calls the constructor of packet class.
@@ -452,7 +525,6 @@ if __name__ == '__main__':
     from bitdust.main import settings
     settings.init()
     key.InitMyKey()
-    from bitdust.userid import identity
     from bitdust.contacts import identitycache
     if len(sys.argv) > 2:
         creator_ident = identity.identity(xmlsrc=bpio.ReadTextFile(sys.argv[2]))
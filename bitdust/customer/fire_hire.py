@@ -473,12 +473,13 @@ class FireHire(automat.Automat):
                 target_suppliers = self._get_suppliers_with_expired_contracts()
         if _Debug:
             lg.args(_DebugLevel, my_current_family=my_current_family, target_suppliers=target_suppliers, configs=self.configs)
+        target_keys = id_url.keys_set(target_suppliers)
         for pos, supplier_idurl in enumerate(my_current_family):
             if not supplier_idurl:
                 continue
             if self.configs[0] and pos >= self.configs[0]:
                 continue
-            if not id_url.is_in(supplier_idurl, target_suppliers):
+            if not id_url.is_in_keys(supplier_idurl, target_keys):
                 continue
             sc = supplier_connector.by_idurl(supplier_idurl)
             if sc is None:
@@ -647,6 +648,7 @@ class FireHire(automat.Automat):
             self.automat('search-failed')
             return
         position_for_new_supplier = None
+        dismiss_keys = id_url.keys_set(self.dismiss_list)
         for pos in range(settings.getSuppliersNumberDesired()):
             if pos in self.hire_list:
                 continue
@@ -655,7 +657,7 @@ class FireHire(automat.Automat):
                 lg.info('found empty supplier at position %d and going to find new supplier on that position' % pos)
                 position_for_new_supplier = pos
                 break
-            if id_url.is_in(supplier_idurl, self.dismiss_list, as_field=False):
+            if id_url.is_in_keys(supplier_idurl, dismiss_keys):
                 lg.info('going to find new supplier on existing position %d to replace supplier %s' % (pos, supplier_idurl))
                 position_for_new_supplier = pos
                 break
@@ -695,11 +697,12 @@ class FireHire(automat.Automat):
             lg.warn('unknown family_position from supplier results, will pick first empty spot')
             position = -1
             old_idurl = None
+            dismiss_keys = id_url.keys_set(self.dismiss_list)
             for i in range(len(current_suppliers)):
                 if not current_suppliers[i].strip():
                     position = i
                     break
-                if id_url.is_in(current_suppliers[i], self.dismiss_list, as_field=False):
+                if id_url.is_in_keys(current_suppliers[i], dismiss_keys):
                     position = i
                     old_idurl = current_suppliers[i]
                     break
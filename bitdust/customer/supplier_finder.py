@@ -200,7 +200,7 @@ class SupplierFinder(automat.Automat):
         global _SuppliersToHire
         available = []
         for idurl in _SuppliersToHire:
-            if id_url.is_not_in(idurl, contactsdb.suppliers(), as_field=False):
+            if not contactsdb.is_supplier(idurl):
                 available.append(idurl)
         return len(available) > 0
 
@@ -235,12 +235,13 @@ class SupplierFinder(automat.Automat):
         if position is None or position == -1:
             lg.warn('position for new supplier is unknown, will "guess"')
             current_suppliers = list(contactsdb.suppliers())
+            dismiss_keys = id_url.keys_set(fire_hire.A().dismiss_list)
             for i in range(len(current_suppliers)):
                 supplier_idurl = current_suppliers[i].to_bin()
                 if not supplier_idurl:
                     position = i
                     break
-                if id_url.is_in(supplier_idurl, fire_hire.A().dismiss_list, as_field=False):
+                if id_url.is_in_keys(supplier_idurl, dismiss_keys):
                     position = i
                     break
         sc = supplier_connector.by_idurl(self.target_idurl)
@@ -290,7 +291,7 @@ class SupplierFinder(automat.Automat):
         """
         global _SuppliersToHire
         for idurl in _SuppliersToHire:
-            if id_url.is_not_in(idurl, contactsdb.suppliers(), as_field=False):
+            if not contactsdb.is_supplier(idurl):
                 self.target_idurl = id_url.field(idurl)
                 _SuppliersToHire.remove(idurl)
                 break
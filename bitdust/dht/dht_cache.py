@@ -0,0 +1,391 @@
+#!/usr/bin/python
+# dht_cache.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (dht_cache.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: dht_cache
+
+Local cache of JSON values read from DHT network.
+
+All records are stored in a single SQLite file, recently used records are also kept in memory.
+Least recently used records are evicted when number of records or total size exceeds the limits,
+records older than `max_age` are removed by a periodic sweep.
+
+Keys which were not found in DHT are remembered for `negative_ttl` seconds in memory only.
+Concurrent lookups of the same key are coalesced: only the first caller starts a network request,
+others are waiting for the same result, see ``dht_service.get_cached_json_value()``.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 24
+
+#------------------------------------------------------------------------------
+
+import os
+import time
+import shutil
+import sqlite3
+
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+
+from twisted.internet.task import LoopingCall  #@UnresolvedImport
+from twisted.python.failure import Failure  #@UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.system import local_fs
+
+from bitdust.lib import jsn
+
+#------------------------------------------------------------------------------
+
+MAX_RECORDS = 20000
+MAX_SIZE = 32*1024*1024
+MAX_AGE = 60*60*24*7
+NEGATIVE_TTL = 60
+SWEEP_INTERVAL = 60*10
+
+#------------------------------------------------------------------------------
+
+_Cache = None
+_SweepTask = None
+
+#------------------------------------------------------------------------------
+
+
+def init(db_file_path, legacy_dir_path=None):
+    global _Cache
+    global _SweepTask
+    if _Cache is not None:
+        lg.warn('DHT cache already opened')
+        return _Cache
+    _Cache = DHTCache(db_file_path)
+    if legacy_dir_path and os.path.isdir(legacy_dir_path):
+        _Cache.import_legacy_dir(legacy_dir_path)
+    _SweepTask = LoopingCall(_Cache.sweep)
+    _SweepTask.start(SWEEP_INTERVAL, now=False)
+    if _Debug:
+        lg.args(_DebugLevel, db_file_path=db_file_path, records=len(_Cache))
+    return _Cache
+
+
+def shutdown():
+    global _Cache
+    global _SweepTask
+    if _Cache is None:
+        return
+    if _SweepTask:
+        _SweepTask.stop()
+        _SweepTask = None
+    _Cache.close()
+    _Cache = None
+
+
+def cache():
+    global _Cache
+    return _Cache
+
+
+#------------------------------------------------------------------------------
+
+
+class DHTCache(object):
+
+    def __init__(self, db_file_path, max_records=MAX_RECORDS, max_size=MAX_SIZE, max_age=MAX_AGE, negative_ttl=NEGATIVE_TTL):
+        self.db_file_path = db_file_path
+        self.max_records = max_records
+        self.max_size = max_size
+        self.max_age = max_age
+        self.negative_ttl = negative_ttl
+        self.records = OrderedDict()
+        self.missing = {}
+        self.lookups = {}
+        self.total_size = 0
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'negative_hits': 0,
+            'coalesced': 0,
+            'evicted': 0,
+            'lookups': 0,
+            'lookups_not_found': 0,
+            'lookups_failed': 0,
+            'lookups_latency': 0.0,
+        }
+        self.db = sqlite3.connect(db_file_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache (layer_id INTEGER, hash_key TEXT, created INTEGER, size INTEGER, value TEXT, PRIMARY KEY (layer_id, hash_key))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_created ON cache (created)')
+        self.db.commit()
+        self.load()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return 'DHTCache(%s, %d records, %d bytes)' % (self.db_file_path, len(self.records), self.total_size)
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+        self.records.clear()
+        self.missing.clear()
+        self.lookups.clear()
+
+    def load(self):
+        """
+        Reads most recent records from the DB file into memory, older records beyond the limits are removed.
+        """
+        self.records.clear()
+        self.total_size = 0
+        for layer_id, hash_key, created, size, value in self.db.execute('SELECT layer_id, hash_key, created, size, value FROM cache ORDER BY created ASC'):
+            try:
+                json_value = jsn.loads_text(value)
+            except:
+                lg.exc()
+                continue
+            self.records[(layer_id, hash_key)] = {
+                'v': json_value,
+                't': created,
+                's': size,
+            }
+            self.total_size += size
+        self.evict()
+        self.sweep()
+        return len(self.records)
+
+    def import_legacy_dir(self, legacy_dir_path):
+        """
+        Moves records from the old cache folder, where every record was stored in a separate file, and removes that folder.
+        """
+        total_records = 0
+        for layer_id_str in os.listdir(legacy_dir_path):
+            layer_dir_path = os.path.join(legacy_dir_path, layer_id_str)
+            if not os.path.isdir(layer_dir_path):
+                continue
+            try:
+                layer_id = int(layer_id_str)
+            except:
+                continue
+            for hash_key in os.listdir(layer_dir_path):
+                try:
+                    cached_record = jsn.loads_text(local_fs.ReadTextFile(os.path.join(layer_dir_path, hash_key)))
+                    self.store(hash_key, cached_record['v'], layer_id=layer_id, timestamp=int(cached_record['t']), commit=False)
+                except:
+                    lg.exc()
+                    continue
+                total_records += 1
+        self.db.commit()
+        shutil.rmtree(legacy_dir_path, ignore_errors=True)
+        lg.info('imported %d records from %r' % (total_records, legacy_dir_path))
+        return total_records
+
+    def count(self, layer_id=None):
+        if layer_id is None:
+            return len(self.records)
+        return len([k for k in self.records.keys() if k[0] == layer_id])
+
+    def get(self, hash_key, layer_id=0):
+        """
+        Returns cached record as dictionary with "v" (value) and "t" (time) fields or None.
+        """
+        return self.records.get((layer_id, hash_key))
+
+    def read(self, hash_key, layer_id=0, cache_ttl=None, now=None):
+        """
+        Returns tuple (found, value). Cached value is counted as expired when it is older than `cache_ttl` seconds.
+        For keys recently not found in DHT returns (True, None).
+        """
+        k = (layer_id, hash_key)
+        if now is None:
+            now = time.time()
+        cached_record = self.records.get(k)
+        if cached_record is not None:
+            if cache_ttl is None or now - cached_record['t'] <= cache_ttl:
+                self.records.move_to_end(k)
+                self.counters['hits'] += 1
+                return True, cached_record['v']
+        if self.is_missing(hash_key, layer_id=layer_id, now=now):
+            self.counters['negative_hits'] += 1
+            return True, None
+        if cached_record is not None:
+            self.counters['expired'] += 1
+        else:
+            self.counters['misses'] += 1
+        return False, None
+
+    def store(self, hash_key, json_value, layer_id=0, timestamp=None, commit=True):
+        if timestamp is None:
+            timestamp = int(time.time())
+        k = (layer_id, hash_key)
+        value = jsn.dumps(json_value)
+        size = len(value)
+        try:
+            self.db.execute('INSERT OR REPLACE INTO cache (layer_id, hash_key, created, size, value) VALUES (?, ?, ?, ?, ?)', (layer_id, hash_key, timestamp, size, value))
+            if commit:
+                self.db.commit()
+        except:
+            lg.exc('failed to store cached dht key %r in layer %d' % (hash_key, layer_id))
+            return False
+        existing = self.records.pop(k, None)
+        if existing:
+            self.total_size -= existing['s']
+        self.records[k] = {
+            'v': json_value,
+            't': timestamp,
+            's': size,
+        }
+        self.total_size += size
+        self.missing.pop(k, None)
+        self.evict(commit=commit)
+        if _Debug:
+            lg.args(_DebugLevel, hash_key=hash_key, layer_id=layer_id, timestamp=timestamp, cached_records=len(self.records))
+        return True
+
+    def remove(self, hash_key, layer_id=0):
+        k = (layer_id, hash_key)
+        self.missing.pop(k, None)
+        existing = self.records.pop(k, None)
+        if not existing:
+            return False
+        self.total_size -= existing['s']
+        self.db.execute('DELETE FROM cache WHERE layer_id=? AND hash_key=?', k)
+        self.db.commit()
+        return True
+
+    def evict(self, commit=True):
+        """
+        Removes least recently used records while there are too many of them or they take too much space.
+        """
+        evicted = []
+        while self.records and (len(self.records) > self.max_records or self.total_size > self.max_size):
+            k, existing = self.records.popitem(last=False)
+            self.total_size -= existing['s']
+            evicted.append(k)
+        if evicted:
+            self.db.executemany('DELETE FROM cache WHERE layer_id=? AND hash_key=?', evicted)
+            if commit:
+                self.db.commit()
+            self.counters['evicted'] += len(evicted)
+        return len(evicted)
+
+    def sweep(self, now=None):
+        """
+        Removes records older than `max_age` and outdated negative records.
+        """
+        if now is None:
+            now = time.time()
+        for k, remember_time in list(self.missing.items()):
+            if now - remember_time > self.negative_ttl:
+                self.missing.pop(k, None)
+        oldest = int(now - self.max_age)
+        expired = self.db.execute('SELECT layer_id, hash_key FROM cache WHERE created<?', (oldest, )).fetchall()
+        if not expired:
+            return 0
+        self.db.execute('DELETE FROM cache WHERE created<?', (oldest, ))
+        self.db.commit()
+        for k in expired:
+            existing = self.records.pop(k, None)
+            if existing:
+                self.total_size -= existing['s']
+        self.counters['evicted'] += len(expired)
+        return len(expired)
+
+    def remember_missing(self, hash_key, layer_id=0, now=None):
+        """
+        Keep in memory that given key was not found in DHT.
+        """
+        self.missing[(layer_id, hash_key)] = time.time() if now is None else now
+
+    def is_missing(self, hash_key, layer_id=0, now=None):
+        k = (layer_id, hash_key)
+        remember_time = self.missing.get(k)
+        if remember_time is None:
+            return False
+        if (time.time() if now is None else now) - remember_time > self.negative_ttl:
+            self.missing.pop(k, None)
+            return False
+        return True
+
+    def start_lookup(self, hash_key, layer_id, result_defer):
+        """
+        Returns True if caller must start a network lookup for given key,
+        otherwise ``result_defer`` will be fired when already running lookup is finished.
+        """
+        k = (layer_id, hash_key)
+        if k in self.lookups:
+            self.lookups[k][1].append(result_defer)
+            self.counters['coalesced'] += 1
+            return False
+        self.lookups[k] = (time.time(), [result_defer])
+        return True
+
+    def finish_lookup(self, result, hash_key, layer_id):
+        """
+        Fires all Deferred objects waiting for given key with the result of the lookup.
+        """
+        started, waiters = self.lookups.pop((layer_id, hash_key), (None, []))
+        if started is not None:
+            self.counters['lookups'] += 1
+            self.counters['lookups_latency'] += time.time() - started
+            if isinstance(result, Failure):
+                self.counters['lookups_failed'] += 1
+            elif not isinstance(result, dict):
+                self.counters['lookups_not_found'] += 1
+        for d in waiters:
+            if d.called:
+                continue
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        return None
+
+    def stats(self):
+        hits = self.counters['hits'] + self.counters['negative_hits']
+        requests = hits + self.counters['misses'] + self.counters['expired']
+        lookups = self.counters['lookups']
+        result = dict(self.counters)
+        result.update({
+            'records': len(self.records),
+            'size': self.total_size,
+            'missing': len(self.missing),
+            'running_lookups': len(self.lookups),
+            'hit_rate': round(hits/float(requests), 4) if requests else 0.0,
+            'lookups_latency_avg': round(self.counters['lookups_latency']/float(lookups), 4) if lookups else 0.0,
+        })
+        result['lookups_latency'] = round(result['lookups_latency'], 4)
+        return result
@@ -63,7 +63,6 @@ if __name__ == '__main__':
 from bitdust.logs import lg
 
 from bitdust.system import bpio
-from bitdust.system import local_fs
 
 from bitdust.main import settings
 from bitdust.main import events
@@ -75,6 +74,7 @@ from bitdust.lib import jsn
 from bitdust.userid import id_url
 
 from bitdust.dht import known_nodes
+from bitdust.dht import dht_cache
 
 #------------------------------------------------------------------------------
 
@@ -84,6 +84,7 @@ from bitdust_forks.entangled.kademlia.node import rpcmethod, MultiLayerNode  # @
 from bitdust_forks.entangled.kademlia.protocol import KademliaMultiLayerProtocol, encoding, msgformat  # @UnresolvedImport
 from bitdust_forks.entangled.kademlia.routingtable import TreeRoutingTable  # @UnresolvedImport
 from bitdust_forks.entangled.kademlia.contact import Contact  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.republisher import RepublishScheduler  # @UnresolvedImport
 
 #------------------------------------------------------------------------------
 
@@ -95,6 +96,14 @@ RECEIVING_QUEUE_LENGTH_CRITICAL = 100
 SENDING_QUEUE_LENGTH_CRITICAL = 50
 DEFAULT_CACHE_TTL = 60*60*3
 
+#: Records of more important types are republished first, see RepublishScheduler
+RECORD_REPUBLISH_PRIORITY = {
+    'identity': 3,
+    'suppliers': 3,
+    'message_broker': 2,
+    'nickname': 1,
+}
+
 #------------------------------------------------------------------------------
 
 _MyNode = None
@@ -102,7 +111,6 @@ _ActiveLookup = None
 _ActiveLookupLayerID = None
 _Counters = {}
 _ProtocolVersion = 7
-_Cache = {}
 
 #------------------------------------------------------------------------------
 
@@ -133,10 +141,10 @@ def init(udp_port, dht_dir_path=None, open_layers=[]):
     list_layers = []
     if os.path.isdir(dht_dir_path):
         list_layers = os.listdir(dht_dir_path)
-    cache_dir_path = os.path.join(dht_dir_path, 'cache')
-    if not os.path.isdir(cache_dir_path):
-        os.makedirs(cache_dir_path)
-    load_cache(cache_dir_path)
+    dht_cache.init(
+        db_file_path=bpio.portablePath(os.path.join(dht_dir_path, 'cache.db')),
+        legacy_dir_path=os.path.join(dht_dir_path, 'cache'),
+    )
     if _Debug:
         lg.dbg(_DebugLevel, 'dht_dir_path=%r list_layers=%r network_info=%r' % (dht_dir_path, list_layers, nw_info))
     layerStores = {}
@@ -183,6 +191,7 @@ def shutdown():
     if _MyNode is not None:
         for ds in _MyNode._dataStores.values():
             ds._db.close()
+        dht_cache.shutdown()
         _MyNode._protocol.node = None
         del _MyNode
         _MyNode = None
@@ -291,6 +300,8 @@ def connect(seed_nodes=[], layer_id=0, attach=False):
         if not node().expire_task.running:
             # reactor.callLater(random.randint(0, 60), node().expire_task.start, int(KEY_EXPIRE_MIN_SECONDS / 2), now=True)  # @UndefinedVariable
             node().expire_task.start(int(KEY_EXPIRE_MIN_SECONDS/2), now=True)  # @UndefinedVariable
+        if node().republisher:
+            node().republisher.start()
         return resolved_seed_nodes
 
     def _on_hosts_resolve_failed(x):
@@ -320,6 +331,8 @@ def disconnect():
         return False
     if node().expire_task and node().expire_task.running:
         node().expire_task.stop()
+    if node().republisher:
+        node().republisher.stop()
     for refresher in node().refreshers.values():
         if refresher and refresher.active():
             refresher.cancel()
@@ -509,18 +522,24 @@ def on_error(x, method, key):
 #------------------------------------------------------------------------------
 
 
-def get_value(key, layer_id=0, parallel_calls=None):
+def get_value(key, layer_id=0, parallel_calls=None, quorum=1, validator=None):
+    """
+    The lookup is finished as soon as `quorum` equal values are received from remote nodes,
+    values which are not accepted by the `validator` callable are skipped.
+    """
     if not node():
         return fail(Exception('DHT service is off'))
     count('get_value_%s' % key)
     key_hash = key_to_hash(key)
     if _Debug:
-        lg.out(_DebugLevel, 'dht_service.get_value key=[%r] key_hash=%s' % (key, key_hash))
+        lg.out(_DebugLevel, 'dht_service.get_value key=[%r] key_hash=%s quorum=%d' % (key, key_hash, quorum))
     d = node().iterativeFindValue(
         key=key_hash,
         rpc='findValue',
         layerID=layer_id,
         parallel_calls=parallel_calls,
+        quorum=quorum,
+        validator=validator,
     )
     d.addCallback(on_success, 'get_value', key)
     d.addErrback(on_error, 'get_value', key)
@@ -618,15 +637,16 @@ def on_read_json_response(response, key, result_defer=None):
     return json_value
 
 
-def get_json_value(key, layer_id=0, update_cache=True):
+def get_json_value(key, layer_id=0, update_cache=True, rules=None):
     if _Debug:
         lg.out(_DebugLevel, 'dht_service.get_json_value key=[%r] layer_id=%d update_cache=%s' % (key, layer_id, update_cache))
     ret = Deferred()
-    d = get_value(key, layer_id=layer_id)
+    if update_cache:
+        # failed lookups are not cached, only found value or a list of closest nodes if value not found
+        ret.addCallback(on_json_response_to_be_cached, key=key, layer_id=layer_id)
+    d = get_value(key, layer_id=layer_id, validator=make_validator(key, rules) if rules else None)
     d.addCallback(on_read_json_response, key, ret)
     d.addErrback(ret.errback)
-    if update_cache:
-        d.addCallback(on_json_response_to_be_cached, key=key, layer_id=layer_id)
     return ret
 
 
@@ -639,9 +659,29 @@ def set_json_value(key, json_data, age=0, expire=KEY_EXPIRE_MAX_SECONDS, collect
         return fail(Exception('bad input json data'))
     if _Debug:
         lg.out(_DebugLevel, 'dht_service.set_json_value key=[%r] layer_id=%d with %d bytes' % (key, layer_id, len(repr(value))))
+    if dht_cache.cache() is not None:
+        dht_cache.cache().remove(key_to_hash(key), layer_id=layer_id)
     return set_value(key=key, value=value, age=age, expire=expire, collect_results=collect_results, layer_id=layer_id)
 
 
+def make_validator(key, rules):
+    """
+    Returns a callable to be used during DHT lookup to skip values which are not passing validation rules,
+    so the lookup is not finished by a broken or malicious record.
+    """
+
+    def _validator(raw_value):
+        try:
+            json_value = jsn.loads_text(raw_value)
+        except:
+            return False
+        if not isinstance(json_value, dict):
+            return False
+        return validate_rules(json_value, key, rules, populate_meta_fields=True) is not None
+
+    return _validator
+
+
 #------------------------------------------------------------------------------
 
 
@@ -920,9 +960,9 @@ def validate_after_receive(value, key, rules, result_defer, raise_for_result, po
 def get_valid_data(key, rules={}, raise_for_result=False, return_details=False, layer_id=0, use_cache_ttl=None, update_cache=True):
     ret = Deferred()
     if use_cache_ttl is not None:
-        d = get_cached_json_value(key, layer_id=layer_id, cache_ttl=use_cache_ttl)
+        d = get_cached_json_value(key, layer_id=layer_id, cache_ttl=use_cache_ttl, rules=rules)
     else:
-        d = get_json_value(key, layer_id=layer_id, update_cache=update_cache)
+        d = get_json_value(key, layer_id=layer_id, update_cache=update_cache, rules=rules)
     d.addCallback(validate_after_receive, key=key, rules=rules, result_defer=ret, raise_for_result=raise_for_result, populate_meta_fields=return_details)
     d.addErrback(ret.errback)
     return ret
@@ -1162,81 +1202,58 @@ def dump_local_db(value_as_json=False):
 #------------------------------------------------------------------------------
 
 
-def cache():
-    global _Cache
-    return _Cache
-
-
-def load_cache(cache_dir_path):
-    global _Cache
-    _Cache.clear()
-    total_records = 0
-    records_per_layer = {}
-    for layer_id_str in os.listdir(cache_dir_path):
-        layer_id = int(layer_id_str)
-        if layer_id not in _Cache:
-            _Cache[layer_id] = {}
-        records_per_layer[layer_id] = 0
-        for hash_key in os.listdir(cache_dir_path):
-            _Cache[layer_id][hash_key] = jsn.loads_text(local_fs.ReadTextFile(os.path.join(cache_dir_path, hash_key)))
-            total_records += 1
-            records_per_layer[layer_id] += 1
-    if _Debug:
-        lg.args(_DebugLevel, total_records=total_records, records_per_layer=records_per_layer)
-    return total_records
-
-
-def store_cached_key(hash_key, json_value, layer_id=0, timestamp=None):
-    global _Cache
-    if not timestamp:
-        timestamp = utime.utcnow_to_sec1970()
-    if layer_id not in _Cache:
-        _Cache[layer_id] = {}
-    cached_json_record = {
-        'v': json_value,
-        't': timestamp,
-    }
-    dht_dir_path = settings.ServiceDir('service_entangled_dht')
-    layer_cache_dir_path = os.path.join(dht_dir_path, 'cache', strng.to_text(layer_id))
-    if not os.path.isdir(layer_cache_dir_path):
-        os.makedirs(layer_cache_dir_path)
-    cached_record_file_path = os.path.join(layer_cache_dir_path, hash_key)
-    if not local_fs.WriteTextFile(cached_record_file_path, jsn.dumps(cached_json_record)):
-        lg.err('failed to store cached dht key %r in layer %d' % (hash_key, layer_id))
-        return False
-    _Cache[layer_id][hash_key] = cached_json_record
-    if _Debug:
-        lg.args(_DebugLevel, hash_key=hash_key, layer_id=layer_id, timestamp=timestamp, cached_records=len(_Cache[layer_id]))
-    return True
+def cache_stats():
+    if dht_cache.cache() is None:
+        return {}
+    return dht_cache.cache().stats()
 
 
-def get_cached_value(hash_key, layer_id=0):
-    global _Cache
-    value = _Cache.get(layer_id, {}).get(hash_key)
-    if _Debug:
-        lg.args(_DebugLevel, layer_id=layer_id, hash_key=hash_key, value_exist=(value is not None))
-    return value
+def republish_stats():
+    if not node() or not node().republisher:
+        return {}
+    return node().republisher.stats()
+
+
+def republish_priority(key, value, layer_id):
+    try:
+        json_value = json.loads(value)
+    except:
+        return 0
+    if not isinstance(json_value, dict):
+        return 0
+    return RECORD_REPUBLISH_PRIORITY.get(json_value.get('type'), 0)
 
 
-def on_json_response_to_be_cached(json_value, key, layer_id):
-    if not json_value:
-        return json_value
+def on_json_response_to_be_cached(response, key, layer_id):
+    if dht_cache.cache() is None:
+        return response
     hash_key = key_to_hash(key)
-    store_cached_key(hash_key, json_value, layer_id)
-    return json_value
+    if isinstance(response, dict):
+        dht_cache.cache().store(hash_key, response, layer_id=layer_id)
+    elif isinstance(response, list):
+        dht_cache.cache().remember_missing(hash_key, layer_id=layer_id)
+    return response
 
 
-def get_cached_json_value(key, layer_id=0, cache_ttl=DEFAULT_CACHE_TTL):
+def get_cached_json_value(key, layer_id=0, cache_ttl=DEFAULT_CACHE_TTL, rules=None):
+    """
+    Returns value from the local cache if it is not older than `cache_ttl` seconds, otherwise reads it from DHT.
+    Concurrent calls for the same key are waiting for a single network lookup.
+    Keys which were not found recently are not requested again, empty list is returned in that case.
+    """
+    if dht_cache.cache() is None:
+        return get_json_value(key, layer_id=layer_id, update_cache=False, rules=rules)
     hash_key = key_to_hash(key)
-    cached_record = get_cached_value(hash_key)
-    if not cached_record:
-        return get_json_value(key, layer_id=layer_id, update_cache=True)
-    if utime.utcnow_to_sec1970() - int(cached_record['t']) > cache_ttl:
-        return get_json_value(key, layer_id=layer_id, update_cache=True)
+    found, value = dht_cache.cache().read(hash_key, layer_id=layer_id, cache_ttl=cache_ttl)
     if _Debug:
-        lg.out(_DebugLevel, 'dht_service.get_cached_json_value key=[%r] layer_id=%d cache_ttl=%d' % (key, layer_id, cache_ttl))
+        lg.out(_DebugLevel, 'dht_service.get_cached_json_value key=[%r] layer_id=%d cache_ttl=%d found=%r' % (key, layer_id, cache_ttl, found))
     ret = Deferred()
-    ret.callback(cached_record['v'])
+    if found:
+        ret.callback(value if value is not None else [])
+        return ret
+    if dht_cache.cache().start_lookup(hash_key, layer_id, ret):
+        d = get_json_value(key, layer_id=layer_id, update_cache=True, rules=rules)
+        d.addBoth(dht_cache.cache().finish_lookup, hash_key, layer_id)
     return ret
 
 
@@ -1262,6 +1279,7 @@ class DHTNode(MultiLayerNode):
                 self.data[layer_id] = {}
         self.expire_task = LoopingCall(self.expire)
         self.rpc_callbacks = {}
+        self.republisher = RepublishScheduler(self, priorityFunc=republish_priority)
 
     def add_rpc_callback(self, rpc_method_name, cb):
         self.rpc_callbacks[rpc_method_name] = cb
@@ -1292,22 +1310,10 @@ class DHTNode(MultiLayerNode):
     def expire(self):
         now = utime.utcnow_to_sec1970()
         for layer_id in self._dataStores.keys():
-            expired_keys = []
-            for key in self._dataStores[layer_id].keys():
-                if key == self.nodeStateKey:
-                    continue
-                item_data = self._dataStores[layer_id].getItem(key)
-                if item_data:
-                    originaly_published = item_data.get('originallyPublished')
-                    expireSeconds = item_data.get('expireSeconds')
-                    if expireSeconds and originaly_published:
-                        age = now - originaly_published
-                        if age > expireSeconds:
-                            expired_keys.append(key)
-            for key in expired_keys:
-                if _Debug:
+            expired_keys = self._dataStores[layer_id].removeExpired(now=now, excludeKeys=[self.nodeStateKey])
+            if _Debug:
+                for key in expired_keys:
                     lg.out(_DebugLevel, 'dht_service.expire   [%s] removed from layer %d' % (key, layer_id))
-                del self._dataStores[layer_id][key]
 
     @rpcmethod
     def store(self, key, value, originalPublisherID=None, age=0, expireSeconds=KEY_EXPIRE_MAX_SECONDS, **kwargs):
@@ -1397,6 +1403,9 @@ class DHTProtocol(KademliaMultiLayerProtocol):
     def __init__(self, node, msgEncoder=encoding.Bencode(), msgTranslator=msgformat.MultiLayerFormat()):
         KademliaMultiLayerProtocol.__init__(self, node, msgEncoder=msgEncoder, msgTranslator=msgTranslator)
         self._counter = count
+        # Nodes advertise their protocol version and talk to each other in binary encoding,
+        # older nodes keep receiving bencoded messages
+        self.protocolVersion = _ProtocolVersion
 
 
 #         self.receiving_queue = []
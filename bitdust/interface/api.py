@@ -568,11 +568,12 @@ def process_info():
         }
     if driver.is_on('service_entangled_dht'):
         from bitdust.dht import dht_service
+        from bitdust.dht import dht_cache
         result['dht']['bytes_out'] = dht_service.node().bytes_out
         result['dht']['bytes_in'] = dht_service.node().bytes_in
         for layer_id in dht_service.node().active_layers:
             result['dht']['layers'][layer_id] = {
-                'cache': len(dht_service.cache().get(layer_id, [])),
+                'cache': dht_cache.cache().count(layer_id) if dht_cache.cache() else 0,
                 'packets_in': dht_service.node().packets_in.get(layer_id, 0),
                 'packets_out': dht_service.node().packets_out.get(layer_id, 0),
             }
@@ -621,6 +622,171 @@ def process_info():
     return OK(result)
 
 
+def process_metrics(reset: bool = False):
+    """
+    Returns metrics collected in the running process: reactor lag, execution time of delayed calls,
+    events and transitions of state machines, incoming and outgoing packets per command.
+
+    Latencies are given in seconds with 50th, 90th and 99th percentiles, counters also have a per second rate during last minute.
+    Set `reset=true` to start collecting from scratch after returning current values.
+
+    Same values in Prometheus text format are available via `/metrics` URL.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/process/metrics/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_metrics", "kwargs": {} }');
+    """
+    from bitdust.logs import metrics
+    if not metrics.enabled():
+        return ERROR('metrics collection is disabled, see "logs/metrics-enabled" option')
+    result = metrics.snapshot()
+    if reset:
+        metrics.reset()
+    return OK(result)
+
+
+def process_logs(limit: int = 100, log_name: str = None, level: int = None):
+    """
+    Returns most recent log messages printed by the main process, they are kept in memory even if writing to the files is disabled.
+    Use `log_name` to select a separate log, for example "packet", and `level` to skip less important messages.
+
+    Result also includes number of messages suppressed by the rate limit for every module, see "logs/rate-limit" option.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/process/logs/v1?limit=20&level=6'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_logs", "kwargs": {"limit": 20, "level": 6} }');
+    """
+    return OK({
+        'entries': lg.recent_entries(limit=int(limit), log_name=log_name, level=(int(level) if level is not None else None)),
+        'stats': lg.logs_stats(),
+    })
+
+
+def process_profiler_start(hz: int = 100, duration: int = 300, threads: list = None):
+    """
+    Starts built-in sampling profiler: stacks of all threads are taken `hz` times per second and counted in memory.
+    Profiler stops automatically after `duration` seconds, previously collected stacks are dropped.
+    Use `threads` to select only some threads by name prefix, for example `["MainThread"]` for the reactor thread.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/process/profiler/start/v1' -d '{"hz": 100, "duration": 60}'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_profiler_start", "kwargs": {"hz": 100, "duration": 60} }');
+    """
+    from bitdust.logs import profiler
+    if not profiler.start(hz=int(hz), duration=int(duration), threads=threads):
+        return ERROR('profiler is already running')
+    return OK(profiler.status())
+
+
+def process_profiler_stop():
+    """
+    Stops sampling profiler, collected stacks are kept in memory until the next start.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/process/profiler/stop/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_profiler_stop", "kwargs": {} }');
+    """
+    from bitdust.logs import profiler
+    profiler.stop()
+    return OK(profiler.status())
+
+
+def process_profiler_report(format: str = 'top', limit: int = 20):
+    """
+    Returns stacks collected by sampling profiler, it can be still running.
+
+    Use `format=top` to get functions with the biggest number of samples, `format=collapsed` to get text
+    for `flamegraph.pl` tool and `format=speedscope` to get JSON file for https://www.speedscope.app.
+
+    Same files can be downloaded directly via `/process/profiler/export/v1?format=speedscope` URL.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/process/profiler/report/v1?format=top&limit=10'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_profiler_report", "kwargs": {"format": "top", "limit": 10} }');
+    """
+    from bitdust.logs import profiler
+    p = profiler.profiler()
+    if not p:
+        return ERROR('profiler was not started')
+    result = profiler.status()
+    if format == 'top':
+        result['top'] = p.top(limit=int(limit))
+    elif format == 'collapsed':
+        result['collapsed'] = p.collapsed()
+    elif format == 'speedscope':
+        result['speedscope'] = p.speedscope()
+    else:
+        return ERROR('unknown format: %s' % format)
+    return OK(result)
+
+
+def process_memory_usage():
+    """
+    Returns number of items and approximate deep size in bytes of the biggest in-memory structures of the main process:
+    backup matrix, catalog indexes, identity cache, known keys, DHT cache, outgoing packets, message queues and state machines.
+
+    Objects are counted in small steps without blocking the main thread, for big structures only a sample of items is measured.
+    Result also includes current RSS of the process.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/process/memory/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_memory_usage", "kwargs": {} }');
+    """
+    from bitdust.logs import memory_usage
+    ret = Deferred()
+    d = memory_usage.collect()
+    d.addCallback(lambda result: ret.callback(OK(result, api_method='process_memory_usage')))
+    d.addErrback(lambda err: ret.callback(ERROR(err, api_method='process_memory_usage')))
+    return ret
+
+
+def process_memory_trace(action: str = 'snapshot', limit: int = 20, frames: int = 1):
+    """
+    Controls `tracemalloc` module in the main process to find the code which allocates memory.
+
+    Use `action=start` to start tracing, `action=snapshot` to take a snapshot and compare it with the previous one,
+    and `action=stop` to stop tracing and release memory used by it.
+    The `limit` source lines with the biggest growth of allocated memory are returned.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/process/memory/trace/v1' -d '{"action": "snapshot", "limit": 10}'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "process_memory_trace", "kwargs": {"action": "snapshot", "limit": 10} }');
+    """
+    from bitdust.logs import memory_usage
+    if action == 'start':
+        if not memory_usage.trace_start(frames=int(frames)):
+            return ERROR('tracemalloc is already started')
+        return OK({'tracing': True})
+    if action == 'stop':
+        if not memory_usage.trace_stop():
+            return ERROR('tracemalloc was not started')
+        return OK({'tracing': False})
+    if action != 'snapshot':
+        return ERROR('unknown action: %s' % action)
+    try:
+        d = memory_usage.trace_snapshot(limit=int(limit))
+    except Exception as exc:
+        return ERROR(str(exc))
+    ret = Deferred()
+    d.addCallback(lambda result: ret.callback(OK(result, api_method='process_memory_trace')))
+    d.addErrback(lambda err: ret.callback(ERROR(err, api_method='process_memory_trace')))
+    return ret
+
+
 def process_debug():
     """
     Execute a breakpoint inside the main thread and start Python shell using standard `pdb.set_trace()` debugger method.
@@ -1513,6 +1679,7 @@ def network_status(suppliers: bool = False, customers: bool = False, cache: bool
                         'packets_sent': dht_service.node().packets_out.get(layer_id, 0),
                         'rpc_calls': dht_service.node().rpc_calls.get(layer_id, {}),
                         'rpc_responses': dht_service.node().rpc_responses.get(layer_id, {}),
+                        'lookups': dht_service.node()._routingTables[layer_id].rttStats(),
                     }
                 )
             r['dht'].update({
@@ -1520,6 +1687,8 @@ def network_status(suppliers: bool = False, customers: bool = False, cache: bool
                 'bytes_received': dht_service.node().bytes_in,
                 'bytes_sent': dht_service.node().bytes_out,
                 'layers': layers,
+                'cache': dht_service.cache_stats(),
+                'republish': dht_service.republish_stats(),
             })
     return OK(r)
 
@@ -4614,10 +4783,13 @@ def user_observe(nickname: str, attempts: int = 3):
 #------------------------------------------------------------------------------
 
 
-def message_history(recipient_id: str = None, sender_id: str = None, message_type: str = None, offset: int = 0, limit: int = 100):
+def message_history(recipient_id: str = None, sender_id: str = None, message_type: str = None, offset: int = 0, limit: int = 100, cursor: str = None):
     """
     Returns chat communications history stored for given user or messaging group.
 
+    Messages are ordered from newest to oldest. Result also contains `next_cursor` field, pass it as `cursor` to read next page.
+    When `cursor` is given, `offset` is ignored.
+
     ###### HTTP
         curl -X GET 'localhost:8180/message/history/v1?message_type=group_message&recipient_id=group_95d0fedc46308e2254477fcb96364af9$alice@server-a.com'
 
@@ -4659,9 +4831,86 @@ def message_history(recipient_id: str = None, sender_id: str = None, message_typ
         if recipient_local_key_id is None:
             lg.warn('local key id for recipient %s was not registered' % recipient_id)
             return RESULT([])
+    next_cursor = None
+    if offset and not cursor:
+        found_messages = message_database.query_messages(
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            bidirectional=bidirectional,
+            message_types=[
+                message_type,
+            ] if message_type else [],
+            offset=offset,
+            limit=limit,
+            raw_results=True,
+        )
+        if found_messages and len(found_messages) == limit:
+            next_cursor = message_database.make_cursor(found_messages[-1])
+        found_messages = [message_database.build_json_message_from_row(row) for row in found_messages]
+    else:
+        try:
+            found_messages, next_cursor = message_database.query_messages_page(
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                bidirectional=bidirectional,
+                message_types=[
+                    message_type,
+                ] if message_type else [],
+                cursor=cursor or None,
+                limit=limit,
+            )
+        except ValueError:
+            return ERROR('invalid cursor: %s' % cursor)
+    messages = [{
+        'doc': m,
+    } for m in found_messages]
+    if _Debug:
+        lg.out(_DebugLevel, 'api.message_history with recipient_id=%s sender_id=%s message_type=%s found %d messages' % (recipient_id, sender_id, message_type, len(messages)))
+    return RESULT(messages, extra_fields={
+        'next_cursor': next_cursor,
+    })
+
+
+def message_search(query: str, recipient_id: str = None, sender_id: str = None, message_type: str = None, offset: int = 0, limit: int = 20):
+    """
+    Full-text search in the chat history, all words from the `query` must be present in the message.
+    Most relevant messages are returned first.
+
+    ###### HTTP
+        curl -X GET 'localhost:8180/message/search/v1?query=hello&message_type=group_message&recipient_id=group_95d0fedc46308e2254477fcb96364af9$alice@server-a.com'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "message_search", "kwargs": {"query": "hello", "recipient_id" : "group_95d0fedc46308e2254477fcb96364af9$alice@server-a.com", "message_type": "group_message"} }');
+    """
+    if not driver.is_on('service_message_history'):
+        return ERROR('service_message_history() is not started')
+    from bitdust.chat import message_database
+    from bitdust.userid import my_id, global_id
+    from bitdust.crypt import my_keys
+    if not query or not query.strip():
+        return ERROR('query is empty')
+    if recipient_id:
+        if not recipient_id.count('@'):
+            from bitdust.contacts import contactsdb
+            recipient_idurl = contactsdb.find_correspondent_by_nickname(recipient_id)
+            if not recipient_idurl:
+                return ERROR('recipient was not found')
+            recipient_id = global_id.UrlToGlobalID(recipient_idurl)
+        recipient_glob_id = global_id.ParseGlobalID(recipient_id)
+        if not recipient_glob_id['idurl']:
+            return ERROR('wrong recipient_id')
+        recipient_id = global_id.MakeGlobalID(**recipient_glob_id)
+        if not my_keys.is_valid_key_id(recipient_id):
+            return ERROR('invalid recipient_id: %s' % recipient_id)
+    bidirectional = False
+    if recipient_id and message_type in [None, 'private_message']:
+        bidirectional = True
+        if sender_id is None:
+            sender_id = my_id.getGlobalID(key_alias='master')
     messages = [{
         'doc': m,
-    } for m in message_database.query_messages(
+    } for m in message_database.search_messages(
+        query=query,
         sender_id=sender_id,
         recipient_id=recipient_id,
         bidirectional=bidirectional,
@@ -4672,7 +4921,7 @@ def message_history(recipient_id: str = None, sender_id: str = None, message_typ
         limit=limit,
     )]
     if _Debug:
-        lg.out(_DebugLevel, 'api.message_history with recipient_id=%s sender_id=%s message_type=%s found %d messages' % (recipient_id, sender_id, message_type, len(messages)))
+        lg.out(_DebugLevel, 'api.message_search with query=%r recipient_id=%s message_type=%s found %d messages' % (query, recipient_id, message_type, len(messages)))
     return RESULT(messages)
 
 
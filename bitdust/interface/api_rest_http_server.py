@@ -51,6 +51,7 @@ import time
 
 from twisted.internet import reactor  # @UnresolvedImport
 from twisted.web.server import Site  # @UnresolvedImport
+from twisted.web.static import Data  # @UnresolvedImport
 
 #------------------------------------------------------------------------------
 
@@ -361,6 +362,82 @@ class BitDustRESTHTTPServer(JsonAPIResource):
     def process_info_v1(self, request):
         return api.process_info()
 
+    @GET('^/p/m$')
+    @GET('^/v1/process/metrics$')
+    @GET('^/process/metrics/v1$')
+    def process_metrics_v1(self, request):
+        return api.process_metrics(reset=bool(_request_arg(request, 'reset', '0') in YES))
+
+    @GET('^/metrics$')
+    @GET('^/v1/process/metrics/prometheus$')
+    def process_metrics_prometheus_v1(self, request):
+        from bitdust.logs import metrics
+        return Data(strng.to_bin(metrics.prometheus_text()), 'text/plain; version=0.0.4; charset=utf-8')
+
+    @GET('^/p/l$')
+    @GET('^/v1/process/logs$')
+    @GET('^/process/logs/v1$')
+    def process_logs_v1(self, request):
+        return api.process_logs(
+            limit=int(_request_arg(request, 'limit', 100)),
+            log_name=_request_arg(request, 'log_name', None),
+            level=_request_arg(request, 'level', None),
+        )
+
+    @POST('^/p/pr/s$')
+    @POST('^/v1/process/profiler/start$')
+    @POST('^/process/profiler/start/v1$')
+    def process_profiler_start_v1(self, request):
+        data = _request_data(request)
+        return api.process_profiler_start(
+            hz=int(data.get('hz', 100)),
+            duration=int(data.get('duration', 300)),
+            threads=data.get('threads') or None,
+        )
+
+    @POST('^/p/pr/c$')
+    @POST('^/v1/process/profiler/stop$')
+    @POST('^/process/profiler/stop/v1$')
+    def process_profiler_stop_v1(self, request):
+        return api.process_profiler_stop()
+
+    @GET('^/p/pr/r$')
+    @GET('^/v1/process/profiler/report$')
+    @GET('^/process/profiler/report/v1$')
+    def process_profiler_report_v1(self, request):
+        return api.process_profiler_report(
+            format=_request_arg(request, 'format', 'top'),
+            limit=int(_request_arg(request, 'limit', 20)),
+        )
+
+    @GET('^/v1/process/profiler/export$')
+    @GET('^/process/profiler/export/v1$')
+    def process_profiler_export_v1(self, request):
+        from bitdust.logs import profiler
+        p = profiler.profiler()
+        if not p:
+            return api.ERROR('profiler was not started')
+        if _request_arg(request, 'format', 'speedscope') == 'collapsed':
+            return Data(strng.to_bin(p.collapsed()), 'text/plain; charset=utf-8')
+        return Data(strng.to_bin(jsn.dumps(p.speedscope())), 'application/json')
+
+    @GET('^/p/mem$')
+    @GET('^/v1/process/memory$')
+    @GET('^/process/memory/v1$')
+    def process_memory_usage_v1(self, request):
+        return api.process_memory_usage()
+
+    @POST('^/p/mem/t$')
+    @POST('^/v1/process/memory/trace$')
+    @POST('^/process/memory/trace/v1$')
+    def process_memory_trace_v1(self, request):
+        data = _request_data(request)
+        return api.process_memory_trace(
+            action=data.get('action', 'snapshot'),
+            limit=int(data.get('limit', 20)),
+            frames=int(data.get('frames', 1)),
+        )
+
     @GET('^/p/d$')
     @GET('^/v1/process/debug$')
     @GET('^/process/debug/v1$')
@@ -1150,6 +1227,20 @@ class BitDustRESTHTTPServer(JsonAPIResource):
             message_type=_request_arg(request, 'message_type', 'private_message'),
             offset=int(_request_arg(request, 'offset', '0')),
             limit=int(_request_arg(request, 'limit', '100')),
+            cursor=_request_arg(request, 'cursor', None),
+        )
+
+    @GET('^/msg/s$')
+    @GET('^/v1/message/search$')
+    @GET('^/message/search/v1$')
+    def message_search_v1(self, request):
+        return api.message_search(
+            query=_request_arg(request, 'query', mandatory=True),
+            recipient_id=_request_arg(request, 'id', None, False),
+            sender_id=_request_arg(request, 'sender_id', None, False),
+            message_type=_request_arg(request, 'message_type', None),
+            offset=int(_request_arg(request, 'offset', '0')),
+            limit=int(_request_arg(request, 'limit', '20')),
         )
 
     @GET('^/msg/c$')
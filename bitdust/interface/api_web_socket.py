@@ -42,8 +42,22 @@ _APILogFileEnabled = False
 
 #------------------------------------------------------------------------------
 
+SNAPSHOTS_FLUSH_WINDOW = 0.1
+MAX_CONNECTION_BUFFER_SIZE = 4*1024*1024
+
+# only these messages can be dropped for a slow client, the rest is always delivered
+DROPPABLE_TYPES = ('event', 'model')
+
+#------------------------------------------------------------------------------
+
+import collections
+
+from zope.interface import implementer
+
 from twisted.application.strports import listen
+from twisted.internet import reactor  # @UnresolvedImport
 from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, Factory
 from twisted.python.failure import Failure
 
@@ -65,6 +79,9 @@ from bitdust.interface import api
 
 _WebSocketListener = None
 _WebSocketTransports = {}
+_WebSocketConnections = {}
+_PendingSnapshots = collections.OrderedDict()
+_SnapshotsFlushTask = None
 _AllAPIMethods = []
 _APISecret = None
 
@@ -96,7 +113,12 @@ def init(port=None):
 
 def shutdown():
     global _WebSocketListener
+    global _SnapshotsFlushTask
     events.remove_subscriber(on_event, event_id='*')
+    if _SnapshotsFlushTask and _SnapshotsFlushTask.active():
+        _SnapshotsFlushTask.cancel()
+    _SnapshotsFlushTask = None
+    _PendingSnapshots.clear()
     if _WebSocketListener:
         if _Debug:
             lg.out(_DebugLevel, 'api_web_socket.shutdown calling _WebSocketListener.stopListening()')
@@ -146,6 +168,106 @@ class WrappedWebSocketFactory(txws.WebSocketFactory):
 #------------------------------------------------------------------------------
 
 
+@implementer(IPushProducer)
+class WebSocketConnection(object):
+
+    """
+    Keeps state of a single web socket client: list of subscriptions and outgoing buffer.
+
+    Registered as a streaming producer on the transport, so when client is not reading fast enough
+    Twisted will call `pauseProducing()` and all outgoing messages are buffered here instead.
+    When buffer grows above `MAX_CONNECTION_BUFFER_SIZE` all pending events and model snapshots are dropped
+    and client receives a "resync" message after the transport was drained.
+    API responses, stream messages and online status updates are never dropped.
+    """
+
+    def __init__(self, key, transport):
+        self.key = key
+        self.transport = transport
+        self.events = None
+        self.models = None
+        self.types = None
+        self.paused = False
+        self.pending = collections.deque()
+        self.pending_size = 0
+        self.dropped = 0
+        self.resync_required = False
+
+    def __repr__(self):
+        return 'WebSocketConnection(%s://%s:%s)' % (self.key[0], self.key[1], self.key[2])
+
+    def subscribe(self, events=None, models=None, types=None):
+        self.events = set(events) if events is not None else None
+        self.models = set(models) if models is not None else None
+        self.types = set(types) if types is not None else None
+        if _Debug:
+            lg.args(_DebugLevel, c=self, events=self.events, models=self.models, types=self.types)
+
+    def is_subscribed(self, json_data):
+        typ = json_data.get('type')
+        if self.types is not None and typ not in self.types:
+            return False
+        if typ == 'event' and self.events is not None:
+            return json_data['payload']['event_id'] in self.events or '*' in self.events
+        if typ == 'model' and self.models is not None:
+            return json_data['payload']['name'] in self.models or '*' in self.models
+        return True
+
+    def send(self, raw_bytes, droppable=True):
+        if not self.paused and not self.pending:
+            self.transport.write(raw_bytes)
+            return True
+        if droppable:
+            if self.resync_required:
+                self.dropped += 1
+                return False
+            if self.pending_size + len(raw_bytes) > MAX_CONNECTION_BUFFER_SIZE:
+                self.drop_pending()
+                self.dropped += 1
+                return False
+        self.pending.append((raw_bytes, droppable))
+        self.pending_size += len(raw_bytes)
+        return True
+
+    def drop_pending(self):
+        kept = collections.deque()
+        kept_size = 0
+        for raw_bytes, droppable in self.pending:
+            if droppable:
+                self.dropped += 1
+            else:
+                kept.append((raw_bytes, droppable))
+                kept_size += len(raw_bytes)
+        self.pending = kept
+        self.pending_size = kept_size
+        self.resync_required = True
+        lg.warn('%r is too slow, dropped %d messages and will require resync' % (self, self.dropped))
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        while self.pending and not self.paused:
+            raw_bytes, _ = self.pending.popleft()
+            self.pending_size -= len(raw_bytes)
+            self.transport.write(raw_bytes)
+        if self.resync_required and not self.paused and not self.pending:
+            self.resync_required = False
+            dropped = self.dropped
+            self.dropped = 0
+            self.transport.write(serialization.DictToBytes({
+                'type': 'resync',
+                'payload': {
+                    'dropped': dropped,
+                },
+            }, encoding='utf-8'))
+
+    def stopProducing(self):
+        self.pending.clear()
+        self.pending_size = 0
+
+
 class WebSocketProtocol(Protocol):
 
     _key = None
@@ -158,26 +280,34 @@ class WebSocketProtocol(Protocol):
             return
         if _Debug:
             lg.dbg(_DebugLevel, 'received %d bytes from web socket: %r' % (len(data), json_data))
-        if not do_process_incoming_message(json_data):
+        if not do_process_incoming_message(json_data, key=self._key):
             lg.warn('failed processing incoming message from web socket: %r' % json_data)
 
     def connectionMade(self):
         global _WebSocketTransports
+        global _WebSocketConnections
         Protocol.connectionMade(self)
         peer = self.transport.getPeer()
         self._key = (peer.type, peer.host, peer.port)
         peer_text = '%s://%s:%s' % (self._key[0], self._key[1], self._key[2])
         _WebSocketTransports[self._key] = self.transport
+        _WebSocketConnections[self._key] = WebSocketConnection(self._key, self.transport)
+        try:
+            self.transport.registerProducer(_WebSocketConnections[self._key], True)
+        except:
+            lg.exc()
         if _Debug:
             lg.args(_DebugLevel, key=self._key, ws_connections=len(_WebSocketTransports))
         events.send('web-socket-connected', data=dict(peer=peer_text))
 
     def connectionLost(self, *args, **kwargs):
         global _WebSocketTransports
+        global _WebSocketConnections
         if _Debug:
             lg.args(_DebugLevel, key=self._key, ws_connections=len(_WebSocketTransports))
         Protocol.connectionLost(self, *args, **kwargs)
         _WebSocketTransports.pop(self._key)
+        _WebSocketConnections.pop(self._key, None)
         peer_text = '%s://%s:%s' % (self._key[0], self._key[1], self._key[2])
         self._key = None
         events.send('web-socket-disconnected', data=dict(peer=peer_text))
@@ -204,9 +334,21 @@ class WebSocketFactory(Factory):
 #------------------------------------------------------------------------------
 
 
-def do_process_incoming_message(json_data):
+def do_process_incoming_message(json_data, key=None):
     global _AllAPIMethods
+    global _WebSocketConnections
     command = json_data.get('command')
+    if command == 'subscribe':
+        connection = _WebSocketConnections.get(key)
+        if not connection:
+            return False
+        connection.subscribe(
+            events=json_data.get('events', None),
+            models=json_data.get('models', None),
+            types=json_data.get('types', None),
+        )
+        return True
+
     if command == 'api_call':
         method = json_data.get('method', None)
         kwargs = json_data.get('kwargs', {})
@@ -220,7 +362,7 @@ def do_process_incoming_message(json_data):
                     'call_id': call_id,
                     'errors': ['api method name was not provided'],
                 },
-            })
+            }, key=key)
 
         if method not in _AllAPIMethods:
             lg.warn('invalid api method name: %r' % method)
@@ -230,7 +372,7 @@ def do_process_incoming_message(json_data):
                     'call_id': call_id,
                     'errors': ['invalid api method name'],
                 },
-            })
+            }, key=key)
 
         if _Debug:
             lg.out(_DebugLevel, '*** %s  API WS IN  %s(%r)' % (call_id, method, kwargs))
@@ -249,7 +391,7 @@ def do_process_incoming_message(json_data):
                     'call_id': call_id,
                     'errors': [str(err)],
                 },
-            })
+            }, key=key)
 
         if isinstance(response, Deferred):
 
@@ -260,7 +402,7 @@ def do_process_incoming_message(json_data):
                         'call_id': call_id,
                         'response': r,
                     },
-                })
+                }, key=key)
 
             def _eb(err):
                 err_msg = err.getErrorMessage() if isinstance(err, Failure) else str(err)
@@ -270,7 +412,7 @@ def do_process_incoming_message(json_data):
                         'call_id': call_id,
                         'errors': [err_msg],
                     },
-                })
+                }, key=key)
 
             response.addCallback(_cb)
             response.addErrback(_eb)
@@ -282,7 +424,7 @@ def do_process_incoming_message(json_data):
                 'call_id': call_id,
                 'response': response,
             },
-        })
+        }, key=key)
 
     return False
 
@@ -315,29 +457,72 @@ def on_online_status_changed(status_info):
 
 
 def on_model_changed(snapshot_object):
-    return push({
-        'type': 'model',
-        'payload': snapshot_object.to_json(),
-    })
+    """
+    Model snapshots are not sent immediately, but collected during `SNAPSHOTS_FLUSH_WINDOW` seconds.
+    If same object was updated many times within that window only the latest snapshot will be sent.
+    """
+    global _PendingSnapshots
+    global _SnapshotsFlushTask
+    if not _WebSocketTransports:
+        return False
+    _PendingSnapshots[(snapshot_object.model_name, snapshot_object.snap_id)] = snapshot_object.to_json()
+    if _SnapshotsFlushTask is None or not _SnapshotsFlushTask.active():
+        _SnapshotsFlushTask = reactor.callLater(SNAPSHOTS_FLUSH_WINDOW, flush_snapshots)  # @UndefinedVariable
+    return True
+
+
+def flush_snapshots():
+    global _PendingSnapshots
+    global _SnapshotsFlushTask
+    if _SnapshotsFlushTask and _SnapshotsFlushTask.active():
+        _SnapshotsFlushTask.cancel()
+    _SnapshotsFlushTask = None
+    pending = _PendingSnapshots
+    _PendingSnapshots = collections.OrderedDict()
+    if _Debug:
+        lg.args(_DebugLevel, snapshots=len(pending))
+    for snapshot_json in pending.values():
+        push({
+            'type': 'model',
+            'payload': snapshot_json,
+        })
+    return len(pending)
 
 
 #------------------------------------------------------------------------------
 
 
-def push(json_data):
-    global _WebSocketTransports
-    if not _WebSocketTransports:
+def push(json_data, key=None):
+    """
+    Serialize given message only once and send it to all connected clients which are subscribed to it.
+    If `key` is provided, the message is only sent to that particular connection.
+    """
+    global _WebSocketConnections
+    if not _WebSocketConnections:
         # lg.warn('there are currently no web socket transports open')
         return False
+    if key is not None:
+        connection = _WebSocketConnections.get(key)
+        if not connection:
+            lg.warn('web socket connection %r was already closed' % (key, ))
+            return False
+        recipients = [
+            connection,
+        ]
+    else:
+        recipients = [c for c in _WebSocketConnections.values() if c.is_subscribed(json_data)]
+        if not recipients:
+            return False
     raw_bytes = serialization.DictToBytes(json_data, encoding='utf-8')
-    for _key, transp in _WebSocketTransports.items():
+    droppable = json_data.get('type') in DROPPABLE_TYPES
+    for connection in recipients:
         try:
-            transp.write(raw_bytes)
+            connection.send(raw_bytes, droppable=droppable)
         except:
             lg.exc()
             continue
         if _Debug:
-            lg.dbg(_DebugLevel, 'sent %d bytes to web socket %s' % (len(raw_bytes), '%s://%s:%s' % (_key[0], _key[1], _key[2])))
+            lg.dbg(_DebugLevel, 'sent %d bytes to %r' % (len(raw_bytes), connection))
     if _Debug:
         lg.out(_DebugLevel, '***   API WS PUSH  %d bytes' % len(raw_bytes))
     if _APILogFileEnabled:
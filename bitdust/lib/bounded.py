@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# bounded.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (bounded.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+"""
+..
+
+module:: bounded
+
+Containers with limited capacity to be used for in-memory queues and histories.
+
+`RingBuffer` stores every item only once, no matter how many consumers are reading from it.
+Every consumer has own cursor - a sequence number of the next item it will read.
+When consumer is too slow and cursor falls behind the oldest stored item - consumer is "overrun".
+
+`ExpiringSet` is a hash set which only remembers most recent items,
+limited by total number of items and by age of every item.
+"""
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+import time
+import collections
+
+#------------------------------------------------------------------------------
+
+
+class RingBuffer(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = [None]*capacity
+        self.head = 0
+        self.released = 0
+        self.cursors = {}
+
+    def __repr__(self):
+        return 'RingBuffer(%d/%d, %d consumers)' % (len(self), self.capacity, len(self.cursors))
+
+    def __len__(self):
+        return self.head - self.tail()
+
+    def tail(self):
+        """
+        Sequence number of the oldest item still stored in the buffer.
+        """
+        return max(self.released, self.head - self.capacity)
+
+    def append(self, item):
+        """
+        Store new item and return its sequence number.
+        """
+        self.items[self.head % self.capacity] = item
+        self.head += 1
+        return self.head - 1
+
+    def consumers(self):
+        return list(self.cursors.keys())
+
+    def is_subscribed(self, consumer_id):
+        return consumer_id in self.cursors
+
+    def subscribe(self, consumer_id):
+        """
+        New consumer will only receive items added after that call.
+        """
+        if consumer_id not in self.cursors:
+            self.cursors[consumer_id] = self.head
+        return self.cursors[consumer_id]
+
+    def unsubscribe(self, consumer_id):
+        if self.cursors.pop(consumer_id, None) is None:
+            return False
+        self.release()
+        return True
+
+    def pending_count(self, consumer_id):
+        cursor = self.cursors.get(consumer_id)
+        if cursor is None:
+            return 0
+        return self.head - cursor
+
+    def is_overrun(self, consumer_id):
+        cursor = self.cursors.get(consumer_id)
+        if cursor is None:
+            return False
+        return cursor < self.head - self.capacity
+
+    def read(self, consumer_id):
+        """
+        Returns a list of all items not yet consumed by given consumer, cursor is not moved.
+        """
+        cursor = self.cursors.get(consumer_id)
+        if cursor is None:
+            return []
+        start = max(cursor, self.head - self.capacity)
+        return [self.items[pos % self.capacity] for pos in range(start, self.head)]
+
+    def commit(self, consumer_id, position=None):
+        """
+        Move consumer cursor forward to given sequence number, or to the end of the buffer.
+        """
+        if consumer_id not in self.cursors:
+            return False
+        self.cursors[consumer_id] = self.head if position is None else min(position, self.head)
+        self.release()
+        return True
+
+    def release(self):
+        """
+        Forget items already consumed by all of the consumers, so they can be garbage collected.
+        """
+        oldest = min(self.cursors.values()) if self.cursors else self.head
+        start = max(self.released, self.head - self.capacity)
+        for pos in range(start, oldest):
+            self.items[pos % self.capacity] = None
+        self.released = max(self.released, oldest)
+
+    def clear(self):
+        self.items = [None]*self.capacity
+        self.head = 0
+        self.released = 0
+        self.cursors.clear()
+
+
+#------------------------------------------------------------------------------
+
+
+class ExpiringSet(object):
+
+    def __init__(self, max_size, max_age=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.items = collections.OrderedDict()
+
+    def __repr__(self):
+        return 'ExpiringSet(%d/%d)' % (len(self.items), self.max_size)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        added = self.items.get(item)
+        if added is None:
+            return False
+        if self.max_age is not None and time.time() - added > self.max_age:
+            self.items.pop(item, None)
+            return False
+        return True
+
+    def add(self, item):
+        now = time.time()
+        self.items.pop(item, None)
+        self.items[item] = now
+        self.cleanup(now)
+
+    def discard(self, item):
+        self.items.pop(item, None)
+
+    def cleanup(self, now=None):
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+        if self.max_age is not None:
+            if now is None:
+                now = time.time()
+            while self.items:
+                oldest = next(iter(self.items))
+                if now - self.items[oldest] <= self.max_age:
+                    break
+                self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
@@ -531,3 +531,13 @@ def IsIndexFileName(path):
     if not path[7:].isdecimal():
         return False
     return True
+
+
+def MakeIndexDeltaFileNamePacketID():
+    return '.index.{}.delta'.format(UniqueID())
+
+
+def IsIndexDeltaFileName(path):
+    if not path.endswith('.delta'):
+        return False
+    return IsIndexFileName(path[:-6])
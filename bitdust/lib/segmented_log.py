@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# segmented_log.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (segmented_log.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+"""
+..
+
+module:: segmented_log
+
+Append-only on-disk log of binary records, split into segment files.
+
+Every record gets a sequential offset number. Segment file is named after the offset of its first record,
+new segment is started when current one reaches `max_segment_size` bytes.
+Oldest segments are removed when total size of the log or age of the records exceeds the limits.
+
+Record format is: CRC32, offset, timestamp, data length and data itself.
+When log is opened all segments are verified, a partially written record at the end
+(for example after a crash) is truncated.
+
+Consumers can store their positions in the log with `commit()`, those are kept in "offsets" file.
+
+Every appended record is flushed to the OS right away, but fsync() only happens in `sync()`:
+when segment is finished, before consumers positions are saved, when log is closed
+and after appending a record if more than `sync_interval` seconds passed since the last sync.
+So a power failure can lose records appended during the last `sync_interval` seconds,
+but never records which consumers already committed. Retention is also checked on every sync.
+"""
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import bisect
+
+from array import array
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.lib import jsn
+
+from bitdust.system import local_fs
+
+#------------------------------------------------------------------------------
+
+_RecordHeader = struct.Struct('>IQdI')
+
+#------------------------------------------------------------------------------
+
+
+class LogSegment(object):
+
+    def __init__(self, base_offset, filepath):
+        self.base_offset = base_offset
+        self.filepath = filepath
+        self.positions = array('Q')
+        self.size = 0
+        self.last_time = 0
+
+    def __repr__(self):
+        return 'LogSegment(%d+%d, %d bytes)' % (self.base_offset, len(self.positions), self.size)
+
+    def next_offset(self):
+        return self.base_offset + len(self.positions)
+
+    def scan(self):
+        """
+        Reads all valid records from the segment file and builds positions index.
+        Returns False if a broken record was found, file is truncated to the last valid record in that case.
+        """
+        self.positions = array('Q')
+        self.size = 0
+        file_size = os.path.getsize(self.filepath)
+        if not file_size:
+            return True
+        valid = True
+        with open(self.filepath, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = 0
+                while pos < file_size:
+                    if pos + _RecordHeader.size > file_size:
+                        valid = False
+                        break
+                    crc, offset, timestamp, length = _RecordHeader.unpack_from(m, pos)
+                    end = pos + _RecordHeader.size + length
+                    if end > file_size or offset != self.next_offset():
+                        valid = False
+                        break
+                    if zlib.crc32(m[pos + 4:end]) & 0xffffffff != crc:
+                        valid = False
+                        break
+                    self.positions.append(pos)
+                    self.last_time = timestamp
+                    pos = end
+                self.size = pos
+            finally:
+                m.close()
+        if not valid:
+            lg.warn('found broken record in %r at position %d, truncating %d bytes' % (self.filepath, self.size, file_size - self.size))
+            with open(self.filepath, 'r+b') as f:
+                f.truncate(self.size)
+        return valid
+
+    def read(self, offset, limit):
+        """
+        Returns list of (offset, timestamp, data) tuples starting from given offset.
+        """
+        index = offset - self.base_offset
+        if index < 0 or index >= len(self.positions):
+            return []
+        results = []
+        with open(self.filepath, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while index < len(self.positions) and len(results) < limit:
+                    pos = self.positions[index]
+                    _, rec_offset, timestamp, length = _RecordHeader.unpack_from(m, pos)
+                    start = pos + _RecordHeader.size
+                    results.append((rec_offset, timestamp, m[start:start + length]))
+                    index += 1
+            finally:
+                m.close()
+        return results
+
+
+#------------------------------------------------------------------------------
+
+
+class SegmentedLog(object):
+
+    def __init__(self, dirpath, max_segment_size=4*1024*1024, max_size=None, max_age=None, sync_interval=None):
+        self.dirpath = dirpath
+        self.max_segment_size = max_segment_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.sync_interval = sync_interval
+        self.last_sync_time = time.time()
+        self.segments = []
+        self.offsets = {}
+        self.offsets_modified = False
+        self.active_file = None
+        self.open()
+
+    def __repr__(self):
+        return 'SegmentedLog(%s, %d:%d, %d segments)' % (self.dirpath, self.first_offset(), self.next_offset(), len(self.segments))
+
+    def __len__(self):
+        return sum([len(s.positions) for s in self.segments])
+
+    def open(self):
+        """
+        Loads all existing segments and recovers the log after unclean shutdown.
+        """
+        if not os.path.isdir(self.dirpath):
+            os.makedirs(self.dirpath)
+        for filename in sorted(os.listdir(self.dirpath)):
+            if not filename.endswith('.log'):
+                continue
+            try:
+                base_offset = int(filename[:-4])
+            except ValueError:
+                lg.warn('unexpected file found in the log folder: %r' % filename)
+                continue
+            segment = LogSegment(base_offset, os.path.join(self.dirpath, filename))
+            segment.scan()
+            self.segments.append(segment)
+        self.segments.sort(key=lambda s: s.base_offset)
+        offsets_filepath = os.path.join(self.dirpath, 'offsets')
+        if os.path.isfile(offsets_filepath):
+            try:
+                self.offsets = jsn.loads_text(local_fs.ReadBinaryFile(offsets_filepath)) or {}
+            except:
+                lg.exc()
+                self.offsets = {}
+        if not self.segments:
+            self.segments.append(self._make_segment(0))
+        self.active_file = open(self.segments[-1].filepath, 'ab')
+        self.retention()
+        if _Debug:
+            lg.args(_DebugLevel, log=self, offsets=len(self.offsets))
+
+    def close(self):
+        self.save_offsets()
+        if self.active_file:
+            self.active_file.close()
+            self.active_file = None
+
+    def relocate(self, dirpath):
+        """
+        Must be called after the log folder was moved to another location.
+        """
+        if self.active_file:
+            self.active_file.close()
+        self.dirpath = dirpath
+        for segment in self.segments:
+            segment.filepath = os.path.join(dirpath, os.path.basename(segment.filepath))
+        self.active_file = open(self.segments[-1].filepath, 'ab')
+
+    def first_offset(self):
+        for segment in self.segments:
+            if segment.positions:
+                return segment.base_offset
+        return self.next_offset()
+
+    def next_offset(self):
+        if not self.segments:
+            return 0
+        return self.segments[-1].next_offset()
+
+    def total_size(self):
+        return sum([s.size for s in self.segments])
+
+    def append(self, data, timestamp=None):
+        """
+        Writes new record at the end of the log and returns its offset.
+        Data is flushed to the OS right away, fsync() happens when segment is finished or `sync_interval` passed.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        segment = self.segments[-1]
+        if segment.size >= self.max_segment_size:
+            segment = self.roll()
+        offset = segment.next_offset()
+        body = _RecordHeader.pack(0, offset, timestamp, len(data))[4:] + data
+        record = struct.pack('>I', zlib.crc32(body) & 0xffffffff) + body
+        self.active_file.write(record)
+        self.active_file.flush()
+        segment.positions.append(segment.size)
+        segment.size += len(record)
+        segment.last_time = timestamp
+        if self.sync_interval is not None and time.time() - self.last_sync_time >= self.sync_interval:
+            self.sync()
+        return offset
+
+    def sync(self):
+        """
+        Makes sure all appended records are written to the disk and removes expired segments.
+        """
+        if self.active_file:
+            self.active_file.flush()
+            os.fsync(self.active_file.fileno())
+        self.last_sync_time = time.time()
+        self.retention()
+
+    def roll(self):
+        """
+        Finish current segment and start a new one.
+        """
+        self.active_file.flush()
+        os.fsync(self.active_file.fileno())
+        self.active_file.close()
+        segment = self._make_segment(self.next_offset())
+        self.segments.append(segment)
+        self.active_file = open(segment.filepath, 'ab')
+        self.retention()
+        return segment
+
+    def read(self, offset, limit=100):
+        """
+        Returns a list of (offset, timestamp, data) tuples, starting from given offset.
+        Records already removed by retention are skipped.
+        """
+        if self.active_file:
+            self.active_file.flush()
+        results = []
+        i = max(0, bisect.bisect_right([s.base_offset for s in self.segments], offset) - 1)
+        while i < len(self.segments) and len(results) < limit:
+            segment = self.segments[i]
+            results.extend(segment.read(max(offset, segment.base_offset), limit - len(results)))
+            i += 1
+        return results
+
+    def retention(self, now=None):
+        """
+        Removes oldest finished segments while log is too big or records are too old.
+        """
+        if now is None:
+            now = time.time()
+        total_size = self.total_size()
+        removed = 0
+        while len(self.segments) > 1:
+            segment = self.segments[0]
+            too_big = self.max_size is not None and total_size > self.max_size
+            too_old = self.max_age is not None and segment.last_time and now - segment.last_time > self.max_age
+            if not too_big and not too_old:
+                break
+            self.segments.pop(0)
+            total_size -= segment.size
+            try:
+                os.remove(segment.filepath)
+            except:
+                lg.exc()
+            removed += 1
+        if removed:
+            lg.info('removed %d old segments from %r' % (removed, self.dirpath))
+        return removed
+
+    def committed(self, consumer_id):
+        """
+        Returns offset of the next record given consumer did not read yet, or None if consumer is unknown.
+        """
+        return self.offsets.get(consumer_id)
+
+    def commit(self, consumer_id, offset):
+        """
+        Remember position of given consumer, offset must point to the next record to be read.
+        Positions are only moving forward, call `save_offsets()` to write them to the disk.
+        """
+        if offset <= self.offsets.get(consumer_id, -1):
+            return False
+        self.offsets[consumer_id] = offset
+        self.offsets_modified = True
+        return True
+
+    def forget(self, consumer_id):
+        if self.offsets.pop(consumer_id, None) is None:
+            return False
+        self.offsets_modified = True
+        return True
+
+    def save_offsets(self):
+        """
+        Records must reach the disk before positions pointing after them, so `sync()` is always called first.
+        """
+        self.sync()
+        if not self.offsets_modified:
+            return False
+        self.offsets_modified = False
+        return local_fs.WriteBinaryFile(os.path.join(self.dirpath, 'offsets'), jsn.dumps(self.offsets, keys_to_text=True))
+
+    def _make_segment(self, base_offset):
+        filepath = os.path.join(self.dirpath, '%020d.log' % base_offset)
+        open(filepath, 'ab').close()
+        return LogSegment(base_offset, filepath)
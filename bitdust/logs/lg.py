@@ -37,6 +37,7 @@ from __future__ import absolute_import
 
 import six
 import os
+import re
 import sys
 import time
 import datetime
@@ -44,6 +45,7 @@ import threading
 import traceback
 import logging
 import platform
+import collections
 from io import open
 
 #------------------------------------------------------------------------------
@@ -72,6 +74,13 @@ _TimePush = 0.0
 _TimeTotalDict = {}
 _TimeDeltaDict = {}
 _TimeCountsDict = {}
+_Writer = None
+_RecentEntries = collections.deque(maxlen=1000)
+_RateLimit = 0
+_RateBurst = 0
+_Sampling = {}
+_Limiters = {}
+_ColorCodes = re.compile('\033\\[[0-9;]*m')
 
 #------------------------------------------------------------------------------
 
@@ -93,6 +102,28 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
     :param nl: this string is added at the end,
                set to empty string to avoid new line.
     """
+    global _WebStreamFunc
+    global _GlobalDebugLevel
+    level = _DebugLevel
+    if not level:
+        level = 0
+    if level < 0:
+        level = 0
+    if level % 2:
+        level -= 1
+    if level > _GlobalDebugLevel and _WebStreamFunc is None:
+        return None
+    if level and (_RateLimit or _Sampling) and level <= _GlobalDebugLevel:
+        modul = _caller_module()
+        suppressed = _limit(modul)
+        if suppressed is None:
+            return None
+        if suppressed:
+            _emit(level, '%d log messages from %s were suppressed' % (suppressed, modul), nl, log_name, showtime)
+    return _emit(level, msg, nl, log_name, showtime)
+
+
+def _emit(level, msg, nl, log_name, showtime):
     global _IsAndroid
     global _InterceptedLogFile
     global _WebStreamFunc
@@ -106,17 +137,9 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
     global _LogLinesCounter
     global _LogsEnabled
     global _UseColors
-    global _GlobalDebugLevel
     global _AllLogFiles
     s = msg
     s_ = s
-    level = _DebugLevel
-    if not level:
-        level = 0
-    if level < 0:
-        level = 0
-    if level % 2:
-        level -= 1
     if level:
         lstr = s.lstrip()
         if lstr.startswith('INFO') or lstr.startswith('DEBUG') or lstr.startswith('DEBUG') or lstr.startswith('WARNING') or lstr.startswith('ERROR'):
@@ -153,6 +176,7 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
     if not _LogsEnabled:
         return
     if is_debug(level):
+        _RecentEntries.append((time.time(), level, log_name, s_))
         if log_name == 'stdout':
             if _LogFile is not None:
                 o = s + nl
@@ -162,13 +186,21 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
                 else:
                     if not isinstance(o, unicode):  # @UndefinedVariable
                         o = o.decode('utf-8')
-                try:
-                    _LogFile.write(o)
-                    _LogFile.flush()
-                except:
-                    pass
+                if _Writer is not None:
+                    _Writer.write(log_name, o, urgent=not level)
+                else:
+                    try:
+                        _LogFile.write(o)
+                        _LogFile.flush()
+                    except:
+                        pass
         else:
-            if _LogFileName:
+            if _LogFileName and _Writer is not None:
+                o = s + nl
+                if not isinstance(o, six.text_type):
+                    o = o.decode('utf-8')
+                _Writer.write(log_name, o)
+            elif _LogFileName:
                 if log_name not in _AllLogFiles:
                     filename = os.path.join(os.path.dirname(_LogFileName), log_name + '.log')
                     if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
@@ -187,7 +219,9 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
                 except:
                     pass
         if not _RedirectStdOut and not _RedirectStdErr and not _NoOutput:
-            if log_name == 'stdout':
+            if log_name == 'stdout' and _Writer is not None:
+                _Writer.write(sys.stdout, s + nl, urgent=not level)
+            elif log_name == 'stdout':
                 s = s + nl
                 try:
                     sys.stdout.write(s)
@@ -205,7 +239,55 @@ def out(_DebugLevel, msg, nl='\n', log_name='stdout', showtime=False):
     return None
 
 
+def _is_active(level):
+    """
+    Returns False if a message at this ``level`` is going to be skipped anyway, so it is not even formatted.
+    """
+    if _WebStreamFunc is not None:
+        return True
+    level = level or 0
+    return level - level % 2 <= _GlobalDebugLevel
+
+
+def _caller_module():
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return ''
+    return frame.f_globals.get('__name__', '')
+
+
+def _limit(modul):
+    """
+    Applies sampling and rate limit to messages from ``modul``.
+    Returns None if message must be skipped, otherwise number of messages suppressed since the last one was printed.
+    """
+    now = time.time()
+    limiter = _Limiters.get(modul)
+    if limiter is None:
+        # tokens, last update time, suppressed messages, all messages
+        limiter = _Limiters[modul] = [_RateBurst, now, 0, 0]
+    limiter[3] += 1
+    every = _Sampling.get(modul)
+    if every and limiter[3] % every:
+        return None
+    if _RateLimit:
+        tokens = min(_RateBurst, limiter[0] + (now - limiter[1])*_RateLimit)
+        limiter[1] = now
+        if tokens < 1:
+            limiter[0] = tokens
+            limiter[2] += 1
+            return None
+        limiter[0] = tokens - 1
+    suppressed = limiter[2]
+    limiter[2] = 0
+    return suppressed
+
+
 def dbg(_DebugLevel, message, *args, **kwargs):
+    if not _is_active(_DebugLevel):
+        return ''
     log_name = kwargs.pop('log_name', 'stdout')
     level = _DebugLevel
     cod = sys._getframe().f_back.f_code
@@ -218,6 +300,8 @@ def dbg(_DebugLevel, message, *args, **kwargs):
 
 
 def args(_DebugLevel, *args, **kwargs):
+    if not _is_active(_DebugLevel):
+        return ''
     log_name = kwargs.pop('log_name', 'stdout')
     level = _DebugLevel
     cod = sys._getframe().f_back.f_code
@@ -242,6 +326,8 @@ def args(_DebugLevel, *args, **kwargs):
 
 def info(message, level=2, log_name='stdout'):
     global _UseColors
+    if not _is_active(level):
+        return message
     if _UseColors is None:
         _UseColors = platform.uname()[0] != 'Windows' and os.environ.get('BITDUST_LOG_USE_COLORS', '1') != '0'
     cod = sys._getframe().f_back.f_code
@@ -265,6 +351,8 @@ def info(message, level=2, log_name='stdout'):
 
 def warn(message, level=2, log_name='stdout'):
     global _UseColors
+    if not _is_active(level):
+        return message
     if _UseColors is None:
         _UseColors = platform.uname()[0] != 'Windows' and os.environ.get('BITDUST_LOG_USE_COLORS', '1') != '0'
     cod = sys._getframe().f_back.f_code
@@ -415,10 +503,6 @@ def exception(level, maxTBlevel, exc_info, message=None, log_name='stdout'):
         exc_label = exc_name.lower().replace(' ', '_').replace('-', '_')[:80]
         exc_label = ''.join([c for c in exc_label if c in '0123456789abcdefghijklmnopqrstuvwxyz_'])
         exc_filename = os.path.join(os.path.dirname(_LogFileName), 'exception_' + exc_label + '.log')
-        if os.path.isfile(exc_filename):
-            fout = open(exc_filename, 'ab')
-        else:
-            fout = open(exc_filename, 'wb')
         if sys.version_info[0] == 3:
             if not isinstance(s, bytes):
                 s = s.encode('utf-8')
@@ -426,8 +510,12 @@ def exception(level, maxTBlevel, exc_info, message=None, log_name='stdout'):
             if not isinstance(s, str):
                 s = s.encode('utf-8')
         s += b'\n==========================================================\n'
-        fout.write(s)
-        fout.close()
+        if _Writer is not None:
+            _Writer.write(('append', exc_filename), s, urgent=True)
+        else:
+            fout = open(exc_filename, 'ab')
+            fout.write(s)
+            fout.close()
         out(level, 'saved to: %s' % exc_filename, log_name=log_name)
     return s
 
@@ -660,6 +748,7 @@ def close_log_file():
     """
     global _LogFile
     global _AllLogFiles
+    stop_writer()
     if not _LogFile:
         return
     _LogFile.flush()
@@ -847,6 +936,117 @@ def set_weblog_func(webstreamfunc):
 #------------------------------------------------------------------------------
 
 
+def start_writer(rotate_size=0, rotate_count=3):
+    """
+    From that moment log lines are written to the files and console in a background thread,
+    see ``bitdust.logs.log_writer`` module. Must be called after ``open_log_file()``.
+    """
+    global _Writer
+    if _Writer is not None:
+        return _Writer
+    from bitdust.logs import log_writer
+    files = {}
+    if _LogFile is not None:
+        files['stdout'] = (_LogFileName, _LogFile)
+    for log_name, logfile in _AllLogFiles.items():
+        files[log_name] = (os.path.abspath(logfile.name), logfile)
+    _Writer = log_writer.LogWriter(
+        logs_dir=os.path.dirname(_LogFileName) if _LogFileName else None,
+        files=files,
+        rotate_size=rotate_size,
+        rotate_count=rotate_count,
+    )
+    _Writer.start()
+    return _Writer
+
+
+def stop_writer():
+    """
+    Writes all queued lines and switch back to writing logs in the calling thread.
+    """
+    global _Writer
+    global _LogFile
+    if _Writer is None:
+        return False
+    writer = _Writer
+    _Writer = None
+    for log_name, (_, logfile) in writer.stop().items():
+        if log_name == 'stdout':
+            _LogFile = logfile
+        else:
+            _AllLogFiles[log_name] = logfile
+    return True
+
+
+def flush(timeout=5.0):
+    """
+    Blocks until all queued log lines are written.
+    """
+    if _Writer is None:
+        return True
+    return _Writer.flush(timeout=timeout)
+
+
+def set_rate_limit(rate, burst=None):
+    """
+    Every module can print not more than ``rate`` messages per second on average and not more than ``burst``
+    messages at once, others are counted and reported later in a single line. Errors are never suppressed.
+    Set ``rate`` to 0 to disable the limit.
+    """
+    global _RateLimit
+    global _RateBurst
+    _RateLimit = max(0, int(rate or 0))
+    _RateBurst = int(burst or _RateLimit*5)
+    _Limiters.clear()
+
+
+def set_sampling(modul, every=None):
+    """
+    Only every N-th message from ``modul`` (full module name like "bitdust.p2p.propagate") is printed,
+    set ``every`` to None to print all of them again.
+    """
+    if every and every > 1:
+        _Sampling[modul] = int(every)
+    else:
+        _Sampling.pop(modul, None)
+    _Limiters.pop(modul, None)
+
+
+def recent_entries(limit=100, log_name=None, level=None):
+    """
+    Returns last printed log entries kept in memory, oldest first.
+    """
+    result = []
+    for tm, lvl, name, message in reversed(_RecentEntries):
+        if log_name is not None and name != log_name:
+            continue
+        if level is not None and lvl > level:
+            continue
+        result.append({
+            'time': tm,
+            'level': lvl,
+            'log_name': name,
+            'message': _ColorCodes.sub('', message).strip(),
+        })
+        if len(result) >= limit:
+            break
+    result.reverse()
+    return result
+
+
+def logs_stats():
+    return {
+        'debug_level': _GlobalDebugLevel,
+        'rate_limit': _RateLimit,
+        'sampling': dict(_Sampling),
+        'suppressed': {modul: limiter[2] for modul, limiter in list(_Limiters.items()) if limiter[2]},
+        'writer': _Writer.stats() if _Writer is not None else None,
+    }
+
+
+#------------------------------------------------------------------------------
+
+
 class STDOUT_redirected(object):
 
     """
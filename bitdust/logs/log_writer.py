@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# log_writer.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (log_writer.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: log_writer
+
+Background thread which writes log lines for ``lg`` module.
+
+Calling thread only appends a line to the queue, the writer thread wakes up few times per second
+and writes all queued lines in one batch per file, so the main thread never waits for disk or console.
+Error messages wake the writer immediately.
+
+Log files are rotated when they grow bigger than ``rotate_size``: "stdout.log" is renamed
+to "stdout.log.1", "stdout.log.1" to "stdout.log.2" and so on.
+
+This module must not import ``lg`` - writer thread can not log its own errors.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+import os
+import threading
+import collections
+
+#------------------------------------------------------------------------------
+
+FLUSH_INTERVAL = 0.2
+
+# new lines are dropped when that many lines are still waiting to be written
+QUEUE_LIMIT = 100000
+
+#------------------------------------------------------------------------------
+
+
+class LogWriter(object):
+
+    """
+    Target of a line can be a log name, a stream object (console) or ``('append', <file path>)``
+    for the files which are only opened to append a single record, like exceptions.
+    """
+
+    def __init__(self, logs_dir=None, files=None, rotate_size=0, rotate_count=3, flush_interval=FLUSH_INTERVAL, queue_limit=QUEUE_LIMIT):
+        self.logs_dir = logs_dir
+        self.files = {}
+        for log_name, (path, fileobj) in (files or {}).items():
+            self.files[log_name] = [path, fileobj]
+        self.rotate_size = rotate_size
+        self.rotate_count = rotate_count
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+        self.done = threading.Condition()
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.rotated = 0
+        self.stopping = False
+        self.thread = None
+
+    def __repr__(self):
+        return 'LogWriter(queued=%d written=%d dropped=%d)' % (self.queued, self.written, self.dropped)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='log_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Writes all queued lines and returns opened files: log name -> (path, file object).
+        """
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        self._write_batch()
+        return {log_name: (path, fileobj) for log_name, (path, fileobj) in self.files.items()}
+
+    def write(self, target, text, urgent=False):
+        if len(self.queue) >= self.queue_limit:
+            self.dropped += 1
+            return False
+        self.queue.append((target, text))
+        self.queued += 1
+        if urgent:
+            self.wakeup.set()
+        return True
+
+    def flush(self, timeout=5.0):
+        """
+        Blocks until all lines queued before that call are written.
+        """
+        expected = self.queued
+        if not self.thread or threading.current_thread() is self.thread:
+            self._write_batch()
+            return True
+        self.wakeup.set()
+        with self.done:
+            return self.done.wait_for(lambda: self.written + self.dropped >= expected or not self.thread, timeout)
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'waiting': len(self.queue),
+            'rotated': self.rotated,
+        }
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self._write_batch()
+
+    def _write_batch(self):
+        batch = collections.OrderedDict()
+        count = 0
+        while True:
+            try:
+                target, text = self.queue.popleft()
+            except IndexError:
+                break
+            batch.setdefault(target, []).append(text)
+            count += 1
+        for target, lines in batch.items():
+            try:
+                if isinstance(target, tuple):
+                    self._append_file(target[1], lines)
+                elif isinstance(target, str):
+                    self._write_log(target, ''.join(lines))
+                else:
+                    target.write(''.join(lines))
+                    target.flush()
+            except:
+                pass
+        if count:
+            with self.done:
+                self.written += count
+                self.done.notify_all()
+
+    def _append_file(self, path, records):
+        with open(path, 'ab') as f:
+            for record in records:
+                f.write(record if isinstance(record, bytes) else record.encode('utf-8'))
+
+    def _write_log(self, log_name, data):
+        if log_name not in self.files:
+            if not self.logs_dir:
+                return
+            path = os.path.abspath(os.path.join(self.logs_dir, log_name + '.log'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.files[log_name] = [path, open(path, 'w')]
+        fileobj = self.files[log_name][1]
+        fileobj.write(data)
+        fileobj.flush()
+        if self.rotate_size and fileobj.tell() >= self.rotate_size:
+            self._rotate(log_name)
+
+    def _rotate(self, log_name):
+        path, fileobj = self.files[log_name]
+        fileobj.close()
+        for i in range(self.rotate_count - 1, 0, -1):
+            if os.path.isfile('%s.%d' % (path, i)):
+                os.replace('%s.%d' % (path, i), '%s.%d' % (path, i + 1))
+        if self.rotate_count > 0:
+            os.replace(path, path + '.1')
+        self.files[log_name][1] = open(path, 'w')
+        self.rotated += 1
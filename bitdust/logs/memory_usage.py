@@ -0,0 +1,370 @@
+#!/usr/bin/python
+# memory_usage.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (memory_usage.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: memory_usage
+
+Accounting of memory used by the biggest global structures of the main process.
+
+Deep size of every structure is counted by walking all objects it refers to, like ``bitdust.lib.getsizeof`` does.
+The walk is done in small steps from the reactor, so even a big catalog does not block the main thread.
+For a container with many items only a random sample of items is walked and the result is extrapolated.
+Every object is counted once, so structures which are measured later do not include objects shared with the
+previous ones. Modules, classes, functions and Twisted internals are not followed.
+
+Optionally ``tracemalloc`` can be started and snapshots compared remotely to find the code which allocates memory.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import sys
+import time
+import types
+import random
+import collections
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet import threads  # @UnresolvedImport
+from twisted.internet.defer import Deferred
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+#------------------------------------------------------------------------------
+
+# name -> (module name, attribute path)
+STRUCTURES = collections.OrderedDict([
+    ('backup_matrix.remote_files', ('bitdust.storage.backup_matrix', '_RemoteFiles')),
+    ('backup_matrix.local_files', ('bitdust.storage.backup_matrix', '_LocalFiles')),
+    ('backup_fs.index_by_id', ('bitdust.storage.backup_fs', '_FileSystemIndexByID')),
+    ('backup_fs.index_by_name', ('bitdust.storage.backup_fs', '_FileSystemIndexByName')),
+    ('identitydb.identity_cache', ('bitdust.contacts.identitydb', '_IdentityCache')),
+    ('my_keys.known_keys', ('bitdust.crypt.my_keys', '_KnownKeys')),
+    ('dht_cache.records', ('bitdust.dht.dht_cache', '_Cache.records')),
+    ('packet_out.outbox_queue', ('bitdust.transport.packet_out', '_OutboxQueue')),
+    ('p2p_queue.active_queues', ('bitdust.stream.p2p_queue', '_ActiveQueues')),
+    ('p2p_queue.queue_logs', ('bitdust.stream.p2p_queue', '_QueueLogs')),
+    ('automat.objects', ('bitdust.automats.automat', '_Objects')),
+])
+
+# items of a bigger container are sampled
+SAMPLE_ITEMS = 1000
+
+# number of objects walked in one reactor iteration
+STEP_OBJECTS = 2000
+
+_SkipTypes = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+    types.FrameType,
+    types.TracebackType,
+)
+
+#------------------------------------------------------------------------------
+
+_Waiters = []
+_LastResult = None
+_TraceSnapshot = None
+
+#------------------------------------------------------------------------------
+
+
+def find_structure(name):
+    """
+    Returns the object registered in ``STRUCTURES`` or None if its module was not loaded yet.
+    Modules are never imported here.
+    """
+    module_name, attr_path = STRUCTURES[name]
+    obj = sys.modules.get(module_name)
+    for attr in attr_path.split('.'):
+        if obj is None:
+            return None
+        obj = getattr(obj, attr, None)
+    return obj
+
+
+def _skip(o):
+    if isinstance(o, _SkipTypes):
+        return True
+    module = getattr(type(o), '__module__', None) or ''
+    return module.startswith('twisted.') or module.startswith('_thread') or module.startswith('sqlite3')
+
+
+def _references(o):
+    if isinstance(o, dict):
+        for k, v in list(o.items()):
+            yield k
+            yield v
+        return
+    if isinstance(o, (list, tuple, set, frozenset, collections.deque)):
+        for v in list(o):
+            yield v
+        return
+    if isinstance(o, (str, bytes, int, float, bool)) or o is None:
+        return
+    d = getattr(o, '__dict__', None)
+    if isinstance(d, dict):
+        yield d
+    for cls in type(o).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if slot != '__dict__':
+                v = getattr(o, slot, None)
+                if v is not None:
+                    yield v
+
+
+class _Walker(object):
+
+    """
+    Counts deep size of given roots, ``step()`` walks not more than ``limit`` objects at once.
+    """
+
+    def __init__(self, roots, seen):
+        self.stack = list(roots)
+        self.seen = seen
+        self.size = 0
+        self.objects = 0
+
+    def step(self, limit):
+        while self.stack and limit > 0:
+            o = self.stack.pop()
+            if id(o) in self.seen or _skip(o):
+                continue
+            self.seen.add(id(o))
+            try:
+                self.size += sys.getsizeof(o)
+                self.stack.extend(_references(o))
+            except Exception:
+                pass
+            self.objects += 1
+            limit -= 1
+        return not self.stack
+
+
+def _sample(obj):
+    """
+    Returns the list of items to be walked and a multiplier to extrapolate their size to the whole container.
+    """
+    if isinstance(obj, dict):
+        keys = list(obj.keys())
+        if len(keys) > SAMPLE_ITEMS:
+            keys = random.sample(keys, SAMPLE_ITEMS)
+        items = []
+        for k in keys:
+            items.append(k)
+            items.append(obj.get(k))
+        total = len(obj)
+        measured = len(keys)
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        values = list(obj)
+        if len(values) > SAMPLE_ITEMS:
+            values = random.sample(values, SAMPLE_ITEMS)
+        items = values
+        total = len(obj)
+        measured = len(values)
+    else:
+        return [obj], 1.0, 1, 1
+    return items, (total/float(measured) if measured else 1.0), total, measured
+
+
+#------------------------------------------------------------------------------
+
+
+def collect(names=None):
+    """
+    Measures all known structures in small steps, returns Deferred object which will be fired with a dictionary:
+    name -> {'count', 'size', 'sampled', 'objects'}
+    """
+    result = Deferred()
+    _Waiters.append(result)
+    if len(_Waiters) > 1:
+        # collecting is already in progress, the result will be the same
+        return result
+    todo = [n for n in (names or STRUCTURES.keys()) if n in STRUCTURES]
+    report = collections.OrderedDict()
+    seen = set()
+    started = time.time()
+    state = {}
+
+    def _next_structure():
+        while todo:
+            name = todo.pop(0)
+            obj = find_structure(name)
+            if obj is None:
+                continue
+            items, multiplier, total, measured = _sample(obj)
+            seen.add(id(obj))
+            state['name'] = name
+            state['walker'] = _Walker(items, seen)
+            state['multiplier'] = multiplier
+            report[name] = {
+                'count': total,
+                'sampled': measured,
+                # the container itself is not sampled
+                'container': sys.getsizeof(obj),
+            }
+            return True
+        return False
+
+    def _finish(ret, failed=False):
+        waiters = list(_Waiters)
+        _Waiters[:] = []
+        for d in waiters:
+            if failed:
+                d.errback(ret)
+            else:
+                d.callback(ret)
+
+    def _step():
+        global _LastResult
+        try:
+            walker = state.get('walker')
+            if walker is None or walker.step(STEP_OBJECTS):
+                if walker is not None:
+                    info = report[state['name']]
+                    info['size'] = int(info.pop('container') + walker.size*state['multiplier'])
+                    info['objects'] = int(walker.objects*state['multiplier'])
+                    state['walker'] = None
+                if not _next_structure():
+                    _LastResult = {
+                        'time': started,
+                        'duration': round(time.time() - started, 3),
+                        'rss': process_rss(),
+                        'structures': report,
+                    }
+                    if _Debug:
+                        lg.args(_DebugLevel, duration=_LastResult['duration'], structures=len(report))
+                    _finish(_LastResult)
+                    return
+            reactor.callLater(0, _step)  # @UndefinedVariable
+        except Exception as exc:
+            lg.exc()
+            _finish(exc, failed=True)
+
+    reactor.callLater(0, _step)  # @UndefinedVariable
+    return result
+
+
+def last_result():
+    return _LastResult
+
+
+def process_rss():
+    """
+    Returns current resident set size of the process in bytes, if known.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])*1024
+    except:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    except:
+        return None
+
+
+#------------------------------------------------------------------------------
+
+
+def trace_start(frames=1):
+    import tracemalloc
+    global _TraceSnapshot
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    _TraceSnapshot = None
+    return True
+
+
+def trace_stop():
+    import tracemalloc
+    global _TraceSnapshot
+    _TraceSnapshot = None
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    return True
+
+
+def trace_snapshot(limit=20):
+    """
+    Takes a new ``tracemalloc`` snapshot and compares it with the previous one in a separate thread:
+    with many traced allocations even taking and filtering the snapshot can block the main thread for seconds.
+    Returns Deferred object which will be fired with biggest differences by source line,
+    the first snapshot is compared with an empty one.
+    """
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        raise Exception('tracemalloc is not started')
+
+    def _compare():
+        global _TraceSnapshot
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        previous = _TraceSnapshot
+        _TraceSnapshot = snapshot
+        if previous is None:
+            stats = snapshot.statistics('lineno')
+            diff = [(s.traceback, s.size, s.size, s.count, s.count) for s in stats[:limit]]
+        else:
+            stats = snapshot.compare_to(previous, 'lineno')
+            diff = [(s.traceback, s.size, s.size_diff, s.count, s.count_diff) for s in stats[:limit]]
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            'traced': traced,
+            'peak': peak,
+            'compared': previous is not None,
+            'top': [{
+                'source': str(tb[0]) if len(tb) else '',
+                'size': size,
+                'size_diff': size_diff,
+                'count': count,
+                'count_diff': count_diff,
+            } for tb, size, size_diff, count, count_diff in diff],
+        }
+
+    return threads.deferToThread(_compare)
@@ -0,0 +1,409 @@
+#!/usr/bin/python
+# metrics.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (metrics.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: metrics
+
+Always-on metrics of the running process, cheap enough to be collected in production:
+
+    * reactor lag: how late the reactor executes a periodic probe
+    * execution time of every callable scheduled with ``reactor.callLater()``
+    * number and duration of events and transitions of every state machine class
+    * number and size of incoming and outgoing packets per command
+
+Latencies are stored in HDR-style histograms: log-linear buckets with 8 sub-buckets
+per power of two, so a value is recorded in constant time into a fixed amount of memory
+and any percentile is known with a relative error below 12.5%.
+
+Metrics are available via ``api.process_metrics()`` and in Prometheus text format
+on the "/metrics" URL of the REST API server.
+
+Recording one event of a state machine costs about two microseconds, see ``tests/test_metrics.py``.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import time
+import functools
+import collections
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.automats import automat
+
+#------------------------------------------------------------------------------
+
+PROBE_INTERVAL = 0.5
+RATES_INTERVAL = 10
+RATES_WINDOW = 60
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# name -> (type, description, label names)
+METRICS = {
+    'reactor_lag_seconds': ('summary', 'How late the reactor executes a periodic probe', ()),
+    'reactor_call_seconds': ('summary', 'Execution time of callables scheduled with reactor.callLater()', ('callable', )),
+    'automat_event_seconds': ('summary', 'Time spent by a state machine to process an event', ('automat', 'event')),
+    'automat_transitions_total': ('counter', 'Number of state changes of state machines', ('automat', 'from', 'to')),
+    'packets_total': ('counter', 'Number of packets passed through the gateway', ('direction', 'command')),
+    'packets_payload_bytes_total': ('counter', 'Payload size of packets passed through the gateway', ('direction', 'command')),
+}
+
+#------------------------------------------------------------------------------
+
+_Enabled = False
+_Counters = {}
+_Histograms = {}
+_History = collections.deque()
+_CallableNames = {}
+_ProbeTask = None
+_ProbeExpectedTime = None
+_OriginalCallLater = None
+
+#------------------------------------------------------------------------------
+
+# values are recorded in microseconds, the last bucket holds everything longer than an hour
+_SUB_BUCKETS = 8
+_BUCKETS = _SUB_BUCKETS*(int(3600*1000000).bit_length() - 3) + _SUB_BUCKETS
+
+
+def _bucket_index(value):
+    if value < 2*_SUB_BUCKETS:
+        return value if value > 0 else 0
+    shift = value.bit_length() - 4
+    index = _SUB_BUCKETS*shift + (value >> shift)
+    return index if index < _BUCKETS else _BUCKETS - 1
+
+
+def _bucket_upper_bound(index):
+    if index < 2*_SUB_BUCKETS:
+        return index + 1
+    shift = index//_SUB_BUCKETS - 1
+    return (index - _SUB_BUCKETS*shift + 1) << shift
+
+
+class Histogram(object):
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0]*_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[_bucket_index(int(seconds*1000000.0))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Returns the highest value in seconds, equivalent to the ``q`` (from 0.0 to 1.0) percentile of recorded values.
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, int(q*self.count + 0.5))
+        seen = 0
+        for index, cnt in enumerate(self.buckets):
+            if not cnt:
+                continue
+            seen += cnt
+            if seen >= target:
+                return min(_bucket_upper_bound(index)/1000000.0, self.max)
+        return self.max
+
+    def to_json(self):
+        ret = {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'max': round(self.max, 6),
+        }
+        for q in QUANTILES:
+            ret['p%d' % int(q*100)] = round(self.percentile(q), 6)
+        return ret
+
+
+#------------------------------------------------------------------------------
+
+
+def init(probe=True, reactor_calls=True):
+    global _Enabled
+    if _Enabled:
+        return
+    _Enabled = True
+    automat.SetEventCallback(on_automat_event)
+    if reactor_calls:
+        patch_reactor_call_later()
+    if probe:
+        _start_probe()
+    if _Debug:
+        lg.out(_DebugLevel, 'metrics.init probe=%r reactor_calls=%r' % (probe, reactor_calls))
+
+
+def shutdown():
+    global _Enabled
+    if not _Enabled:
+        return
+    _Enabled = False
+    _stop_probe()
+    patch_reactor_call_later(apply=False)
+    automat.SetEventCallback(None)
+    if _Debug:
+        lg.out(_DebugLevel, 'metrics.shutdown')
+
+
+def enabled():
+    return _Enabled
+
+
+def reset():
+    _Counters.clear()
+    _Histograms.clear()
+    _History.clear()
+
+
+#------------------------------------------------------------------------------
+
+
+def count(name, labels=(), value=1):
+    if not _Enabled:
+        return
+    key = (name, labels)
+    _Counters[key] = _Counters.get(key, 0) + value
+
+
+def observe(name, seconds, labels=()):
+    if not _Enabled:
+        return
+    key = (name, labels)
+    h = _Histograms.get(key)
+    if h is None:
+        h = _Histograms[key] = Histogram()
+    h.record(seconds)
+
+
+def on_automat_event(automat_name, event, old_state, new_state, duration):
+    observe('automat_event_seconds', duration, (automat_name, event))
+    if old_state != new_state:
+        count('automat_transitions_total', (automat_name, old_state, new_state))
+
+
+def on_packet(direction, command, payload_size):
+    count('packets_total', (direction, command))
+    count('packets_payload_bytes_total', (direction, command), payload_size)
+
+
+#------------------------------------------------------------------------------
+
+
+def callable_name(f):
+    """
+    Returns a short and stable name of a callable, names of lambdas and inner functions are taken from the code,
+    so the number of different names does not grow while the process is running.
+    """
+    func = getattr(f, '__func__', f)
+    if isinstance(func, functools.partial):
+        func = getattr(func.func, '__func__', func.func)
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        key = code
+    elif hasattr(func, '__self__') and hasattr(func, '__name__'):
+        key = (type(func.__self__), func.__name__)
+    else:
+        key = type(func)
+    name = _CallableNames.get(key)
+    if name is None:
+        if code is not None:
+            name = '%s.%s' % (getattr(func, '__module__', None) or '', getattr(func, '__qualname__', code.co_name))
+        elif isinstance(key, tuple):
+            name = '%s.%s' % (key[0].__name__, key[1])
+        else:
+            name = '%s.%s' % (key.__module__, key.__name__)
+        _CallableNames[key] = name
+    return name
+
+
+def _timed_call(name, f, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return f(*args, **kwargs)
+    finally:
+        observe('reactor_call_seconds', time.perf_counter() - started, (name, ))
+
+
+def _call_later(delay, f, *args, **kwargs):
+    return _OriginalCallLater(delay, _timed_call, callable_name(f), f, args, kwargs)
+
+
+def patch_reactor_call_later(apply=True):
+    """
+    Wraps ``reactor.callLater()`` to measure execution time of every scheduled callable.
+    """
+    global _OriginalCallLater
+    if apply:
+        if _OriginalCallLater is None:
+            _OriginalCallLater = reactor.callLater  # @UndefinedVariable
+            reactor.callLater = _call_later  # @UndefinedVariable
+    else:
+        if _OriginalCallLater is not None:
+            reactor.callLater = _OriginalCallLater  # @UndefinedVariable
+            _OriginalCallLater = None
+
+
+#------------------------------------------------------------------------------
+
+
+def _call_later_untimed(delay, f, *args, **kwargs):
+    return (_OriginalCallLater or reactor.callLater)(delay, f, *args, **kwargs)  # @UndefinedVariable
+
+
+def _start_probe():
+    global _ProbeTask
+    global _ProbeExpectedTime
+    _ProbeExpectedTime = time.monotonic() + PROBE_INTERVAL
+    _ProbeTask = _call_later_untimed(PROBE_INTERVAL, _probe)
+
+
+def _stop_probe():
+    global _ProbeTask
+    if _ProbeTask and _ProbeTask.active():
+        _ProbeTask.cancel()
+    _ProbeTask = None
+
+
+def _probe():
+    global _ProbeTask
+    global _ProbeExpectedTime
+    now = time.monotonic()
+    observe('reactor_lag_seconds', max(0.0, now - _ProbeExpectedTime))
+    if not _History or now - _History[-1][0] >= RATES_INTERVAL:
+        _History.append((now, dict(_Counters)))
+        while len(_History) > 1 and now - _History[0][0] > RATES_WINDOW:
+            _History.popleft()
+    _ProbeExpectedTime = now + PROBE_INTERVAL
+    _ProbeTask = _call_later_untimed(PROBE_INTERVAL, _probe)
+
+
+def rates():
+    """
+    Returns per second rates of all counters during last minute.
+    """
+    if not _History:
+        return {}
+    started, previous = _History[0]
+    duration = time.monotonic() - started
+    if duration <= 0:
+        return {}
+    return {key: (value - previous.get(key, 0))/duration for key, value in _Counters.items()}
+
+
+#------------------------------------------------------------------------------
+
+
+def _labels_dict(name, labels):
+    return dict(zip(METRICS.get(name, (None, None, ()))[2], labels))
+
+
+def snapshot():
+    """
+    Returns all collected values sorted by name, histograms are sorted by total time spent.
+    """
+    current_rates = rates()
+    counters = []
+    for key in sorted(_Counters.keys()):
+        counters.append({
+            'name': key[0],
+            'labels': _labels_dict(*key),
+            'value': _Counters[key],
+            'rate': round(current_rates.get(key, 0.0), 3),
+        })
+    histograms = []
+    for key in sorted(_Histograms.keys(), key=lambda k: (k[0], -_Histograms[k].total)):
+        h = _Histograms[key].to_json()
+        h['name'] = key[0]
+        h['labels'] = _labels_dict(*key)
+        histograms.append(h)
+    return {
+        'enabled': _Enabled,
+        'counters': counters,
+        'histograms': histograms,
+    }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(name, labels, extra=None):
+    pairs = ['%s="%s"' % (k, _escape(v)) for k, v in zip(METRICS.get(name, (None, None, ()))[2], labels)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(pairs)
+
+
+def prometheus_text(prefix='bitdust_'):
+    """
+    Returns all collected values in Prometheus text exposition format, version 0.0.4.
+    """
+    by_name = collections.defaultdict(list)
+    for key in _Counters.keys():
+        by_name[key[0]].append(key)
+    for key in _Histograms.keys():
+        by_name[key[0]].append(key)
+    lines = []
+    for name in sorted(by_name.keys()):
+        typ, description, _ = METRICS.get(name, ('untyped', '', ()))
+        full_name = prefix + name
+        lines.append('# HELP %s %s' % (full_name, description))
+        lines.append('# TYPE %s %s' % (full_name, typ))
+        for key in sorted(by_name[name]):
+            if key in _Counters:
+                lines.append('%s%s %s' % (full_name, _labels_text(*key), _Counters[key]))
+                continue
+            h = _Histograms[key]
+            for q in QUANTILES:
+                lines.append('%s%s %.6f' % (full_name, _labels_text(key[0], key[1], 'quantile="%s"' % q), h.percentile(q)))
+            lines.append('%s_sum%s %.6f' % (full_name, _labels_text(*key), h.total))
+            lines.append('%s_count%s %d' % (full_name, _labels_text(*key), h.count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# profiler.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (profiler.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: profiler
+
+Sampling profiler which can be started and stopped in a running process via API.
+
+A separate thread wakes up ``hz`` times per second, takes current stack of every other thread
+with ``sys._current_frames()`` and counts identical stacks in memory. Nothing is done inside
+of profiled threads, so the main thread is only slowed down while the sampling thread holds the GIL:
+one sample of a few dozens of threads takes tens of microseconds.
+
+Collected stacks can be exported as "collapsed stacks" text for ``flamegraph.pl``
+or as JSON file for https://www.speedscope.app.
+
+Profiler stops automatically after ``duration`` seconds, so it is safe to forget about it.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import threading
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+#------------------------------------------------------------------------------
+
+DEFAULT_HZ = 100
+MAX_HZ = 1000
+DEFAULT_DURATION = 300
+MAX_DEPTH = 128
+
+#------------------------------------------------------------------------------
+
+_Profiler = None
+
+#------------------------------------------------------------------------------
+
+
+def start(hz=DEFAULT_HZ, duration=DEFAULT_DURATION, threads=None):
+    """
+    Starts sampling, ``threads`` is an optional list of thread name prefixes to be profiled, all threads by default.
+    Previously collected stacks are dropped.
+    """
+    global _Profiler
+    if _Profiler and _Profiler.is_running():
+        return False
+    _Profiler = SamplingProfiler(hz=hz, duration=duration, threads=threads)
+    _Profiler.start()
+    if _Debug:
+        lg.args(_DebugLevel, p=_Profiler)
+    return True
+
+
+def stop():
+    if not _Profiler or not _Profiler.is_running():
+        return False
+    _Profiler.stop()
+    if _Debug:
+        lg.args(_DebugLevel, p=_Profiler)
+    return True
+
+
+def shutdown():
+    global _Profiler
+    stop()
+    _Profiler = None
+
+
+def profiler():
+    return _Profiler
+
+
+def status():
+    if not _Profiler:
+        return {
+            'running': False,
+        }
+    return _Profiler.status()
+
+
+#------------------------------------------------------------------------------
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, hz=DEFAULT_HZ, duration=DEFAULT_DURATION, threads=None):
+        self.interval = 1.0/max(1, min(int(hz), MAX_HZ))
+        self.duration = duration
+        self.threads = list(threads or [])
+        self.stacks = {}  # (thread name, tuple of code objects from root to leaf) -> samples
+        self.labels = {}  # code object -> frame label
+        self.names = {}  # thread ID -> thread name
+        self.samples = 0
+        self.sampling_time = 0.0
+        self.started = None
+        self.finished = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def __repr__(self):
+        return 'SamplingProfiler(%d Hz, samples=%d stacks=%d)' % (int(1.0/self.interval), self.samples, len(self.stacks))
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(5)
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stopping.is_set()
+
+    def status(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            'running': self.is_running(),
+            'hz': int(1.0/self.interval),
+            'started': self.started,
+            'elapsed': round(elapsed, 3),
+            'samples': self.samples,
+            'stacks': len(self.stacks),
+            'threads': sorted(set(k[0] for k in list(self.stacks.keys()))),
+            # share of time the sampling thread was holding the GIL
+            'overhead': round(self.sampling_time/elapsed, 6) if elapsed > 0 else 0.0,
+            'sample_usec': round(self.sampling_time/self.samples*1000000.0, 1) if self.samples else 0.0,
+        }
+
+    def _run(self):
+        deadline = time.monotonic() + self.duration if self.duration else None
+        next_sample = time.monotonic()
+        names_updated = 0
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            if deadline and now >= deadline:
+                break
+            if now - names_updated > 1.0:
+                self.names = {t.ident: t.name for t in threading.enumerate()}
+                names_updated = now
+            self.sample()
+            self.sampling_time += time.monotonic() - now
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # can not keep up, skip missed samples instead of sampling in a loop
+                next_sample = time.monotonic()
+                delay = 0
+            self.stopping.wait(delay)
+        self.finished = time.time()
+        self.stopping.set()
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            name = self.names.get(ident) or ('thread-%d' % ident)
+            if self.threads and not name.startswith(tuple(self.threads)):
+                continue
+            codes = []
+            while frame is not None and len(codes) < MAX_DEPTH:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+            key = (name, tuple(codes))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def label(self, code):
+        lbl = self.labels.get(code)
+        if lbl is None:
+            lbl = self.labels[code] = '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+        return lbl
+
+    def collapsed(self):
+        """
+        Returns stacks in "collapsed" format, one line per unique stack: thread;root;...;leaf count
+        """
+        lines = []
+        for (name, codes), count in sorted(list(self.stacks.items()), key=lambda i: -i[1]):
+            lines.append('%s;%s %d' % (name, ';'.join(self.label(c) for c in codes), count))
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self):
+        """
+        Returns profile in speedscope file format, one sampled profile for every thread.
+        """
+        frames = []
+        frame_index = {}
+        profiles = {}
+        for (name, codes), count in list(self.stacks.items()):
+            stack = []
+            for code in codes:
+                if code not in frame_index:
+                    frame_index[code] = len(frames)
+                    frames.append({
+                        'name': code.co_name,
+                        'file': code.co_filename,
+                        'line': code.co_firstlineno,
+                    })
+                stack.append(frame_index[code])
+            profile = profiles.setdefault(name, {'samples': [], 'weights': []})
+            profile['samples'].append(stack)
+            profile['weights'].append(count*self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': 'BitDust process %d' % os.getpid(),
+            'exporter': 'bitdust',
+            'activeProfileIndex': 0,
+            'shared': {
+                'frames': frames,
+            },
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(profiles[name]['weights']),
+                'samples': profiles[name]['samples'],
+                'weights': profiles[name]['weights'],
+            } for name in sorted(profiles.keys())],
+        }
+
+    def top(self, limit=20):
+        """
+        Returns functions with the biggest number of samples, where they were running themselves ("self")
+        and where they were anywhere in the stack ("total").
+        """
+        own = {}
+        total = {}
+        for (_, codes), count in list(self.stacks.items()):
+            if codes:
+                own[codes[-1]] = own.get(codes[-1], 0) + count
+            for code in set(codes):
+                total[code] = total.get(code, 0) + count
+        result = []
+        for code in sorted(total.keys(), key=lambda c: (-own.get(c, 0), -total[c]))[:limit]:
+            result.append({
+                'function': self.label(code),
+                'self': own.get(code, 0),
+                'total': total[code],
+            })
+        return result
@@ -163,6 +163,23 @@ def init(UI='', options=None, args=None, overDict=None, executablePath=None):
     except:
         lg.exc()
 
+    #---metrics---
+    if config.conf().getBool('logs/metrics-enabled'):
+        try:
+            from bitdust.logs import metrics
+            metrics.init()
+            reactor.addSystemEventTrigger('before', 'shutdown', metrics.shutdown)  # @UndefinedVariable
+        except:
+            lg.exc()
+
+    #---logs writer---
+    if config.conf().getBool('logs/async-enabled'):
+        try:
+            from bitdust.lib import diskspace
+            lg.start_writer(rotate_size=diskspace.GetBytesFromString(config.conf().getData('logs/rotate-size'), 0))
+        except:
+            lg.exc()
+
     #---reactor.callLater patch---
     # if _Debug:
     #     patchReactorCallLater(reactor)
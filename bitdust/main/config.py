@@ -474,6 +474,11 @@ class FixedTypesConfig(NotifiableConfig):
                 return {
                     'possible_values': eccmap.SuppliersNumbers(),
                 }
+            elif entryPath == 'services/backups/compression':
+                from bitdust.storage import backup_compress
+                return {
+                    'possible_values': backup_compress.available_codecs(),
+                }
             else:
                 raise TypeError('unexpected option type for %r' % entryPath)
         return {}
@@ -518,6 +523,8 @@ class FixedTypesConfig(NotifiableConfig):
         elif typ == config_types.TYPE_COMBO_BOX:
             if entryPath == 'services/customer/suppliers-number':
                 value = self.getInt(entryPath, default=default)
+            elif entryPath == 'services/backups/compression':
+                value = self.getString(entryPath, default=default)
             else:
                 raise TypeError('unexpected option type for %r' % entryPath)
         elif typ in [
@@ -563,6 +570,8 @@ class FixedTypesConfig(NotifiableConfig):
         elif typ == config_types.TYPE_COMBO_BOX:
             if entryPath == 'services/customer/suppliers-number':
                 value = self.setInt(entryPath, int(value))
+            elif entryPath == 'services/backups/compression':
+                value = self.setString(entryPath, value)
             else:
                 raise TypeError('unexpected option type for %r' % entryPath)
         elif typ in [
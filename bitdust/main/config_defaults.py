@@ -54,13 +54,17 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('interface/ftp/port', settings.DefaultFTPPort())
 
     conf_obj.setDefaultValue('logs/api-enabled', 'false')
+    conf_obj.setDefaultValue('logs/async-enabled', 'true')
     conf_obj.setDefaultValue('logs/automat-transitions-enabled', 'false')
     conf_obj.setDefaultValue('logs/automat-events-enabled', 'false')
     conf_obj.setDefaultValue('logs/debug-level', settings.defaultDebugLevel())
     conf_obj.setDefaultValue('logs/memdebug-enabled', 'false')
     conf_obj.setDefaultValue('logs/memdebug-port', '9996')
     conf_obj.setDefaultValue('logs/memprofile-enabled', 'false')
+    conf_obj.setDefaultValue('logs/metrics-enabled', 'true')
     conf_obj.setDefaultValue('logs/packet-enabled', 'false')
+    conf_obj.setDefaultValue('logs/rate-limit', '200')
+    conf_obj.setDefaultValue('logs/rotate-size', '100 MB')
     conf_obj.setDefaultValue('logs/stream-enabled', 'false')
     conf_obj.setDefaultValue('logs/stream-port', settings.DefaultWebLogPort())
     conf_obj.setDefaultValue('logs/traffic-enabled', 'false')
@@ -83,6 +87,8 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/backup-db/enabled', 'true')
 
     conf_obj.setDefaultValue('services/backups/enabled', 'true')
+    conf_obj.setDefaultValue('services/backups/incremental-enabled', 'false')
+    conf_obj.setDefaultValue('services/backups/compression', 'auto')
     conf_obj.setDefaultValue('services/backups/block-size', diskspace.MakeStringFromBytes(settings.DefaultBackupBlockSize()))
     conf_obj.setDefaultValue('services/backups/max-block-size', diskspace.MakeStringFromBytes(settings.DefaultBackupMaxBlockSize()))
     conf_obj.setDefaultValue('services/backups/max-copies', '2')
@@ -173,6 +179,7 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/identity-propagate/max-servers', 5)
     conf_obj.setDefaultValue('services/identity-propagate/automatic-rotate-enabled', 'true')
     conf_obj.setDefaultValue('services/identity-propagate/health-check-interval-seconds', 60*5)
+    conf_obj.setDefaultValue('services/identity-propagate/max-sends-per-second', 20)
 
     conf_obj.setDefaultValue('services/joint-postman/enabled', 'true')
 
@@ -53,6 +53,9 @@ def raw():
 {logs/api-enabled} log API calls
 Enable logging of all API calls that reach the main process to the `~/.bitdust/logs/api.log` file.
 
+{logs/async-enabled} write logs in background
+Log lines are written to the files and console in a separate thread, so the main process never waits for the disk.
+
 {logs/automat-events-enabled} log state machines events
 This option enables logging of all events that are submitted to state machines, see `~/.bitdust/logs/automats.log` file.
 
@@ -62,9 +65,18 @@ By enabling this option, you can also monitor the life cycle of each state machi
 {logs/debug-level} debug level
 Higher values of `debug-level` option will produce more log messages in the console output, see `~/.bitdust/logs/stdout.log` file.
 
+{logs/metrics-enabled} collect metrics
+Keep track of reactor lag, execution time of delayed calls, state machines events and network packets, see `process_metrics()` API method and `/metrics` URL of the REST API server.
+
 {logs/packet-enabled} log network packets
 This option enables logging of all incoming & outgoing peer-to-peer packets - very helpful when analyzing/debugging network communications, see `~/.bitdust/logs/packet.log` file.
 
+{logs/rate-limit} log messages per second
+Maximum number of log messages per second from a single module, others are counted and reported later in a single line. Errors are never suppressed, set to 0 to print all messages.
+
+{logs/rotate-size} maximum size of a log file
+When log file grows bigger it is renamed to `stdout.log.1` and a new one is started, only 3 previous files are kept.
+
 {logs/stream-enabled}
 
 {logs/stream-port}
@@ -106,6 +118,14 @@ Maximum block size in bytes which used to split the raw data during uploading pr
 The actual block size is calculated depending on size of the particular backup to optimize performance and data storage.
 If you plan to do a large file uploads - set higher values to increase the performance.
 
+{services/backups/compression} compression of uploaded data
+Codec used to compress the data before encryption: "zstd" and "lz4" are the fastest, but available only if corresponding Python packages are installed.
+With "auto" the fastest available codec is selected. Parts of the data which can not be compressed well are uploaded as they are.
+
+{services/backups/incremental-enabled} upload only changed data
+Enable this to split every uploaded file or folder into chunks and upload only chunks which were not uploaded with previous versions.
+A version which holds chunks used by newer versions is kept until none of them needs it anymore.
+
 {services/backups/keep-local-copies-enabled} keep locally copies of uploaded files
 Enable this to keep a copy of every uploaded file on your local disk as well as on remote machines of your suppliers.
 This increases data reliability, rebuilding performance and decrease network load, but consumes much storage space of your own device.
@@ -257,6 +277,9 @@ This way, your device will remain identifiable on the network even when it is of
 {services/identity-propagate/health-check-interval-seconds} health check interval
 The period in seconds between checks that could potentially cause an automatic identity rotation when your primary ID server is down.
 
+{services/identity-propagate/max-sends-per-second} identity propagation rate
+Maximum number of packets per second sent when your identity file is delivered to all of your contacts, for example after identity rotation.
+
 {services/identity-server/enabled} start Identity server
 You can start own Identity server and store identity files of other users on your machine.
 This will help others to join and operate in the BitDust network.
@@ -78,13 +78,17 @@ def defaults():
         'interface/ftp/enabled': TYPE_BOOLEAN,
         'interface/ftp/port': TYPE_PORT_NUMBER,
         'logs/api-enabled': TYPE_BOOLEAN,
+        'logs/async-enabled': TYPE_BOOLEAN,
         'logs/automat-events-enabled': TYPE_BOOLEAN,
         'logs/automat-transitions-enabled': TYPE_BOOLEAN,
         'logs/debug-level': TYPE_POSITIVE_INTEGER,
         'logs/memdebug-enabled': TYPE_BOOLEAN,
         'logs/memdebug-port': TYPE_PORT_NUMBER,
         'logs/memprofile-enabled': TYPE_BOOLEAN,
+        'logs/metrics-enabled': TYPE_BOOLEAN,
         'logs/packet-enabled': TYPE_BOOLEAN,
+        'logs/rate-limit': TYPE_POSITIVE_INTEGER,
+        'logs/rotate-size': TYPE_DISK_SPACE,
         'logs/stream-enabled': TYPE_BOOLEAN,
         'logs/stream-port': TYPE_PORT_NUMBER,
         'logs/traffic-enabled': TYPE_BOOLEAN,
@@ -103,7 +107,9 @@ def defaults():
         'services/api-router/port': TYPE_PORT_NUMBER,
         'services/backup-db/enabled': TYPE_BOOLEAN,
         'services/backups/block-size': TYPE_DISK_SPACE,
+        'services/backups/compression': TYPE_COMBO_BOX,
         'services/backups/enabled': TYPE_BOOLEAN,
+        'services/backups/incremental-enabled': TYPE_BOOLEAN,
         'services/backups/keep-local-copies-enabled': TYPE_BOOLEAN,
         'services/backups/max-block-size': TYPE_DISK_SPACE,
         'services/backups/max-copies': TYPE_POSITIVE_INTEGER,
@@ -170,6 +176,7 @@ def defaults():
         'services/identity-propagate/max-servers': TYPE_NON_ZERO_POSITIVE_INTEGER,
         'services/identity-propagate/automatic-rotate-enabled': TYPE_BOOLEAN,
         'services/identity-propagate/health-check-interval-seconds': TYPE_POSITIVE_INTEGER,
+        'services/identity-propagate/max-sends-per-second': TYPE_NON_ZERO_POSITIVE_INTEGER,
         'services/ip-port-responder/enabled': TYPE_BOOLEAN,
         'services/joint-postman/enabled': TYPE_BOOLEAN,
         'services/keys-registry/enabled': TYPE_BOOLEAN,
@@ -61,6 +61,7 @@ from twisted.internet.defer import Deferred  # @UnresolvedImport
 from bitdust.logs import lg
 
 from bitdust.lib import utime
+from bitdust.lib import bounded
 
 #------------------------------------------------------------------------------
 
@@ -70,7 +71,7 @@ MAX_PENDING_EVENTS_PER_CONSUMER = 100
 
 _Subscribers = {}
 _ConsumersCallbacks = {}
-_EventQueuePerConsumer = {}
+_EventsQueue = bounded.RingBuffer(capacity=MAX_PENDING_EVENTS_PER_CONSUMER*2)
 _EventsCount = {}
 
 #------------------------------------------------------------------------------
@@ -209,8 +210,11 @@ def send(event_id, data=None, created=None, fast=False):
 
 
 def event_queue():
-    global _EventQueuePerConsumer
-    return _EventQueuePerConsumer
+    """
+    All consumers are reading from one shared ring buffer, every event is stored only once.
+    """
+    global _EventsQueue
+    return _EventsQueue
 
 
 def consumers_callbacks():
@@ -221,6 +225,7 @@ def consumers_callbacks():
 def consume_events(consumer_id):
     if consumer_id not in consumers_callbacks():
         consumers_callbacks()[consumer_id] = []
+    event_queue().subscribe(consumer_id)
     d = Deferred()
     consumers_callbacks()[consumer_id].append(d)
     if _Debug:
@@ -230,43 +235,47 @@ def consume_events(consumer_id):
 
 
 def push_event(event_object):
-    for consumer_id in consumers_callbacks().keys():
-        if consumer_id not in event_queue():
-            event_queue()[consumer_id] = []
-        event_queue()[consumer_id].append({
-            'type': 'event',
-            'id': event_object.event_id,
-            'data': event_object.data,
-            'time': event_object.created,
-        })
-        if _Debug:
-            lg.out(_DebugLevel, 'events.push_event "%s" for consumer "%s", %d pending events' % (event_object.event_id, consumer_id, len(event_queue()[consumer_id])))
+    if not consumers_callbacks():
+        return
+    event_queue().append({
+        'type': 'event',
+        'id': event_object.event_id,
+        'data': event_object.data,
+        'time': event_object.created,
+    })
+    if _Debug:
+        lg.out(_DebugLevel, 'events.push_event "%s" for %d consumers, %r' % (event_object.event_id, len(consumers_callbacks()), event_queue()))
     reactor.callLater(0, pop_event)  # @UndefinedVariable
 
 
 def pop_event():
     for consumer_id in list(consumers_callbacks().keys()):
-        if consumer_id not in event_queue() or len(event_queue()[consumer_id]) == 0:
+        pending_count = event_queue().pending_count(consumer_id)
+        if pending_count == 0:
             continue
         registered_callbacks = consumers_callbacks()[consumer_id]
-        pending_messages = event_queue()[consumer_id]
-        if len(registered_callbacks) == 0 and len(pending_messages) > MAX_PENDING_EVENTS_PER_CONSUMER:
+        if len(registered_callbacks) == 0 and (pending_count > MAX_PENDING_EVENTS_PER_CONSUMER or event_queue().is_overrun(consumer_id)):
             consumers_callbacks().pop(consumer_id)
-            event_queue().pop(consumer_id)
+            event_queue().unsubscribe(consumer_id)
             if _Debug:
                 lg.out(_DebugLevel, 'events.pop_event STOPPED consumer "%s", too many pending messages but no callbacks' % consumer_id)
             continue
+        if event_queue().is_overrun(consumer_id):
+            lg.warn('consumer "%s" was too slow, oldest events were lost' % consumer_id)
+        pending_messages = None
         for consumer_callback in registered_callbacks:
             if not consumer_callback:
                 if _Debug:
-                    lg.out(_DebugLevel, 'events.pop_event %d events waiting consuming by "%s", no callback yet' % (len(event_queue()[consumer_id]), consumer_id))
+                    lg.out(_DebugLevel, 'events.pop_event %d events waiting consuming by "%s", no callback yet' % (pending_count, consumer_id))
                 continue
             if consumer_callback.called:
                 if _Debug:
-                    lg.out(_DebugLevel, 'events.pop_event %d events waiting consuming by "%s", callback state is "called"' % (len(event_queue()[consumer_id]), consumer_id))
+                    lg.out(_DebugLevel, 'events.pop_event %d events waiting consuming by "%s", callback state is "called"' % (pending_count, consumer_id))
                 continue
+            if pending_messages is None:
+                pending_messages = event_queue().read(consumer_id)
+                event_queue().commit(consumer_id)
             consumer_callback.callback(pending_messages)
-            event_queue()[consumer_id] = []
             if _Debug:
                 lg.out(_DebugLevel, 'events.pop_event %d events consumed by "%s"' % (len(pending_messages), consumer_id))
         consumers_callbacks()[consumer_id] = []
@@ -107,6 +107,8 @@ def init_settings(base_dir=None, network_name=None, override_configs=None, enabl
     if enable_debug:
         lg.set_debug_level(settings.getDebugLevel())
     config.conf().addConfigNotifier('logs/debug-level', lambda p, value, o, r: lg.set_debug_level(value))
+    lg.set_rate_limit(config.conf().getInt('logs/rate-limit', 0))
+    config.conf().addConfigNotifier('logs/rate-limit', lambda p, value, o, r: lg.set_rate_limit(value))
 
 
 def init_engine():
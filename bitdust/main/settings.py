@@ -919,6 +919,13 @@ def BackupIndexFileName():
     return 'index'
 
 
+def BackupIndexDeltaFileName():
+    """
+    Changes of the backup data base index made after the index file was stored on supplier.
+    """
+    return 'index.delta'
+
+
 def BackupIndexFilePath(customer_idurl=None, key_alias='master'):
     from bitdust.userid import my_id
     from bitdust.userid import id_url
@@ -1862,6 +1869,20 @@ def getBackupsKeepLocalCopies():
     return config.conf().getBool('services/backups/keep-local-copies-enabled')
 
 
+def getBackupsIncremental():
+    """
+    Return True if only changed parts of the data must be uploaded with every new version.
+    """
+    return config.conf().getBool('services/backups/incremental-enabled')
+
+
+def getBackupsCompression():
+    """
+    Codec name to compress uploaded data with, see ``storage.backup_compress``.
+    """
+    return config.conf().getString('services/backups/compression', 'auto')
+
+
 def getGeneralWaitSuppliers():
     """
     Return True if user want to be sure that suppliers are reliable enough
@@ -88,6 +88,7 @@ _Shutdowner = None
 def shutdown_settings():
     if config.conf():
         config.conf().removeConfigNotifier('logs/debug-level')
+        config.conf().removeConfigNotifier('logs/rate-limit')
     settings.shutdown()
 
 
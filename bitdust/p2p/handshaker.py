@@ -49,6 +49,8 @@ _DebugLevel = 20
 
 #------------------------------------------------------------------------------
 
+import time
+
 from twisted.internet.defer import Deferred
 
 #------------------------------------------------------------------------------
@@ -78,6 +80,11 @@ from bitdust.userid import my_id
 
 _RunningHandshakers = {}
 _KnownChannels = {}
+_SharedPing = None
+
+#------------------------------------------------------------------------------
+
+SHARED_PING_LIFETIME = 5*60
 
 #------------------------------------------------------------------------------
 
@@ -95,6 +102,7 @@ def ping(
     channel='identity',
     channel_counter=True,
     cancel_running=False,
+    shared_packet=False,
 ):
     """
     Doing peer-to-peer ping with acknowledgment and return `Deferred` object to receive result.
@@ -102,6 +110,9 @@ def ping(
     Then sending my own identity to remote node and wait for ack.
     If Ack() packet from remote node times out (or another error happened)
     should return failed result in the result `Deferred`.
+    Set `shared_packet=True` to send a copy of Identity() packet which is signed once for all
+    keep-alive pings, see ``get_shared_ping()``. It is only used if remote node supports broadcast packets,
+    see ``signed.BroadcastSupported()``.
     """
     global _RunningHandshakers
     remote_idurl = strng.to_bin(idurl)
@@ -141,6 +152,7 @@ def ping(
         fake_identity=fake_identity,
         channel=channel,
         channel_counter=channel_counter,
+        shared_packet=shared_packet,
         debug_level=_DebugLevel,
         log_events=_Debug,
         log_transitions=_Debug,
@@ -164,6 +176,14 @@ def is_running(idurl):
     return remote_idurl in _RunningHandshakers
 
 
+def count_running():
+    """
+    Returns number of handshakes currently running.
+    """
+    global _RunningHandshakers
+    return len(_RunningHandshakers)
+
+
 def get_info(idurl):
     """
     If there is a running handshake with given idurl will return its instance.
@@ -177,10 +197,35 @@ def get_info(idurl):
 
 def cancel_all():
     global _RunningHandshakers
+    global _SharedPing
     for remote_idurl in list(_RunningHandshakers.keys()):
         h = (_RunningHandshakers.get(remote_idurl, {}) or {}).get('instance')
         if h:
             h.event('cancel')
+    _SharedPing = None
+
+
+def get_shared_ping():
+    """
+    Returns broadcast Identity() packet used for keep-alive pings, see ``signed.Packet.Envelope()``.
+    Packet is signed again only when my identity was changed or it is older than `SHARED_PING_LIFETIME` seconds.
+    """
+    global _SharedPing
+    payload = strng.to_bin(my_id.getLocalIdentity().serialize())
+    if _SharedPing is not None:
+        created, ping_packet = _SharedPing
+        if ping_packet.Payload == payload and time.time() - created < SHARED_PING_LIFETIME:
+            return ping_packet
+    ping_packet = signed.Packet(
+        Command=commands.Identity(),
+        OwnerID=my_id.getIDURL(),
+        CreatorID=my_id.getIDURL(),
+        PacketID='%sping:%s' % (signed.BROADCAST_PACKET_ID_PREFIX, packetid.UniqueID()),
+        Payload=payload,
+        RemoteID=my_id.getIDURL(),
+    )
+    _SharedPing = (time.time(), ping_packet)
+    return ping_packet
 
 
 #------------------------------------------------------------------------------
@@ -208,7 +253,7 @@ class Handshaker(automat.Automat):
     """
 
     def __init__(
-        self, remote_idurl, ack_timeout, cache_timeout, cache_retries, ping_retries, skip_outbox, keep_alive, fake_identity, channel, channel_counter, debug_level=0, log_events=False, log_transitions=False, publish_events=False, **kwargs
+        self, remote_idurl, ack_timeout, cache_timeout, cache_retries, ping_retries, skip_outbox, keep_alive, fake_identity, channel, channel_counter, shared_packet=False, debug_level=0, log_events=False, log_transitions=False, publish_events=False, **kwargs
     ):
         """
         Builds `handshaker()` state machine.
@@ -227,6 +272,7 @@ class Handshaker(automat.Automat):
         self.fake_identity = fake_identity
         self.channel = channel
         self.channel_counter = channel_counter
+        self.shared_packet = shared_packet
         if self.channel not in _KnownChannels:
             _KnownChannels[self.channel] = 0
         _KnownChannels[self.channel] += 1
@@ -348,18 +394,22 @@ class Handshaker(automat.Automat):
             identity_object = my_id.getLocalIdentity()
         if not identity_object.Valid():
             raise Exception('can not use invalid identity for ping')
-        if self.channel_counter:
-            packet_id = '%s:%d:%d:%s' % (self.channel, _KnownChannels[self.channel], self.ping_attempts, packetid.UniqueID())
+        if self.shared_packet and not self.fake_identity and self.ping_attempts == 1 and signed.BroadcastSupported(self.remote_idurl):
+            ping_packet = get_shared_ping().Envelope(self.remote_idurl)
+            packet_id = ping_packet.PacketID
         else:
-            packet_id = '%s:%d:%s' % (self.channel, self.ping_attempts, packetid.UniqueID())
-        ping_packet = signed.Packet(
-            Command=commands.Identity(),
-            OwnerID=my_id.getIDURL(),
-            CreatorID=my_id.getIDURL(),
-            PacketID=packet_id,
-            Payload=strng.to_bin(identity_object.serialize()),
-            RemoteID=self.remote_idurl,
-        )
+            if self.channel_counter:
+                packet_id = '%s:%d:%d:%s' % (self.channel, _KnownChannels[self.channel], self.ping_attempts, packetid.UniqueID())
+            else:
+                packet_id = '%s:%d:%s' % (self.channel, self.ping_attempts, packetid.UniqueID())
+            ping_packet = signed.Packet(
+                Command=commands.Identity(),
+                OwnerID=my_id.getIDURL(),
+                CreatorID=my_id.getIDURL(),
+                PacketID=packet_id,
+                Payload=strng.to_bin(identity_object.serialize()),
+                RemoteID=self.remote_idurl,
+            )
         if self.skip_outbox:
             packet_out.create(
                 outpacket=ping_packet,
@@ -44,6 +44,18 @@ means that he is currently available over the network.
 A one instance of ``online_status()`` machine is created for
 every remote contact and monitor his status.
 
+State machines do not run own timers, instead all of them share one presence queue:
+a heap of the next check deadlines processed by a single periodic task.
+Only due contacts are visited on every tick and number of concurrent probes is limited
+by `MAX_CONCURRENT_PROBES`, remaining due checks are simply postponed to the next tick.
+
+When remote node is connected and there is an already opened transport session with him
+a transport level keep-alive is sent instead of a signed Identity() packet.
+Keep-alive is not acknowledged, so after `MAX_KEEP_ALIVES_WITHOUT_INBOX` of them sent
+without any incoming traffic a regular handshake is started again.
+Background pings to the nodes which support broadcast packets are made with a single shared
+Identity() packet, see ``handshaker.get_shared_ping()``.
+
 
 EVENTS:
     * :red:`ack-receieved`
@@ -71,6 +83,8 @@ _DebugLevel = 20
 
 #------------------------------------------------------------------------------
 
+import heapq
+
 from twisted.internet.task import LoopingCall
 from twisted.internet.defer import Deferred
 
@@ -93,6 +107,7 @@ from bitdust.p2p import commands
 from bitdust.p2p import handshaker
 
 from bitdust.transport import callback
+from bitdust.transport import gateway
 
 from bitdust.userid import my_id
 from bitdust.userid import id_url
@@ -110,7 +125,21 @@ _StatusLabels = {
 
 _OnlineStatusDict = {}
 _ShutdownFlag = False
-_OfflineCheckTask = None
+_PresenceQueue = []
+_PresenceCounter = 0
+_PresenceTask = None
+
+#------------------------------------------------------------------------------
+
+PRESENCE_TICK_INTERVAL = 1.0
+MAX_CONCURRENT_PROBES = 32
+
+CONNECTED_CHECK_INTERVAL = 60
+PING_TIMEOUT = 20
+FIRST_OFFLINE_CHECK_DELAY = 10
+OFFLINE_CHECK_INTERVAL = 10*60
+RECENT_INBOX_CHECK_INTERVAL = 10
+MAX_KEEP_ALIVES_WITHOUT_INBOX = 5
 
 #------------------------------------------------------------------------------
 
@@ -120,35 +149,36 @@ def init():
     Called from top level code when the software is starting.
     Needs to be called before other methods here.
     """
-    global _OfflineCheckTask
+    global _PresenceTask
     global _ShutdownFlag
     if _Debug:
         lg.out(_DebugLevel, 'online_status.init')
     _ShutdownFlag = False
     callback.insert_inbox_callback(1, Inbox)  # try to not overwrite top callback in the list, but stay on top
     callback.add_queue_item_status_callback(OutboxStatus)
-    _OfflineCheckTask = LoopingCall(RunOfflineChecks)
-    _OfflineCheckTask.start(10, now=False)
+    _PresenceTask = LoopingCall(RunPresenceChecks)
+    _PresenceTask.start(PRESENCE_TICK_INTERVAL, now=False)
 
 
 def shutdown():
     """
     Called from top level code when the software is stopping.
     """
-    global _OfflineCheckTask
+    global _PresenceTask
     global _ShutdownFlag
     global _OnlineStatusDict
     if _Debug:
         lg.out(_DebugLevel, 'online_status.shutdown')
     handshaker.cancel_all()
-    _OfflineCheckTask.stop()
-    del _OfflineCheckTask
-    _OfflineCheckTask = None
+    _PresenceTask.stop()
+    del _PresenceTask
+    _PresenceTask = None
     callback.remove_inbox_callback(Inbox)
     callback.remove_queue_item_status_callback(OutboxStatus)
     for o_status in list(_OnlineStatusDict.values()):
         o_status.automat('shutdown')
     _OnlineStatusDict.clear()
+    del _PresenceQueue[:]
     _ShutdownFlag = True
 
 
@@ -539,23 +569,75 @@ def PacketSendingTimeout(remoteID, packetID):
 #------------------------------------------------------------------------------
 
 
-def RunOfflineChecks():
-    for o_status in list(_OnlineStatusDict.values()):
-        if o_status.state != 'OFFLINE':
-            # if user is online or checking: do nothing
-            continue
-        if not o_status.latest_check_time:
-            # if no checks done yet but he is offline: ping user
-            o_status.automat('offline-check')
-            continue
-        if utime.utcnow_to_sec1970() - o_status.latest_check_time > 10*60:
-            # user is offline and latest check was sent a while ago: lets try to ping user again
-            o_status.automat('offline-check')
+def find_active_sessions(idurl):
+    """
+    Returns list of opened transport sessions with given node.
+    Those sessions were already authenticated with Identity() exchange when connection was established.
+    """
+    if not gateway.is_ready():
+        return []
+    result = []
+    for proto in gateway.list_active_transports():
+        if proto not in ('tcp', 'udp'):
+            # only direct connections are counted, proxy transport is routing packets via another node
             continue
-        if o_status.latest_inbox_time and utime.utcnow_to_sec1970() - o_status.latest_inbox_time < 60:
-            # user is offline, but we know that he was online recently: lets try to ping him again
-            o_status.automat('offline-check')
+        for session in (gateway.find_active_session(proto, idurl=idurl) or []):
+            if session.is_connected():
+                result.append(session)
+    return result
+
+
+def schedule_check(o_status, deadline, event):
+    """
+    Puts state machine into the presence queue, ``event`` will be fired after ``deadline``.
+    Scheduled check is cancelled when state is changed, see ``OnlineStatus.state_changed()``.
+    """
+    global _PresenceCounter
+    _PresenceCounter += 1
+    heapq.heappush(_PresenceQueue, (deadline, _PresenceCounter, o_status.check_generation, o_status, event))
+
+
+def pop_due_checks(now=None, max_probes=None):
+    """
+    Takes out of the presence queue all checks which are due and reschedules every instance for the next check.
+    Returns list of (instance, event) tuples to be fired.
+    Checks which will start a new probe are postponed when ``max_probes`` limit is reached.
+    """
+    if now is None:
+        now = utime.utcnow_to_sec1970()
+    if max_probes is None:
+        max_probes = MAX_CONCURRENT_PROBES
+    result = []
+    postponed = []
+    while _PresenceQueue and _PresenceQueue[0][0] <= now:
+        item = heapq.heappop(_PresenceQueue)
+        _, _, generation, o_status, event = item
+        if o_status.idurl is None or o_status.check_generation != generation:
+            # state was changed or instance destroyed already
             continue
+        if o_status.isProbe(event):
+            if max_probes <= 0:
+                postponed.append(item)
+                continue
+            max_probes -= 1
+        deadline, next_event = o_status.getNextCheck(now, checked=True)
+        if deadline is not None:
+            schedule_check(o_status, deadline, next_event)
+        result.append((o_status, event))
+    for item in postponed:
+        heapq.heappush(_PresenceQueue, item)
+    return result
+
+
+def RunPresenceChecks():
+    """
+    Periodically called to fire due timer events and offline checks of all `online_status()` machines.
+    """
+    if _ShutdownFlag:
+        return False
+    max_probes = MAX_CONCURRENT_PROBES - handshaker.count_running()
+    for o_status, event in pop_due_checks(max_probes=max_probes):
+        o_status.automat(event)
     return True
 
 
@@ -596,10 +678,7 @@ class OnlineStatus(automat.Automat):
     This class implements all the functionality of ``online_status()`` state machine.
     """
 
-    timers = {
-        'timer-1min': (60, ['CONNECTED']),
-        'timer-20sec': (20.0, ['PING?']),
-    }
+    timers = {}
 
     def __init__(self, idurl, name, state, debug_level=0, log_events=False, log_transitions=False, **kwargs):
         """
@@ -609,6 +688,8 @@ class OnlineStatus(automat.Automat):
         self.latest_inbox_time = None
         self.latest_check_time = None
         self.keep_alive = False
+        self.keep_alives_sent = 0
+        self.check_generation = 0
         super(OnlineStatus, self).__init__(name=name, state=state, debug_level=debug_level, log_events=log_events, log_transitions=log_transitions, **kwargs)
         if _Debug:
             lg.out(_DebugLevel, 'online_status.ContactStatus %s %s %s' % (name, state, idurl))
@@ -656,6 +737,37 @@ class OnlineStatus(automat.Automat):
             listeners.push_snapshot('online_status', snap_id=self.idurl.to_text(), data=self.to_json())
         if newstate == 'PING?' and oldstate != 'AT_STARTUP':
             listeners.push_snapshot('online_status', snap_id=self.idurl.to_text(), data=self.to_json())
+        self.check_generation += 1
+        deadline, check_event = self.getNextCheck(utime.utcnow_to_sec1970())
+        if deadline is not None:
+            schedule_check(self, deadline, check_event)
+
+    def getNextCheck(self, now, checked=False):
+        """
+        Returns (deadline, event) tuple for the next scheduled check in the current state or (None, None).
+        Set ``checked=True`` when the check is just happening at the moment ``now``.
+        """
+        if self.state == 'CONNECTED':
+            return now + CONNECTED_CHECK_INTERVAL, 'timer-1min'
+        if self.state == 'PING?':
+            return now + PING_TIMEOUT, 'timer-20sec'
+        if self.state == 'OFFLINE':
+            if self.latest_inbox_time and now - self.latest_inbox_time < 60:
+                # user is offline, but we know that he was online recently: lets try to ping him again soon
+                return now + RECENT_INBOX_CHECK_INTERVAL, 'offline-check'
+            latest_check_time = now if checked else self.latest_check_time
+            if not latest_check_time:
+                # if no checks done yet but he is offline: ping user
+                return now + FIRST_OFFLINE_CHECK_DELAY, 'offline-check'
+            # user is offline and latest check was sent a while ago: lets try to ping user again
+            return max(now, latest_check_time + OFFLINE_CHECK_INTERVAL), 'offline-check'
+        return None, None
+
+    def isProbe(self, event):
+        """
+        Returns True if scheduled ``event`` may start a new ping towards remote node.
+        """
+        return self.keep_alive and event in ('offline-check', 'timer-1min')
 
     def A(self, event, *args, **kwargs):
         """
@@ -690,7 +802,9 @@ class OnlineStatus(automat.Automat):
                 self.state = 'CLOSED'
                 self.doReportOffline(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
-            elif event == 'timer-1min' and not self.isRecentInbox(*args, **kwargs):
+            elif event == 'timer-1min' and not self.isRecentInbox(*args, **kwargs) and self.isKeepAliveEnough(*args, **kwargs):
+                self.doSendKeepAlive(*args, **kwargs)
+            elif event == 'timer-1min' and not self.isRecentInbox(*args, **kwargs) and not self.isKeepAliveEnough(*args, **kwargs):
                 self.doHandshake(event, *args, **kwargs)
             elif event == 'handshake':
                 self.state = 'PING?'
@@ -732,6 +846,22 @@ class OnlineStatus(automat.Automat):
             return False
         return utime.utcnow_to_sec1970() - self.latest_inbox_time > 60
 
+    def isSessionOpened(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        if not self.keep_alive:
+            return False
+        return len(find_active_sessions(self.idurl.to_bin())) > 0
+
+    def isKeepAliveEnough(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        if self.keep_alives_sent >= MAX_KEEP_ALIVES_WITHOUT_INBOX:
+            return False
+        return self.isSessionOpened(*args, **kwargs)
+
     def doInit(self, *args, **kwargs):
         """
         Action method.
@@ -761,7 +891,6 @@ class OnlineStatus(automat.Automat):
                 ack_timeout=ack_timeout,
                 ping_retries=ping_retries,
                 channel=channel or 'ping',
-                cancel_running=True,
             )
         elif event == 'handshake':
             d = handshaker.ping(
@@ -781,6 +910,7 @@ class OnlineStatus(automat.Automat):
                     ping_retries=ping_retries,
                     force_cache=True,
                     channel='offline_ping',
+                    shared_packet=True,
                 )
         else:
             if self.keep_alive:
@@ -791,11 +921,20 @@ class OnlineStatus(automat.Automat):
                     ping_retries=ping_retries,
                     force_cache=True,
                     channel='idle_ping',
+                    shared_packet=True,
                 )
         if d:
             d.addCallback(self._on_ping_success)
             d.addErrback(self._on_ping_failed)
 
+    def doSendKeepAlive(self, *args, **kwargs):
+        """
+        Action method.
+        """
+        self.keep_alives_sent += 1
+        for session in find_active_sessions(self.idurl.to_bin()):
+            session.automat('send-keep-alive')
+
     def doRememberTime(self, *args, **kwargs):
         """
         Action method.
@@ -807,6 +946,7 @@ class OnlineStatus(automat.Automat):
         if to_be_remembered:
             ratings.remember_connected_time(self.idurl.to_bin())
         self.latest_inbox_time = utime.utcnow_to_sec1970()
+        self.keep_alives_sent = 0
 
     def doRememberCheckTime(self, *args, **kwargs):
         """
@@ -868,6 +1008,7 @@ class OnlineStatus(automat.Automat):
         """
         global _OnlineStatusDict
         _OnlineStatusDict.pop(self.idurl)
+        self.check_generation += 1
         self.idurl = None
         self.latest_inbox_time = None
         self.handshake_callbacks = None
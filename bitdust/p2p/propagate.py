@@ -53,6 +53,8 @@ _DebugLevel = 24
 
 import sys
 
+from collections import deque
+
 try:
     from twisted.internet import reactor  # @UnresolvedImport
 except:
@@ -72,6 +74,7 @@ from bitdust.lib import packetid
 from bitdust.contacts import contactsdb
 from bitdust.contacts import identitycache
 
+from bitdust.main import config
 from bitdust.main import settings
 
 from bitdust.userid import my_id
@@ -92,6 +95,13 @@ from bitdust.dht import dht_records
 _SlowSendIsWorking = False
 _PropagateCounter = 0
 _StartupPropagateList = set()
+_BroadcastQueue = deque()
+_BroadcastQueueIndex = {}
+_BroadcastTask = None
+
+#------------------------------------------------------------------------------
+
+BROADCAST_TICK_INTERVAL = 0.1
 
 #------------------------------------------------------------------------------
 
@@ -106,8 +116,14 @@ def init():
 
 
 def shutdown():
+    global _BroadcastTask
     if _Debug:
         lg.out(_DebugLevel, 'propagate.shutdown')
+    if _BroadcastTask and _BroadcastTask.active():
+        _BroadcastTask.cancel()
+    _BroadcastTask = None
+    _BroadcastQueue.clear()
+    _BroadcastQueueIndex.clear()
 
 
 def startup_list():
@@ -362,19 +378,20 @@ def SlowSendSuppliers(delay=1, customer_idurl=None):
     if _Debug:
         lg.out(_DebugLevel, 'propagate.SlowSendSuppliers delay=%s' % str(delay))
 
-    def _send(index, payload, delay):
+    def _send(index, broadcast_packet, delay):
         global _SlowSendIsWorking
         idurl = contactsdb.supplier(index, customer_idurl=customer_idurl)
         if not idurl:
             _SlowSendIsWorking = False
             return
         # transport_control.ClearAliveTime(idurl)
-        SendToID(idurl, Payload=payload, wide=True)
-        reactor.callLater(delay, _send, index + 1, payload, delay)  # @UndefinedVariable
+        if broadcast_packet is None and signed.BroadcastSupported(idurl):
+            broadcast_packet = MakeBroadcastPacket()
+        SendToID(idurl, BroadcastPacket=broadcast_packet, wide=True)
+        reactor.callLater(delay, _send, index + 1, broadcast_packet, delay)  # @UndefinedVariable
 
     _SlowSendIsWorking = True
-    payload = strng.to_bin(my_id.getLocalIdentity().serialize())
-    _send(0, payload, delay)
+    _send(0, None, delay)
 
 
 def SlowSendCustomers(delay=1):
@@ -390,19 +407,20 @@ def SlowSendCustomers(delay=1):
     if _Debug:
         lg.out(_DebugLevel, 'propagate.SlowSendCustomers delay=%s' % str(delay))
 
-    def _send(index, payload, delay):
+    def _send(index, broadcast_packet, delay):
         global _SlowSendIsWorking
         idurl = contactsdb.customer(index)
         if not idurl:
             _SlowSendIsWorking = False
             return
         # transport_control.ClearAliveTime(idurl)
-        SendToID(idurl, Payload=payload, wide=True)
-        reactor.callLater(delay, _send, index + 1, payload, delay)  # @UndefinedVariable
+        if broadcast_packet is None and signed.BroadcastSupported(idurl):
+            broadcast_packet = MakeBroadcastPacket()
+        SendToID(idurl, BroadcastPacket=broadcast_packet, wide=True)
+        reactor.callLater(delay, _send, index + 1, broadcast_packet, delay)  # @UndefinedVariable
 
     _SlowSendIsWorking = True
-    payload = strng.to_bin(my_id.getLocalIdentity().serialize())
-    _send(0, payload, delay)
+    _send(0, None, delay)
 
 
 def HandleSuppliersAck(ackpacket, info):
@@ -435,6 +453,45 @@ def OnFileSent(pkt_out, item, status, size, error_message):
     return False
 
 
+def MakeIdentityPacket(idurl, Payload=None):
+    """
+    Creates Identity() packet signed for a single recipient, every node can verify such packet.
+    """
+    global _PropagateCounter
+    if Payload is None:
+        Payload = strng.to_bin(my_id.getLocalIdentity().serialize())
+    p = signed.Packet(
+        Command=commands.Identity(),
+        OwnerID=my_id.getIDURL(),
+        CreatorID=my_id.getIDURL(),
+        PacketID=('propagate:%d:%s' % (_PropagateCounter, packetid.UniqueID())),
+        Payload=Payload,
+        RemoteID=idurl,
+    )
+    _PropagateCounter += 1
+    return p
+
+
+def MakeBroadcastPacket(Payload=None):
+    """
+    Creates Identity() packet which is signed only once and can be sent to many nodes, see ``signed.Packet.Envelope()``.
+    Only nodes which announced "identity-broadcast" capability are able to verify it, see ``signed.BroadcastSupported()``.
+    """
+    global _PropagateCounter
+    if Payload is None:
+        Payload = strng.to_bin(my_id.getLocalIdentity().serialize())
+    p = signed.Packet(
+        Command=commands.Identity(),
+        OwnerID=my_id.getIDURL(),
+        CreatorID=my_id.getIDURL(),
+        PacketID=('%spropagate:%d:%s' % (signed.BROADCAST_PACKET_ID_PREFIX, _PropagateCounter, packetid.UniqueID())),
+        Payload=Payload,
+        RemoteID=my_id.getIDURL(),
+    )
+    _PropagateCounter += 1
+    return p
+
+
 def SendToID(
     idurl,
     Payload=None,
@@ -442,12 +499,14 @@ def SendToID(
     ack_handler=None,
     timeout_handler=None,
     response_timeout=None,
+    BroadcastPacket=None,
 ):
     """
     Create ``packet`` with my Identity file and calls
     ``transport.gateway.outbox()`` to send it.
+    Pass ``BroadcastPacket`` created with ``MakeBroadcastPacket()`` to avoid signing a new packet,
+    it is only used if remote node supports broadcast packets.
     """
-    global _PropagateCounter
     if _Debug:
         lg.out(_DebugLevel, 'propagate.SendToID [%s] wide=%s' % (nameurl.GetName(idurl), str(wide)))
     if response_timeout is None:
@@ -456,21 +515,13 @@ def SendToID(
         ack_handler = HandleAck
     if timeout_handler is None:
         timeout_handler = HandleTimeOut
-    thePayload = Payload
-    if thePayload is None:
-        thePayload = strng.to_bin(my_id.getLocalIdentity().serialize())
-    p = signed.Packet(
-        Command=commands.Identity(),
-        OwnerID=my_id.getIDURL(),
-        CreatorID=my_id.getIDURL(),
-        PacketID=('propagate:%d:%s' % (_PropagateCounter, packetid.UniqueID())),
-        Payload=thePayload,
-        RemoteID=idurl,
-    )
-    _PropagateCounter += 1
-    result = gateway.outbox(
-        p,
-        wide,
+    if BroadcastPacket is not None and Payload is None:
+        Payload = BroadcastPacket.Payload
+    return send_identity(
+        idurl=idurl,
+        payload=Payload,
+        broadcast_packet=BroadcastPacket,
+        wide=wide,
         response_timeout=response_timeout,
         callbacks={
             commands.Ack(): ack_handler,
@@ -478,92 +529,147 @@ def SendToID(
             None: timeout_handler,
         },
     )
-    if wide:
-        # this is a ping packet - need to clear old info
-        p2p_stats.ErasePeerProtosStates(idurl)
-        p2p_stats.EraseMyProtosStates(idurl)
-    return result
 
 
 def SendToIDs(idlist, wide=False, ack_handler=None, timeout_handler=None, response_timeout=None, wait_packets=False):
     """
     Same, but send to many IDs and also check previous packets to not re-send.
+    Identity packet is signed once for all recipients which support broadcast packets. Packets are not sent all at once,
+    but placed into the queue which is processed with the rate set in "services/identity-propagate/max-sends-per-second".
     """
-    global _PropagateCounter
     if response_timeout is None:
         response_timeout = settings.P2PTimeOut()
     if ack_handler is None:
         ack_handler = HandleAck
     if timeout_handler is None:
         timeout_handler = HandleTimeOut
-    LocalIdentity = my_id.getLocalIdentity()
-    Payload = strng.to_bin(LocalIdentity.serialize())
+    payload = strng.to_bin(my_id.getLocalIdentity().serialize())
+    broadcast_packet = None
     if _Debug:
-        lg.out(_DebugLevel, 'propagate.SendToIDs to %d users, rev=%r wide=%s' % (len(idlist), LocalIdentity.getRevisionValue(), wide))
+        lg.out(_DebugLevel, 'propagate.SendToIDs to %d users, rev=%r wide=%s' % (len(idlist), my_id.getLocalIdentity().getRevisionValue(), wide))
+    callbacks = {
+        commands.Ack(): ack_handler,
+        commands.Fail(): ack_handler,
+        None: timeout_handler,
+    }
     alreadysent = set()
     totalsent = 0
-    inqueue = {}
-    found_previous_packets = 0
-    for pkt_out in packet_out.queue():
-        if id_url.is_in(pkt_out.remote_idurl, idlist, as_field=False):
-            if pkt_out.description.count('Identity'):
-                if pkt_out.remote_idurl not in inqueue:
-                    inqueue[pkt_out.remote_idurl] = 0
-                inqueue[pkt_out.remote_idurl] += 1
-                found_previous_packets += 1
     wait_list = []
     for contact in idlist:
         if not contact:
             continue
-        if contact in alreadysent:
+        contact_key = id_url.identity_key(contact) or id_url.to_bin(contact)
+        if contact_key in alreadysent:
             # just want to send once even if both customer and supplier
             continue
-        if contact in inqueue and inqueue[contact] > 2:
-            # now only 2 protocols is working: tcp and udp
+        alreadysent.add(contact_key)
+        if is_identity_in_flight(contact, payload):
             if _Debug:
                 lg.out(_DebugLevel, '        skip sending [Identity] to %s, packet already in the queue' % contact)
             continue
-        p = signed.Packet(
-            Command=commands.Identity(),
-            OwnerID=my_id.getIDURL(),
-            CreatorID=my_id.getIDURL(),
-            PacketID=('propagate:%d:%s' % (_PropagateCounter, packetid.UniqueID())),
-            Payload=Payload,
-            RemoteID=contact,
-        )
-        _PropagateCounter += 1
-        if _Debug:
-            lg.out(_DebugLevel, '        sending %r to %s' % (p, nameurl.GetName(contact)))
-        res = gateway.outbox(
-            p,
-            wide,
-            response_timeout=response_timeout,
-            callbacks={
-                commands.Ack(): ack_handler,
-                commands.Fail(): ack_handler,
-                None: timeout_handler,
-            },
-        )
-        if not res:
-            lg.warn('my Identity() was not sent to %r' % contact)
-            continue
-        if wide:
-            # this is a ping packet - need to clear old info
-            p2p_stats.ErasePeerProtosStates(contact)
-            p2p_stats.EraseMyProtosStates(contact)
-        alreadysent.add(contact)
+        if broadcast_packet is None and signed.BroadcastSupported(contact):
+            broadcast_packet = MakeBroadcastPacket(payload)
+        item = _BroadcastQueueIndex.get(contact_key)
+        if item:
+            # not sent yet, but my identity might be already changed
+            item['payload'] = payload
+            item['packet'] = broadcast_packet
+        else:
+            item = {
+                'key': contact_key,
+                'idurl': contact,
+                'payload': payload,
+                'packet': broadcast_packet,
+                'wide': wide,
+                'response_timeout': response_timeout,
+                'callbacks': callbacks,
+                'waiters': [],
+            }
+            _BroadcastQueue.append(item)
+            _BroadcastQueueIndex[contact_key] = item
+        if wait_packets:
+            waiter = Deferred()
+            item['waiters'].append(waiter)
+            wait_list.append(waiter)
         totalsent += 1
-        if wait_packets and res:
-            if isinstance(res, Deferred):
-                wait_list.append(res)
-            elif res.finished_deferred and isinstance(res.finished_deferred, Deferred):
-                wait_list.append(res.finished_deferred)
     del alreadysent
+    if _BroadcastQueue and not _BroadcastTask:
+        process_broadcast_queue()
     if not wait_packets:
         return totalsent
     return DeferredList(wait_list, consumeErrors=True)
 
 
+def is_identity_in_flight(idurl, payload):
+    for pkt_out in packet_out.search_by_command(commands.Identity(), idurl):
+        if pkt_out.outpacket and pkt_out.outpacket.Payload == payload:
+            return True
+    return False
+
+
+def process_broadcast_queue():
+    """
+    Sends next portion of packets from the queue and schedules next call to itself.
+    """
+    global _BroadcastTask
+    _BroadcastTask = None
+    rate = max(1, config.conf().getInt('services/identity-propagate/max-sends-per-second', 20))
+    interval = max(BROADCAST_TICK_INTERVAL, 1.0/rate)
+    count = max(1, int(rate*interval))
+    while _BroadcastQueue and count > 0:
+        item = _BroadcastQueue.popleft()
+        _BroadcastQueueIndex.pop(item['key'], None)
+        count -= 1
+        res = send_identity(
+            idurl=item['idurl'],
+            payload=item['payload'],
+            broadcast_packet=item['packet'],
+            wide=item['wide'],
+            response_timeout=item['response_timeout'],
+            callbacks=item['callbacks'],
+        )
+        for waiter in item['waiters']:
+            if not res:
+                waiter.callback(None)
+            elif isinstance(res, Deferred):
+                res.addBoth(_on_identity_sent, waiter)
+            elif res.finished_deferred and isinstance(res.finished_deferred, Deferred):
+                res.finished_deferred.addBoth(_on_identity_sent, waiter)
+            else:
+                waiter.callback(res)
+    if _BroadcastQueue:
+        _BroadcastTask = reactor.callLater(interval, process_broadcast_queue)  # @UndefinedVariable
+
+
+def _on_identity_sent(result, waiter):
+    if not waiter.called:
+        waiter.callback(result)
+    return result
+
+
+def send_identity(idurl, payload, broadcast_packet, wide, response_timeout, callbacks):
+    if broadcast_packet is not None and signed.BroadcastSupported(idurl):
+        p = broadcast_packet.Envelope(idurl)
+    else:
+        p = MakeIdentityPacket(idurl, payload)
+    if _Debug:
+        lg.out(_DebugLevel, '        sending %r to %s' % (p, nameurl.GetName(idurl)))
+    res = gateway.outbox(
+        p,
+        wide,
+        response_timeout=response_timeout,
+        callbacks=callbacks,
+    )
+    if not res:
+        lg.warn('my Identity() was not sent to %r' % idurl)
+        return res
+    if wide:
+        # this is a ping packet - need to clear old info
+        p2p_stats.ErasePeerProtosStates(idurl)
+        p2p_stats.EraseMyProtosStates(idurl)
+    return res
+
+
 #------------------------------------------------------------------------------
 
 
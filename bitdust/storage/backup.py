@@ -45,7 +45,8 @@ Main idea:
    3) always use select/poll before reading, so never block the main process
    4) also poll to see if more data is needed to create a block
    5) number/name blocks so can be sure what is what when we read back later
-   6) encrypt the block data into ``encrypted_blocks``
+   6) encrypt the block data into ``encrypted_blocks`` in a pool of worker threads,
+      a few blocks are encrypted in parallel while the next block is being read
    7) call ``p2p.raidmake`` to split block and make "Parity" packets (pieces of block)
    8) notify the top level code about new pieces of data to send on suppliers
 
@@ -66,7 +67,6 @@ and all blocks will receive a delivery report.
 EVENTS:
     * :red:`block-encrypted`
     * :red:`block-raid-done`
-    * :red:`block-raid-started`
     * :red:`fail`
     * :red:`read-success`
     * :red:`start`
@@ -96,7 +96,8 @@ try:
 except:
     sys.exit('Error initializing twisted.internet.reactor in backup.py')
 
-from twisted.internet.defer import maybeDeferred, Deferred, succeed
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
 
 #------------------------------------------------------------------------------
 
@@ -131,6 +132,44 @@ from bitdust.crypt import key
 #-------------------------------------------------------------------------------
 
 
+def default_encrypting_blocks():
+    """
+    How many blocks of a single backup can be encrypted at the same time.
+    """
+    return max(2, min(8, os.cpu_count() or 1))
+
+
+def encrypt_block(creatorIDURL, backupID, blockNumber, lastBlock, raw_bytes, keyID, fileno):
+    """
+    Executed in the reactor's thread pool, so the main thread is not blocked while a large block
+    is encrypted, signed and serialized. Writes the result into already opened temporary file.
+    """
+    dt = time.time()
+    try:
+        block = encrypted.Block(
+            CreatorID=creatorIDURL,
+            BackupID=backupID,
+            BlockNumber=blockNumber,
+            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
+            SessionKeyType=key.SessionKeyType(),
+            LastBlock=lastBlock,
+            Data=raw_bytes,
+            EncryptKey=keyID,
+        )
+        del raw_bytes
+        serializedblock = block.Serialize()
+        del block
+        os.write(fileno, strng.to_bin(len(serializedblock)) + b':' + serializedblock)
+    finally:
+        os.close(fileno)
+    if _Debug:
+        lg.out(_DebugLevel, 'backup.encrypt_block blockNumber=%d size=%d atEOF=%s dt=%s EncryptKey=%s' % (blockNumber, len(serializedblock), lastBlock, str(time.time() - dt), keyID))
+    return len(serializedblock)
+
+
+#-------------------------------------------------------------------------------
+
+
 class backup(automat.Automat):
 
     """
@@ -154,6 +193,7 @@ class backup(automat.Automat):
         keyID=None,
         ecc_map=None,
         creatorIDURL=None,
+        maxEncryptingBlocks=None,
     ):
         self.backupID = backupID
         self.creatorIDURL = creatorIDURL or my_id.getIDURL()
@@ -177,6 +217,8 @@ class backup(automat.Automat):
         self.currentBlockData = BytesIO()
         self.currentBlockSize = 0
         self.workBlocks = {}
+        self.encryptingBlocks = {}
+        self.maxEncryptingBlocks = maxEncryptingBlocks or default_encrypting_blocks()
         self.blockNumber = 0
         self.dataSent = 0
         self.blocksSent = 0
@@ -209,9 +251,15 @@ class backup(automat.Automat):
                 self.doFirstBlock(*args, **kwargs)
         #---READ---
         elif self.state == 'READ':
-            if event == 'read-success' and not self.isReadingNow(*args, **kwargs) and (self.isBlockReady(*args, **kwargs) or self.isEOF(*args, **kwargs)):
+            if event == 'read-success' and not self.isReadingNow(*args, **kwargs) and (self.isEOF(*args, **kwargs) or (self.isBlockReady(*args, **kwargs) and self.isEncryptQueueFull(*args, **kwargs))):
                 self.state = 'ENCRYPT'
                 self.doEncryptBlock(*args, **kwargs)
+            elif event == 'read-success' and not self.isReadingNow(*args, **kwargs) and not self.isEOF(*args, **kwargs) and self.isBlockReady(*args, **kwargs) and not self.isEncryptQueueFull(*args, **kwargs):
+                self.doEncryptBlock(*args, **kwargs)
+                self.doNextBlock(*args, **kwargs)
+                self.doRead(*args, **kwargs)
+            elif event == 'block-encrypted':
+                self.doBlockPushAndRaid(*args, **kwargs)
             elif event == 'fail' or ((event == 'read-success' or event == 'timer-001sec') and self.isAborted(*args, **kwargs)):
                 self.state = 'ABORTED'
                 self.doClose(*args, **kwargs)
@@ -233,24 +281,27 @@ class backup(automat.Automat):
                 self.doClose(*args, **kwargs)
                 self.doReport(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
-            elif event == 'block-raid-started' and not self.isEOF(*args, **kwargs) and not self.isAborted(*args, **kwargs):
-                self.state = 'READ'
-                self.doNextBlock(*args, **kwargs)
-                self.doRead(*args, **kwargs)
             elif event == 'block-raid-done' and self.isMoreBlocks(*args, **kwargs) and not self.isAborted(*args, **kwargs):
                 self.doPopBlock(*args, **kwargs)
                 self.doBlockReport(*args, **kwargs)
                 self.doNotifyNewData(*args, **kwargs)
-            elif event == 'fail' or ((event == 'timer-01sec' or event == 'block-raid-done' or event == 'block-raid-started') and self.isAborted(*args, **kwargs)):
+            elif event == 'fail' or ((event == 'timer-01sec' or event == 'block-raid-done') and self.isAborted(*args, **kwargs)):
                 self.state = 'ABORTED'
                 self.doClose(*args, **kwargs)
                 self.doReport(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
         #---ENCRYPT---
         elif self.state == 'ENCRYPT':
-            if event == 'block-encrypted':
+            if event == 'block-encrypted' and self.isEOF(*args, **kwargs) and not self.isEncrypting(*args, **kwargs):
                 self.state = 'RAID'
                 self.doBlockPushAndRaid(*args, **kwargs)
+            elif event == 'block-encrypted' and self.isEOF(*args, **kwargs) and self.isEncrypting(*args, **kwargs):
+                self.doBlockPushAndRaid(*args, **kwargs)
+            elif event == 'block-encrypted' and not self.isEOF(*args, **kwargs):
+                self.state = 'READ'
+                self.doBlockPushAndRaid(*args, **kwargs)
+                self.doNextBlock(*args, **kwargs)
+                self.doRead(*args, **kwargs)
             elif event == 'fail':
                 self.state = 'ABORTED'
                 self.doClose(*args, **kwargs)
@@ -305,6 +356,18 @@ class backup(automat.Automat):
             lg.args(_DebugLevel, stateReading=self.stateReading)
         return self.stateReading
 
+    def isEncrypting(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        return len(self.encryptingBlocks) > 0
+
+    def isEncryptQueueFull(self, *args, **kwargs):
+        """
+        Condition method, True if there will be no free slot for the next block after the current one is started.
+        """
+        return len(self.encryptingBlocks) + 1 >= self.maxEncryptingBlocks
+
     def isMoreBlocks(self, *args, **kwargs):
         """
         Condition method.
@@ -379,60 +442,40 @@ class backup(automat.Automat):
         """
         Action method.
         """
-
-        def _doBlock():
-            dt = time.time()
-            raw_bytes = self.currentBlockData.getvalue()
-            block = encrypted.Block(
-                CreatorID=self.creatorIDURL,
-                BackupID=self.backupID,
-                BlockNumber=self.blockNumber,
-                SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-                SessionKeyType=key.SessionKeyType(),
-                LastBlock=self.stateEOF,
-                Data=raw_bytes,
-                EncryptKey=self.keyID,
-            )
-            del raw_bytes
-            if _Debug:
-                lg.out(_DebugLevel, 'backup.doEncryptBlock blockNumber=%d size=%d atEOF=%s dt=%s EncryptKey=%s' % (self.blockNumber, self.currentBlockSize, self.stateEOF, str(time.time() - dt), self.keyID))
-            return block
-
-        d = maybeDeferred(_doBlock)
-        d.addCallback(lambda block: self.automat('block-encrypted', block))
-        d.addErrback(lambda err: self.automat('fail', err))
+        blockNumber = self.blockNumber
+        fileno, filename = tmpfile.make('raid', extension='.raid')
+        self.encryptingBlocks[blockNumber] = filename
+        d = deferToThread(
+            encrypt_block,
+            self.creatorIDURL,
+            self.backupID,
+            blockNumber,
+            self.stateEOF,
+            self.currentBlockData.getvalue(),
+            self.keyID,
+            fileno,
+        )
+        d.addCallback(self._on_block_encrypted, blockNumber, filename)
+        d.addErrback(self._on_block_encrypt_failed, blockNumber, filename)
 
     def doBlockPushAndRaid(self, *args, **kwargs):
         """
         Action method.
         """
-        newblock = args[0]
-        if newblock is None:
-            self.abort()
-            self.automat('fail')
-            if _Debug:
-                lg.out(_DebugLevel, 'backup.doBlockPushAndRaid ERROR newblock is empty, terminating=%s' % self.terminating)
-            lg.warn('failed to encrypt block, ABORTING')
-            return
+        blockNumber, filename = args[0]
         if self.terminating:
-            self.automat('block-raid-done', (newblock.BlockNumber, None))
+            tmpfile.throw_out(filename, 'backup aborted')
+            self.automat('block-raid-done', (blockNumber, None))
             if _Debug:
                 lg.out(_DebugLevel, 'backup.doBlockPushAndRaid SKIP, terminating=True')
             return
-        fileno, filename = tmpfile.make('raid', extension='.raid')
-        serializedblock = newblock.Serialize()
-        blocklen = len(serializedblock)
-        os.write(fileno, strng.to_bin(blocklen) + b':' + serializedblock)
-        os.close(fileno)
-        self.workBlocks[newblock.BlockNumber] = filename
+        self.workBlocks[blockNumber] = filename
         dt = time.time()
         outputpath = os.path.join(settings.getLocalBackupsDir(), self.customerGlobalID, self.pathID, self.version)
-        task_params = (filename, self.eccmap.name, self.version, newblock.BlockNumber, outputpath)
+        task_params = (filename, self.eccmap.name, self.version, blockNumber, outputpath)
         raid_worker.add_task('make', task_params, lambda cmd, params, result: self._raidmakeCallback(params, result, dt))
-        self.automat('block-raid-started', newblock)
-        del serializedblock
         if _Debug:
-            lg.out(_DebugLevel, 'backup.doBlockPushAndRaid %s : start process data from %s to %s, %d' % (newblock.BlockNumber, filename, outputpath, id(self.terminating)))
+            lg.out(_DebugLevel, 'backup.doBlockPushAndRaid %s : start process data from %s to %s, %d' % (blockNumber, filename, outputpath, id(self.terminating)))
 
     def doPopBlock(self, *args, **kwargs):
         """
@@ -485,6 +528,7 @@ class backup(automat.Automat):
         self.closed = True
         for filename in self.workBlocks.values():
             tmpfile.throw_out(filename, 'backup aborted')
+        # blocks which are still being encrypted will be removed when the workers finish
 
     def doReport(self, *args, **kwargs):
         """
@@ -546,6 +590,24 @@ class backup(automat.Automat):
         percent = min(100.0, 100.0*self.dataSent/self.totalSize)
         return percent
 
+    def _on_block_encrypted(self, size, blockNumber, filename):
+        self.encryptingBlocks.pop(blockNumber, None)
+        if self.closed or self.workBlocks is None:
+            tmpfile.throw_out(filename, 'backup closed')
+            return None
+        self.automat('block-encrypted', (blockNumber, filename))
+        return None
+
+    def _on_block_encrypt_failed(self, err, blockNumber, filename):
+        self.encryptingBlocks.pop(blockNumber, None)
+        tmpfile.throw_out(filename, 'block encryption failed')
+        lg.err('failed to encrypt block %d of %s: %r' % (blockNumber, self.backupID, err))
+        if self.closed or self.workBlocks is None:
+            return None
+        self.abort()
+        self.automat('fail', err)
+        return None
+
     def _raidmakeCallback(self, params, result, dt):
         _, _, _, blockNumber, _ = params
         if result is None:
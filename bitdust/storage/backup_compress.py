@@ -0,0 +1,381 @@
+#!/usr/bin/python
+# backup_compress.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (backup_compress.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: backup_compress
+
+Compression stage of the backup stream. The ".tar" stream is cut into blocks of equal size
+and every block is compressed independently in a pool of worker threads - zlib, bz2, zstd and lz4
+all release the GIL, so the blocks are compressed in parallel. Results are written in the original order.
+
+Blocks which do not compress (media files, archives, encrypted data) are detected by compressing
+a few small samples with a fast codec first and are stored as they are.
+
+    [header: magic, codec name][frame][frame]...[end frame]
+    frame: [1 byte flags][4 bytes raw length][4 bytes stored length][stored data]
+
+The codec is written in the header of the stream, so restore selects the decoder from the stream itself.
+Streams without the header are regular ".tar" files: with "none" codec the stream is not framed at all
+and can be restored by older versions of the software.
+
+Codecs "zstd" and "lz4" are available only when "zstandard" and "lz4" packages are installed.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import bz2
+import gzip
+import zlib
+import struct
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+#------------------------------------------------------------------------------
+
+BLOCK_SIZE = 1024*1024
+
+STREAM_MAGIC = b'BDCOMPR1'
+
+FLAG_STORED = 0
+FLAG_COMPRESSED = 1
+
+# a block is stored as it is if samples did not compress better than that
+INCOMPRESSIBLE_RATIO = 0.9
+
+_Header = struct.Struct('>8s8s')
+_Frame = struct.Struct('>BII')
+
+_SampleSize = 4096
+_SamplesCount = 4
+
+#------------------------------------------------------------------------------
+
+_Executor = None
+_ExecutorLock = threading.Lock()
+_Local = threading.local()
+
+#------------------------------------------------------------------------------
+
+
+def init(workers=None):
+    global _Executor
+    with _ExecutorLock:
+        if _Executor is None:
+            _Executor = ThreadPoolExecutor(max_workers=workers or default_workers(), thread_name_prefix='compress')
+    if _Debug:
+        lg.args(_DebugLevel, workers=_Executor._max_workers, codecs=available_codecs())
+    return _Executor
+
+
+def shutdown():
+    global _Executor
+    with _ExecutorLock:
+        if _Executor is None:
+            return
+        _Executor.shutdown(wait=True)
+        _Executor = None
+
+
+def executor():
+    global _Executor
+    if _Executor is None:
+        init()
+    return _Executor
+
+
+def default_workers():
+    return max(1, min(8, os.cpu_count() or 1))
+
+
+#------------------------------------------------------------------------------
+
+
+def _zstd_compress(data):
+    if not hasattr(_Local, 'zstd_compressor'):
+        # compressor objects can not be shared between threads
+        _Local.zstd_compressor = zstandard.ZstdCompressor(level=3)
+    return _Local.zstd_compressor.compress(data)
+
+
+def _zstd_decompress(data, raw_size):
+    if not hasattr(_Local, 'zstd_decompressor'):
+        _Local.zstd_decompressor = zstandard.ZstdDecompressor()
+    return _Local.zstd_decompressor.decompress(data, max_output_size=raw_size)
+
+
+_Codecs = {
+    'gzip': (
+        lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+        lambda data, raw_size: gzip.decompress(data),
+    ),
+    'bz2': (
+        lambda data: bz2.compress(data, 9),
+        lambda data, raw_size: bz2.decompress(data),
+    ),
+}
+
+if zstandard is not None:
+    _Codecs['zstd'] = (_zstd_compress, _zstd_decompress)
+
+if lz4frame is not None:
+    _Codecs['lz4'] = (
+        lambda data: lz4frame.compress(data),
+        lambda data, raw_size: lz4frame.decompress(data),
+    )
+
+#------------------------------------------------------------------------------
+
+
+def known_codecs():
+    return ['auto', 'zstd', 'lz4', 'gzip', 'bz2', 'none']
+
+
+def available_codecs():
+    return [c for c in known_codecs() if c in ('auto', 'none') or c in _Codecs]
+
+
+def resolve(codec):
+    """
+    Returns the codec which will be actually used: "auto" is the fastest available codec,
+    unknown codec or codec which is not installed falls back to "gzip".
+    """
+    if codec == 'auto':
+        for c in ('zstd', 'lz4', 'gzip'):
+            if c in _Codecs:
+                return c
+    if codec == 'none' or codec in _Codecs:
+        return codec
+    lg.warn('compression codec %r is not available, using "gzip"' % codec)
+    return 'gzip'
+
+
+def looks_compressible(data):
+    """
+    Compresses a few small samples from different places of the block with the fastest zlib level.
+    """
+    size = len(data)
+    if size <= _SampleSize*_SamplesCount:
+        samples = [data]
+    else:
+        step = (size - _SampleSize)//(_SamplesCount - 1)
+        samples = [data[i*step:i*step + _SampleSize] for i in range(_SamplesCount)]
+    total = sum(len(s) for s in samples)
+    if not total:
+        return False
+    compressed = sum(len(zlib.compress(s, 1)) for s in samples)
+    return compressed < total*INCOMPRESSIBLE_RATIO
+
+
+def compress_block(codec, data):
+    """
+    Returns ready to write frame.
+    """
+    data = bytes(data)
+    if codec != 'none' and looks_compressible(data):
+        payload = _Codecs[codec][0](data)
+        if len(payload) < len(data):
+            return _Frame.pack(FLAG_COMPRESSED, len(data), len(payload)) + payload
+    return _Frame.pack(FLAG_STORED, len(data), len(data)) + data
+
+
+def decompress_block(codec, flags, raw_size, payload):
+    if flags == FLAG_STORED:
+        return payload
+    if codec not in _Codecs:
+        raise ValueError('compression codec %r is not available' % codec)
+    data = _Codecs[codec][1](payload, raw_size)
+    if len(data) != raw_size:
+        raise ValueError('wrong size of decompressed block: %d != %d' % (len(data), raw_size))
+    return data
+
+
+#------------------------------------------------------------------------------
+
+
+class CompressWriter(object):
+
+    """
+    File-like object which receives the stream in the producer thread and writes compressed frames into ``output``.
+    At most ``2*workers`` blocks are compressed at the same time, so memory usage does not depend on the data size.
+    """
+
+    def __init__(self, output, codec='auto', block_size=BLOCK_SIZE, workers=None):
+        self.output = output
+        self.codec = resolve(codec)
+        self.block_size = block_size
+        self.pool = executor()
+        self.max_in_flight = 2*(workers or self.pool._max_workers)
+        self.buffer = bytearray()
+        self.in_flight = deque()
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.blocks = 0
+        self.blocks_skipped = 0
+        self.closed = False
+        self._write(_Header.pack(STREAM_MAGIC, self.codec.encode('ascii')))
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return self.info()
+        self.closed = True
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.in_flight:
+            self._complete()
+        self._write(_Frame.pack(FLAG_STORED, 0, 0))
+        if _Debug:
+            lg.args(_DebugLevel, **self.info())
+        return self.info()
+
+    def info(self):
+        return {
+            'codec': self.codec,
+            'raw': self.raw_bytes,
+            'stored': self.stored_bytes,
+            'blocks': self.blocks,
+            'skipped': self.blocks_skipped,
+        }
+
+    def _submit(self, block):
+        self.raw_bytes += len(block)
+        self.in_flight.append(self.pool.submit(compress_block, self.codec, block))
+        while len(self.in_flight) >= self.max_in_flight:
+            self._complete()
+
+    def _complete(self):
+        frame = self.in_flight.popleft().result()
+        self.blocks += 1
+        if frame[0] == FLAG_STORED:
+            self.blocks_skipped += 1
+        self._write(frame)
+
+    def _write(self, data):
+        self.stored_bytes += len(data)
+        self.output.write(data)
+
+
+#------------------------------------------------------------------------------
+
+
+def wrap(output, codec='auto', **kwargs):
+    """
+    Returns ``CompressWriter`` writing into ``output`` or ``output`` itself if the data should not be compressed.
+    """
+    codec = resolve(codec)
+    if codec == 'none':
+        return output
+    return CompressWriter(output, codec=codec, **kwargs)
+
+
+def detect(filepath):
+    """
+    Returns codec name if the file is a compressed stream or None if this is a regular file.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            header = f.read(_Header.size)
+    except:
+        lg.exc()
+        return None
+    if len(header) < _Header.size:
+        return None
+    magic, codec = _Header.unpack(header)
+    if magic != STREAM_MAGIC:
+        return None
+    return codec.rstrip(b'\x00').decode('ascii')
+
+
+def decompress_file(source_path, output_path):
+    """
+    Decodes the compressed stream into ``output_path``, blocks are decompressed in the pool of worker threads.
+    Returns number of written bytes.
+    """
+    pool = executor()
+    in_flight = deque()
+    total = [0]
+
+    with open(source_path, 'rb') as fin, open(output_path, 'wb') as fout:
+
+        def _complete():
+            data = in_flight.popleft().result()
+            fout.write(data)
+            total[0] += len(data)
+
+        magic, codec = _Header.unpack(fin.read(_Header.size))
+        if magic != STREAM_MAGIC:
+            raise ValueError('%r is not a compressed stream' % source_path)
+        codec = codec.rstrip(b'\x00').decode('ascii')
+        while True:
+            frame = fin.read(_Frame.size)
+            if len(frame) < _Frame.size:
+                raise ValueError('compressed stream %r is truncated' % source_path)
+            flags, raw_size, stored_size = _Frame.unpack(frame)
+            if raw_size == 0:
+                break
+            payload = fin.read(stored_size)
+            if len(payload) != stored_size:
+                raise ValueError('compressed stream %r is truncated' % source_path)
+            in_flight.append(pool.submit(decompress_block, codec, flags, raw_size, payload))
+            while len(in_flight) >= 2*pool._max_workers:
+                _complete()
+        while in_flight:
+            _complete()
+    return total[0]
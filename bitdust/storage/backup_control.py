@@ -96,6 +96,9 @@ from bitdust.stream import data_sender
 from bitdust.storage import backup_fs
 from bitdust.storage import backup_matrix
 from bitdust.storage import backup
+from bitdust.storage import backup_dedup
+from bitdust.storage import backup_compress
+from bitdust.storage import index_journal
 
 from bitdust.userid import my_id
 
@@ -140,6 +143,11 @@ def init():
     """
     if _Debug:
         lg.out(_DebugLevel, 'backup_control.init')
+    chunks_dir = settings.ServiceDir('service_backups')
+    if not os.path.isdir(chunks_dir):
+        bpio._dirs_make(chunks_dir)
+    backup_dedup.init(os.path.join(chunks_dir, 'chunks.db'))
+    backup_compress.init()
 
 
 def shutdown():
@@ -148,6 +156,8 @@ def shutdown():
     """
     if _Debug:
         lg.out(_DebugLevel, 'backup_control.shutdown')
+    backup_dedup.shutdown()
+    backup_compress.shutdown()
 
 
 #------------------------------------------------------------------------------
@@ -286,19 +296,20 @@ def IncomingSupplierListFiles(newpacket, list_files_global_id):
     return True
 
 
-def IncomingSupplierBackupIndex(newpacket, key_id=None, deleted_path_ids=[]):
+def IncomingSupplierBackupIndex(newpacket, key_id=None, deleted_path_ids=[], delta_packet=None):
     """
     Called by ``p2p.p2p_service`` when a remote copy of our local index data
     base ( in the "Data" packet ) is received from one of our suppliers.
 
     The index is also stored on suppliers to be able to restore it.
+    Changes made after the index file was stored on supplier are passed in ``delta_packet``.
     """
     block = encrypted.Unserialize(newpacket.Payload, decrypt_key=key_id)
     if not block:
         lg.err('failed reading data from %s' % newpacket.RemoteID)
         return None
     try:
-        data = block.Data()
+        data = backup_fs.UnpackIndexFile(block.Data())
         inpt = StringIO(strng.to_text(data))
         supplier_revision = inpt.readline().rstrip('\n')
         if supplier_revision:
@@ -314,8 +325,21 @@ def IncomingSupplierBackupIndex(newpacket, key_id=None, deleted_path_ids=[]):
             pass
         return None
     inpt.close()
+    if delta_packet is not None and supplier_revision is not None:
+        supplier_revision, text_data = _apply_index_delta(delta_packet, key_id, supplier_revision, text_data)
     if _Debug:
         lg.args(_DebugLevel, k=key_id, p=newpacket.PacketID, c=newpacket.CreatorID, sz=len(text_data), inp=len(newpacket.Payload), deleted=len(deleted_path_ids))
+    if supplier_revision is not None:
+        if key_id:
+            glob_id = global_id.ParseGlobalID(key_id)
+            local_revision = backup_fs.revision(glob_id['idurl'], glob_id['key_alias'])
+        else:
+            local_revision = backup_fs.revision()
+        if supplier_revision <= local_revision:
+            # nothing to update, do not parse the whole catalog
+            if _Debug:
+                lg.dbg(_DebugLevel, 'local revision %d is up to date, supplier revision is %d' % (local_revision, supplier_revision))
+            return supplier_revision
     count, updated_customers_keys = backup_fs.ReadIndex(text_data, new_revision=supplier_revision, deleted_path_ids=deleted_path_ids)
     if updated_customers_keys:
         for customer_idurl, key_alias in updated_customers_keys:
@@ -325,6 +349,19 @@ def IncomingSupplierBackupIndex(newpacket, key_id=None, deleted_path_ids=[]):
     return supplier_revision
 
 
+def _apply_index_delta(delta_packet, key_id, revision, text_data):
+    block = encrypted.Unserialize(delta_packet.Payload, decrypt_key=key_id)
+    if not block:
+        lg.err('failed reading index delta from %s' % delta_packet.RemoteID)
+        return revision, text_data
+    try:
+        delta_data = strng.to_text(backup_fs.UnpackIndexFile(block.Data()))
+    except:
+        lg.exc()
+        return revision, text_data
+    return index_journal.apply_delta(revision, text_data, delta_data)
+
+
 #------------------------------------------------------------------------------
 
 
@@ -364,7 +401,7 @@ def DeleteBackup(backupID, removeLocalFilesToo=True, saveDB=True, calculate=True
     10) save the modified index data base, soon it will be synchronized with "index_synchronizer()" state machine
     """
     backupID = global_id.CanonicalID(backupID)
-    key_alias, customer, _, _ = packetid.SplitBackupIDFull(backupID)
+    key_alias, customer, remotePath, version = packetid.SplitBackupIDFull(backupID)
     customer_idurl = global_id.GlobalUserToIDURL(customer)
     # if the user deletes a backup, make sure we remove any work we're doing on it
     # abort backup if it just started and is running at the moment
@@ -372,6 +409,10 @@ def DeleteBackup(backupID, removeLocalFilesToo=True, saveDB=True, calculate=True
         if _Debug:
             lg.out(_DebugLevel, 'backup_control.DeleteBackup %s is in process, stopping' % backupID)
         return True
+    item = backup_fs.GetByID(remotePath, iterID=backup_fs.fsID(customer_idurl, key_alias))
+    if item and item.is_version_referenced(version):
+        lg.warn('can not delete %r, the data is used by other incremental versions' % backupID)
+        return False
     from bitdust.stream import io_throttle
     from bitdust.storage import backup_rebuilder
     if _Debug:
@@ -383,6 +424,8 @@ def DeleteBackup(backupID, removeLocalFilesToo=True, saveDB=True, calculate=True
     # mark it as being deleted in the db, well... just remove it from the index now
     if not backup_fs.DeleteBackupID(backupID):
         return False
+    if backup_dedup.index():
+        backup_dedup.index().forget_version(backup_dedup.scope_of(backupID), version)
     # finally remove local files for this backupID
     if removeLocalFilesToo:
         backup_fs.DeleteLocalBackup(settings.getLocalBackupsDir(), backupID)
@@ -442,6 +485,8 @@ def DeletePathBackups(pathID, removeLocalFilesToo=True, saveDB=True, calculate=T
         # finally remove this backup from the index
         item.delete_version(version)
         # lg.out(8, 'backup_control.DeletePathBackups ' + backupID)
+    if backup_dedup.index():
+        backup_dedup.index().forget_scope(pathID)
     # stop any rebuilding, we will restart it soon
     backup_rebuilder.RemoveAllBackupsToWork()
     backup_rebuilder.SetStoppedFlag()
@@ -657,14 +702,23 @@ class Task():
         if _Debug:
             lg.out(_DebugLevel, 'backup_control.Task.on_folder_size_counted %s %d for %r' % (pth, sz, itemInfo))
 
-        compress_mode = 'bz2'
         arcname = os.path.basename(self.sourcePath)
+        codec = backup_compress.resolve(settings.getBackupsCompression())
+        incremental = settings.getBackupsIncremental() and backup_dedup.index()
+        backupID = self.backupID
+
+        def _wrapper(p):
+            # the ".tar" stream is not compressed by itself: the chunks must be found in the raw data first
+            output = backup_compress.wrap(p, codec=codec)
+            if not incremental:
+                return output
+            return backup_dedup.DedupWriter(output, backupID, backup_dedup.index(), finished_callback=OnManifestPrepared, close_output=output is not p)
 
         from bitdust.storage import backup_tar
         if bpio.pathIsDir(self.localPath):
-            backupPipe = backup_tar.backuptardir_thread(self.localPath, arcname=arcname, compress=compress_mode)
+            backupPipe = backup_tar.backuptardir_thread(self.localPath, arcname=arcname, compress='none', wrapper=_wrapper)
         else:
-            backupPipe = backup_tar.backuptarfile_thread(self.localPath, arcname=arcname, compress=compress_mode)
+            backupPipe = backup_tar.backuptarfile_thread(self.localPath, arcname=arcname, compress='none', wrapper=_wrapper)
 
         job = backup.backup(
             self.backupID,
@@ -830,6 +884,8 @@ def OnJobDone(backupID, result):
     keyAlias, customerGlobalID, remotePath, version = packetid.SplitBackupIDFull(backupID)
     customer_idurl = global_id.GlobalUserToIDURL(customerGlobalID)
     if result == 'done':
+        if backup_dedup.index():
+            backup_dedup.index().commit_version(backup_dedup.scope_of(backupID), version)
         maxBackupsNum = settings.getBackupsMaxCopies()
         if maxBackupsNum:
             item = backup_fs.GetByID(remotePath, iterID=backup_fs.fsID(customer_idurl, keyAlias))
@@ -837,8 +893,13 @@ def OnJobDone(backupID, result):
                 versions = item.list_versions(sorted=True, reverse=True)
                 if len(versions) > maxBackupsNum:
                     for version in versions[maxBackupsNum:]:
+                        if item.is_version_referenced(version):
+                            # the data is still needed to restore one of the newer incremental versions
+                            continue
                         item.delete_version(version)
                         backupID = packetid.MakeBackupID(customerGlobalID, remotePath, version, key_alias=keyAlias)
+                        if backup_dedup.index():
+                            backup_dedup.index().forget_version(backup_dedup.scope_of(backupID), version)
                         backup_rebuilder.RemoveBackupToWork(backupID)
                         backup_fs.DeleteLocalBackup(settings.getLocalBackupsDir(), backupID)
                         backup_matrix.EraseBackupLocalInfo(backupID)
@@ -862,6 +923,22 @@ def OnJobDone(backupID, result):
     reactor.callLater(0, FireTaskFinishedCallbacks, remotePath, version, result)  # @UndefinedVariable
 
 
+def OnManifestPrepared(backupID, info):
+    """
+    Called when incremental version was split into chunks, ``info['versions']`` are
+    all versions where the data of that version is stored.
+    """
+    keyAlias, customerGlobalID, remotePath, version = packetid.SplitBackupIDFull(backupID)
+    customer_idurl = global_id.GlobalUserToIDURL(customerGlobalID)
+    item = backup_fs.GetByID(remotePath, iterID=backup_fs.fsID(customer_idurl, keyAlias))
+    if not item:
+        lg.warn('item %r not found' % remotePath)
+        return
+    item.set_version_refs(version, info['versions'][1:])
+    if _Debug:
+        lg.args(_DebugLevel, backup_id=backupID, size=info['size'], stored=info['stored'], refs=info['versions'][1:])
+
+
 def OnJobFailed(backupID, err):
     lg.err('job failed [%s] : %s' % (backupID, err))
     jobs().pop(backupID)
@@ -0,0 +1,449 @@
+#!/usr/bin/python
+# backup_dedup.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (backup_dedup.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: backup_dedup
+
+Incremental backups: the ".tar" stream is split into content-defined chunks and
+only chunks which were not uploaded before with another version of the same item are stored.
+
+The stream of an incremental version is a "pack": new chunks one after another,
+followed by the manifest and a trailer. The manifest lists all chunks of the original stream in order,
+every chunk is referenced by the version where it is stored and the offset inside of that version's pack.
+So to restore such version the packs of the referenced versions must be restored as well,
+see ``restore_monitor`` and ``assemble()``.
+
+    [chunk data ...][manifest][8 bytes manifest length][PACK_MAGIC]
+
+Chunk boundaries are found with normalized chunking as in FastCDC: a stricter condition before
+the average chunk size and a looser after it. The fingerprint of every position is computed from
+a small window of bytes with ``bytes.translate()`` and boundaries are searched with ``bytes.find()``,
+a per-byte rolling hash loop in Python is too slow for large data sets.
+
+Local SQLite file keeps index of all known chunks by content hash: the version and the position where
+the chunk is stored. Only chunks of completed versions are reused. The index is just an optimization -
+when it is lost the next version will upload all of the data again.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import zlib
+import json
+import struct
+import random
+import hashlib
+import sqlite3
+import threading
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+#------------------------------------------------------------------------------
+
+CHUNK_MIN_SIZE = 16*1024
+CHUNK_AVG_SIZE = 64*1024
+CHUNK_MAX_SIZE = 256*1024
+
+PACK_MAGIC = b'BDDEDUP1'
+
+# every byte is mapped to 2 bits, a boundary is placed after those sequences of symbols
+_FingerprintTable = bytes(random.Random(6291).choices(range(4), k=256))
+_StrictPattern = bytes([0, 1, 3, 2, 1, 0, 2, 3, 1])
+_LoosePattern = bytes([2, 3, 0, 0, 1, 3, 2])
+
+_Entry = struct.Struct('>HQI')
+_Trailer = struct.Struct('>Q8s')
+
+#------------------------------------------------------------------------------
+
+_Index = None
+
+#------------------------------------------------------------------------------
+
+
+def init(db_file_path):
+    global _Index
+    if _Index is not None:
+        lg.warn('chunks index already opened')
+        return _Index
+    _Index = ChunkIndex(db_file_path)
+    _Index.cleanup_incomplete()
+    if _Debug:
+        lg.args(_DebugLevel, db_file_path=db_file_path)
+    return _Index
+
+
+def shutdown():
+    global _Index
+    if _Index is None:
+        return
+    _Index.close()
+    _Index = None
+
+
+def index():
+    global _Index
+    return _Index
+
+
+#------------------------------------------------------------------------------
+
+
+def scope_of(backupID):
+    """
+    Chunks are shared between versions of the same item: "master$alice@host.com:0/1/2".
+    """
+    return backupID.rpartition('/')[0]
+
+
+def version_of(backupID):
+    return backupID.rpartition('/')[2]
+
+
+#------------------------------------------------------------------------------
+
+
+class Chunker(object):
+
+    """
+    Splits a stream into content-defined chunks, boundaries depend only on the data since previous boundary.
+    """
+
+    def __init__(self, min_size=CHUNK_MIN_SIZE, avg_size=CHUNK_AVG_SIZE, max_size=CHUNK_MAX_SIZE):
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self._buffer = b''
+
+    def feed(self, data):
+        """
+        Returns a list of complete chunks, the tail is kept till the next call.
+        """
+        self._buffer += data
+        if len(self._buffer) < self.max_size*4:
+            return []
+        chunks, pos = self._split(self._buffer, final=False)
+        self._buffer = self._buffer[pos:]
+        return chunks
+
+    def flush(self):
+        chunks, _ = self._split(self._buffer, final=True)
+        self._buffer = b''
+        return chunks
+
+    def _split(self, data, final):
+        symbols = data.translate(_FingerprintTable)
+        view = memoryview(data)
+        total = len(data)
+        chunks = []
+        pos = 0
+        while pos < total:
+            if total - pos <= self.max_size and not final:
+                break
+            if total - pos <= self.min_size:
+                chunks.append(view[pos:])
+                pos = total
+                break
+            cut = self._cut(symbols, pos, total)
+            chunks.append(view[pos:cut])
+            pos = cut
+        return chunks, pos
+
+    def _cut(self, symbols, pos, total):
+        i = symbols.find(_StrictPattern, pos + self.min_size - len(_StrictPattern), min(total, pos + self.avg_size))
+        if i >= 0:
+            return i + len(_StrictPattern)
+        i = symbols.find(_LoosePattern, pos + self.avg_size - len(_LoosePattern), min(total, pos + self.max_size))
+        if i >= 0:
+            return i + len(_LoosePattern)
+        return min(total, pos + self.max_size)
+
+
+#------------------------------------------------------------------------------
+
+
+class ChunkIndex(object):
+
+    """
+    Keeps location of every known chunk: (scope, hash) -> (version, offset, length).
+    Used from the thread producing the ".tar" stream and from the main thread.
+    """
+
+    def __init__(self, db_file_path):
+        self.db_file_path = db_file_path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(db_file_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS chunks (scope TEXT, hash BLOB, version TEXT, offset INTEGER, length INTEGER, PRIMARY KEY (scope, hash)) WITHOUT ROWID')
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_version ON chunks (scope, version)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS versions (scope TEXT, version TEXT, complete INTEGER, PRIMARY KEY (scope, version))')
+        self.db.commit()
+
+    def __repr__(self):
+        return 'ChunkIndex(%s)' % self.db_file_path
+
+    def close(self):
+        with self._lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def start_version(self, scope, version):
+        with self._lock:
+            self.db.execute('INSERT OR REPLACE INTO versions VALUES (?, ?, 0)', (scope, version))
+            self.db.commit()
+
+    def commit_version(self, scope, version):
+        with self._lock:
+            self.db.execute('UPDATE versions SET complete=1 WHERE scope=? AND version=?', (scope, version))
+            self.db.commit()
+
+    def lookup(self, scope, digest, current_version=None):
+        """
+        Returns (version, offset, length) of a chunk stored by one of the completed versions or by the current version.
+        """
+        with self._lock:
+            return self.db.execute(
+                'SELECT chunks.version, chunks.offset, chunks.length FROM chunks JOIN versions ON versions.scope=chunks.scope AND versions.version=chunks.version '
+                'WHERE chunks.scope=? AND chunks.hash=? AND (versions.complete=1 OR versions.version=?)',
+                (scope, digest, current_version),
+            ).fetchone()
+
+    def add(self, scope, version, rows):
+        """
+        Stores a list of (hash, offset, length) chunks of the given version.
+        """
+        with self._lock:
+            self.db.executemany('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)', [(scope, digest, version, offset, length) for digest, offset, length in rows])
+            self.db.commit()
+
+    def forget_version(self, scope, version):
+        with self._lock:
+            self.db.execute('DELETE FROM chunks WHERE scope=? AND version=?', (scope, version))
+            self.db.execute('DELETE FROM versions WHERE scope=? AND version=?', (scope, version))
+            self.db.commit()
+
+    def forget_scope(self, scope):
+        with self._lock:
+            self.db.execute('DELETE FROM chunks WHERE scope=?', (scope, ))
+            self.db.execute('DELETE FROM versions WHERE scope=?', (scope, ))
+            self.db.commit()
+
+    def cleanup_incomplete(self):
+        """
+        Versions which were not finished (the program was stopped in the middle of backup) are never referenced.
+        """
+        with self._lock:
+            incomplete = self.db.execute('SELECT scope, version FROM versions WHERE complete=0').fetchall()
+            for scope, version in incomplete:
+                self.db.execute('DELETE FROM chunks WHERE scope=? AND version=?', (scope, version))
+                self.db.execute('DELETE FROM versions WHERE scope=? AND version=?', (scope, version))
+            self.db.commit()
+        return len(incomplete)
+
+    def stats(self, scope=None):
+        with self._lock:
+            if scope is None:
+                row = self.db.execute('SELECT COUNT(*), SUM(length) FROM chunks').fetchone()
+            else:
+                row = self.db.execute('SELECT COUNT(*), SUM(length) FROM chunks WHERE scope=?', (scope, )).fetchone()
+        return {
+            'chunks': row[0] or 0,
+            'bytes': row[1] or 0,
+        }
+
+
+#------------------------------------------------------------------------------
+
+
+class DedupWriter(object):
+
+    """
+    File-like object which receives the ".tar" stream in the producer thread and writes the pack into ``output``.
+    With ``close_output`` enabled the ``output`` is closed as well, that is used when it is another stage of
+    the stream, like ``backup_compress.CompressWriter``.
+    """
+
+    def __init__(self, output, backupID, chunks_index, finished_callback=None, batch_size=1000, close_output=False):
+        self.output = output
+        self.close_output = close_output
+        self.backupID = backupID
+        self.scope = scope_of(backupID)
+        self.version = version_of(backupID)
+        self.index = chunks_index
+        self.finished_callback = finished_callback
+        self.batch_size = batch_size
+        self.chunker = Chunker()
+        self.versions = [self.version]
+        self.entries = bytearray()
+        self.pending = {}
+        self.batch = []
+        self.offset = 0
+        self.size = 0
+        self.chunks = 0
+        self.reused = 0
+        self.index.start_version(self.scope, self.version)
+
+    def write(self, data):
+        for chunk in self.chunker.feed(data):
+            self._process(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Must be called after all data was written: writes the last chunk, the manifest and the trailer.
+        """
+        for chunk in self.chunker.flush():
+            self._process(chunk)
+        if self.batch:
+            self.index.add(self.scope, self.version, self.batch)
+            self.batch = []
+        info = {
+            'versions': self.versions,
+            'size': self.size,
+            'stored': self.offset,
+            'chunks': self.chunks,
+            'reused': self.reused,
+        }
+        header = json.dumps(info).encode('utf-8')
+        manifest = struct.pack('>I', len(header)) + header + zlib.compress(bytes(self.entries))
+        self.output.write(manifest)
+        self.output.write(_Trailer.pack(len(manifest), PACK_MAGIC))
+        if self.close_output:
+            self.output.close()
+        if _Debug:
+            lg.args(_DebugLevel, backup_id=self.backupID, size=self.size, stored=self.offset, chunks=self.chunks, reused=self.reused)
+        if self.finished_callback:
+            reactor.callFromThread(self.finished_callback, self.backupID, info)  # @UndefinedVariable
+        return info
+
+    def _process(self, chunk):
+        digest = hashlib.sha256(chunk).digest()
+        length = len(chunk)
+        self.size += length
+        self.chunks += 1
+        # chunks of the current version which are not yet saved in the index
+        location = self.pending.get(digest)
+        if location is None:
+            known = self.index.lookup(self.scope, digest, current_version=self.version)
+            if known:
+                if known[0] not in self.versions:
+                    self.versions.append(known[0])
+                location = (self.versions.index(known[0]), known[1])
+        if location is not None:
+            self.reused += 1
+        else:
+            location = (0, self.offset)
+            self.output.write(chunk)
+            self.pending[digest] = location
+            self.batch.append((digest, self.offset, length))
+            if len(self.batch) >= self.batch_size:
+                self.index.add(self.scope, self.version, self.batch)
+                self.batch = []
+                self.pending.clear()
+            self.offset += length
+        self.entries += _Entry.pack(location[0], location[1], length)
+
+
+#------------------------------------------------------------------------------
+
+
+def read_manifest(pack_path):
+    """
+    Returns the manifest info of a pack file or None if that is a regular ".tar" stream.
+    Field "entries" is a list of (version, offset, length) tuples.
+    """
+    try:
+        pack_size = os.path.getsize(pack_path)
+        if pack_size < _Trailer.size:
+            return None
+        with open(pack_path, 'rb') as f:
+            f.seek(pack_size - _Trailer.size)
+            manifest_size, magic = _Trailer.unpack(f.read(_Trailer.size))
+            if magic != PACK_MAGIC or manifest_size > pack_size - _Trailer.size:
+                return None
+            f.seek(pack_size - _Trailer.size - manifest_size)
+            manifest = f.read(manifest_size)
+        header_size = struct.unpack('>I', manifest[:4])[0]
+        info = json.loads(manifest[4:4 + header_size].decode('utf-8'))
+        entries = zlib.decompress(manifest[4 + header_size:])
+    except:
+        lg.exc()
+        return None
+    versions = info['versions']
+    info['entries'] = [(versions[v], offset, length) for v, offset, length in _Entry.iter_unpack(entries)]
+    return info
+
+
+def assemble(pack_path, packs, output_path, manifest=None):
+    """
+    Writes the original stream of the version into ``output_path``.
+    The ``packs`` is a dictionary with file paths of the packs of all referenced versions.
+    """
+    if manifest is None:
+        manifest = read_manifest(pack_path)
+    if not manifest:
+        raise ValueError('manifest not found in %r' % pack_path)
+    own_version = manifest['versions'][0]
+    files = {}
+    total = 0
+    try:
+        for version in manifest['versions']:
+            path = pack_path if version == own_version else packs.get(version)
+            if not path:
+                raise ValueError('pack of version %r is not available' % version)
+            files[version] = open(path, 'rb')
+        with open(output_path, 'wb') as fout:
+            for version, offset, length in manifest['entries']:
+                f = files[version]
+                f.seek(offset)
+                data = f.read(length)
+                if len(data) != length:
+                    raise ValueError('pack of version %r is too short' % version)
+                fout.write(data)
+                total += length
+    finally:
+        for f in files.values():
+            f.close()
+    if total != manifest['size']:
+        raise ValueError('assembled %d bytes, but expected %d' % (total, manifest['size']))
+    return output_path
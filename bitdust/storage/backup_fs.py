@@ -53,6 +53,10 @@ The software keeps 2 index dictionaries in the memory:
 * ID -> path
 
 Those dictionaries are trees - replicates the file system structure.
+
+Every change of an item in the catalog is remembered, so ``SaveIndex()`` only appends changed
+items to the journal of the index file (see ``index_journal``) and ``Calculate()`` only
+visits folders which have changed items inside.
 """
 
 #------------------------------------------------------------------------------
@@ -74,6 +78,7 @@ import os
 import sys
 import time
 import json
+import zlib
 import random
 
 #------------------------------------------------------------------------------
@@ -104,6 +109,8 @@ from bitdust.crypt import my_keys
 
 from bitdust.contacts import identitycache
 
+from bitdust.storage import index_journal
+
 from bitdust.interface import api
 
 from bitdust.userid import global_id
@@ -113,6 +120,8 @@ from bitdust.userid import my_id
 #------------------------------------------------------------------------------
 
 INFO_KEY = 'i'
+# index file sent to suppliers is compressed, regular index file starts with the revision number
+INDEX_FILE_COMPRESSED = b'zlib\n'
 UNKNOWN = -1
 FILE = 0
 DIR = 1
@@ -128,6 +137,9 @@ _FileSystemIndexByName = {}
 _FileSystemIndexByID = {}
 _RevisionNumber = {}
 _Stats = {}
+_Changes = {}
+_Journals = {}
+_Folders = {}
 
 #------------------------------------------------------------------------------
 
@@ -412,6 +424,47 @@ def sizebackups(customer_idurl=None, key_alias='master'):
 #------------------------------------------------------------------------------
 
 
+def _changed(item):
+    """
+    Remember that given item was created, modified or removed from the catalog.
+    Every consumer (``SaveIndex()`` and ``Calculate()`` of every customer) has own set of changed path IDs.
+    """
+    if isinstance(item, dict):
+        item = item.get(INFO_KEY)
+    if item is None:
+        return
+    consumers = _Changes.get(item.key_alias())
+    if consumers:
+        for path_ids in consumers.values():
+            path_ids.add(item.path_id)
+
+
+def _pending_changes(consumer, customer_idurl, key_alias, reset=True):
+    """
+    Returns set of path IDs changed since the last call or None if the whole catalog must be processed.
+    """
+    consumers = _Changes.setdefault(key_alias, {})
+    ret = consumers.get((consumer, customer_idurl))
+    if reset:
+        consumers[(consumer, customer_idurl)] = set()
+    return ret
+
+
+def _forget_changes(customer_idurl, key_alias=None):
+    for k_alias, consumers in _Changes.items():
+        if key_alias is not None and k_alias != key_alias:
+            continue
+        for consumer in list(consumers.keys()):
+            if consumer[1] == customer_idurl:
+                consumers.pop(consumer)
+    for k in list(_Folders.keys()):
+        if k[0] == customer_idurl and (key_alias is None or k[1] == key_alias):
+            _Folders.pop(k)
+
+
+#------------------------------------------------------------------------------
+
+
 class FSItemInfo():
 
     """
@@ -425,6 +478,7 @@ class FSItemInfo():
         self.size = -1
         self.key_id = key_id
         self.versions = {}
+        self.version_refs = {}
         self.created = created or utime.get_sec1970()
 
     def __repr__(self):
@@ -455,7 +509,9 @@ class FSItemInfo():
         return self.size != -1
 
     def set_size(self, sz):
-        self.size = sz
+        if self.size != sz:
+            self.size = sz
+            _changed(self)
 
     def read_stats(self, path):
         if not bpio.pathExist(path):
@@ -470,7 +526,7 @@ class FSItemInfo():
             except:
                 lg.exc()
                 return False
-        self.size = int(s.st_size)
+        self.set_size(int(s.st_size))
         return True
 
     def read_versions(self, local_path):
@@ -520,9 +576,12 @@ class FSItemInfo():
 
     def add_version(self, version):
         self.versions[version] = [-1, -1]
+        _changed(self)
 
     def set_version_info(self, version, maxblocknum, sizebytes):
-        self.versions[version] = [maxblocknum, sizebytes]
+        if self.versions.get(version) != [maxblocknum, sizebytes]:
+            self.versions[version] = [maxblocknum, sizebytes]
+            _changed(self)
 
     def get_version_info(self, version):
         return self.versions.get(version, [-1, -1])
@@ -532,6 +591,27 @@ class FSItemInfo():
 
     def delete_version(self, version):
         self.versions.pop(version, None)
+        self.version_refs.pop(version, None)
+        _changed(self)
+
+    def set_version_refs(self, version, refs):
+        """
+        Incremental version keeps only new data, the rest is stored with other versions listed in ``refs``.
+        """
+        if refs:
+            self.version_refs[version] = list(refs)
+        else:
+            self.version_refs.pop(version, None)
+        _changed(self)
+
+    def get_version_refs(self, version):
+        return self.version_refs.get(version, [])
+
+    def is_version_referenced(self, version):
+        for v, refs in self.version_refs.items():
+            if v != version and v in self.versions and version in refs:
+                return True
+        return False
 
     def has_version(self, version):
         return version in self.versions
@@ -581,15 +661,21 @@ class FSItemInfo():
                 's': self.size,
                 'k': self.key_id,
                 'c': self.created,
-                'v': [{
-                    'n': v,
-                    'b': self.versions[v][0],
-                    's': self.versions[v][1],
-                } for v in self.list_versions(sorted=True)],
+                'v': [self._serialize_version(v) for v in self.list_versions(sorted=True)],
             }
         e = strng.to_text(self.unicodename, encoding=encoding)
         return '%s %d %d %s\n%s\n%d\n' % (self.path_id, self.type, self.size, self.pack_versions(), e, self.created)
 
+    def _serialize_version(self, version):
+        ret = {
+            'n': version,
+            'b': self.versions[version][0],
+            's': self.versions[version][1],
+        }
+        if self.version_refs.get(version):
+            ret['r'] = self.version_refs[version]
+        return ret
+
     def unserialize(self, src, decoding='utf-8', from_json=False):
         if from_json:
             try:
@@ -600,6 +686,7 @@ class FSItemInfo():
                 self.created = int(src.get('c') or utime.get_sec1970())
                 self.key_id = my_keys.latest_key_id(strng.to_text(src['k'], encoding=decoding))
                 self.versions = {strng.to_text(v['n']): [v['b'], v['s']] for v in src['v']}
+                self.version_refs = {strng.to_text(v['n']): [strng.to_text(r) for r in v['r']] for v in src['v'] if v.get('r')}
             except:
                 lg.exc()
                 raise KeyError('Incorrect item format:\n%s' % src)
@@ -724,6 +811,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
             iter[ii.name()] = {0: id}
             # also save index from opposite side
             iterID[id] = {INFO_KEY: ii}
+            _changed(ii)
         else:
             # get an existing ID from the index
             id = iter[name][0]
@@ -744,6 +832,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
         ii.read_stats(path)
     iter[ii.name()] = id
     iterID[id] = ii
+    _changed(ii)
     # finally make a complete backup id - this a relative path to the backed up file
     return resultID, ii, iter, iterID
 
@@ -784,6 +873,7 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None, force_pa
                 ii.read_stats(p)
             iter[ii.name()] = {0: id}
             iterID[id] = {INFO_KEY: ii}
+            _changed(ii)
         else:
             id = iter[name][0]
             resultID += '/' + str(id)
@@ -793,7 +883,8 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None, force_pa
         if i == len(parts) - 1:
             if iterID[INFO_KEY].type != DIR:
                 lg.warn('not a dir: %s' % iterID[INFO_KEY])
-            iterID[INFO_KEY].type = DIR
+                iterID[INFO_KEY].type = DIR
+                _changed(iterID[INFO_KEY])
     return resultID.lstrip('/'), ii, iter, iterID
 
 
@@ -820,6 +911,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     if read_stats:
                         ii.read_stats(p)
                     iterID[id] = {INFO_KEY: ii}
+                    _changed(ii)
                     lastID = id
                 else:
                     id = iter[name][0]
@@ -831,6 +923,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     ii.read_stats(p)
                 iter[ii.name()] = id
                 iterID[id] = ii
+                _changed(ii)
                 c += 1
                 lastID = id
         return c
@@ -865,6 +958,7 @@ def PutItem(name, parent_path_id, as_folder=False, iter=None, iterID=None, key_i
     ii = FSItemInfo(name=remote_path, path_id=resultID, typ=typ, key_id=key_id)
     iter[ii.name()] = newItemID
     iterID[newItemID] = ii
+    _changed(ii)
     return resultID, ii, iter, iterID
 
 
@@ -896,13 +990,17 @@ def SetFile(item, customer_idurl=None, force_replace_existing=False):
                         raise FileSystemItemAlreadyExists(existing_fs_item)
                     iter[itemname] = id
                     iterID[id] = item
+                    _changed(existing_fs_item)
+                    _changed(item)
             else:
                 iter[itemname] = id
                 iterID[id] = item
+                _changed(item)
                 return True, True
             if item.pack_versions() == iterID[id].pack_versions():
                 return True, False
             iterID[id] = item
+            _changed(item)
             lg.warn('updated list of versions for %r' % item)
             return True, True
         found = False
@@ -955,6 +1053,7 @@ def SetDir(item, customer_idurl=None, force_replace_existing=False):
             if not cur_item:
                 modified = True
             iterID[id][INFO_KEY] = item
+            _changed(item)
             return True, modified
         found = False
         for name in iter.keys():
@@ -1105,7 +1204,7 @@ def DeleteByID(pathID, iter=None, iterID=None):
         if name not in iter:
             raise Exception('can not found target name in the index')
         if j == len(parts) - 1:
-            iterID.pop(id)
+            _changed(iterID.pop(id))
             iter.pop(name)
             return path
         iterID = iterID[id]
@@ -1127,7 +1226,7 @@ def DeleteByPath(path, iter=None, iterID=None):
     if ppath in iter:
         path_id = iter[ppath]
         iter.pop(ppath)
-        iterID.pop(path_id)
+        _changed(iterID.pop(path_id))
         return str(path_id)
     for j in range(len(parts)):
         name = parts[j]
@@ -1149,7 +1248,7 @@ def DeleteByPath(path, iter=None, iterID=None):
             raise Exception('can not found target ID in the index')
         if j == len(parts) - 1:
             iter.pop(name)
-            iterID.pop(id)
+            _changed(iterID.pop(id))
             return path_id.lstrip('/')
         iter = iter[name]
         iterID = iterID[id]
@@ -1825,66 +1924,72 @@ def ScanID(pathID, basedir=None, customer_idurl=None, key_alias='master'):
 
 def Calculate(customer_idurl=None, key_alias='master'):
     """
-    Scan all items in the index and calculate folder and backups sizes.
+    Scan items in the index and calculate folder and backups sizes.
+
+    Totals of every folder are cached, only folders with changed items inside are visited again.
     """
     if customer_idurl is None:
         customer_idurl = my_id.getIDURL()
     customer_idurl = id_url.field(customer_idurl)
-    val = {
-        'items': 0,
-        'files': 0,
-        'folders': 0,
-        'size_files': 0,
-        'size_folders': 0,
-        'size_backups': 0,
-    }
-
-    def recursive_calculate(i):
+    changes = _pending_changes('calc', customer_idurl, key_alias, reset=False)
+    folders = _Folders.setdefault((customer_idurl, key_alias), {})
+    stale = None
+    if changes is None:
+        folders.clear()
+    else:
+        stale = set()
+        for path_id in changes:
+            parts = path_id.split('/')
+            for j in range(len(parts) + 1):
+                stale.add('/'.join(parts[:j]))
+
+    def count_item(item, val):
+        # val: items, files, folders, size_files, size_folders, size_backups
+        if item.type == FILE:
+            val[1] += 1
+            if item.exist():
+                val[3] += item.size
+        if item.type == DIR:
+            val[2] += 1
+            if item.exist():
+                val[4] += item.size
+        for version in item.list_versions():
+            versionSize = item.get_version_info(version)[1]
+            if versionSize > 0:
+                val[5] += versionSize
+        val[0] += 1
+
+    def recursive_calculate(i, path_id):
+        if stale is not None and path_id not in stale and path_id in folders:
+            return folders[path_id]
         folder_size = 0
+        val = [0, 0, 0, 0, 0, 0]
         for id in i.keys():
             if id == INFO_KEY:
                 continue
             if isinstance(i[id], FSItemInfo):
                 if i[id].exist():
                     folder_size += i[id].size
-                if i[id].type == FILE:
-                    val['files'] += 1
-                    if i[id].exist():
-                        val['size_files'] += i[id].size
-                if i[id].type == DIR:
-                    val['folders'] += 1
-                    if i[id].exist():
-                        val['size_folders'] += i[id].size
-                for version in i[id].list_versions():
-                    versionSize = i[id].get_version_info(version)[1]
-                    if versionSize > 0:
-                        val['size_backups'] += versionSize
-                val['items'] += 1
+                count_item(i[id], val)
             elif isinstance(i[id], dict):
-                sub_folder_size = recursive_calculate(i[id])
+                sub_folder_size, sub_val = recursive_calculate(i[id], (path_id + '/' + str(id)) if path_id else str(id))
                 if sub_folder_size != -1:
                     folder_size += sub_folder_size
+                for j in range(len(val)):
+                    val[j] += sub_val[j]
             else:
                 raise Exception('wrong item type in the index')
         if INFO_KEY in i:
-            i[INFO_KEY].size = folder_size
-            if i[INFO_KEY].type == FILE:
-                val['files'] += 1
-                if i[INFO_KEY].exist():
-                    val['size_files'] += i[INFO_KEY].size
-            if i[INFO_KEY].type == DIR:
-                val['folders'] += 1
-                if i[INFO_KEY].exist():
-                    val['size_folders'] += i[INFO_KEY].size
-            for version in i[INFO_KEY].list_versions():
-                versionSize = i[INFO_KEY].get_version_info(version)[1]
-                if versionSize > 0:
-                    val['size_backups'] += versionSize
-            val['items'] += 1
-        return folder_size
+            i[INFO_KEY].set_size(folder_size)
+            count_item(i[INFO_KEY], val)
+        folders[path_id] = (folder_size, val)
+        return folder_size, val
 
     iterID = fsID(customer_idurl=customer_idurl, key_alias=key_alias)
-    ret = recursive_calculate(iterID)
+    ret, totals = recursive_calculate(iterID, '')
+    # sizes of folders were just updated, that is already counted
+    _pending_changes('calc', customer_idurl, key_alias)
+    val = dict(zip(('items', 'files', 'folders', 'size_files', 'size_folders', 'size_backups'), totals))
     set_stat(val, customer_idurl=customer_idurl, key_alias=key_alias)
 
     if _Debug:
@@ -1901,6 +2006,7 @@ def Clear(customer_idurl, key_alias=None):
     """
     fs(customer_idurl, key_alias).clear()
     fsID(customer_idurl, key_alias).clear()
+    _forget_changes(id_url.field(customer_idurl), key_alias)
     # forget(customer_idurl, key_alias)
 
 
@@ -1911,6 +2017,9 @@ def ClearAllIndexes():
     _FileSystemIndexByID.clear()
     _FileSystemIndexByName.clear()
     _RevisionNumber.clear()
+    _Changes.clear()
+    _Journals.clear()
+    _Folders.clear()
 
 
 #------------------------------------------------------------------------------
@@ -2100,30 +2209,93 @@ def UnserializeIndex(json_data, customer_idurl=None, new_revision=None, deleted_
 
 
 def SaveIndex(customer_idurl=None, key_alias='master', encoding='utf-8'):
+    """
+    Writes changed items of the catalog to the journal of the index file,
+    whole catalog is written only for the first time.
+    """
     if customer_idurl is None:
         customer_idurl = my_id.getIDURL()
     customer_idurl = id_url.field(customer_idurl)
     customer_id = customer_idurl.to_id()
-    index_file_path = settings.BackupIndexFilePath(customer_idurl, key_alias)
-    if not os.path.isdir(os.path.dirname(index_file_path)):
-        os.makedirs(os.path.dirname(index_file_path))
-    json_data = {}
-    json_data[customer_id] = SerializeIndex(
-        customer_idurl=customer_idurl,
-        key_alias=key_alias,
-        encoding=encoding,
-    )
+    journal = _Journals.get((customer_idurl, key_alias))
+    if journal is None:
+        journal = index_journal.IndexJournal(settings.BackupIndexFilePath(customer_idurl, key_alias), customer_id, key_alias)
+        _Journals[(customer_idurl, key_alias)] = journal
+    changes = _pending_changes('save', customer_idurl, key_alias)
+    iterID = fsID(customer_idurl, key_alias)
     rev = revision(customer_idurl, key_alias)
-    src = '%d\n' % rev
-    src += jsn.dumps(
-        json_data,
-        indent=1,
-        separators=(',', ':'),
-        encoding=encoding,
-    )
+
+    def _serialize(info):
+        return jsn.dumps(info.serialize(encoding=encoding, to_json=True), separators=(',', ':'), encoding=encoding)
+
+    if changes is None:
+        items = {}
+
+        def _one_item(path_id, path, info):
+            items[path_id] = _serialize(info)
+
+        TraverseByID(_one_item, iterID=iterID)
+        if _Debug:
+            lg.args(_DebugLevel, rev=rev, c=customer_id, k=key_alias, items=len(items), path=journal.index_file_path)
+        return journal.rewrite(rev, items)
+    updated = {}
+    removed = []
+    for path_id in changes:
+        info = GetByID(path_id, iterID=iterID)
+        if info is None:
+            removed.append(path_id)
+        else:
+            updated[path_id] = _serialize(info)
     if _Debug:
-        lg.args(_DebugLevel, rev=rev, c=customer_id, k=key_alias, sz=len(src), path=index_file_path)
-    return bpio.WriteTextFile(index_file_path, src)
+        lg.args(_DebugLevel, rev=rev, c=customer_id, k=key_alias, updated=len(updated), removed=len(removed))
+    return journal.update(rev, updated, removed)
+
+
+def IndexFileData(customer_idurl=None, key_alias='master'):
+    """
+    Returns content of the index file to be sent to suppliers, the journal is merged into the file first.
+    """
+    if customer_idurl is None:
+        customer_idurl = my_id.getIDURL()
+    customer_idurl = id_url.field(customer_idurl)
+    journal = _Journals.get((customer_idurl, key_alias))
+    if journal is None:
+        SaveIndex(customer_idurl, key_alias)
+    else:
+        journal.compact()
+    return bpio.ReadBinaryFile(settings.BackupIndexFilePath(customer_idurl, key_alias))
+
+
+def IndexFileItems(customer_idurl=None, key_alias='master'):
+    """
+    Returns revision and serialized items of the catalog exactly as they were saved to the index file and the journal.
+    Used to prepare changes for suppliers which already have previous copy of the index file.
+    """
+    if customer_idurl is None:
+        customer_idurl = my_id.getIDURL()
+    customer_idurl = id_url.field(customer_idurl)
+    journal = _Journals.get((customer_idurl, key_alias))
+    if journal is None:
+        SaveIndex(customer_idurl, key_alias)
+        journal = _Journals[(customer_idurl, key_alias)]
+    return journal.revision, journal.items
+
+
+def PackIndexFile(data):
+    """
+    Compressed content of the index file, the catalog is a JSON text which compresses very well.
+    """
+    return INDEX_FILE_COMPRESSED + zlib.compress(strng.to_bin(data), 6)
+
+
+def UnpackIndexFile(data):
+    """
+    Returns original content of the index file received from supplier, uncompressed files are returned as they are.
+    """
+    data = strng.to_bin(data)
+    if data.startswith(INDEX_FILE_COMPRESSED):
+        return zlib.decompress(data[len(INDEX_FILE_COMPRESSED):])
+    return data
 
 
 def ReadIndex(text_data, new_revision=None, deleted_path_ids=[], encoding='utf-8'):
@@ -2180,6 +2352,7 @@ def LoadIndex(index_file_path):
         return False
     raw_data = inpt.read()
     inpt.close()
+    new_revision, raw_data = index_journal.replay(index_file_path, new_revision, raw_data)
     count, _ = ReadIndex(raw_data, new_revision=new_revision)
     if not count:
         return False
@@ -2191,6 +2364,8 @@ def LoadAllIndexes():
     if not os.path.isdir(index_dir_path):
         os.makedirs(index_dir_path)
     for key_id in os.listdir(index_dir_path):
+        if index_journal.is_journal_file(key_id):
+            continue
         if my_keys.latest_key_id(key_id) != key_id:
             lg.warn('ignore old index file for rotated identity: %r' % key_id)
             continue
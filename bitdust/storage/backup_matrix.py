@@ -363,6 +363,9 @@ def process_line_file(line, current_key_alias=None, customer_idurl=None, is_in_s
         pth = line
         filesz = -1
     path_id = pth.strip('/')
+    if path_id == settings.BackupIndexDeltaFileName():
+        # changes of the index file stored on supplier, it is not an item of the catalog
+        return modified, paths2remove
     if auto_create and is_in_sync:
         if (path_id != settings.BackupIndexFileName() and not packetid.IsIndexFileName(path_id)) and path_id not in ignored_path_ids:
             if not backup_fs.IsFileID(pth, iterID=backup_fs.fsID(customer_idurl, current_key_alias)):
@@ -42,13 +42,17 @@ _DebugLevel = 10
 
 import os
 import sys
+import threading
+
 from io import open
+from collections import deque
 
 #------------------------------------------------------------------------------
 
 from twisted.internet import reactor  # @UnresolvedImport
 from twisted.internet import threads
 from twisted.internet.defer import Deferred
+from twisted.python.threadable import isInIOThread
 
 #------------------------------------------------------------------------------
 
@@ -69,25 +73,45 @@ BYTES_LOOP_EMPTY = 0
 BYTES_LOOP_READY2READ = 1
 BYTES_LOOP_CLOSED = 2
 
+# Producer thread is blocked when that many bytes are waiting to be read
+BYTES_LOOP_HIGH_WATER_MARK = 16*1024*1024
+
 #------------------------------------------------------------------------------
 
 
+class BytesLoopClosed(Exception):
+    pass
+
+
 class BytesLoop:
 
-    def __init__(self, s=b''):
-        self._buffer = s
+    """
+    A pipe between the thread producing the stream and the reader in the main thread.
+    Written chunks are kept as they are in a queue and only sliced with `memoryview` when reading,
+    so every byte is copied at most once. The producer thread is blocked in `write()` while
+    more than `high_water_mark` bytes are waiting to be read.
+    """
+
+    def __init__(self, s=b'', high_water_mark=BYTES_LOOP_HIGH_WATER_MARK):
+        self._chunks = deque()
+        self._size = 0
         self._reader = None
         self._last_read = -1
         self._finished = False
         self._closed = False
+        self._high_water_mark = high_water_mark
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        if s:
+            self._append(s)
 
     def read_defer(self, n=-1):
         if self._reader:
             raise Exception('already reading')
         if _Debug:
-            lg.args(_DebugLevel, n=n, b=len(self._buffer), f=self._finished)
+            lg.args(_DebugLevel, n=n, b=self._size, f=self._finished)
         self._reader = (Deferred(), n)
-        if len(self._buffer) > 0:
+        if self._size > 0:
             chunk = self.read(n=n)
             d = self._reader[0]
             self._reader = None
@@ -97,43 +121,86 @@ class BytesLoop:
             chunk = b''
             d = self._reader[0]
             self._reader = None
-            if len(self._buffer) > 0:
+            if self._size > 0:
                 chunk = self.read(n=n)
             reactor.callFromThread(d.callback, chunk)  # @UndefinedVariable
             return d
         return self._reader[0]
 
     def read(self, n=-1):
-        before_bytes = len(self._buffer)
-        chunk = self._buffer[:n]
-        self._buffer = self._buffer[n:]
-        after_bytes = len(self._buffer)
+        before_bytes = self._size
+        if n is None or n < 0 or n >= self._size:
+            parts = list(self._chunks)
+            self._chunks.clear()
+        else:
+            parts = []
+            while n > 0:
+                head = self._chunks[0]
+                if len(head) <= n:
+                    parts.append(self._chunks.popleft())
+                    n -= len(head)
+                else:
+                    head = memoryview(head)
+                    parts.append(head[:n])
+                    self._chunks[0] = head[n:]
+                    n = 0
+        if len(parts) == 1 and isinstance(parts[0], bytes):
+            chunk = parts[0]
+        else:
+            chunk = b''.join(parts)
+        self._size -= len(chunk)
         self._last_read = len(chunk)
+        self._release(len(chunk))
         if _Debug:
-            lg.args(_DebugLevel, before_bytes=before_bytes, after_bytes=after_bytes, chunk_bytes=len(chunk))
+            lg.args(_DebugLevel, before_bytes=before_bytes, after_bytes=self._size, chunk_bytes=len(chunk))
         return chunk
 
     def write(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        with self._pending_changed:
+            if not isInIOThread():
+                while self._pending >= self._high_water_mark and not self._closed:
+                    self._pending_changed.wait(1.0)
+            if self._closed:
+                raise BytesLoopClosed('stream was closed')
+            self._pending += len(chunk)
         reactor.callFromThread(self._write, chunk)  # @UndefinedVariable
 
     def _write(self, chunk):
-        self._buffer += chunk
+        if self._closed:
+            return
+        self._append(chunk)
         if _Debug:
-            lg.args(_DebugLevel, buffer_bytes=len(self._buffer), chunk_bytes=len(chunk))
-        if len(self._buffer) > 0:
+            lg.args(_DebugLevel, buffer_bytes=self._size, chunk_bytes=len(chunk))
+        if self._size > 0:
             if self._reader:
                 chunk = self.read(n=self._reader[1])
                 d = self._reader[0]
                 self._reader = None
                 reactor.callFromThread(d.callback, chunk)  # @UndefinedVariable
 
+    def _append(self, chunk):
+        if chunk:
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+
+    def _release(self, size):
+        with self._pending_changed:
+            self._pending = max(0, self._pending - size)
+            self._pending_changed.notify_all()
+
     def close(self):
         if self._reader:
             d = self._reader[0]
             self._reader = None
             reactor.callFromThread(d.callback, b'')  # @UndefinedVariable
-        self._closed = True
-        self._buffer = b''
+        with self._pending_changed:
+            self._closed = True
+            self._pending = 0
+            self._pending_changed.notify_all()
+        self._chunks.clear()
+        self._size = 0
 
     def kill(self):
         self.close()
@@ -144,7 +211,7 @@ class BytesLoop:
             d, n = self._reader
             self._reader = None
             chunk = b''
-            if len(self._buffer) > 0:
+            if self._size > 0:
                 chunk = self.read(n=n)
             if d.called:
                 lg.warn('stream was finished with unread data left, but receiver is not ready')
@@ -153,10 +220,10 @@ class BytesLoop:
 
     def state(self):
         if _Debug:
-            lg.args(_DebugLevel, b=len(self._buffer), c=self._closed, f=self._finished, l=self._last_read, r=bool(self._reader))
+            lg.args(_DebugLevel, b=self._size, c=self._closed, f=self._finished, l=self._last_read, r=bool(self._reader))
         if self._closed:
             return BYTES_LOOP_CLOSED
-        if len(self._buffer) > 0:
+        if self._size > 0:
             if self._reader:
                 return BYTES_LOOP_EMPTY
             return BYTES_LOOP_READY2READ
@@ -176,10 +243,12 @@ class BytesLoop:
 #------------------------------------------------------------------------------
 
 
-def backuptarfile_thread(filepath, arcname=None, compress=None):
+def backuptarfile_thread(filepath, arcname=None, compress=None, wrapper=None):
     """
     Makes tar archive of a folder inside a thread.
     Returns `BytesLoop` object instance which can be used to read produced data in parallel.
+    Optional `wrapper` callable receives `BytesLoop` and returns a file-like object to be used by tar instead,
+    it is closed in the same thread after the archive was written, see `backup_dedup.DedupWriter`.
     """
     if not os.path.isfile(filepath):
         lg.err('file %s not found' % filepath)
@@ -190,15 +259,24 @@ def backuptarfile_thread(filepath, arcname=None, compress=None):
 
     def _run():
         from bitdust.storage import tar_file
-        ret = tar_file.writetar(
-            sourcepath=filepath,
-            arcname=arcname,
-            subdirs=False,
-            compression=compress or 'none',
-            encoding='utf-8',
-            fileobj=p,
-        )
-        p.mark_finished()
+        fileobj = p if wrapper is None else wrapper(p)
+        try:
+            ret = tar_file.writetar(
+                sourcepath=filepath,
+                arcname=arcname,
+                subdirs=False,
+                compression=compress or 'none',
+                encoding='utf-8',
+                fileobj=fileobj,
+            )
+            if fileobj is not p:
+                fileobj.close()
+        except BytesLoopClosed:
+            if _Debug:
+                lg.out(_DebugLevel, 'backup_tar.backuptarfile_thread stream was closed before writetar() finished')
+            return None
+        # must be executed in the main thread after all of the written chunks were added to the loop
+        reactor.callFromThread(p.mark_finished)  # @UndefinedVariable
         if _Debug:
             lg.out(_DebugLevel, 'backup_tar.backuptarfile_thread writetar() finished')
         return ret
@@ -207,10 +285,11 @@ def backuptarfile_thread(filepath, arcname=None, compress=None):
     return p
 
 
-def backuptardir_thread(directorypath, arcname=None, recursive_subfolders=True, compress='bz2'):
+def backuptardir_thread(directorypath, arcname=None, recursive_subfolders=True, compress='bz2', wrapper=None):
     """
     Makes tar archive of a single file inside a thread.
     Returns `BytesLoop` object instance which can be used to read produced data in parallel.
+    See `backuptarfile_thread()` about `wrapper` argument.
     """
     if not bpio.pathIsDir(directorypath):
         lg.err('folder %s not found' % directorypath)
@@ -221,15 +300,24 @@ def backuptardir_thread(directorypath, arcname=None, recursive_subfolders=True,
 
     def _run():
         from bitdust.storage import tar_file
-        ret = tar_file.writetar(
-            sourcepath=directorypath,
-            arcname=arcname,
-            subdirs=recursive_subfolders,
-            compression=compress or 'none',
-            encoding='utf-8',
-            fileobj=p,
-        )
-        p.mark_finished()
+        fileobj = p if wrapper is None else wrapper(p)
+        try:
+            ret = tar_file.writetar(
+                sourcepath=directorypath,
+                arcname=arcname,
+                subdirs=recursive_subfolders,
+                compression=compress or 'none',
+                encoding='utf-8',
+                fileobj=fileobj,
+            )
+            if fileobj is not p:
+                fileobj.close()
+        except BytesLoopClosed:
+            if _Debug:
+                lg.out(_DebugLevel, 'backup_tar.backuptardir_thread stream was closed before writetar() finished')
+            return None
+        # must be executed in the main thread after all of the written chunks were added to the loop
+        reactor.callFromThread(p.mark_finished)  # @UndefinedVariable
         if _Debug:
             lg.out(_DebugLevel, 'backup_tar.backuptardir_thread writetar() finished')
         return ret
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# index_journal.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (index_journal.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+"""
+..
+
+module:: index_journal
+
+On-disk copy of a single catalog from ``backup_fs``.
+
+The index file itself is a snapshot of all items, it has the same format as before
+and is sent to suppliers as it is. Items changed after the snapshot was written are
+appended to the ".journal" file next to it, one JSON record per line:
+
+    {"r": <revision>, "s": <serialized item>}
+    {"r": <revision>, "d": <path ID of removed item>}
+    {"r": <revision>}
+
+So saving the catalog costs as much as the change itself. When the journal grows bigger
+than the catalog, or the full index file is needed for suppliers, a new snapshot is written
+from already serialized items and the journal is removed.
+
+A partially written record at the end of the journal (for example after a crash) is ignored.
+
+Suppliers can also keep a delta next to the index file: all changes made after that snapshot,
+see ``make_delta()`` and ``apply_delta()``:
+
+    {"b": <snapshot revision>, "r": <revision>, "d": [<removed path IDs>], "s": [<serialized items>]}
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import json
+
+#------------------------------------------------------------------------------
+
+from bitdust.logs import lg
+
+from bitdust.system import local_fs
+
+#------------------------------------------------------------------------------
+
+JOURNAL_SUFFIX = '.journal'
+
+# journal is merged into the snapshot when it has more records than that and more than items in the catalog
+COMPACT_MIN_RECORDS = 1000
+
+#------------------------------------------------------------------------------
+
+
+def journal_file_path(index_file_path):
+    return index_file_path + JOURNAL_SUFFIX
+
+
+def is_journal_file(filename):
+    return filename.endswith(JOURNAL_SUFFIX)
+
+
+def _depth_order(path_id):
+    # parent folders must be loaded before the items inside
+    return (path_id.count('/'), path_id)
+
+
+def _remove_prefix(items, path_id):
+    removed = False
+    if items.pop(path_id, None) is not None:
+        removed = True
+    prefix = path_id + '/'
+    for p in [p for p in items.keys() if p.startswith(prefix)]:
+        items.pop(p)
+        removed = True
+    return removed
+
+
+#------------------------------------------------------------------------------
+
+
+class IndexJournal(object):
+
+    """
+    Keeps serialized items of the catalog exactly as they were written to disk last time,
+    so only items which are really different are appended to the journal.
+    """
+
+    def __init__(self, index_file_path, customer_id, key_alias):
+        self.index_file_path = index_file_path
+        self.journal_file_path = journal_file_path(index_file_path)
+        self.customer_id = customer_id
+        self.key_alias = key_alias
+        self.items = {}
+        self.revision = -1
+        self.records = 0
+
+    def __repr__(self):
+        return 'IndexJournal(%s$%s rev=%d items=%d records=%d)' % (self.key_alias, self.customer_id, self.revision, len(self.items), self.records)
+
+    def rewrite(self, revision, items):
+        """
+        Replaces all items and writes a new snapshot, ``items`` is a dictionary: path ID -> serialized item.
+        """
+        self.items = dict(items)
+        self.revision = revision
+        return self.compact(force=True)
+
+    def update(self, revision, updated, removed):
+        """
+        Appends changed items to the journal, ``updated`` is a dictionary: path ID -> serialized item,
+        ``removed`` is a list of path IDs, items inside of removed folders are also removed.
+        """
+        lines = []
+        for path_id in removed:
+            if _remove_prefix(self.items, path_id):
+                lines.append('{"r":%d,"d":%s}' % (revision, json.dumps(path_id)))
+        for path_id, text in updated.items():
+            if self.items.get(path_id) == text:
+                continue
+            self.items[path_id] = text
+            lines.append('{"r":%d,"s":%s}' % (revision, text))
+        if not lines and revision != self.revision:
+            lines.append('{"r":%d}' % revision)
+        self.revision = revision
+        if not lines:
+            return True
+        self.records += len(lines)
+        if self.records >= max(COMPACT_MIN_RECORDS, len(self.items)):
+            return self.compact(force=True)
+        try:
+            with open(self.journal_file_path, 'at', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except:
+            lg.exc()
+            return False
+        if _Debug:
+            lg.args(_DebugLevel, j=self, written=len(lines))
+        return True
+
+    def compact(self, force=False):
+        """
+        Writes all items into the index file and removes the journal.
+        """
+        if not force and not self.records:
+            return True
+        if not os.path.isdir(os.path.dirname(self.index_file_path)):
+            os.makedirs(os.path.dirname(self.index_file_path))
+        if not local_fs.WriteTextFile(self.index_file_path, self.snapshot()):
+            lg.err('failed writing index file %r' % self.index_file_path)
+            return False
+        if os.path.isfile(self.journal_file_path):
+            try:
+                os.remove(self.journal_file_path)
+            except:
+                lg.exc()
+                return False
+        self.records = 0
+        if _Debug:
+            lg.args(_DebugLevel, j=self)
+        return True
+
+    def snapshot(self):
+        return '%d\n{%s:{%s:{"items":[\n%s\n]}}}' % (
+            self.revision,
+            json.dumps(self.customer_id),
+            json.dumps(self.key_alias),
+            ',\n'.join(self.items[p] for p in sorted(self.items.keys(), key=_depth_order)),
+        )
+
+
+#------------------------------------------------------------------------------
+
+
+def _read_items(text_data):
+    json_data = json.loads(text_data)
+    customer_id = list(json_data.keys())[0]
+    key_alias = list(json_data[customer_id].keys())[0]
+    items = {}
+    for item in json_data[customer_id][key_alias]['items']:
+        items[item['i']] = item
+    return json_data, customer_id, key_alias, items
+
+
+def _write_items(json_data, customer_id, key_alias, items):
+    json_data[customer_id][key_alias]['items'] = [items[p] for p in sorted(items.keys(), key=_depth_order)]
+    return json.dumps(json_data, ensure_ascii=False)
+
+
+def replay(index_file_path, revision, text_data):
+    """
+    Applies journal records written after the snapshot ``text_data`` was saved.
+    Returns the latest revision and the content of the catalog in the regular index file format.
+    """
+    path = journal_file_path(index_file_path)
+    if not os.path.isfile(path):
+        return revision, text_data
+    try:
+        json_data, customer_id, key_alias, items = _read_items(text_data)
+    except:
+        lg.exc()
+        return revision, text_data
+    count = 0
+    with open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                lg.warn('journal %r is truncated after %d records' % (path, count))
+                break
+            if 's' in record:
+                items[record['s']['i']] = record['s']
+            elif 'd' in record:
+                _remove_prefix(items, record['d'])
+            revision = max(revision, record['r'])
+            count += 1
+    if _Debug:
+        lg.args(_DebugLevel, path=path, records=count, rev=revision, items=len(items))
+    return revision, _write_items(json_data, customer_id, key_alias, items)
+
+
+def make_delta(base_revision, base_items, revision, items):
+    """
+    Returns all changes of the catalog made after the snapshot of ``base_revision`` was written,
+    ``base_items`` and ``items`` are dictionaries: path ID -> serialized item.
+    """
+    updated = [p for p, text in items.items() if base_items.get(p) != text]
+    removed = [p for p in base_items.keys() if p not in items]
+    return '{"b":%d,"r":%d,"d":%s,"s":[\n%s\n]}' % (
+        base_revision,
+        revision,
+        json.dumps(sorted(removed, key=_depth_order)),
+        ',\n'.join(items[p] for p in sorted(updated, key=_depth_order)),
+    )
+
+
+def apply_delta(revision, text_data, delta_data):
+    """
+    Applies the delta created by ``make_delta()`` to the snapshot ``text_data`` of given ``revision``.
+    Returns the latest revision and the content of the catalog in the regular index file format,
+    a delta made for another snapshot is ignored.
+    """
+    try:
+        delta = json.loads(delta_data)
+    except:
+        lg.exc()
+        return revision, text_data
+    if delta.get('b') != revision or delta.get('r', -1) <= revision:
+        if _Debug:
+            lg.dbg(_DebugLevel, 'delta from %r to %r is not matching snapshot revision %r' % (delta.get('b'), delta.get('r'), revision))
+        return revision, text_data
+    try:
+        json_data, customer_id, key_alias, items = _read_items(text_data)
+    except:
+        lg.exc()
+        return revision, text_data
+    for path_id in delta['d']:
+        _remove_prefix(items, path_id)
+    for item in delta['s']:
+        items[item['i']] = item
+    if _Debug:
+        lg.args(_DebugLevel, base=revision, rev=delta['r'], updated=len(delta['s']), removed=len(delta['d']), items=len(items))
+    return delta['r'], _write_items(json_data, customer_id, key_alias, items)
@@ -56,6 +56,15 @@ At first step, index_synchronizer() requests all remote copies of the database f
 When new file arrives from supplier, "backup_control" starts a validation against
 current local index file and update local copy if required.
 On next step index_synchronizer() sends a latest version of index file to all suppliers to hold.
+The index file is compressed before encryption, suppliers which already acked
+or reported the latest revision are skipped.
+
+Suppliers which announced "index-delta" capability in their identity and already hold
+the latest checkpoint (a full copy of the index file) receive only a delta - all changes
+made after that checkpoint. The supplier keeps the delta next to the index file and
+both are requested and merged together when the index is restored.
+A new checkpoint is uploaded every ``CHECKPOINT_REVISIONS`` revisions or when the delta
+is getting too big comparing to the full index file.
 
 The backup_monitor() machine should be restarted every one hour
 or every time when your files were changed.
@@ -90,6 +99,13 @@ _DebugLevel = 10
 
 #------------------------------------------------------------------------------
 
+DELTA_CAPABILITY = 'index-delta'
+
+CHECKPOINT_REVISIONS = 50
+CHECKPOINT_DELTA_RATIO = 0.3
+
+#------------------------------------------------------------------------------
+
 import time
 
 from twisted.internet import reactor  # @UnresolvedImport
@@ -108,8 +124,6 @@ from bitdust.p2p import online_status
 from bitdust.p2p import p2p_service
 from bitdust.p2p import propagate
 
-from bitdust.system import bpio
-
 from bitdust.userid import my_id
 from bitdust.userid import global_id
 
@@ -208,6 +222,14 @@ class IndexSynchronizer(automat.Automat):
         self.sent_suppliers_number = 0
         self.outgoing_packets_ids = []
         self.last_time_in_sync = -1
+        self.suppliers_revisions = {}
+        self.sending_revision = -1
+        self.sending_kinds = {}
+        self.checkpoint_revision = -1
+        self.checkpoint_items = None
+        self.checkpoint_size = 0
+        self.suppliers_checkpoints = {}
+        self.received_index_packets = {}
         self.PushAgain = False
 
     def state_changed(self, oldstate, newstate, event, *args, **kwargs):
@@ -366,6 +388,7 @@ class IndexSynchronizer(automat.Automat):
         self.requesting_suppliers.clear()
         self.requested_suppliers_number = 0
         self.requests_packets_sent = []
+        self.received_index_packets.clear()
         if self.ping_required:
             propagate.ping_suppliers().addBoth(self._do_retrieve)
             self.ping_required = False
@@ -376,27 +399,14 @@ class IndexSynchronizer(automat.Automat):
         """
         Action method.
         """
-        packetID = global_id.MakeGlobalID(
-            customer=my_id.getGlobalID(key_alias='master'),
-            path=packetid.MakeIndexFileNamePacketID(),
-        )
         self.sending_suppliers.clear()
         self.outgoing_packets_ids = []
         self.sent_suppliers_number = 0
-        localID = my_id.getIDURL()
-        data = bpio.ReadBinaryFile(settings.BackupIndexFilePath())
-        b = encrypted.Block(
-            CreatorID=localID,
-            BackupID=packetID,
-            BlockNumber=0,
-            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-            SessionKeyType=key.SessionKeyType(),
-            LastBlock=True,
-            Data=data,
-        )
-        Payload = b.Serialize()
-        if _Debug:
-            lg.args(_DebugLevel, pid=packetID, sz=len(data), payload=len(Payload), length=b.Length)
+        self.sending_kinds.clear()
+        from bitdust.storage import backup_fs
+        self.sending_revision, items = backup_fs.IndexFileItems()
+        suppliers = []
+        up_to_date = 0
         for supplier_idurl in contactsdb.suppliers():
             if not supplier_idurl:
                 continue
@@ -405,24 +415,32 @@ class IndexSynchronizer(automat.Automat):
                 continue
             if online_status.isOffline(supplier_idurl):
                 continue
-            newpacket, pkt_out = p2p_service.SendData(
-                raw_data=Payload,
-                ownerID=localID,
-                creatorID=localID,
-                remoteID=supplier_idurl,
-                packetID=packetID,
-                callbacks={
-                    commands.Ack(): self._on_supplier_acked,
-                    commands.Fail(): self._on_supplier_acked,
-                },
-            )
-            if pkt_out:
-                self.sending_suppliers.add(supplier_idurl)
-                self.sent_suppliers_number += 1
-                if newpacket.PacketID not in self.outgoing_packets_ids:
-                    self.outgoing_packets_ids.append(newpacket.PacketID)
+            if self.suppliers_revisions.get(supplier_idurl) == self.sending_revision:
+                up_to_date += 1
+                continue
+            suppliers.append(supplier_idurl)
+        if not suppliers and up_to_date:
             if _Debug:
-                lg.out(_DebugLevel, '    %s sending to %s' % (newpacket, nameurl.GetName(supplier_idurl)))
+                lg.dbg(_DebugLevel, 'all %d suppliers already have revision %d' % (up_to_date, self.sending_revision))
+            reactor.callLater(0, self.automat, 'all-acked')  # @UndefinedVariable
+            return
+        delta_suppliers = [s for s in suppliers if self._is_delta_allowed(s)]
+        delta_data = None
+        if delta_suppliers:
+            delta_data = self._make_delta(items)
+        full_data = None
+        if delta_data is None:
+            delta_suppliers = []
+            full_data = self._make_checkpoint(items)
+        elif len(delta_suppliers) < len(suppliers):
+            full_data = backup_fs.PackIndexFile(backup_fs.IndexFileData())
+        if _Debug:
+            lg.args(_DebugLevel, rev=self.sending_revision, checkpoint=self.checkpoint_revision, suppliers=len(suppliers), delta_suppliers=len(delta_suppliers))
+        if delta_suppliers:
+            self._send_data(delta_data, packetid.MakeIndexDeltaFileNamePacketID(), delta_suppliers, 'delta')
+        full_suppliers = [s for s in suppliers if s not in delta_suppliers]
+        if full_suppliers:
+            self._send_data(full_data, packetid.MakeIndexFileNamePacketID(), full_suppliers, 'full')
 
     def doCancelSendings(self, *args, **kwargs):
         """
@@ -477,10 +495,40 @@ class IndexSynchronizer(automat.Automat):
             lg.err('incoming Data() is not valid')
             return
         supplier_idurl = wrapped_packet.RemoteID
+        if self._is_delta_supported(supplier_idurl) and supplier_idurl not in self.received_index_packets:
+            # the supplier may also hold changes made after that index file was uploaded
+            self.received_index_packets[supplier_idurl] = (newpacket, wrapped_packet)
+            self._do_retrieve_delta(supplier_idurl)
+            return
+        self._do_process_index(newpacket, wrapped_packet)
+
+    def _on_supplier_delta_response(self, newpacket, info):
+        wrapped_delta = signed.Unserialize(newpacket.Payload)
+        if not wrapped_delta or not wrapped_delta.Valid():
+            lg.err('incoming Data() is not valid')
+            wrapped_delta = None
+        supplier_idurl = newpacket.CreatorID
+        if supplier_idurl not in self.received_index_packets:
+            return
+        index_newpacket, wrapped_packet = self.received_index_packets.pop(supplier_idurl)
+        self._do_process_index(index_newpacket, wrapped_packet, wrapped_delta)
+
+    def _on_supplier_delta_fail(self, newpacket, info):
+        supplier_idurl = newpacket.remote_idurl if info == 'timeout' else newpacket.CreatorID
+        if _Debug:
+            lg.args(_DebugLevel, newpacket=newpacket, info=info, supplier=supplier_idurl)
+        if supplier_idurl not in self.received_index_packets:
+            return
+        index_newpacket, wrapped_packet = self.received_index_packets.pop(supplier_idurl)
+        self._do_process_index(index_newpacket, wrapped_packet)
+
+    def _do_process_index(self, newpacket, wrapped_packet, wrapped_delta=None):
+        supplier_idurl = wrapped_packet.RemoteID
         from bitdust.storage import backup_control
-        supplier_revision = backup_control.IncomingSupplierBackupIndex(wrapped_packet)
+        supplier_revision = backup_control.IncomingSupplierBackupIndex(wrapped_packet, delta_packet=wrapped_delta)
         self.requesting_suppliers.discard(supplier_idurl)
         if supplier_revision is not None:
+            self.suppliers_revisions[supplier_idurl] = supplier_revision
             reactor.callLater(0, self.automat, 'index-file-received', (newpacket, supplier_revision))  # @UndefinedVariable
         if _Debug:
             lg.out(_DebugLevel, 'index_synchronizer._on_supplier_response %s from %r, rev:%s, pending: %d, total: %d' % (newpacket, supplier_idurl, supplier_revision, len(self.requesting_suppliers), self.requested_suppliers_number))
@@ -492,6 +540,7 @@ class IndexSynchronizer(automat.Automat):
             lg.args(_DebugLevel, newpacket=newpacket)
         supplier_idurl = newpacket.CreatorID
         self.requesting_suppliers.discard(supplier_idurl)
+        self.suppliers_revisions.pop(supplier_idurl, None)
         if _Debug:
             lg.out(_DebugLevel, 'index_synchronizer._on_supplier_fail %s from %r, pending: %d, total: %d' % (newpacket, supplier_idurl, len(self.requesting_suppliers), self.requested_suppliers_number))
         if len(self.requesting_suppliers) == 0:
@@ -499,6 +548,13 @@ class IndexSynchronizer(automat.Automat):
 
     def _on_supplier_acked(self, newpacket, info):
         self.sending_suppliers.discard(newpacket.OwnerID)
+        if newpacket.Command == commands.Ack():
+            self.suppliers_revisions[newpacket.OwnerID] = self.sending_revision
+            if self.sending_kinds.get(newpacket.OwnerID) == 'full':
+                self.suppliers_checkpoints[newpacket.OwnerID] = self.sending_revision
+        else:
+            self.suppliers_revisions.pop(newpacket.OwnerID, None)
+            self.suppliers_checkpoints.pop(newpacket.OwnerID, None)
         # if newpacket.PacketID in self.outgoing_packets_ids:
         #     self.outgoing_packets_ids.remove(newpacket.PacketID)
         sc = supplier_connector.by_idurl(newpacket.OwnerID)
@@ -542,3 +598,101 @@ class IndexSynchronizer(automat.Automat):
                 self.requests_packets_sent.append((packetID, supplier_idurl))
             if _Debug:
                 lg.dbg(_DebugLevel, '%s sending to %s' % (pkt_out, nameurl.GetName(supplier_idurl)))
+
+    def _do_retrieve_delta(self, supplier_idurl):
+        packetID = global_id.MakeGlobalID(
+            customer=my_id.getGlobalID(key_alias='master'),
+            path=packetid.MakeIndexDeltaFileNamePacketID(),
+        )
+        localID = my_id.getIDURL()
+        pkt_out = p2p_service.SendRetreive(
+            ownerID=localID,
+            creatorID=localID,
+            packetID=packetID,
+            remoteID=supplier_idurl,
+            response_timeout=settings.P2PTimeOut(),
+            callbacks={
+                commands.Data(): self._on_supplier_delta_response,
+                commands.Fail(): self._on_supplier_delta_fail,
+                'timeout': self._on_supplier_delta_fail,
+            },
+        )
+        if not pkt_out:
+            index_newpacket, wrapped_packet = self.received_index_packets.pop(supplier_idurl)
+            self._do_process_index(index_newpacket, wrapped_packet)
+        if _Debug:
+            lg.dbg(_DebugLevel, '%s sending to %s' % (pkt_out, nameurl.GetName(supplier_idurl)))
+
+    def _send_data(self, data, path, suppliers, kind):
+        packetID = global_id.MakeGlobalID(
+            customer=my_id.getGlobalID(key_alias='master'),
+            path=path,
+        )
+        localID = my_id.getIDURL()
+        b = encrypted.Block(
+            CreatorID=localID,
+            BackupID=packetID,
+            BlockNumber=0,
+            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
+            SessionKeyType=key.SessionKeyType(),
+            LastBlock=True,
+            Data=data,
+        )
+        Payload = b.Serialize()
+        if _Debug:
+            lg.args(_DebugLevel, pid=packetID, rev=self.sending_revision, sz=len(data), payload=len(Payload), length=b.Length, suppliers=len(suppliers))
+        for supplier_idurl in suppliers:
+            newpacket, pkt_out = p2p_service.SendData(
+                raw_data=Payload,
+                ownerID=localID,
+                creatorID=localID,
+                remoteID=supplier_idurl,
+                packetID=packetID,
+                callbacks={
+                    commands.Ack(): self._on_supplier_acked,
+                    commands.Fail(): self._on_supplier_acked,
+                },
+            )
+            if pkt_out:
+                self.sending_suppliers.add(supplier_idurl)
+                self.sent_suppliers_number += 1
+                self.sending_kinds[supplier_idurl] = kind
+                if newpacket.PacketID not in self.outgoing_packets_ids:
+                    self.outgoing_packets_ids.append(newpacket.PacketID)
+            if _Debug:
+                lg.out(_DebugLevel, '    %s sending to %s' % (newpacket, nameurl.GetName(supplier_idurl)))
+
+    def _is_delta_supported(self, supplier_idurl):
+        if DELTA_CAPABILITY not in my_id.CAPABILITIES:
+            return False
+        supplier_identity = contactsdb.get_contact_identity(supplier_idurl)
+        if not supplier_identity:
+            return False
+        return supplier_identity.hasCapability(DELTA_CAPABILITY)
+
+    def _is_delta_allowed(self, supplier_idurl):
+        if self.checkpoint_items is None:
+            return False
+        if self.suppliers_checkpoints.get(supplier_idurl) != self.checkpoint_revision:
+            return False
+        return self._is_delta_supported(supplier_idurl)
+
+    def _make_checkpoint(self, items):
+        from bitdust.storage import backup_fs
+        data = backup_fs.PackIndexFile(backup_fs.IndexFileData())
+        self.checkpoint_revision = self.sending_revision
+        self.checkpoint_items = dict(items)
+        self.checkpoint_size = len(data)
+        return data
+
+    def _make_delta(self, items):
+        if self.sending_revision <= self.checkpoint_revision:
+            return None
+        if self.sending_revision - self.checkpoint_revision > CHECKPOINT_REVISIONS:
+            return None
+        from bitdust.storage import backup_fs
+        from bitdust.storage import index_journal
+        data = backup_fs.PackIndexFile(index_journal.make_delta(self.checkpoint_revision, self.checkpoint_items, self.sending_revision, items))
+        if len(data) > self.checkpoint_size*CHECKPOINT_DELTA_RATIO:
+            return None
+        return data
@@ -42,6 +42,11 @@ import os
 
 #------------------------------------------------------------------------------
 
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+
+#------------------------------------------------------------------------------
+
 from bitdust.logs import lg
 
 from bitdust.main import events
@@ -51,6 +56,8 @@ from bitdust.lib import misc
 from bitdust.system import tmpfile
 
 from bitdust.storage import backup_tar
+from bitdust.storage import backup_dedup
+from bitdust.storage import backup_compress
 from bitdust.storage import backup_matrix
 from bitdust.storage import backup_control
 
@@ -147,7 +154,98 @@ def extract_failed(err, backupID, source_filename, output_location, callback_met
     return err
 
 
-def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_method):
+def decompress_stream(filename, alias):
+    """
+    If the restored file is a compressed stream, decodes it into another temporary file and removes the source.
+    The result is the path of the plain stream.
+    """
+    codec = backup_compress.detect(filename)
+    if not codec:
+        return succeed(filename)
+    if _Debug:
+        lg.args(_DebugLevel, filename=filename, codec=codec)
+    _, plainfilename = tmpfile.make('restore', extension='.tar', prefix=alias + '_', close_fd=True)
+
+    def _on_done(size):
+        tmpfile.throw_out(filename, 'file decompressed')
+        return plainfilename
+
+    def _on_failed(err):
+        tmpfile.throw_out(plainfilename, 'decompress failed')
+        return err
+
+    d = deferToThread(backup_compress.decompress_file, filename, plainfilename)
+    d.addCallbacks(_on_done, _on_failed)
+    return d
+
+
+def restore_references(backupID, packfilename, manifest, keyID=None):
+    """
+    Incremental version keeps only new data, so the versions it refers to are restored one by one
+    and the original ".tar" stream is assembled from all of them.
+    The result is the path of the assembled file.
+    """
+    result = Deferred()
+    alias = backupID.split('$')[0]
+    refs = list(manifest['versions'][1:])
+    packs = {}
+
+    def _cleanup(reason):
+        for filename in packs.values():
+            tmpfile.throw_out(filename, reason)
+
+    def _on_assembled(tarfilename):
+        _cleanup('file assembled')
+        tmpfile.throw_out(packfilename, 'file assembled')
+        result.callback(tarfilename)
+
+    def _on_failed(err):
+        _cleanup('assemble failed')
+        if not result.called:
+            result.errback(err)
+        return None
+
+    def _on_ref_restored(ret, version, fd, filename):
+        try:
+            os.close(fd)
+        except:
+            lg.exc()
+        if ret != 'done':
+            tmpfile.throw_out(filename, 'restore ' + str(ret))
+            _on_failed(Exception('failed to restore referenced version %r: %r' % (version, ret)))
+            return None
+        d = decompress_stream(filename, alias)
+        d.addCallback(_on_ref_ready, version)
+        d.addErrback(_on_failed)
+        return None
+
+    def _on_ref_ready(filename, version):
+        packs[version] = filename
+        _next()
+
+    def _next():
+        if not refs:
+            _, tarfilename = tmpfile.make('restore', extension='.tar', prefix=alias + '_', close_fd=True)
+            d = deferToThread(backup_dedup.assemble, packfilename, packs, tarfilename, manifest)
+            d.addCallback(_on_assembled)
+            d.addErrback(_on_failed)
+            return
+        version = refs.pop(0)
+        refBackupID = backup_dedup.scope_of(backupID) + '/' + version
+        if _Debug:
+            lg.args(_DebugLevel, backup_id=backupID, ref=refBackupID)
+        fd, filename = tmpfile.make('restore', extension='.pack', prefix=alias + '_')
+        from bitdust.storage import restore_worker
+        r = restore_worker.RestoreWorker(refBackupID, fd, KeyID=keyID)
+        r.MyDeferred.addCallback(_on_ref_restored, version, fd, filename)
+        r.MyDeferred.addErrback(_on_failed)
+        r.automat('init')
+
+    _next()
+    return result
+
+
+def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_method, keyID=None):
     global _WorkingBackupIDs
     global _WorkingRestoreProgress
     global OnRestoreDoneFunc
@@ -162,9 +260,13 @@ def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_
     except:
         lg.exc()
     if result == 'done':
-        d = backup_tar.extracttar_thread(tarfilename, outputlocation)
-        d.addCallback(extract_done, backupID, tarfilename, outputlocation, callback_method)
-        d.addErrback(extract_failed, backupID, tarfilename, outputlocation, callback_method)
+        d = decompress_stream(tarfilename, backupID.split('$')[0])
+        d.addCallbacks(
+            callback=_on_stream_ready,
+            callbackArgs=(backupID, outputlocation, callback_method, keyID),
+            errback=extract_failed,
+            errbackArgs=(backupID, tarfilename, outputlocation, callback_method),
+        )
         return d
     _WorkingBackupIDs.pop(backupID, None)
     _WorkingRestoreProgress.pop(backupID, None)
@@ -179,6 +281,27 @@ def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_
     return result
 
 
+def _on_stream_ready(tarfilename, backupID, outputlocation, callback_method, keyID):
+    manifest = backup_dedup.read_manifest(tarfilename)
+    if manifest:
+        d = restore_references(backupID, tarfilename, manifest, keyID=keyID)
+        d.addCallbacks(
+            callback=lambda assembled: _extract(backupID, assembled, outputlocation, callback_method),
+            errback=extract_failed,
+            errbackArgs=(backupID, tarfilename, outputlocation, callback_method),
+        )
+        return d
+    return _extract(backupID, tarfilename, outputlocation, callback_method)
+
+
+def _extract(backupID, tarfilename, outputlocation, callback_method):
+    # older versions were written as ".tar.bz2" by the "tarfile" module itself
+    d = backup_tar.extracttar_thread(tarfilename, outputlocation, mode='r:*')
+    d.addCallback(extract_done, backupID, tarfilename, outputlocation, callback_method)
+    d.addErrback(extract_failed, backupID, tarfilename, outputlocation, callback_method)
+    return d
+
+
 #------------------------------------------------------------------------------
 
 
@@ -197,7 +320,7 @@ def Start(backupID, outputLocation, callback=None, keyID=None):
     )
     from bitdust.storage import restore_worker
     r = restore_worker.RestoreWorker(backupID, outfd, KeyID=keyID)
-    r.MyDeferred.addCallback(restore_done, backupID, outfd, outfilename, outputLocation, callback)
+    r.MyDeferred.addCallback(restore_done, backupID, outfd, outfilename, outputLocation, callback, keyID)
     r.set_block_restored_callback(block_restored_callback)
     r.set_packet_in_callback(packet_in_callback)
     _WorkingBackupIDs[backupID] = r
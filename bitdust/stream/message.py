@@ -63,6 +63,7 @@ from bitdust.lib import utime
 from bitdust.lib import serialization
 from bitdust.lib import jsn
 from bitdust.lib import strng
+from bitdust.lib import bounded
 
 from bitdust.crypt import key
 from bitdust.crypt import my_keys
@@ -76,16 +77,18 @@ from bitdust.userid import global_id
 #------------------------------------------------------------------------------
 
 MAX_PENDING_MESSAGES_PER_CONSUMER = 100
+MAX_RECEIVED_MESSAGES_IDS = 1000
+RECEIVED_MESSAGES_IDS_TTL = 60*10
 
 #------------------------------------------------------------------------------
 
 _ConsumersCallbacks = {}
-_ReceivedMessagesIDs = []
+_ReceivedMessagesIDs = bounded.ExpiringSet(max_size=MAX_RECEIVED_MESSAGES_IDS, max_age=RECEIVED_MESSAGES_IDS_TTL)
 
 _IncomingMessageCallbacks = []
 _OutgoingMessageCallbacks = []
 
-_MessageQueuePerConsumer = {}
+_MessagesQueue = bounded.RingBuffer(capacity=MAX_PENDING_MESSAGES_PER_CONSUMER*2)
 
 _LastUserPingTime = {}
 _PingTrustIntervalSeconds = 60*5
@@ -111,15 +114,21 @@ def shutdown():
 
 
 def received_messages_ids(erase_old_records=False):
+    """
+    Recent incoming packet IDs, used to detect duplicated messages.
+    """
     global _ReceivedMessagesIDs
     if erase_old_records:
-        _ReceivedMessagesIDs = _ReceivedMessagesIDs[50:]
+        _ReceivedMessagesIDs.cleanup()
     return _ReceivedMessagesIDs
 
 
 def message_queue():
-    global _MessageQueuePerConsumer
-    return _MessageQueuePerConsumer
+    """
+    All consumers are reading from one shared ring buffer, every message is stored only once.
+    """
+    global _MessagesQueue
+    return _MessagesQueue
 
 
 def consumers_callbacks():
@@ -345,9 +354,7 @@ def on_incoming_message(request, info, status, error_message):
     if request.PacketID in received_messages_ids():
         lg.warn('skip incoming message %s because found in recent history' % request.PacketID)
         return False
-    received_messages_ids().append(request.PacketID)
-    if len(received_messages_ids()) > 100:
-        received_messages_ids(True)
+    received_messages_ids().add(request.PacketID)
     handled = False
     try:
         for cb in _IncomingMessageCallbacks:
@@ -589,6 +596,7 @@ def consume_messages(consumer_callback_id, callback=None, direction=None, messag
         'direction': direction,
         'message_types': message_types,
     }
+    message_queue().subscribe(consumer_callback_id)
     if _Debug:
         lg.out(_DebugLevel, 'message.consume_messages added callback for consumer %r' % consumer_callback_id)
     do_read()
@@ -601,6 +609,7 @@ def clear_consumer_callbacks(consumer_callback_id, reason=None):
             lg.dbg(_DebugLevel, 'consumer callback %r not regisered' % consumer_callback_id)
         return True
     cb_info = consumers_callbacks().pop(consumer_callback_id)
+    message_queue().unsubscribe(consumer_callback_id)
     if isinstance(cb_info['callback'], Deferred):
         if _Debug:
             lg.args(_DebugLevel, consumer_callback_id=consumer_callback_id, cb=cb_info['callback'], called=cb_info['callback'].called)
@@ -617,23 +626,22 @@ def clear_consumer_callbacks(consumer_callback_id, reason=None):
 
 
 def push_message(direction, msg_type, recipient_id, sender_id, packet_id, owner_idurl, json_message, run_consumers=True):
-    for consumers_callback_id in consumers_callbacks().keys():
-        if consumers_callback_id not in message_queue():
-            message_queue()[consumers_callback_id] = []
-        message_queue()[consumers_callback_id].append(
-            {
-                'type': msg_type,
-                'dir': direction,
-                'to': recipient_id,
-                'from': sender_id,
-                'data': json_message,
-                'packet_id': packet_id,
-                'owner_idurl': owner_idurl,
-                'time': utime.utcnow_to_sec1970(),
-            }
-        )
-        if _Debug:
-            lg.args(_DebugLevel, dir=direction, msg_type=msg_type, to_id=recipient_id, from_id=sender_id, cb=consumers_callback_id, pending=len(message_queue()[consumers_callback_id]))
+    if not message_queue().consumers():
+        return 0
+    message_queue().append(
+        {
+            'type': msg_type,
+            'dir': direction,
+            'to': recipient_id,
+            'from': sender_id,
+            'data': json_message,
+            'packet_id': packet_id,
+            'owner_idurl': owner_idurl,
+            'time': utime.utcnow_to_sec1970(),
+        }
+    )
+    if _Debug:
+        lg.args(_DebugLevel, dir=direction, msg_type=msg_type, to_id=recipient_id, from_id=sender_id, consumers=len(consumers_callbacks()), q=message_queue())
     if not run_consumers:
         return 0
     total_consumed = do_read()
@@ -694,20 +702,37 @@ def push_group_message(json_message, direction, group_key_id, producer_id, seque
 #------------------------------------------------------------------------------
 
 
+def stop_consumer(consumer_id):
+    consumers_callbacks().pop(consumer_id, None)
+    message_queue().unsubscribe(consumer_id)
+
+
+def release_callback(consumer_id):
+    """
+    Consumer remains subscribed and will receive all not yet committed messages after calling `consume_messages()` again.
+    """
+    consumers_callbacks().pop(consumer_id, None)
+
+
 def do_read():
-    known_consumers = list(message_queue().keys())
+    known_consumers = message_queue().consumers()
     total_handled = 0
     for consumer_id in known_consumers:
-        if consumer_id not in message_queue() or len(message_queue()[consumer_id]) == 0:
+        pending_count = message_queue().pending_count(consumer_id)
+        if pending_count == 0:
             continue
         cb_info = consumers_callbacks().get(consumer_id)
-        pending_messages = message_queue()[consumer_id]
-        # no consumer or queue is growing too much -> stop consumer and queue
-        if (not cb_info or not cb_info['callback']) or len(pending_messages) > MAX_PENDING_MESSAGES_PER_CONSUMER:
-            consumers_callbacks().pop(consumer_id, None)
-            message_queue().pop(consumer_id, None)
-            lg.warn('stopped consumer "%s", pending_messages=%d' % (consumer_id, len(pending_messages)))
+        # queue is growing too much -> stop consumer and queue
+        if pending_count > MAX_PENDING_MESSAGES_PER_CONSUMER or message_queue().is_overrun(consumer_id):
+            stop_consumer(consumer_id)
+            lg.warn('stopped consumer "%s", pending_messages=%d' % (consumer_id, pending_count))
+            continue
+        # no callback at the moment -> keep messages until consumer is back
+        if not cb_info or not cb_info['callback']:
+            if _Debug:
+                lg.out(_DebugLevel, 'message.do_read %d messages waiting consuming by "%s", no callback yet' % (pending_count, consumer_id))
             continue
+        pending_messages = message_queue().read(consumer_id)
         # filter messages which consumer is not interested in
         if cb_info['direction']:
             consumer_messages = filter(lambda msg: msg['dir'] == cb_info['direction'], pending_messages)
@@ -717,45 +742,42 @@ def do_read():
             consumer_messages = filter(lambda msg: msg['type'] in cb_info['message_types'], consumer_messages)
         consumer_messages = list(consumer_messages)
         if not consumer_messages:
-            message_queue()[consumer_id] = []
+            message_queue().commit(consumer_id)
             continue
         # callback is a one-time Deferred object, must call it now and release the callback
         if isinstance(cb_info['callback'], Deferred):
             if cb_info['callback'].called:
                 if _Debug:
-                    lg.out(_DebugLevel, 'message.do_read %d messages waiting consuming by "%s", callback state is "called"' % (len(message_queue()[consumer_id]), consumer_id))
-                consumers_callbacks().pop(consumer_id, None)
+                    lg.out(_DebugLevel, 'message.do_read %d messages waiting consuming by "%s", callback state is "called"' % (pending_count, consumer_id))
+                release_callback(consumer_id)
                 continue
             try:
                 cb_result = cb_info['callback'].callback(consumer_messages)
             except:
                 lg.exc()
-                consumers_callbacks().pop(consumer_id, None)
+                # messages are not committed, so consumer can re-try
+                release_callback(consumer_id)
                 continue
             if _Debug:
                 lg.args(_DebugLevel, consumer_id=consumer_id, cb_result=cb_result)
-            consumers_callbacks().pop(consumer_id, None)
-            message_queue()[consumer_id] = []
+            message_queue().commit(consumer_id)
+            release_callback(consumer_id)
             total_handled += len(consumer_messages)
             continue
         # callback is a "callable" method which we must not release
-        message_queue()[consumer_id] = []
         try:
             handled = cb_info['callback'](consumer_messages)
         except:
             lg.exc()
-            consumers_callbacks().pop(consumer_id, None)
-            # put back failed messages to the queue so consumer can re-try
-            message_queue()[consumer_id] = pending_messages
+            # messages are not committed, so the next do_read() will deliver them again
             continue
         if _Debug:
             lg.args(_DebugLevel, handled=handled, cb_info=cb_info)
         if handled is None:
             lg.err('failed consuming messages by consumer %r' % consumer_id)
-            consumers_callbacks().pop(consumer_id, None)
-            # put back failed messages to the queue so consumer can re-try
-            message_queue()[consumer_id] = pending_messages
+            # messages are not committed, so the next do_read() will deliver them again
             continue
+        message_queue().commit(consumer_id)
         if handled:
             total_handled += len(consumer_messages)
     if _Debug:
@@ -37,6 +37,21 @@ Methods to establish a messages queue between two or more nodes.:
     + Global queue ID is unique : queue_alias&alice@somehost.net&bob@anotherhost.com
     + Queue size is limited by a parameter, you can not publish when queue is overloaded
 
+Queue can be backed by a durable on-disk log, see `segmented_log` module.
+In that case every message is first appended to the log and in-memory queue only keeps
+a limited window of messages which are currently being delivered.
+Messages which do not fit into the window are loaded from the log later,
+also after restart - consumers positions are stored in the log as well.
+Positions are written to the disk at most once per `QUEUE_LOG_OFFSETS_SAVE_DELAY` seconds and on shutdown,
+so a few messages can be delivered again after a crash.
+
+Every consumer keeps a read cursor per queue - ID of the latest message it was notified about,
+so looking up next pending messages does not need to walk the whole queue.
+Consumers registered with `batched=True` callback receive up to `MAX_NOTIFICATION_BATCH_SIZE`
+messages (but not more than `MAX_NOTIFICATION_BATCH_BYTES`) in a single call and acknowledge the whole batch.
+Only one notification or batch per consumer per queue can be in progress, notification which was not finished
+in `NOTIFICATION_TIMEOUT` seconds is treated as failed.
+
 """
 
 #------------------------------------------------------------------------------
@@ -53,6 +68,7 @@ _DebugLevel = 10
 
 import sys
 import time
+import bisect
 
 from collections import OrderedDict
 
@@ -81,6 +97,7 @@ from bitdust.lib import packetid
 from bitdust.lib import strng
 from bitdust.lib import jsn
 from bitdust.lib import serialization
+from bitdust.lib import segmented_log
 
 from bitdust.main import events
 
@@ -102,6 +119,16 @@ MAX_CONSUMER_PENDING_MESSAGES = int(MAX_QUEUE_LENGTH/2)
 MIN_PROCESS_QUEUES_DELAY = 0.1
 MAX_PROCESS_QUEUES_DELAY = 2.0
 
+MAX_QUEUE_LOG_SEGMENT_SIZE = 4*1024*1024
+MAX_QUEUE_LOG_SIZE = 64*1024*1024
+MAX_QUEUE_LOG_AGE = 60*60*24*7
+QUEUE_LOG_SYNC_INTERVAL = 1.0
+QUEUE_LOG_OFFSETS_SAVE_DELAY = 0.5
+
+MAX_NOTIFICATION_BATCH_SIZE = 50
+MAX_NOTIFICATION_BATCH_BYTES = 64*1024
+NOTIFICATION_TIMEOUT = 60
+
 #------------------------------------------------------------------------------
 
 _ProcessQueuesDelay = 0.1
@@ -109,6 +136,11 @@ _ProcessQueuesTask = None
 _ProcessQueuesLastTime = 0
 
 _ActiveQueues = {}
+_QueueMessageIDs = {}
+_QueueSubscribers = {}
+_QueueLogs = {}
+_QueueLogPositions = {}
+_SaveOffsetsTask = None
 
 _LastMessageID = None
 
@@ -193,6 +225,7 @@ def stop():
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.stop')
     global _ProcessQueuesTask
+    save_queue_logs_offsets()
     if _ProcessQueuesTask:
         if _ProcessQueuesTask.active():
             _ProcessQueuesTask.cancel()
@@ -206,6 +239,8 @@ def process_queues(interested_consumers=None):
     global _ProcessQueuesTask
     global _ProcessQueuesLastTime
     has_activity = do_consume(interested_consumers=interested_consumers)
+    if not has_activity:
+        do_cleanup()
     _ProcessQueuesLastTime = time.time()
     if _ProcessQueuesTask is None or _ProcessQueuesTask.called:
         _ProcessQueuesDelay = misc.LoopAttenuation(
@@ -254,15 +289,18 @@ def is_queue_exist(queue_id):
     return queue_id in queue()
 
 
-def open_queue(queue_id):
+def open_queue(queue_id, log_dir=None):
     global _ActiveQueues
     if not valid_queue_id(queue_id):
         raise Exception('invalid queue id')
     if queue_id in queue():
         raise Exception('queue already exist')
     if _Debug:
-        lg.args(_DebugLevel, queue_id=queue_id)
+        lg.args(_DebugLevel, queue_id=queue_id, log_dir=log_dir)
     _ActiveQueues[queue_id] = OrderedDict()
+    _QueueMessageIDs[queue_id] = []
+    if log_dir:
+        open_queue_log(queue_id, log_dir)
     lg.info('new queue opened: %s' % queue_id)
     return True
 
@@ -291,7 +329,11 @@ def close_queue(queue_id, remove_empty_consumers=False, remove_empty_producers=F
     for consumer_id in list(consumer().keys()):
         if is_consumer_subscribed(consumer_id, queue_id):
             unsubscribe_consumer(consumer_id, queue_id, remove_empty=remove_empty_consumers)
+    if is_queue_log_opened(queue_id):
+        close_queue_log(queue_id)
     _ActiveQueues.pop(queue_id)
+    _QueueMessageIDs.pop(queue_id, None)
+    _QueueSubscribers.pop(queue_id, None)
     lg.info('existing queue closed: %s' % queue_id)
     return True
 
@@ -316,9 +358,18 @@ def rename_queue(old_queue_id, new_queue_id):
     subscribed_consumers = list_subscribed_consumers(old_queue_id)
     connected_producers = list_connected_producers(old_queue_id)
     queue()[new_queue_id] = stored_messages
+    _QueueMessageIDs[new_queue_id] = _QueueMessageIDs.pop(old_queue_id, [])
+    _QueueSubscribers[new_queue_id] = _QueueSubscribers.pop(old_queue_id, set())
+    if old_queue_id in _QueueLogs:
+        _QueueLogs[new_queue_id] = _QueueLogs.pop(old_queue_id)
+        _QueueLogPositions[new_queue_id] = _QueueLogPositions.pop(old_queue_id)
     for consumer_id in subscribed_consumers:
         consumer(consumer_id).queues.remove(old_queue_id)
         consumer(consumer_id).queues.append(new_queue_id)
+        if old_queue_id in consumer(consumer_id).cursors:
+            consumer(consumer_id).cursors[new_queue_id] = consumer(consumer_id).cursors.pop(old_queue_id)
+        if old_queue_id in consumer(consumer_id).pending:
+            consumer(consumer_id).pending[new_queue_id] = consumer(consumer_id).pending.pop(old_queue_id)
     for producer_id in connected_producers:
         producer(producer_id).queues.remove(old_queue_id)
         producer(producer_id).queues.append(new_queue_id)
@@ -329,6 +380,131 @@ def rename_queue(old_queue_id, new_queue_id):
 #------------------------------------------------------------------------------
 
 
+def is_queue_log_opened(queue_id):
+    return queue_id in _QueueLogs
+
+
+def queue_log(queue_id):
+    return _QueueLogs.get(queue_id)
+
+
+def open_queue_log(queue_id, log_dir):
+    """
+    Attach durable on-disk log to the queue, all not yet delivered messages will be loaded from there.
+    """
+    if queue_id not in queue():
+        raise Exception('queue not exist')
+    if queue_id in _QueueLogs:
+        raise Exception('queue log already opened')
+    _QueueLogs[queue_id] = segmented_log.SegmentedLog(
+        dirpath=log_dir,
+        max_segment_size=MAX_QUEUE_LOG_SEGMENT_SIZE,
+        max_size=MAX_QUEUE_LOG_SIZE,
+        max_age=MAX_QUEUE_LOG_AGE,
+        sync_interval=QUEUE_LOG_SYNC_INTERVAL,
+    )
+    start_offset = _QueueLogs[queue_id].first_offset()
+    committed_offsets = list(_QueueLogs[queue_id].offsets.values())
+    if committed_offsets:
+        start_offset = max(start_offset, min(committed_offsets))
+    _QueueLogPositions[queue_id] = start_offset
+    if _Debug:
+        lg.args(_DebugLevel, queue_id=queue_id, log=_QueueLogs[queue_id], start_offset=start_offset)
+    return True
+
+
+def close_queue_log(queue_id):
+    """
+    Detach on-disk log from the queue, messages which were loaded from the log are removed from memory.
+    """
+    if queue_id not in _QueueLogs:
+        raise Exception('queue log not opened')
+    if queue_id in queue():
+        for message_id in list(queue(queue_id).keys()):
+            if queue(queue_id)[message_id].log_offset is not None:
+                queue(queue_id).pop(message_id)
+        _QueueMessageIDs[queue_id] = list(queue(queue_id).keys())
+    _QueueLogPositions.pop(queue_id, None)
+    _QueueLogs.pop(queue_id).close()
+    return True
+
+
+def schedule_save_queue_logs_offsets():
+    """
+    Consumers positions are written to the disk with a small delay, so many delivered messages are committed at once.
+    After a crash some of the messages can be delivered again.
+    """
+    global _SaveOffsetsTask
+    if _SaveOffsetsTask is None or not _SaveOffsetsTask.active():
+        _SaveOffsetsTask = reactor.callLater(QUEUE_LOG_OFFSETS_SAVE_DELAY, save_queue_logs_offsets)  # @UndefinedVariable
+
+
+def save_queue_logs_offsets():
+    global _SaveOffsetsTask
+    if _SaveOffsetsTask is not None and _SaveOffsetsTask.active():
+        _SaveOffsetsTask.cancel()
+    _SaveOffsetsTask = None
+    count = 0
+    for queue_log in _QueueLogs.values():
+        if queue_log.offsets_modified:
+            queue_log.save_offsets()
+            count += 1
+    return count
+
+
+def read_queue_log(queue_id, offset, limit=100):
+    """
+    Returns a list of stored messages as dictionaries, this way consumer can catch up with the queue.
+    """
+    if queue_id not in _QueueLogs:
+        raise Exception('queue log not opened')
+    results = []
+    for log_offset, _, raw_data in _QueueLogs[queue_id].read(offset, limit=limit):
+        try:
+            record = serialization.BytesToDict(raw_data, keys_to_text=True)
+        except:
+            lg.exc()
+            continue
+        record['log_offset'] = log_offset
+        record['size'] = len(raw_data)
+        results.append(record)
+    return results
+
+
+def load_queue_window(queue_id):
+    """
+    Fills in-memory queue with messages from the on-disk log which were not delivered yet.
+    """
+    if queue_id not in _QueueLogs:
+        return 0
+    free_slots = MAX_QUEUE_LENGTH - len(queue(queue_id))
+    if free_slots <= 0:
+        return 0
+    position = _QueueLogPositions[queue_id]
+    if position >= _QueueLogs[queue_id].next_offset():
+        return 0
+    loaded = 0
+    for record in read_queue_log(queue_id, position, limit=free_slots):
+        log_offset = record['log_offset']
+        _QueueLogPositions[queue_id] = log_offset + 1
+        new_message = QueueMessage(record['producer_id'], queue_id, record['payload'], created=record['created'], log_offset=log_offset)
+        new_message.size = record['size']
+        if not new_message.consumers:
+            continue
+        new_message.state = 'PUSHED'
+        queue(queue_id)[new_message.message_id] = new_message
+        _QueueMessageIDs[queue_id].append(new_message.message_id)
+        loaded += 1
+    if _QueueLogPositions[queue_id] < _QueueLogs[queue_id].first_offset():
+        _QueueLogPositions[queue_id] = _QueueLogs[queue_id].first_offset()
+    if _Debug:
+        lg.args(_DebugLevel, queue_id=queue_id, loaded=loaded, position=_QueueLogPositions[queue_id])
+    return loaded
+
+
+#------------------------------------------------------------------------------
+
+
 def is_consumer_exists(consumer_id):
     return consumer_id in consumer()
 
@@ -346,8 +522,11 @@ def remove_consumer(consumer_id):
     global _Consumers
     if consumer_id not in consumer():
         raise Exception('consumer not exist')
+    for queue_id in list(consumer(consumer_id).queues):
+        forget_consumer_queue(consumer_id, queue_id)
     old_consumer = _Consumers.pop(consumer_id)
     old_consumer.commands = {}
+    old_consumer.batched_commands.clear()
     old_consumer.queues = []
     lg.info('existing consumer removed: %s' % str(consumer_id))
     return True
@@ -364,14 +543,20 @@ def is_callback_method_registered(consumer_id, callback_method):
     return True
 
 
-def add_callback_method(consumer_id, callback_method, interested_queues_list=None):
+def add_callback_method(consumer_id, callback_method, interested_queues_list=None, batched=False):
+    """
+    If `batched` is True, callback method will receive a list of messages in the "messages" field,
+    otherwise only one message is passed to the callback at a time.
+    """
     if consumer_id not in consumer():
         raise Exception('consumer not found')
     if callback_method in consumer(consumer_id).commands:
         raise Exception('callback method already exist')
     consumer(consumer_id).commands[callback_method] = interested_queues_list
+    if batched:
+        consumer(consumer_id).batched_commands.add(callback_method)
     if _Debug:
-        lg.args(_DebugLevel, c=consumer_id, cb=callback_method)
+        lg.args(_DebugLevel, c=consumer_id, cb=callback_method, batched=batched)
     return True
 
 
@@ -381,6 +566,7 @@ def remove_callback_method(consumer_id, callback_method):
     if callback_method not in consumer(consumer_id).commands:
         raise Exception('callback method not found')
     consumer(consumer_id).commands.pop(callback_method)
+    consumer(consumer_id).batched_commands.discard(callback_method)
     if _Debug:
         lg.args(_DebugLevel, c=consumer_id, cb=callback_method)
     return True
@@ -404,7 +590,7 @@ def is_consumer_subscribed(consumer_id, queue_id=None):
 def list_subscribed_consumers(queue_id):
     if not valid_queue_id(queue_id):
         return []
-    return [c_id for c_id in consumer().keys() if queue_id in consumer(c_id).queues]
+    return list(_QueueSubscribers.get(queue_id, []))
 
 
 def subscribe_consumer(consumer_id, queue_id):
@@ -415,6 +601,9 @@ def subscribe_consumer(consumer_id, queue_id):
     if queue_id in consumer(consumer_id).queues:
         raise Exception('consumer is already subscribed')
     consumer(consumer_id).queues.append(queue_id)
+    if queue_id not in _QueueSubscribers:
+        _QueueSubscribers[queue_id] = set()
+    _QueueSubscribers[queue_id].add(consumer_id)
     lg.info('consumer %s subscribed to read queue %s' % (consumer_id, queue_id))
     return True
 
@@ -425,6 +614,8 @@ def unsubscribe_consumer(consumer_id, queue_id=None, remove_empty=False):
     if consumer_id not in consumer():
         raise Exception('consumer not found')
     if queue_id is None:
+        for subscribed_queue_id in list(consumer(consumer_id).queues):
+            forget_consumer_queue(consumer_id, subscribed_queue_id)
         consumer(consumer_id).queues = []
         lg.info('consumer %s unsubscribed from all queues' % (consumer_id, ))
         if remove_empty:
@@ -433,6 +624,7 @@ def unsubscribe_consumer(consumer_id, queue_id=None, remove_empty=False):
     if queue_id not in consumer(consumer_id).queues:
         raise Exception('consumer is not subscribed')
     consumer(consumer_id).queues.remove(queue_id)
+    forget_consumer_queue(consumer_id, queue_id)
     lg.info('consumer %s unsubscribed from queue %s' % (consumer_id, queue_id))
     if remove_empty:
         if len(consumer(consumer_id).queues) == 0:
@@ -440,6 +632,22 @@ def unsubscribe_consumer(consumer_id, queue_id=None, remove_empty=False):
     return True
 
 
+def forget_consumer_queue(consumer_id, queue_id):
+    """
+    Consumer will not be waited anymore by the messages it was not yet notified about.
+    """
+    if queue_id in _QueueSubscribers:
+        _QueueSubscribers[queue_id].discard(consumer_id)
+    if consumer_id in consumer():
+        consumer(consumer_id).cursors.pop(queue_id, None)
+        consumer(consumer_id).pending.pop(queue_id, None)
+    if queue_id not in queue():
+        return
+    for message_obj in queue(queue_id).values():
+        if consumer_id in message_obj.consumers and consumer_id not in message_obj.notifications:
+            message_obj.consumers.discard(consumer_id)
+
+
 #------------------------------------------------------------------------------
 
 
@@ -545,32 +753,49 @@ def stop_event_publisher(producer_id, event_id):
 #------------------------------------------------------------------------------
 
 
-def start_notification(consumer_id, queue_id, message_id):
-    if not valid_queue_id(queue_id):
-        raise Exception('invalid queue id')
-    if consumer_id not in consumer():
-        raise Exception('consumer not found')
+def start_notification(consumer_id, queue_id, message_id, callback_object=None):
     if queue_id not in queue():
+        if not valid_queue_id(queue_id):
+            raise Exception('invalid queue id')
         raise Exception('queue not exist')
+    if consumer_id not in consumer():
+        raise Exception('consumer not found')
     if message_id not in queue(queue_id):
         raise Exception('message not exist')
     if consumer_id in queue(queue_id)[message_id].notifications:
         raise Exception('notification already sent to given consumer')
-    callback_object = Deferred()
+    if callback_object is None:
+        callback_object = Deferred()
+        callback_object.addCallback(on_notification_succeed, consumer_id, queue_id, message_id)
+        callback_object.addErrback(on_notification_failed, consumer_id, queue_id, message_id)
+        # batch notification is counted only once in do_notify_batch()
+        consumer(consumer_id).pending[queue_id] = consumer(consumer_id).pending.get(queue_id, 0) + 1
+    else:
+        queue(queue_id)[message_id].batched_notifications.add(consumer_id)
     queue(queue_id)[message_id].notifications[consumer_id] = callback_object
-    consumer(consumer_id).consumed_messages += 1
-    callback_object.addCallback(on_notification_succeed, consumer_id, queue_id, message_id)
-    callback_object.addErrback(on_notification_failed, consumer_id, queue_id, message_id)
+    consumer_info = consumer(consumer_id)
+    consumer_info.consumed_messages += 1
+    if message_id > consumer_info.cursors.get(queue_id, 0):
+        consumer_info.cursors[queue_id] = message_id
     queue(queue_id)[message_id].state = 'SENT'
     if _Debug:
         lg.args(_DebugLevel, consumer_id=consumer_id, queue_id=queue_id, message_id=message_id, notifications=len(queue(queue_id)[message_id].notifications))
     return callback_object
 
 
+def release_pending(consumer_id, queue_id):
+    """
+    Notification or batch was finished, so the next one can be sent to the consumer.
+    """
+    consumer_info = _Consumers.get(consumer_id)
+    if consumer_info and consumer_info.pending.get(queue_id):
+        consumer_info.pending[queue_id] -= 1
+
+
 def finish_notification(consumer_id, queue_id, message_id, success):
-    if not valid_queue_id(queue_id):
-        raise Exception('invalid queue id')
     if queue_id not in queue():
+        if not valid_queue_id(queue_id):
+            raise Exception('invalid queue id')
         raise Exception('queue not exist')
     if message_id not in queue(queue_id):
         raise Exception('message not exist')
@@ -583,12 +808,17 @@ def finish_notification(consumer_id, queue_id, message_id, success):
         raise Exception('invalid notification type')
     queue(queue_id)[message_id].notifications[consumer_id] = None
     # queue(queue_id)[message_id].notifications.pop(consumer_id)
+    consumer_info = _Consumers.get(consumer_id)
+    if consumer_id not in queue(queue_id)[message_id].batched_notifications:
+        release_pending(consumer_id, queue_id)
     if success:
-        queue(queue_id)[message_id].success_notifications.append(consumer_id)
-        consumer(consumer_id).success_notifications += 1
+        queue(queue_id)[message_id].success_notifications.add(consumer_id)
+        if consumer_info:
+            consumer_info.success_notifications += 1
     else:
-        queue(queue_id)[message_id].failed_notifications.append(consumer_id)
-        consumer(consumer_id).failed_notifications += 1
+        queue(queue_id)[message_id].failed_notifications.add(consumer_id)
+        if consumer_info:
+            consumer_info.failed_notifications += 1
     if not defer_result.called:
         lg.info('canceling non-finished notification in the queue %s' % queue_id)
         defer_result.cancel()
@@ -607,14 +837,15 @@ def on_notification_succeed(result, consumer_id, queue_id, message_id):
     if is_queue_exist(queue_id) and is_consumer_exists(consumer_id):
         try:
             # reactor.callLater(0, finish_notification, consumer_id, queue_id, message_id, success=True)  # @UndefinedVariable
-            finish_notification(consumer_id, queue_id, message_id, success=True)
+            # consumer can also respond with a Fail() packet, then result is False
+            finish_notification(consumer_id, queue_id, message_id, success=bool(result))
         except:
             lg.exc()
     else:
         lg.warn('notification %r was not finished for consumer %r in %r' % (message_id, consumer_id, queue_id))
-    # TODO: add a counter and execute cleanup less frequently
-    do_cleanup(target_queues=[queue_id])
-    # reactor.callLater(0, do_cleanup, target_queues=[queue_id, ])  # @UndefinedVariable
+    do_cleanup(target_queues=[queue_id], target_messages=[message_id])
+    if is_consumer_exists(consumer_id):
+        touch_queues(interested_consumers=[consumer_id])
     return result
 
 
@@ -629,8 +860,7 @@ def on_notification_failed(err, consumer_id, queue_id, message_id):
             lg.exc()
     else:
         lg.warn('failed notification %r was not finished for consumer %r in %r' % (message_id, consumer_id, queue_id))
-    # TODO: add a counter and execute cleanup less frequently
-    do_cleanup(target_queues=[queue_id])
+    do_cleanup(target_queues=[queue_id], target_messages=[message_id])
     return None
 
 
@@ -644,11 +874,29 @@ def write_message(producer_id, queue_id, data, creation_time=None):
         raise Exception('unknown producer')
     if not is_producer_connected(producer_id, queue_id):
         raise Exception('producer was not connected to the queue')
-    if len(queue(queue_id)) >= MAX_QUEUE_LENGTH:
-        raise P2PQueueIsOverloaded('queue is overloaded')
-    producer(producer_id).produced_messages += 1
-    new_message = QueueMessage(producer_id, queue_id, data, created=creation_time)
+    log_offset = None
+    if queue_id in _QueueLogs:
+        creation_time = creation_time or utime.utcnow_to_sec1970()
+        log_offset = _QueueLogs[queue_id].append(serialization.DictToBytes({
+            'producer_id': producer_id,
+            'created': creation_time,
+            'payload': data,
+        }, keys_to_text=True))
+        producer(producer_id).produced_messages += 1
+        if log_offset != _QueueLogPositions[queue_id] or len(queue(queue_id)) >= MAX_QUEUE_LENGTH:
+            # in-memory window is full, message will be loaded from the log later
+            if _Debug:
+                lg.out(_DebugLevel, 'p2p_queue.write_message  %r stored in the log of the queue %s' % (log_offset, queue_id))
+            touch_queues()
+            return None
+        _QueueLogPositions[queue_id] = log_offset + 1
+    else:
+        if len(queue(queue_id)) >= MAX_QUEUE_LENGTH:
+            raise P2PQueueIsOverloaded('queue is overloaded')
+        producer(producer_id).produced_messages += 1
+    new_message = QueueMessage(producer_id, queue_id, data, created=creation_time, log_offset=log_offset)
     queue(queue_id)[new_message.message_id] = new_message
+    _QueueMessageIDs[queue_id].append(new_message.message_id)
     queue(queue_id)[new_message.message_id].state = 'PUSHED'
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.write_message  %r added to queue %s' % (new_message.message_id, queue_id))
@@ -657,9 +905,9 @@ def write_message(producer_id, queue_id, data, creation_time=None):
 
 
 def pull_message(queue_id, message_id=None):
-    if not valid_queue_id(queue_id):
-        raise Exception('invalid queue id')
-    if queue_id not in list(queue().keys()):
+    if queue_id not in queue():
+        if not valid_queue_id(queue_id):
+            raise Exception('invalid queue id')
         raise Exception('queue id not found')
     if message_id is None:
         if len(list(queue(queue_id).keys())) == 0:
@@ -671,34 +919,57 @@ def pull_message(queue_id, message_id=None):
         return None
     existing_message = queue(queue_id).pop(message_id)
     existing_message.state = 'PULLED'
+    for consumer_id, defer_result in existing_message.notifications.items():
+        if defer_result is not None and consumer_id not in existing_message.batched_notifications:
+            # notification will not be finished anymore because message is gone
+            release_pending(consumer_id, queue_id)
+    message_ids = _QueueMessageIDs[queue_id]
+    pos = bisect.bisect_left(message_ids, message_id)
+    if pos < len(message_ids) and message_ids[pos] == message_id:
+        del message_ids[pos]
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.pull_message  %r removed from queue %s' % (message_id, queue_id))
     return existing_message
 
 
 def lookup_pending_message(consumer_id, queue_id):
-    if not valid_queue_id(queue_id):
-        raise Exception('invalid queue id')
+    pending_messages = lookup_pending_messages(consumer_id, queue_id, limit=1)
+    if not pending_messages:
+        return None
+    return pending_messages[0]
+
+
+def lookup_pending_messages(consumer_id, queue_id, limit=MAX_NOTIFICATION_BATCH_SIZE, max_bytes=None):
+    """
+    Returns IDs of the messages given consumer was not notified about yet, starting from consumer's cursor.
+    """
     if queue_id not in queue():
+        if not valid_queue_id(queue_id):
+            raise Exception('invalid queue id')
         raise Exception('queue not exist')
     if consumer_id not in consumer():
         raise Exception('consumer not found')
-    pending_message_id = None
-    # here we assume that OrderedDict is really ordered
-    for message_id, message_obj in queue(queue_id).items():
-        # loop all messages from the beginning
-        if consumer_id not in message_obj.consumers:
-            # only interested consumers needs to be selected
-            continue
-        if consumer_id in message_obj.success_notifications or consumer_id in message_obj.failed_notifications:
-            # only select consumer which was not notified yet
+    consumer_info = consumer(consumer_id)
+    messages = queue(queue_id)
+    message_ids = _QueueMessageIDs[queue_id]
+    pos = bisect.bisect_right(message_ids, consumer_info.cursors.get(queue_id, 0))
+    pending_messages = []
+    total_bytes = 0
+    while pos < len(message_ids) and len(pending_messages) < limit:
+        message_id = message_ids[pos]
+        message_obj = messages[message_id]
+        pos += 1
+        if consumer_id not in message_obj.consumers or consumer_id in message_obj.notifications:
+            if not pending_messages:
+                # that message will never be delivered to given consumer, so cursor can be moved forward
+                consumer_info.cursors[queue_id] = message_id
             continue
-        if consumer_id in message_obj.notifications:
-            # notification already started to given consumer
-            continue
-        pending_message_id = message_id
-        break
-    return pending_message_id
+        if max_bytes is not None:
+            total_bytes += message_obj.get_size()
+            if pending_messages and total_bytes > max_bytes:
+                break
+        pending_messages.append(message_id)
+    return pending_messages
 
 
 #------------------------------------------------------------------------------
@@ -890,9 +1161,9 @@ def do_notify(callback_method, consumer_id, queue_id, message_id):
             message_id=existing_message.message_id,
             created=existing_message.created,
             callbacks={
-                commands.Ack(): lambda response, info: ret.callback(True),
-                commands.Fail(): lambda response, info: ret.callback(False),
-                None: lambda pkt_out: ret.callback(False),
+                commands.Ack(): lambda response, info: None if ret.called else ret.callback(True),
+                commands.Fail(): lambda response, info: None if ret.called else ret.callback(False),
+                None: lambda pkt_out: None if ret.called else ret.callback(False),
             },
         )
     else:
@@ -912,135 +1183,254 @@ def do_notify(callback_method, consumer_id, queue_id, message_id):
             lg.exc('%r %r %r %r' % (callback_method, consumer_id, queue_id, message_id))
             result = False
         if isinstance(result, Deferred):
-            result.addCallback(lambda ok: ret.callback(True) if ok else ret.callback(False))
+            result.addCallback(lambda ok: None if ret.called else ret.callback(bool(ok)))
             result.addErrback(lg.errback, debug=_Debug, debug_level=_DebugLevel, method='p2p_queue.do_notify')
-            result.addErrback(lambda err: ret.callback(False))
+            result.addErrback(lambda err: None if ret.called else ret.callback(False))
         else:
             reactor.callLater(0, ret.callback, result)  # @UndefinedVariable
+    ret.addTimeout(NOTIFICATION_TIMEOUT, reactor)
     return ret
 
 
+def do_notify_batch(callback_method, consumer_id, queue_id, message_ids):
+    """
+    Passes multiple messages to the callback method in a single call, result is applied to all of the messages.
+    """
+    event_id = global_id.ParseGlobalQueueID(queue_id)['queue_alias']
+    batch_result = Deferred()
+    batch_result.addCallback(on_batch_notification_finished, consumer_id, queue_id, message_ids)
+    batch_result.addErrback(on_batch_notification_failed, consumer_id, queue_id, message_ids)
+    consumer(consumer_id).pending[queue_id] = consumer(consumer_id).pending.get(queue_id, 0) + 1
+    messages_info = []
+    for message_id in message_ids:
+        existing_message = queue(queue_id)[message_id]
+        start_notification(consumer_id, queue_id, message_id, callback_object=batch_result)
+        messages_info.append(dict(
+            payload=existing_message.payload,
+            producer_id=existing_message.producer_id,
+            message_id=existing_message.message_id,
+            created=existing_message.created,
+        ))
+    if _Debug:
+        lg.args(_DebugLevel, cb=callback_method, c=consumer_id, q=queue_id, messages=len(message_ids))
+    try:
+        result = callback_method(dict(
+            event_id=event_id,
+            consumer_id=consumer_id,
+            queue_id=queue_id,
+            messages=messages_info,
+        ))
+    except:
+        lg.exc('%r %r %r %r' % (callback_method, consumer_id, queue_id, message_ids))
+        result = False
+    if isinstance(result, Deferred):
+        result.addCallback(lambda ok: None if batch_result.called else batch_result.callback(bool(ok)))
+        result.addErrback(lg.errback, debug=_Debug, debug_level=_DebugLevel, method='p2p_queue.do_notify_batch')
+        result.addErrback(lambda err: None if batch_result.called else batch_result.callback(False))
+    else:
+        reactor.callLater(0, batch_result.callback, bool(result))  # @UndefinedVariable
+    batch_result.addTimeout(NOTIFICATION_TIMEOUT, reactor)
+    return batch_result
+
+
+def on_batch_notification_finished(result, consumer_id, queue_id, message_ids):
+    # the whole batch was counted as one pending notification, even if some of the messages were already removed
+    release_pending(consumer_id, queue_id)
+    if is_queue_exist(queue_id):
+        for message_id in message_ids:
+            if message_id not in queue(queue_id):
+                continue
+            try:
+                finish_notification(consumer_id, queue_id, message_id, success=bool(result))
+            except:
+                lg.exc()
+        do_cleanup(target_queues=[queue_id], target_messages=message_ids)
+    else:
+        lg.warn('notification of %d messages was not finished for consumer %r in %r' % (len(message_ids), consumer_id, queue_id))
+    if is_consumer_exists(consumer_id):
+        touch_queues(interested_consumers=[consumer_id])
+    return result
+
+
+def on_batch_notification_failed(err, consumer_id, queue_id, message_ids):
+    if _Debug:
+        lg.out(_DebugLevel, 'p2p_queue.on_batch_notification_failed %d messages for consumer %r in %r : %r' % (len(message_ids), consumer_id, queue_id, err))
+    on_batch_notification_finished(False, consumer_id, queue_id, message_ids)
+    return None
+
+
 def do_consume(interested_consumers=None):
+    for queue_id in list(_QueueLogs.keys()):
+        load_queue_window(queue_id)
     if not interested_consumers:
         interested_consumers = list(consumer().keys())
-    disconnected_consumers = []
-    to_be_consumed = []
+    notifications_count = 0
+    consumers_affected = 0
     for consumer_id in interested_consumers:
-        if len(consumer(consumer_id).queues) == 0:
+        consumer_info = _Consumers.get(consumer_id)
+        if not consumer_info or not consumer_info.queues:
             # skip, consumer is not subscribed to any queues
             continue
-        if len(consumer(consumer_id).commands) == 0:
+        if not consumer_info.commands:
             # skip, no available notification methods found for given consumer
-            disconnected_consumers.append(consumer_id)
             continue
-        interested_queues = set()
-        for queue_id in consumer(consumer_id).queues:
-            if queue_id not in queue():
-                continue
-            if len(queue(queue_id)) == 0:
+        consumer_notified = False
+        for queue_id in list(consumer_info.queues):
+            if not _QueueMessageIDs.get(queue_id):
                 # no messages in the queue
                 continue
-            interested_queues.add(queue_id)
-        if len(interested_queues) == 0:
-            # skip, no new messages in the queues which consumer subscribed on
-            continue
-        for queue_id in interested_queues:
-            to_be_consumed.append((
-                consumer_id,
-                queue_id,
-            ))
-    if not to_be_consumed:
-        # nothing to consume
-        return False
-    notifications_count = 0
-    consumers_affected = []
-    for _consumer_id, _queue_id in to_be_consumed:
-        if _consumer_id in consumers_affected:
-            # only one message per consumer at a time
-            continue
-        _message_id = lookup_pending_message(_consumer_id, _queue_id)
-        if _message_id is None:
-            # no new messages found for that consumer
-            continue
-        for callback_method, interested_queues_list in consumer(_consumer_id).commands.items():
-            if interested_queues_list:
-                matching = False
-                for interested_queue in interested_queues_list:
-                    if _queue_id.startswith(interested_queue):
-                        matching = True
-                        break
-                if not matching:
+            if consumer_info.pending.get(queue_id):
+                # only one notification per consumer per queue can be in progress at a time
+                continue
+            callback_method = None
+            for _callback_method, interested_queues_list in consumer_info.commands.items():
+                if interested_queues_list:
+                    matching = False
+                    for interested_queue in interested_queues_list:
+                        if queue_id.startswith(interested_queue):
+                            matching = True
+                            break
+                    if not matching:
+                        continue
+                callback_method = _callback_method
+                break
+            if callback_method is None:
+                continue
+            if callback_method in consumer_info.batched_commands:
+                message_ids = lookup_pending_messages(consumer_id, queue_id, limit=MAX_NOTIFICATION_BATCH_SIZE, max_bytes=MAX_NOTIFICATION_BATCH_BYTES)
+                if not message_ids:
+                    continue
+                do_notify_batch(callback_method, consumer_id, queue_id, message_ids)
+            else:
+                message_ids = lookup_pending_messages(consumer_id, queue_id, limit=1)
+                if not message_ids:
                     continue
-            do_notify(callback_method, _consumer_id, _queue_id, _message_id)
+                do_notify(callback_method, consumer_id, queue_id, message_ids[0])
             notifications_count += 1
-            consumers_affected.append(_consumer_id)
-            break
+            consumer_notified = True
+        if consumer_notified:
+            consumers_affected += 1
     if _Debug:
         lg.args(_DebugLevel, notifications_count=notifications_count, consumers_affected=consumers_affected)
-    del to_be_consumed
-    del consumers_affected
     if notifications_count == 0:
         # nothing was sent
         return False
     return True
 
 
-def do_cleanup(target_queues=None):
+def do_cleanup(target_queues=None, target_messages=None):
+    """
+    Removes messages which were delivered to all of the consumers.
+    If `target_messages` is passed, only those messages will be verified.
+    """
     global _MessageProcessedCallbacks
-    to_be_removed = set()
+    to_be_removed = []
     if not target_queues:
         target_queues = list(queue().keys())
     for queue_id in target_queues:
         if not is_queue_exist(queue_id):
             continue
-        for _message in queue(queue_id).values():
+        if target_messages is None:
+            messages_to_check = list(queue(queue_id).values())
+        else:
+            messages_to_check = [queue(queue_id)[message_id] for message_id in target_messages if message_id in queue(queue_id)]
+        for _message in messages_to_check:
+            if len(_message.consumers) == 0:
+                # there is no consumers for that message - remove it
+                to_be_removed.append((queue_id, _message.message_id))
+                continue
             if _message.state == 'SENT':
-                found_pending_notifications = False
-                for defer_result in _message.notifications.values():
-                    if defer_result and not defer_result.called:
-                        found_pending_notifications = True
-                if not found_pending_notifications:
-                    # no pending notifications found, but state is SENT : all is done
-                    to_be_removed.add((queue_id, _message.message_id))
-                    continue
                 if len(_message.failed_notifications) + len(_message.success_notifications) >= len(_message.consumers):
                     # all notifications are sent and results are received (or timeouts) - remove message from the queue
-                    to_be_removed.add((queue_id, _message.message_id))
+                    to_be_removed.append((queue_id, _message.message_id))
                     continue
-            if len(_message.consumers) == 0:
-                # there is no consumers for that message - remove it
-                to_be_removed.add((queue_id, _message.message_id))
-                continue
+                if target_messages is None and not is_message_awaited(_message):
+                    # remaining consumers are not able to receive that message anymore
+                    to_be_removed.append((queue_id, _message.message_id))
+                    continue
+    delivered_offsets = {}
+    logs_modified = set()
     for queue_id, message_id in to_be_removed:
         processed_message = pull_message(queue_id, message_id)
         if processed_message:
+            if processed_message.log_offset is not None and queue_id in _QueueLogs:
+                # only consumers who really received the message are moving forward in the log
+                for consumer_id in processed_message.success_notifications:
+                    delivered_offsets[(queue_id, consumer_id)] = max(delivered_offsets.get((queue_id, consumer_id), 0), processed_message.log_offset + 1)
+                # other consumers are only registered in the log, so the message is delivered to them again after restart
+                for consumer_id in processed_message.consumers:
+                    if consumer_id not in processed_message.success_notifications and _QueueLogs[queue_id].committed(consumer_id) is None:
+                        _QueueLogs[queue_id].commit(consumer_id, processed_message.log_offset)
+                        logs_modified.add(queue_id)
             for cb in _MessageProcessedCallbacks:
                 if not cb(processed_message):
                     lg.warn('message %r was not correctly processed in %r' % (message_id, cb))
-    to_be_removed.clear()
+    for (queue_id, consumer_id), offset in delivered_offsets.items():
+        if queue_id not in _QueueLogs:
+            continue
+        if _QueueLogs[queue_id].commit(consumer_id, min(offset, lowest_pending_offset(queue_id, consumer_id))):
+            logs_modified.add(queue_id)
+    if logs_modified:
+        schedule_save_queue_logs_offsets()
     del to_be_removed
     return True
 
 
+def lowest_pending_offset(queue_id, consumer_id):
+    """
+    Returns offset of the first record in the queue log which was not yet delivered to given consumer.
+    """
+    lowest = _QueueLogPositions.get(queue_id, 0)
+    if queue_id not in queue():
+        return lowest
+    for message_obj in queue(queue_id).values():
+        if message_obj.log_offset is None or message_obj.log_offset >= lowest:
+            continue
+        if consumer_id in message_obj.consumers and consumer_id not in message_obj.success_notifications:
+            lowest = message_obj.log_offset
+    return lowest
+
+
+def is_message_awaited(message_obj):
+    """
+    Returns True if at least one of the consumers is still able to receive that message or notification is in progress.
+    """
+    for consumer_id in message_obj.consumers:
+        if consumer_id in message_obj.success_notifications or consumer_id in message_obj.failed_notifications:
+            continue
+        if message_obj.notifications.get(consumer_id):
+            return True
+        consumer_info = _Consumers.get(consumer_id)
+        if consumer_info and consumer_info.commands and message_obj.queue_id in consumer_info.queues:
+            return True
+    return False
+
+
 #------------------------------------------------------------------------------
 
 
 class QueueMessage(object):
 
-    def __init__(self, producer_id, queue_id, json_data, created=None):
+    def __init__(self, producer_id, queue_id, json_data, created=None, log_offset=None):
         self.message_id = make_message_id()
         self.producer_id = producer_id
         self.queue_id = queue_id
         self.created = created or utime.utcnow_to_sec1970()
         self.payload = jsn.dict_items_to_text(json_data)
+        self.log_offset = log_offset
+        self.size = None
         self.state = 'CREATED'
         self.notifications = {}
-        self.success_notifications = []
-        self.failed_notifications = []
-        self.consumers = []
-        for consumer_id in consumer():
-            if queue_id in consumer(consumer_id).queues:
-                self.consumers.append(consumer_id)
+        self.success_notifications = set()
+        self.failed_notifications = set()
+        self.batched_notifications = set()
+        self.consumers = set(_QueueSubscribers.get(queue_id, []))
+        message_log = _QueueLogs.get(queue_id) if log_offset is not None else None
+        if message_log and message_log.offsets:
+            for consumer_id in list(self.consumers):
+                if log_offset < (message_log.committed(consumer_id) or 0):
+                    # consumer already received that message before restart
+                    self.consumers.discard(consumer_id)
         if len(self.consumers) == 0:
             if _Debug:
                 lg.warn('message %r from %r in queue %r will have no consumers' % (self.message_id, self.producer_id, self.queue_id))
@@ -1056,6 +1446,14 @@ class QueueMessage(object):
     def get_sequence_id(self):
         return self.payload.get('sequence_id', None)
 
+    def get_size(self):
+        """
+        Approximate size of the message payload in bytes.
+        """
+        if self.size is None:
+            self.size = len(jsn.dumps(self.payload, keys_to_text=True, values_to_text=True))
+        return self.size
+
 
 #------------------------------------------------------------------------------
 
@@ -1066,7 +1464,10 @@ class ConsumerInfo(object):
         self.state = 'READY'
         self.consumer_id = consumer_id
         self.commands = {}
+        self.batched_commands = set()
         self.queues = []
+        self.cursors = {}
+        self.pending = {}
         self.consumed_messages = 0
         self.success_notifications = 0
         self.failed_notifications = 0
@@ -310,38 +310,40 @@ def on_consumer_notify(message_info):
     if not queue_id.startswith('group_'):
         # ignore the message, it seems it is not a queue message but it is addressed to the same consumer
         return False
-    try:
-        payload = message_info['payload']
-    except:
-        lg.exc('invalid incoming message: %r' % message_info)
-        return False
-    if 'sequence_id' not in payload:
-        # ignore the message, it seems it is not a queue message but it is addressed to the same consumer
-        return False
     try:
         consumer_id = message_info['consumer_id']
-        packet_id = packetid.MakeQueueMessagePacketID(queue_id, packetid.UniqueID())
-        sequence_id = payload['sequence_id']
-        last_sequence_id = get_latest_sequence_id(queue_id)
-        producer_id = payload['producer_id']
+        messages_info = message_info['messages']
     except:
         lg.exc('invalid incoming message: %r' % message_info)
         return False
+    items = []
+    for one_message in messages_info:
+        payload = one_message.get('payload') or {}
+        if 'sequence_id' not in payload:
+            # skip the message, it seems it is not a queue message but it is addressed to the same consumer
+            continue
+        try:
+            items.append({
+                'sequence_id': payload['sequence_id'],
+                'created': payload['created'],
+                'producer_id': payload['producer_id'],
+                'payload': payload['payload'],
+            })
+        except:
+            lg.exc('invalid incoming message: %r' % one_message)
+            continue
+    if not items:
+        return False
+    packet_id = packetid.MakeQueueMessagePacketID(queue_id, packetid.UniqueID())
+    last_sequence_id = get_latest_sequence_id(queue_id)
     if _Debug:
-        lg.args(_DebugLevel, p=producer_id, c=consumer_id, q=queue_id, s=sequence_id, l=last_sequence_id)
+        lg.args(_DebugLevel, c=consumer_id, q=queue_id, items=len(items), l=last_sequence_id)
     ret = message.send_message(
         json_data={
             'msg_type': 'queue_message',
             'action': 'read',
             'created': utime.utcnow_to_sec1970(),
-            'items': [
-                {
-                    'sequence_id': sequence_id,
-                    'created': payload['created'],
-                    'producer_id': producer_id,
-                    'payload': payload['payload'],
-                },
-            ],
+            'items': items,
             'last_sequence_id': last_sequence_id,
         },
         recipient_global_id=my_keys.make_key_id(alias='master', creator_glob_id=consumer_id),
@@ -351,7 +353,7 @@ def on_consumer_notify(message_info):
     )
     ret.addErrback(lg.errback, debug=_Debug, debug_level=_DebugLevel, ignore=True, method='postman.on_consumer_notify')
     if _Debug:
-        lg.out(_DebugLevel, '>>> NOTIFY >>>    from %r by producer %r to consumer %r at sequence %d' % (queue_id, producer_id, consumer_id, sequence_id))
+        lg.out(_DebugLevel, '>>> NOTIFY >>>    from %r to consumer %r with %d messages, sequence %d..%d' % (queue_id, consumer_id, len(items), items[0]['sequence_id'], items[-1]['sequence_id']))
     return ret
 
 
@@ -509,8 +511,13 @@ def rename_stream(old_queue_id, new_queue_id):
         customers()[new_customer_idurl].append(new_queue_id)
     if os.path.isdir(new_queue_dir):
         bpio.rmdir_recursive(new_queue_dir, ignore_errors=True)
+    queue_log = p2p_queue.queue_log(new_queue_id)
+    if queue_log:
+        queue_log.close()
     if os.path.isdir(old_queue_dir):
         bpio.move_dir_recursive(old_queue_dir, new_queue_dir)
+    if queue_log:
+        queue_log.relocate(os.path.join(new_queue_dir, 'log'))
     if _Debug:
         lg.args(_DebugLevel, old=old_queue_id, new=new_queue_id)
     return True
@@ -671,7 +678,7 @@ def start_consumer(queue_id, consumer_id):
     if not p2p_queue.is_consumer_exists(consumer_id):
         p2p_queue.add_consumer(consumer_id)
     if not p2p_queue.is_callback_method_registered(consumer_id, on_consumer_notify):
-        p2p_queue.add_callback_method(consumer_id, on_consumer_notify, interested_queues_list=['group_'])
+        p2p_queue.add_callback_method(consumer_id, on_consumer_notify, interested_queues_list=['group_'], batched=True)
     if not p2p_queue.is_consumer_subscribed(consumer_id, queue_id):
         p2p_queue.subscribe_consumer(consumer_id, queue_id)
     streams()[queue_id]['consumers'][consumer_id]['active'] = True
@@ -753,7 +760,9 @@ def start_stream(queue_id):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id)
     if not p2p_queue.is_queue_exist(queue_id):
-        p2p_queue.open_queue(queue_id)
+        service_dir = settings.ServiceDir('service_joint_postman')
+        log_dir = os.path.join(service_dir, 'queues', queue_id, 'log')
+        p2p_queue.open_queue(queue_id, log_dir=log_dir)
     for consumer_id in list(streams()[queue_id]['consumers'].keys()):
         start_consumer(queue_id, consumer_id)
     for producer_id in list(streams()[queue_id]['producers'].keys()):
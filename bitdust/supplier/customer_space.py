@@ -276,6 +276,8 @@ def make_filename(customerGlobID, filePath, keyAlias=None):
         bpio._dir_make(keyAliasDir)
     if packetid.IsIndexFileName(filePath):
         filePath = settings.BackupIndexFileName()
+    elif packetid.IsIndexDeltaFileName(filePath):
+        filePath = settings.BackupIndexDeltaFileName()
     filename = os.path.join(keyAliasDir, filePath)
     return filename
 
@@ -291,7 +293,7 @@ def make_valid_filename(customerIDURL, glob_path):
     if not customerGlobID:
         lg.warn('customer id is empty: %r' % glob_path)
         return ''
-    if filePath != settings.BackupIndexFileName() and not packetid.IsIndexFileName(filePath):
+    if filePath != settings.BackupIndexFileName() and not packetid.IsIndexFileName(filePath) and not packetid.IsIndexDeltaFileName(filePath):
         # SECURITY
         if not packetid.Valid(filePath):
             lg.warn('invalid file path')
@@ -531,7 +533,7 @@ def on_retrieve(newpacket):
     # to solve the issue we will create a new Data() packet
     # which will be addressed directly to recipient and "wrap" stored data inside it
     return_packet_id = stored_packet.PacketID
-    if packetid.IsIndexFileName(glob_path['path']):
+    if packetid.IsIndexFileName(glob_path['path']) or packetid.IsIndexDeltaFileName(glob_path['path']):
         return_packet_id = newpacket.PacketID
     payload = stored_packet.Serialize()
     return_packet = signed.Packet(
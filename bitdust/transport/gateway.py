@@ -93,6 +93,7 @@ if __name__ == '__main__':
 #------------------------------------------------------------------------------
 
 from bitdust.logs import lg
+from bitdust.logs import metrics
 
 from bitdust.p2p import commands
 from bitdust.p2p import p2p_service
@@ -439,6 +440,7 @@ def inbox(info):
         lg.exc()
         return None
     _LastInboxPacketTime = time.time()
+    metrics.on_packet('in', Command, len(Payload or b''))
     if _Debug:
         lg.out(_DebugLevel - 2, 'gateway.inbox [%s] signed by %s|%s (for %s) from %s://%s' % (Command, nameurl.GetName(OwnerID), nameurl.GetName(CreatorID), nameurl.GetName(RemoteID), info.proto, info.host))
     if _PacketLogFileEnabled:
@@ -513,6 +515,7 @@ def outbox(
             log_name='packet',
             showtime=True,
         )
+    metrics.on_packet('out', outpacket.Command, len(outpacket.Payload or b''))
     return callback.run_outbox_filter_callbacks(
         outpacket,
         wide=wide,
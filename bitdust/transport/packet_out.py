@@ -101,6 +101,7 @@ from bitdust.userid import my_id
 #------------------------------------------------------------------------------
 
 _OutboxQueue = []
+_OutboxIndex = {}
 _PacketsCounter = 0
 
 #------------------------------------------------------------------------------
@@ -153,10 +154,27 @@ def create(outpacket, wide, callbacks, target=None, route=None, response_timeout
         )
     p = PacketOut(outpacket, wide, callbacks, target, route, response_timeout, keep_alive, skip_ack=skip_ack)
     queue().append(p)
+    p.index_key = make_index_key(outpacket.Command, p.remote_idurl)
+    _OutboxIndex.setdefault(p.index_key, set()).add(p)
     p.automat('run')
     return p
 
 
+def make_index_key(command, remote_idurl):
+    idurl_key = id_url.identity_key(remote_idurl)
+    if idurl_key is None:
+        idurl_key = id_url.to_bin(remote_idurl)
+    return (command, idurl_key)
+
+
+def search_by_command(command, remote_idurl):
+    """
+    Returns list of pending outgoing packets with given command addressed to given node.
+    Unlike other search methods it does not walk the whole outbox queue.
+    """
+    return list(_OutboxIndex.get(make_index_key(command, remote_idurl), []))
+
+
 #------------------------------------------------------------------------------
 
 
@@ -298,19 +316,20 @@ def search_by_response_packet(newpacket=None, proto=None, host=None, outgoing_co
         if not id_url.is_cached(incoming_remote_idurl):
             identitycache.start_one(incoming_remote_idurl)
         else:
-            if id_url.is_in(incoming_owner_idurl, expected_recipient, as_field=False):
+            expected_keys = id_url.keys_set(expected_recipient)
+            if id_url.is_in_keys(incoming_owner_idurl, expected_keys):
                 if id_url.is_the_same(my_id.getIDURL(), incoming_remote_idurl):
                     if _Debug:
                         lg.out(_DebugLevel, 'packet_out.search_by_response_packet    matched with incoming owner: %s' % expected_recipient)
                     matched = True
             if not matched:
-                if id_url.is_in(incoming_creator_idurl, expected_recipient, as_field=False):
+                if id_url.is_in_keys(incoming_creator_idurl, expected_keys):
                     if id_url.is_the_same(my_id.getIDURL(), incoming_remote_idurl):
                         if _Debug:
                             lg.out(_DebugLevel, 'packet_out.search_by_response_packet    matched with incoming creator: %s' % expected_recipient)
                         matched = True
             if not matched:
-                if id_url.is_in(incoming_remote_idurl, expected_recipient, as_field=False):
+                if id_url.is_in_keys(incoming_remote_idurl, expected_keys):
                     if id_url.is_the_same(my_id.getIDURL(), incoming_owner_idurl) and incoming_command == commands.Data():
                         if _Debug:
                             lg.out(_DebugLevel, 'packet_out.search_by_response_packet    matched my own incoming Data with incoming remote: %s' % expected_recipient)
@@ -407,6 +426,7 @@ class PacketOut(automat.Automat):
         self.final_result = None
         self.description = self.outpacket.Command + '[' + self.outpacket.PacketID + ']'
         self.remote_idurl = id_url.field(target) if target else None
+        self.index_key = None
         self.route = route
         self.response_timeout = response_timeout
         if self.route and 'remoteid' in self.route:
@@ -1063,6 +1083,11 @@ class PacketOut(automat.Automat):
         Remove all references to the state machine object to destroy it.
         """
         queue().remove(self)
+        indexed = _OutboxIndex.get(self.index_key)
+        if indexed is not None:
+            indexed.discard(self)
+            if not indexed:
+                _OutboxIndex.pop(self.index_key)
         if self not in self.outpacket.Packets:
             lg.warn('packet_out not connected to the packet')
         else:
@@ -80,6 +80,8 @@ _KnownIDURLs = {}
 _MergedIDURLs = {}
 _KnownSources = {}
 _KnownUniqueNames = {}
+_KnownFields = {}
+_KeysGeneration = 0
 _Ready = False
 
 #------------------------------------------------------------------------------
@@ -96,6 +98,7 @@ def init():
     from bitdust.userid import identity
     if _Debug:
         lg.out(_DebugLevel, 'id_url.init')
+    forget_fields()
     if not _IdentityHistoryDir:
         _IdentityHistoryDir = settings.IdentityHistoryDir()
     if not os.path.exists(_IdentityHistoryDir):
@@ -210,6 +213,7 @@ def shutdown():
     _MergedIDURLs.clear()
     _KnownSources.clear()
     _KnownUniqueNames.clear()
+    forget_fields()
     _Ready = False
 
 
@@ -400,6 +404,7 @@ def identity_cached(new_id_obj):
             _KnownUniqueNames[unique_name].append(one_source)
             if _Debug:
                 lg.out(_DebugLevel, 'id_url.identity_cached added new source %r for unique name %r' % (one_source, unique_name))
+    forget_fields(pub_key)
     if _Debug:
         lg.args(_DebugLevel, is_identity_rotated=is_identity_rotated, latest_id_obj=bool(latest_id_obj))
     if is_identity_rotated and latest_id_obj is not None:
@@ -459,17 +464,40 @@ def identity_cached(new_id_obj):
 #------------------------------------------------------------------------------
 
 
+def forget_fields(pub_key=None):
+    """
+    Drops interned `ID_URL_FIELD` values for all known sources of given public key,
+    or all of them if `pub_key` is None.
+    Must be called every time identity history for that user was changed,
+    so next call to `field()` will produce a field with the latest info.
+    """
+    global _KnownFields
+    global _KnownSources
+    global _KeysGeneration
+    _KeysGeneration += 1
+    if pub_key is None:
+        _KnownFields.clear()
+        return
+    for one_source in _KnownSources.get(pub_key, []):
+        _KnownFields.pop(one_source, None)
+
+
 def field(idurl):
     """
     Translates string into `ID_URL_FIELD` object.
     Also we try to read from local identity cache folder if do not know given "idurl".
+    For already cached identities the field is built from interned value, which is much faster.
     """
     global _KnownIDURLs
+    global _KnownFields
     if isinstance(idurl, ID_URL_FIELD):
         return idurl
     if idurl in [None, 'None', '', b'None', b'', False]:
         return ID_URL_FIELD(idurl)
     idurl = strng.to_bin(idurl.strip())
+    known_field = _KnownFields.get(idurl)
+    if known_field is not None:
+        return known_field.clone()
     if idurl not in _KnownIDURLs:
         if _Debug:
             lg.out(_DebugLevel, 'id_url.field   will try to find %r in local identity cache' % idurl)
@@ -483,7 +511,10 @@ def field(idurl):
                 modul = os.path.basename(cod.co_filename).replace('.py', '')
                 caller = cod.co_name
                 lg.warn('unknown yet idurl %s, call from %s.%s' % (idurl, modul, caller))
-    return ID_URL_FIELD(idurl)
+    new_field = ID_URL_FIELD(idurl)
+    if idurl in _KnownIDURLs:
+        _KnownFields[idurl] = new_field.clone()
+    return new_field
 
 
 def fields_list(idurl_list):
@@ -578,6 +609,53 @@ def to_bin_dict(idurl_dict):
     return {to_bin(k): v for k, v in idurl_dict.items()}
 
 
+def identity_key(idurl):
+    """
+    Returns a stable key of the identity which is not changing after rotation : the public key.
+    For empty values returns empty binary string and None if given idurl is not cached yet.
+    """
+    global _KnownIDURLs
+    if isinstance(idurl, ID_URL_FIELD):
+        return idurl.to_public_key(raise_error=False)
+    if idurl in [None, 'None', '', b'None', b'', False]:
+        return b''
+    return _KnownIDURLs.get(strng.to_bin(idurl).strip())
+
+
+def keys_generation():
+    """
+    Returns a counter which is incremented every time identity history was changed.
+    Sets made by `keys_set()` can be kept in memory while that value is the same.
+    """
+    global _KeysGeneration
+    return _KeysGeneration
+
+
+def keys_set(iterable_object):
+    """
+    Builds a set of identity keys from given idurls, so you can do many `is_in_keys()` checks in a loop.
+    Not cached yet idurls are stored as binary strings.
+    Note that result will not follow identity rotations, it must be built again when `keys_generation()` was changed.
+    """
+    result = set()
+    for one_idurl in iterable_object:
+        one_key = identity_key(one_idurl)
+        if one_key is None:
+            one_key = to_bin(one_idurl)
+        result.add(one_key)
+    return result
+
+
+def is_in_keys(idurl, keys):
+    """
+    Fast O(1) equivalent of `is_in()`, but `keys` must be created with `keys_set()` first.
+    """
+    idurl_key = identity_key(idurl)
+    if idurl_key is None:
+        idurl_key = to_bin(idurl)
+    return idurl_key in keys
+
+
 def is_in(idurl, iterable_object, as_field=True, as_bin=False):
     """
     Equivalent of `idurl in iterable_object`.
@@ -587,6 +665,17 @@ def is_in(idurl, iterable_object, as_field=True, as_bin=False):
     if not iterable_object:
         return False
     if as_field:
+        idurl_key = identity_key(idurl)
+        if idurl_key is not None:
+            # all idurls are usually already cached, so just compare public keys and avoid creating new fields
+            for one_idurl in iterable_object:
+                one_key = identity_key(one_idurl)
+                if one_key is None:
+                    break
+                if one_key == idurl_key:
+                    return True
+            else:
+                return False
         return field(idurl) in fields_list(iterable_object)
     if as_bin:
         return to_bin(idurl) in to_bin_list(iterable_object)
@@ -993,6 +1082,14 @@ class ID_URL_FIELD(object):
             lg.args(_DebugLevel*2, latest=self.latest)
         return len(self.latest)
 
+    def clone(self):
+        """
+        Creates a copy of that field without resolving all the info again.
+        """
+        another_field = ID_URL_FIELD.__new__(ID_URL_FIELD)
+        another_field.__dict__.update(self.__dict__)
+        return another_field
+
     def refresh(self, replace_original=True):
         _latest, _latest_revision = get_latest_revision(self.current)
         if self.latest and self.latest == _latest:
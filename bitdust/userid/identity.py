@@ -142,7 +142,8 @@ _DebugLevel = 10
 import os
 import sys
 
-from xml.dom import minidom, Node
+from xml.etree import ElementTree
+from xml.dom import Node
 from xml.dom.minidom import getDOMImplementation
 
 #------------------------------------------------------------------------------
@@ -184,6 +185,35 @@ default_identity_src = """<?xml version="1.0" encoding="ISO-8859-1"?>
   <signature></signature>
 </identity>"""
 
+_ListSections = (
+    ('sources', 'source'),
+    ('contacts', 'contact'),
+    ('certificates', 'certificate'),
+    ('scrubbers', 'scrubber'),
+)
+
+_ValueSections = (
+    'postage',
+    'date',
+    'version',
+    'revision',
+    'publickey',
+    'signature',
+)
+
+#------------------------------------------------------------------------------
+
+
+def escape_xml_text(txt):
+    """
+    Same escaping rules as ``minidom`` uses when writing a text node,
+    so the output of ``identity.toxml()`` stays byte-identical to the old DOM based code.
+    """
+    if not txt:
+        return ''
+    return txt.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
 #------------------------------------------------------------------------------
 
 
@@ -410,12 +440,12 @@ class identity(object):
         A smart method to load object fields data from XML content.
         """
         try:
-            doc = minidom.parseString(strng.to_bin(xmlsrc))
+            root = ElementTree.fromstring(strng.to_bin(xmlsrc))
         except:
             lg.warn('failed reading identity source from %d bytes' % len(strng.to_bin(xmlsrc)))
             return
         self.clear_data()
-        self.from_xmlobj(doc.documentElement)
+        self.from_etree(root)
 
     def unserialize_object(self, xmlobject):
         """
@@ -447,14 +477,14 @@ class identity(object):
         Used to save identity on disk or transfer over network.
         """
         if as_text:
-            return strng.to_text(self.toxml()[0].strip())
-        return self.toxml()[0].strip()
+            return strng.to_text(self.toxml().strip())
+        return self.toxml().strip()
 
     def serialize_object(self):
         """
         Almost the same but return a DOM object.
         """
-        return self.toxml()[1]
+        return self.todom()[0]
 
     def serialize_json(self):
         """
@@ -481,6 +511,40 @@ class identity(object):
     def toxml(self):
         """
         Call this to convert to XML format.
+
+        Output is exactly the same as ``minidom`` method ``toprettyxml()`` would produce for the DOM
+        tree built by ``todom()``, but without creating any DOM objects.
+        """
+        out = [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<identity>',
+        ]
+        for section_name, item_name in _ListSections:
+            if section_name == 'sources':
+                items = [source.original() for source in self.sources]
+            else:
+                items = getattr(self, section_name)
+            if not items:
+                out.append('  <%s/>' % section_name)
+                continue
+            out.append('  <%s>' % section_name)
+            for item in items:
+                txt = escape_xml_text(strng.to_text(item))
+                if txt:
+                    out.append('    <%s>%s</%s>' % (item_name, txt, item_name))
+                else:
+                    out.append('    <%s></%s>' % (item_name, item_name))
+            out.append('  </%s>' % section_name)
+        for section_name in _ValueSections:
+            txt = escape_xml_text(strng.to_text(getattr(self, section_name)))
+            out.append('  <%s>%s</%s>' % (section_name, txt, section_name))
+        out.append('</identity>')
+        out.append('')
+        return '\n'.join(out).encode('utf-8')
+
+    def todom(self):
+        """
+        Build and return a DOM tree for that identity: ``(root, doc)``.
         """
         impl = getDOMImplementation()
 
@@ -539,8 +603,34 @@ class identity(object):
         signature.appendChild(doc.createTextNode(strng.to_text(self.signature)))
         root.appendChild(signature)
 
-        xmlsrc = doc.toprettyxml(indent='  ', newl='\n', encoding='utf-8')
-        return xmlsrc, root, doc
+        return root, doc
+
+    def from_etree(self, root_node):
+        """
+        This is to load identity fields from ``xml.etree`` element - used during ``unserialize`` procedure.
+        Follows exactly the same rules as ``from_xmlobj()`` does for DOM objects.
+        """
+        for xsection in root_node:
+            tag = xsection.tag
+            if tag == 'sources':
+                for xsource in xsection:
+                    if xsource.text is not None:
+                        self.sources.append(id_url.ID_URL_FIELD(xsource.text.strip()))
+            elif tag == 'contacts':
+                for xcontact in xsection:
+                    if xcontact.text is not None:
+                        self.contacts.append(strng.to_bin(xcontact.text.strip()))
+            elif tag == 'certificates':
+                for xcertificate in xsection:
+                    if xcertificate.text is not None:
+                        self.certificates.append(strng.to_bin(xcertificate.text.strip()))
+            elif tag == 'scrubbers':
+                for xscrubber in xsection:
+                    if xscrubber.text is not None:
+                        self.scrubbers.append(strng.to_bin(xscrubber.text.strip()))
+            elif tag in _ValueSections:
+                if xsection.text is not None:
+                    setattr(self, tag, strng.to_bin(xsection.text.strip()))
 
     def from_xmlobj(self, root_node):
         """
@@ -822,6 +912,22 @@ class identity(object):
         """
         return strng.to_text(self.version)
 
+    def getCapabilities(self):
+        """
+        Returns a list of optional protocol features supported by the software of that node.
+        They are listed in the version string after "caps:" prefix: "caps:identity-broadcast,shared-ping".
+        """
+        for word in self.getVersionStr().split(' '):
+            if word.startswith('caps:'):
+                return [cap for cap in word[5:].split(',') if cap]
+        return []
+
+    def hasCapability(self, capability):
+        """
+        Returns True if that node announced support of given protocol feature in the version string.
+        """
+        return capability in self.getCapabilities()
+
     def getRevisionValue(self):
         """
         Returns identity revision number.
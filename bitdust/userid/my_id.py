@@ -83,6 +83,14 @@ _ValidTransports = [
 
 #------------------------------------------------------------------------------
 
+# optional protocol features supported by this software, they are announced in my identity version string
+CAPABILITIES = [
+    'identity-broadcast',
+    'index-delta',
+]
+
+#------------------------------------------------------------------------------
+
 
 def init():
     """
@@ -594,7 +602,11 @@ def rebuildLocalIdentity(identity_object=None, skip_transports=[], new_sources=N
     repo = 'sources'
     # lid.setVersion((vernum + b' ' + strng.to_bin(repo.strip()) + b' ' + strng.to_bin(bpio.osinfo().strip()).strip()))
     # TODO: add latest commit hash from the GIT repo to the version
-    lid.setVersion(vernum + b' ' + strng.to_bin(repo.strip()))
+    version = vernum + b' ' + strng.to_bin(repo.strip())
+    if CAPABILITIES:
+        # other nodes will use those protocol features only after they see them in my identity
+        version += b' caps:' + strng.to_bin(','.join(CAPABILITIES))
+    lid.setVersion(version)
     # generate signature with changed content
     lid.sign()
     new_xmlsrc = lid.serialize()
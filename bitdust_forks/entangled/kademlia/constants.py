@@ -25,6 +25,9 @@ specific constants, and do not affect general Kademlia operation.
 #: Small number Representing the degree of parallelism in network calls
 alpha = 4
 
+#: Upper limit for the degree of parallelism when it is adjusted dynamically during iterative lookups
+alphaMax = 8
+
 #: Maximum number of contacts stored in a bucket; this should be an even number
 k = 4
 
@@ -34,6 +37,19 @@ rpcTimeout = 10
 # Delay between iterations of iterative node lookups (for loose parallelism)  (in seconds)
 iterativeLookupDelay = rpcTimeout/2
 
+#: Enables adaptive iterative lookups: contacts are selected by measured round-trip time,
+#: the degree of parallelism follows the observed failure rate and slow RPCs are hedged
+adaptiveLookups = True
+
+#: Lower limit for the delay before an extra (hedged) RPC is sent during iterative lookups (in seconds)
+minHedgeDelay = 0.05
+
+#: Weight of the most recent sample in the smoothed round-trip time of a contact
+rttSmoothing = 0.125
+
+#: Maximum number of contacts for which round-trip time statistics are kept in a single routing table
+rttTrackedContacts = 1024
+
 #: If a k-bucket has not been used for this amount of time, refresh it (in seconds)
 refreshTimeout = 600  # 10 min
 #: The interval at which nodes replicate (republish/refresh) data they are holding
@@ -50,6 +66,29 @@ dataExpireSecondsDefaut = 60*60*12  # 12 hours
 #: or whether any data needs to be republished (in seconds)
 checkRefreshInterval = refreshTimeout/5
 
+#: Records which are due for republishing are spread randomly over that period of time (in seconds)
+republishJitter = checkRefreshInterval/2
+
+#: Records which are going to expire sooner are republished without delay (in seconds)
+republishUrgency = replicateInterval
+
+#: Global limits of the traffic spent for republishing: UDP packets and bytes per second
+republishPacketsPerSecond = 40
+republishBytesPerSecond = 32*1024
+
+#: Maximum number of records being republished at the same time
+republishConcurrency = 4
+
+#: Republishing of a record is skipped when that many other nodes already hold the same value
+republishFreshReplicas = 2
+
+#: Messages are sent in binary encoding to the peers which advertised at least that protocol version,
+#: others are receiving bencoded messages
+binaryEncodingVersion = 7
+
+#: Maximum number of remote addresses for which advertised protocol version is remembered
+peerVersionsLimit = 4096
+
 #: Max size of a single UDP datagram, in bytes. If a message is larger than this, it will
 #: be spread accross several UDP packets.
 udpDatagramMaxSize = 8192  # 8 KB
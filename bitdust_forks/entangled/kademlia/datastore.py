@@ -27,6 +27,10 @@ except ImportError:
 import sqlite3
 import os
 import json
+import time
+import threading
+
+from contextlib import contextmanager
 
 from . import constants  # @UnresolvedImport
 from . import encoding  # @UnresolvedImport
@@ -89,6 +93,39 @@ class DataStore(DictMixin):
         current time.
         """
 
+    @contextmanager
+    def transaction(self):
+        """
+        All writes made inside of that block are committed at once if the storage supports that.
+        """
+        yield self
+
+    def iterItems(self):
+        """
+        Yields all stored records in the same format as C{getItem} returns.
+        """
+        for key in self.keys():
+            item = self.getItem(key)
+            if item:
+                yield item
+
+    def removeExpired(self, now=None, excludeKeys=None):
+        """
+        Removes records which are older than their "expireSeconds" and returns list of removed keys.
+        """
+        if now is None:
+            now = int(time.time())
+        expired = []
+        for item in self.iterItems():
+            if excludeKeys and item['key'] in excludeKeys:
+                continue
+            if item.get('expireSeconds') and item.get('originallyPublished'):
+                if now - item['originallyPublished'] > item['expireSeconds']:
+                    expired.append(item['key'])
+        for key in expired:
+            del self[key]
+        return expired
+
     def __getitem__(self, key):
         """
         Get the value identified by C{key}
@@ -167,7 +204,7 @@ class DictDataStore(DataStore):
         should set the "last published" value for the (key, value) pair to the
         current time.
         """
-        self._dict[key] = (value, lastPublished, originallyPublished, originalPublisherID)
+        self._dict[key] = (value, lastPublished, originallyPublished, originalPublisherID, kwargs.get('expireSeconds', constants.dataExpireSecondsDefaut))
 
     def __getitem__(self, key):
         """
@@ -185,11 +222,13 @@ class DictDataStore(DataStore):
         try:
             row = self._dict[key]
             result = dict(
-                key=row[0].encode(),
-                value=row[1],
-                lastPublished=row[2],
-                originallyPublished=row[3],
-                originalPublisherID=None if not row[4] else row[4].encode(),
+                key=key,
+                value=row[0],
+                lastPublished=row[1],
+                originallyPublished=row[2],
+                originalPublisherID=row[3] or None,
+                expireSeconds=row[4],
+                revision=0,
             )
         except:
             return None
@@ -199,7 +238,15 @@ class DictDataStore(DataStore):
 class SQLiteVersionedJsonDataStore(DataStore):
     """
     SQLite database-based datastore.
+
+    Every record is a single row indexed by the primary key, the time when the record expires
+    is stored in a separate indexed column so expired records are removed with a single query.
+    Connection can be used from the reactor thread and from the republish thread.
     """
+
+    SCHEMA_VERSION = 1
+    COLUMNS = 'key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision'
+
     def __init__(self, dbFile=':memory:'):
         """
         @param dbFile: The name of the file containing the SQLite database; if
@@ -207,35 +254,59 @@ class SQLiteVersionedJsonDataStore(DataStore):
         @type dbFile: str
         """
         self.dbFile = dbFile
-        createDB = not os.path.exists(dbFile)
+        createDB = dbFile == ':memory:' or not os.path.exists(dbFile)
         if _Debug:
             print('[DHT DB] dbFile=%r   createDB=%r' % (
                 dbFile,
                 createDB,
             ))
-        self._db = sqlite3.connect(dbFile)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(dbFile, check_same_thread=False)
         self._db.isolation_level = None
         self._db.text_factory = encoding.to_text
+        if dbFile != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._cursor = self._db.cursor()
         if createDB:
             self.create_table()
             if _Debug:
                 print('[DHT DB]  Created empty table for DHT records')
-        self._cursor = self._db.cursor()
+        else:
+            self.upgrade_table()
 
     def _dbQuery(self, key, columnName):
-        try:
-            self._cursor.execute(
-                'SELECT %s FROM data WHERE key=:reqKey' % columnName,
-                {
-                    'reqKey': key,
-                },
-            )
-            row = self._cursor.fetchone()
-            value = row[0]
-        except:
-            raise KeyError(key)
-        else:
-            return value
+        with self._lock:
+            try:
+                self._cursor.execute(
+                    'SELECT %s FROM data WHERE key=:reqKey' % columnName,
+                    {
+                        'reqKey': encoding.to_text(key),
+                    },
+                )
+                row = self._cursor.fetchone()
+                value = row[0]
+            except:
+                raise KeyError(key)
+            else:
+                return value
+
+    def _rowToItem(self, row):
+        v = row[1]
+        if isinstance(v, buffer):
+            v = encoding.to_text(v)
+        v = json.loads(v)
+        # TODO: check / verify v['k'] against key
+        # TODO: check / verify v['v'] against PROTOCOL_VERSION
+        return dict(
+            key=row[0],
+            value=v['d'],
+            lastPublished=row[2],
+            originallyPublished=row[3],
+            originalPublisherID=row[4] or None,
+            expireSeconds=row[5],
+            revision=row[6],
+        )
 
     def __getitem__(self, key):
         v = self._dbQuery(key, 'value')
@@ -243,24 +314,88 @@ class SQLiteVersionedJsonDataStore(DataStore):
         return v['d']
 
     def __delitem__(self, key):
-        self._cursor.execute('DELETE FROM data WHERE key=:reqKey', {
-            'reqKey': key,
-        })
+        with self._lock:
+            self._cursor.execute('DELETE FROM data WHERE key=:reqKey', {
+                'reqKey': encoding.to_text(key),
+            })
+
+    def __contains__(self, key):
+        with self._lock:
+            self._cursor.execute('SELECT 1 FROM data WHERE key=:reqKey', {
+                'reqKey': encoding.to_text(key),
+            })
+            return self._cursor.fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            self._cursor.execute('SELECT COUNT(*) FROM data')
+            return self._cursor.fetchone()[0]
 
     def create_table(self):
-        self._db.execute('CREATE TABLE data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision)')
+        with self._lock:
+            self._db.execute('CREATE TABLE data(key TEXT PRIMARY KEY, value, lastPublished INTEGER, originallyPublished INTEGER, originalPublisherID, expireSeconds INTEGER, revision INTEGER, expireTime INTEGER)')
+            self._db.execute('CREATE INDEX data_expire_time ON data(expireTime)')
+            self._db.execute('PRAGMA user_version=%d' % self.SCHEMA_VERSION)
+
+    def upgrade_table(self):
+        """
+        Moves records from the old "data" table without primary key into the new schema,
+        only the latest row is kept for every key.
+        """
+        with self._lock:
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return False
+            if not self._db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='data'").fetchone():
+                self.create_table()
+                return True
+            with self.transaction():
+                self._db.execute('ALTER TABLE data RENAME TO data_old')
+                self.create_table()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO data(%s, expireTime) SELECT %s, '
+                    'CASE WHEN expireSeconds AND originallyPublished THEN originallyPublished + expireSeconds ELSE NULL END '
+                    'FROM data_old ORDER BY rowid' % (self.COLUMNS, self.COLUMNS)
+                )
+                self._db.execute('DROP TABLE data_old')
+            if _Debug:
+                print('[DHT DB] %r upgraded from version %d to %d' % (self.dbFile, version, self.SCHEMA_VERSION))
+            return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        All writes made inside of that block are committed at once::
+
+            with store.transaction():
+                store.setItem(...)
+                store.setItem(...)
+        """
+        with self._lock:
+            if self._db.in_transaction:
+                yield self
+                return
+            self._db.execute('BEGIN')
+            try:
+                yield self
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+            else:
+                self._db.execute('COMMIT')
 
     def keys(self):
         """
         Return a list of the keys in this data store.
         """
         keys = []
-        try:
-            self._cursor.execute('SELECT key FROM data')
-            for row in self._cursor:
-                keys.append(row[0])
-        finally:
-            return keys
+        with self._lock:
+            try:
+                self._cursor.execute('SELECT key FROM data')
+                for row in self._cursor:
+                    keys.append(row[0])
+            finally:
+                return keys
 
     def lastPublished(self, key):
         """
@@ -302,15 +437,20 @@ class SQLiteVersionedJsonDataStore(DataStore):
             return 0
 
     def setItem(self, key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds=constants.dataExpireSecondsDefaut, **kwargs):
+        """
+        Inserts new record or updates existing one with a single query.
+        If `revision` is not passed it is incremented automatically.
+        """
         key_hex = encoding.to_text(key)
         new_revision = kwargs.get('revision', None)
-        if new_revision is None:
-            new_revision = self.revision(key) + 1
-        self._cursor.execute('select key from data where key=:reqKey', {'reqKey': key_hex})
-        opID = originalPublisherID or None
-        if self._cursor.fetchone() is None:
+        expireTime = (originallyPublished + expireSeconds) if (expireSeconds and originallyPublished) else None
+        with self._lock:
             self._cursor.execute(
-                'INSERT INTO data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision) VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                'INSERT INTO data(%s, expireTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value=excluded.value, lastPublished=excluded.lastPublished, '
+                'originallyPublished=excluded.originallyPublished, originalPublisherID=excluded.originalPublisherID, '
+                'expireSeconds=excluded.expireSeconds, expireTime=excluded.expireTime, '
+                'revision=CASE WHEN ? THEN excluded.revision ELSE data.revision + 1 END' % self.COLUMNS, (
                     key_hex,
                     json.dumps({
                         'k': key_hex,
@@ -319,102 +459,72 @@ class SQLiteVersionedJsonDataStore(DataStore):
                     }),
                     lastPublished,
                     originallyPublished,
-                    opID,
+                    originalPublisherID or None,
                     expireSeconds,
-                    new_revision,
+                    1 if new_revision is None else new_revision,
+                    expireTime,
+                    new_revision is not None,
                 )
             )
-            if _Debug:
-                print('[DHT DB] %r setItem  stored new value for key [%s] with revision %d' % (self.dbFile, key, new_revision))
-        else:
-            self._cursor.execute(
-                'UPDATE data SET value=?, lastPublished=?, originallyPublished=?, originalPublisherID=?, expireSeconds=?, revision=? WHERE key=?', (
-                    json.dumps({
-                        'k': key_hex,
-                        'd': value,
-                        'v': PROTOCOL_VERSION,
-                    }),
-                    lastPublished,
-                    originallyPublished,
-                    opID,
-                    expireSeconds,
-                    new_revision,
-                    key_hex,
-                )
-            )
-            if _Debug:
-                print('[DHT DB] %r setItem  updated existing value for key [%s] with revision %d' % (self.dbFile, key, new_revision))
+        if _Debug:
+            print('[DHT DB] %r setItem  stored value for key [%s] with revision %r' % (self.dbFile, key, new_revision))
 
     def getItem(self, key):
-        key_hex = key
-        key_hex = encoding.to_text(key)
-        self._cursor.execute('SELECT * FROM data WHERE key=:reqKey', {
-            'reqKey': key_hex,
-        })
-
-        row = self._cursor.fetchone()
+        """
+        Returns all fields of a single record as a dictionary or None if key was not found.
+        """
+        with self._lock:
+            self._cursor.execute('SELECT %s FROM data WHERE key=:reqKey' % self.COLUMNS, {
+                'reqKey': encoding.to_text(key),
+            })
+            row = self._cursor.fetchone()
         if not row:
             if _Debug:
-                print('[DHT DB] %r getItem [%s]  return None : did not found key in dataStore' % (self.dbfile, key))
+                print('[DHT DB] %r getItem [%s]  return None : did not found key in dataStore' % (self.dbFile, key))
             return None
-
-        v = row[1]
-        if isinstance(v, buffer):
-            v = encoding.to_text(v)
-
-        v = json.loads(v)
-
-        # TODO: check / verify v['k'] against key_hex
-        # TODO: check / verify v['v'] against PROTOCOL_VERSION
-
-        value = v['d']
-
-        key_orig = row[0]
-
-        # TODO: check / verify key_orig against key
-
-        opID = row[4] or None
-
-        result = dict(
-            key=key_orig,
-            value=value,
-            lastPublished=row[2],
-            originallyPublished=row[3],
-            originalPublisherID=opID,
-            expireSeconds=row[5],
-            revision=row[6],
-        )
-
+        result = self._rowToItem(row)
         if _Debug:
-            print('[DHT DB] %r getItem   found one record for key [%s], revision is %d' % (self.dbFile, key, row[6]))
+            print('[DHT DB] %r getItem   found one record for key [%s], revision is %d' % (self.dbFile, key, result['revision']))
         return result
 
+    def iterItems(self, batchSize=1000):
+        """
+        Yields all records in the same format as ``getItem()`` returns, rows are fetched in batches with a single query.
+        """
+        cursor = self._db.cursor()
+        with self._lock:
+            cursor.execute('SELECT %s FROM data ORDER BY key' % self.COLUMNS)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batchSize)
+            if not rows:
+                break
+            for row in rows:
+                yield self._rowToItem(row)
+        cursor.close()
+
     def getAllItems(self):
-        self._cursor.execute('SELECT * FROM data')
-        rows = self._cursor.fetchall()
         items = []
-        for row in rows:
-
-            v = row[1]
-            if isinstance(v, buffer):
-                v = encoding.to_text(v)
-
-            v = json.loads(v)
-
-            # TODO: check / verify v['k'] against key_hex
-            # TODO: check / verify v['v'] against PROTOCOL_VERSION
-
-            value = v['d']
-
-            _k = row[0]
-            _opID = row[4] or None
-
-            items.append(dict(
-                value=value,
-                lastPublished=row[2],
-                originallyPublished=row[3],
-                originalPublisherID=_opID,
-                expireSeconds=row[5],
-                revision=row[6],
-            ))
+        for item in self.iterItems():
+            item.pop('key')
+            items.append(item)
         return items
+
+    def removeExpired(self, now=None, excludeKeys=None):
+        """
+        Removes all records which are older than their "expireSeconds", uses index on "expireTime" column.
+        Returns list of removed keys.
+        """
+        if now is None:
+            now = int(time.time())
+        excludeKeys = [encoding.to_text(k) for k in (excludeKeys or [])]
+        condition = 'expireTime<?'
+        if excludeKeys:
+            condition += ' AND key NOT IN (%s)' % ','.join(['?']*len(excludeKeys))
+        params = [now] + excludeKeys
+        with self.transaction():
+            self._cursor.execute('SELECT key FROM data WHERE %s' % condition, params)
+            expired = [row[0] for row in self._cursor.fetchall()]
+            if expired:
+                self._cursor.execute('DELETE FROM data WHERE %s' % condition, params)
+        return expired
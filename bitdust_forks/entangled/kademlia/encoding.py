@@ -17,8 +17,10 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 import six
-import codecs
 import sys
+import codecs
+import struct
+import binascii
 
 if sys.version_info[0] == 3:
     text_type = str
@@ -244,7 +246,7 @@ class Bencode(Encoding):
                 key, startIndex = Bencode._decodeRecursive(data, startIndex, encoding=encoding)
                 value, startIndex = Bencode._decodeRecursive(data, startIndex, encoding=encoding)
                 decodedDict[key] = value
-            return (decodedDict, startIndex)
+            return (decodedDict, startIndex + 1)
         elif data[startIndex:startIndex + 1] == b'f':
             # This (float data type) is a non-standard extension to the original Bencode algorithm
             endPos = data[startIndex:].find(b'e') + startIndex
@@ -258,3 +260,203 @@ class Bencode(Encoding):
             if encoding:
                 byts = byts.decode(encoding=encoding)
             return (byts, endPos)
+
+
+class Binary(Encoding):
+    """
+    Compact binary encoding of RPC messages.
+
+    Every item is prefixed with a single byte tag followed by a fixed size
+    number, or by the length of a string or a collection. Node IDs, RPC IDs
+    and other 160-bit hex identifiers are packed into 20 raw bytes, strings
+    (including JSON values) are copied as they are.
+
+    Decoded values are the same as L{Bencode} produces: C{None} becomes
+    C{0}, tuples become lists and strings are decoded only if C{encoding}
+    is given, so both encodings are interchangeable for the same message.
+    Encoded data always starts with the C{marker} byte, which never starts
+    a bencoded message.
+    """
+    marker = b'\xbd'
+
+    tagInt8, tagInt32, tagInt64, tagBigInt, tagFloat, tagStr8, tagStr32, tagHex, tagList8, tagList32, tagDict8, tagDict32 = [six.int2byte(i) for i in range(1, 13)]
+
+    _int8 = struct.Struct('>b')
+    _int32 = struct.Struct('>i')
+    _int64 = struct.Struct('>q')
+    _uint8 = struct.Struct('>B')
+    _uint32 = struct.Struct('>I')
+    _float = struct.Struct('>d')
+
+    def encode(self, data, encoding='utf-8'):
+        """
+        Encode the specified data into compact binary form.
+
+        @param data: The data to encode
+        @type data: int, long, float, tuple, list, dict or str
+
+        @return: The encoded data or None if data can not be encoded
+        @rtype: bytes
+        """
+        parts = [self.marker]
+        try:
+            self._encodeRecursive(data, parts, encoding)
+            ret = b''.join(parts)
+            if _Debug:
+                print('[DHT ENCODING]         binary encode  %r  into  %d bytes' % (
+                    type(data),
+                    len(ret),
+                ))
+            return ret
+        except Exception as exc:
+            if _Debug:
+                print('[DHT ENCODING]         binary encode failed with: %r' % exc)
+
+    def decode(self, data, encoding=None):
+        """
+        Decode data encoded with C{encode()}.
+
+        @return: The decoded data, as a native Python type
+        @rtype:  int, float, list, dict or str
+        """
+        try:
+            if data[0:1] != self.marker:
+                raise ValueError('binary encoding marker not found')
+            ret, endPos = self._decodeRecursive(data, 1, encoding)
+            if endPos != len(data):
+                raise ValueError('unexpected %d bytes at the end' % (len(data) - endPos))
+            if _Debug:
+                print('[DHT ENCODING]         binary decode %r  endPos=%d' % (
+                    type(ret),
+                    endPos,
+                ))
+            return ret
+        except Exception as exc:
+            if _Debug:
+                print('[DHT ENCODING]         binary decode failed with: %r' % exc)
+
+    def _encodeRecursive(self, data, parts, encoding):
+        if data is None:
+            data = 0
+        if isinstance(data, six.integer_types):
+            if -0x80 <= data < 0x80:
+                parts.append(self.tagInt8 + self._int8.pack(data))
+            elif -0x80000000 <= data < 0x80000000:
+                parts.append(self.tagInt32 + self._int32.pack(data))
+            elif -0x8000000000000000 <= data < 0x8000000000000000:
+                parts.append(self.tagInt64 + self._int64.pack(data))
+            else:
+                digits = str(data).encode('ascii')
+                parts.append(self.tagBigInt + self._uint8.pack(len(digits)) + digits)
+        elif isinstance(data, (six.text_type, six.binary_type)):
+            if len(data) == 40:
+                # Node IDs and RPC IDs are hex encoded SHA1 digests, only lower case form can be restored back
+                try:
+                    raw = binascii.unhexlify(data)
+                    if binascii.hexlify(raw) == to_bin(data):
+                        parts.append(self.tagHex + raw)
+                        return
+                except (TypeError, ValueError, binascii.Error):
+                    pass
+            if isinstance(data, six.text_type):
+                data = data.encode(encoding=encoding or 'utf-8')
+            if len(data) < 0x100:
+                parts.append(self.tagStr8 + self._uint8.pack(len(data)))
+            else:
+                parts.append(self.tagStr32 + self._uint32.pack(len(data)))
+            parts.append(data)
+        elif isinstance(data, (list, tuple)):
+            if len(data) < 0x100:
+                parts.append(self.tagList8 + self._uint8.pack(len(data)))
+            else:
+                parts.append(self.tagList32 + self._uint32.pack(len(data)))
+            for item in data:
+                self._encodeRecursive(item, parts, encoding)
+        elif isinstance(data, dict):
+            if len(data) < 0x100:
+                parts.append(self.tagDict8 + self._uint8.pack(len(data)))
+            else:
+                parts.append(self.tagDict32 + self._uint32.pack(len(data)))
+            for k, v in data.items():
+                self._encodeRecursive(k, parts, encoding)
+                self._encodeRecursive(v, parts, encoding)
+        elif isinstance(data, float):
+            parts.append(self.tagFloat + self._float.pack(data))
+        else:
+            raise TypeError("Cannot encode '%s' object" % type(data))
+
+    def _decodeRecursive(self, data, pos, encoding):
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == self.tagStr8 or tag == self.tagStr32:
+            if tag == self.tagStr8:
+                length = self._uint8.unpack_from(data, pos)[0]
+                pos += 1
+            else:
+                length = self._uint32.unpack_from(data, pos)[0]
+                pos += 4
+            if pos + length > len(data):
+                raise ValueError('string is out of range')
+            byts = data[pos:pos + length]
+            if encoding:
+                byts = byts.decode(encoding=encoding)
+            return (byts, pos + length)
+        elif tag == self.tagHex:
+            if pos + 20 > len(data):
+                raise ValueError('identifier is out of range')
+            byts = binascii.hexlify(data[pos:pos + 20])
+            if encoding:
+                byts = byts.decode(encoding=encoding)
+            return (byts, pos + 20)
+        elif tag == self.tagInt8:
+            return (self._int8.unpack_from(data, pos)[0], pos + 1)
+        elif tag == self.tagInt32:
+            return (self._int32.unpack_from(data, pos)[0], pos + 4)
+        elif tag == self.tagInt64:
+            return (self._int64.unpack_from(data, pos)[0], pos + 8)
+        elif tag == self.tagFloat:
+            return (self._float.unpack_from(data, pos)[0], pos + 8)
+        elif tag == self.tagList8 or tag == self.tagList32:
+            if tag == self.tagList8:
+                count = self._uint8.unpack_from(data, pos)[0]
+                pos += 1
+            else:
+                count = self._uint32.unpack_from(data, pos)[0]
+                pos += 4
+            decodedList = []
+            for _ in range(count):
+                item, pos = self._decodeRecursive(data, pos, encoding)
+                decodedList.append(item)
+            return (decodedList, pos)
+        elif tag == self.tagDict8 or tag == self.tagDict32:
+            if tag == self.tagDict8:
+                count = self._uint8.unpack_from(data, pos)[0]
+                pos += 1
+            else:
+                count = self._uint32.unpack_from(data, pos)[0]
+                pos += 4
+            decodedDict = {}
+            for _ in range(count):
+                key, pos = self._decodeRecursive(data, pos, encoding)
+                value, pos = self._decodeRecursive(data, pos, encoding)
+                decodedDict[key] = value
+            return (decodedDict, pos)
+        elif tag == self.tagBigInt:
+            length = self._uint8.unpack_from(data, pos)[0]
+            pos += 1
+            return (int(data[pos:pos + length].decode('ascii')), pos + length)
+        raise ValueError('unknown tag %r at position %d' % (tag, pos - 1))
+
+
+def decoderFor(data):
+    """
+    Returns encoding instance which is able to decode the given data: all
+    nodes are able to receive both bencoded and binary encoded messages.
+    """
+    if data[0:1] == Binary.marker:
+        return _BinaryEncoding
+    return _Bencode
+
+
+_Bencode = Bencode()
+_BinaryEncoding = Binary()
@@ -90,7 +90,8 @@ class DefaultFormat(MessageTranslator):
 
 class MultiLayerFormat(MessageTranslator):
     typeRequest, typeResponse, typeError, typeQuestion = list(range(4))
-    headerType, headerMsgID, headerNodeID, headerPayload, headerArgs, headerLayer = list(range(6))
+    # The protocol version of the sender is optional and is added by the protocol itself
+    headerType, headerMsgID, headerNodeID, headerPayload, headerArgs, headerLayer, headerVersion = list(range(7))
 
     def fromPrimitive(self, msgPrimitive):
         msgType = msgPrimitive[self.headerType]
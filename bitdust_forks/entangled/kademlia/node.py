@@ -435,9 +435,9 @@ class Node(object):
                     # Now, see if we have the value (it might seem wasteful to search on the network
                     # first, but it ensures that all values are properly propagated through the
                     # network
-                    if key in self._dataStore:
+                    item = self._dataStore.getItem(key)
+                    if item:
                         # Ok, we have the value locally, so use that
-                        item = self._dataStore.getItem(key)
                         expireSeconds = item.get('expireSeconds', constants.dataExpireSecondsDefaut)
                         # Send this value to the closest node without it
                         if len(result['activeContacts']) > 0:
@@ -466,9 +466,9 @@ class Node(object):
                 # Now, see if we have the value (it might seem wasteful to search on the network
                 # first, but it ensures that all values are properly propagated through the
                 # network
-                if key in self._dataStore:
+                item = self._dataStore.getItem(key)
+                if item:
                     # Ok, we have the value locally, so use that
-                    item = self._dataStore.getItem(key)
                     expireSeconds = item.get('expireSeconds', constants.dataExpireSecondsDefaut)
                     # Send this value to the closest node without it
                     if len(result) > 0:
@@ -660,21 +660,14 @@ class Node(object):
         #     self._counter('rpc_node_findValue')
         if _Debug:
             print('[DHT NODE] SINGLE rpcmethod.findValue %r' % key)
-        if key in self._dataStore:
-            exp = None
-            expireSecondsCall = getattr(self._dataStore, 'expireSeconds')
-            if expireSecondsCall:
-                exp = expireSecondsCall(key)
-            originalPublishTimeCall = getattr(self._dataStore, 'originalPublishTime')
-            published = None
-            if originalPublishTimeCall:
-                published = originalPublishTimeCall(key)
+        item = self._dataStore.getItem(key)
+        if item:
             if _Debug:
-                print('[DHT NODE]  SINGLE    found key in local dataStore %r' % self._dataStore[key])
+                print('[DHT NODE]  SINGLE    found key in local dataStore %r' % item['value'])
             return {
-                key: self._dataStore[key],
-                'expireSeconds': exp,
-                'originallyPublished': published,
+                key: item['value'],
+                'expireSeconds': item.get('expireSeconds'),
+                'originallyPublished': item.get('originallyPublished'),
             }
         if _Debug:
             print('[DHT NODE] SINGLE     NOT found key in local dataStore')
@@ -1006,7 +999,8 @@ class Node(object):
         if _Debug:
             print('[DHT NODE]  SINGLE republishData called, node: %r' % self.id)
         expiredKeys = []
-        for key in self._dataStore.keys():
+        for itemData in self._dataStore.iterItems():
+            key = itemData['key']
             if _Debug:
                 print('[DHT NODE]  SINGLE    %r' % key)
             # Filter internal variables stored in the datastore
@@ -1014,7 +1008,6 @@ class Node(object):
                 continue
 
             now = int(time.time())
-            itemData = self._dataStore.getItem(key)
             originallyPublished = itemData['originallyPublished']
             originalPublisherID = itemData['originalPublisherID']
             lastPublished = itemData['lastPublished']
@@ -1043,13 +1036,14 @@ class Node(object):
                     twisted.internet.reactor.callFromThread(  # @UndefinedVariable
                         self.iterativeStore,
                         key=key,
-                        value=self._dataStore[key],
+                        value=itemData['value'],
                         originalPublisherID=originalPublisherID,
                         age=age,
                         expireSeconds=expireSeconds,
                     )
-        for key in expiredKeys:
-            del self._dataStore[key]
+        with self._dataStore.transaction():
+            for key in expiredKeys:
+                del self._dataStore[key]
 
 
 class MultiLayerNode(Node):
@@ -1075,6 +1069,9 @@ class MultiLayerNode(Node):
         self.bytes_in = 0
         self.bytes_out = 0
 
+        # Optional republisher.RepublishScheduler, when set the stored records are republished in the background
+        self.republisher = None
+
         # This will contain a deferred created when joining the network, to enable publishing/retrieving information from
         # the DHT as soon as the node is part of the network (add callbacks to this deferred if scheduling such operations
         # before the node has finished joining the network)
@@ -1331,7 +1328,12 @@ class MultiLayerNode(Node):
         df = self._iterativeFind(key, rpc='delete', layerID=layerID, parallel_calls=parallel_calls)
         return df
 
-    def iterativeFindValue(self, key, rpc='findValue', refresh_revision=False, layerID=0, parallel_calls=None):
+    def iterativeFindValue(self, key, rpc='findValue', refresh_revision=False, layerID=0, parallel_calls=None, quorum=1, validator=None):
+        """
+        Searches the DHT for the value stored under C{key}. The lookup stops
+        when C{quorum} equal values accepted by the C{validator} callable
+        were received, see C{_iterativeFind()}.
+        """
         outerDf = defer.Deferred()
 
         def storeFailed(x):
@@ -1385,9 +1387,9 @@ class MultiLayerNode(Node):
                     # Now, see if we have the value (it might seem wasteful to search on the network
                     # first, but it ensures that all values are properly propagated through the
                     # network
-                    if key in self._dataStores[layerID]:
+                    item = self._dataStores[layerID].getItem(key)
+                    if item:
                         # Ok, we have the value locally, so use that
-                        item = self._dataStores[layerID].getItem(key)
                         expireSeconds = item.get('expireSeconds', constants.dataExpireSecondsDefaut)
                         # Send this value to the closest node without it
                         if len(result['activeContacts']) > 0:
@@ -1416,9 +1418,9 @@ class MultiLayerNode(Node):
                 # Now, see if we have the value (it might seem wasteful to search on the network
                 # first, but it ensures that all values are properly propagated through the
                 # network
-                if key in self._dataStores[layerID]:
+                item = self._dataStores[layerID].getItem(key)
+                if item:
                     # Ok, we have the value locally, so use that
-                    item = self._dataStores[layerID].getItem(key)
                     expireSeconds = item.get('expireSeconds', constants.dataExpireSecondsDefaut)
                     # Send this value to the closest node without it
                     if len(result) > 0:
@@ -1447,7 +1449,7 @@ class MultiLayerNode(Node):
                     outerDf.callback(result)
 
         # Execute the search
-        df = self._iterativeFind(key, rpc=rpc, layerID=layerID, parallel_calls=parallel_calls)
+        df = self._iterativeFind(key, rpc=rpc, layerID=layerID, parallel_calls=parallel_calls, quorum=quorum, validator=validator)
         df.addCallback(checkResult)
         df.addErrback(lookupFailed)
         return outerDf
@@ -1458,6 +1460,14 @@ class MultiLayerNode(Node):
     def removeContact(self, contactID, layerID=0):
         self._routingTables[layerID].removeContact(contactID)
 
+    def contactResponded(self, contactID, rtt, layerID=0):
+        if layerID in self._routingTables:
+            self._routingTables[layerID].updateRTT(contactID, rtt)
+
+    def contactFailed(self, contactID, layerID=0):
+        if layerID in self._routingTables:
+            self._routingTables[layerID].failedRPC(contactID)
+
     def findContact(self, contactID, layerID=0, parallel_calls=None):
         try:
             contact = self._routingTables[layerID].getContact(contactID)
@@ -1577,36 +1587,51 @@ class MultiLayerNode(Node):
             return []
         if _Debug:
             print('[DHT NODE]    rpcmethod.findValue %r layerID=%r : %r' % (key, layerID, kwargs))
-        if key in self._dataStores[layerID]:
-            exp = None
-            expireSecondsCall = getattr(self._dataStores[layerID], 'expireSeconds')
-            if expireSecondsCall:
-                exp = expireSecondsCall(key)
-            originalPublishTimeCall = getattr(self._dataStores[layerID], 'originalPublishTime')
-            published = None
-            if originalPublishTimeCall:
-                published = originalPublishTimeCall(key)
+        item = self._dataStores[layerID].getItem(key)
+        if item:
             if _Debug:
-                print('[DHT NODE]        found key in local dataStore %r' % self._dataStores[layerID][key])
+                print('[DHT NODE]        found key in local dataStore %r' % item['value'])
             return {
-                key: self._dataStores[layerID][key],
-                'expireSeconds': exp,
-                'originallyPublished': published,
+                key: item['value'],
+                'expireSeconds': item.get('expireSeconds'),
+                'originallyPublished': item.get('originallyPublished'),
+                'revision': item.get('revision', 0),
             }
         if _Debug:
             print('[DHT NODE]        NOT found key in local dataStore')
         return self.findNode(key, **kwargs)
 
-    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode', deep=False, layerID=0, parallel_calls=None):
+    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode', deep=False, layerID=0, parallel_calls=None, quorum=1, validator=None):
+        """
+        The basic Kademlia iterative lookup operation (for nodes/values),
+        see C{Node._iterativeFind()}.
+
+        If C{parallel_calls} is not set and C{constants.adaptiveLookups} is
+        enabled the lookup adapts to the network conditions: the degree of
+        parallelism follows the observed failure rate, closest contacts are
+        queried fastest first and when pending RPCs are late (according to
+        the measured round-trip time) extra RPCs are sent to the next contacts
+        instead of waiting for C{constants.iterativeLookupDelay}.
+
+        When looking for a value the search stops as soon as C{quorum} equal
+        values were received, values not accepted by the C{validator}
+        callable are ignored.
+        """
         if _Debug:
             print('[DHT NODE]    _iterativeFind   layerID=%d   rpc=%r   key=%r  startupShortlist=%r routingTables=%r parallel_calls=%r' % (layerID, rpc, key, startupShortlist, self._routingTables, parallel_calls))
         if rpc != 'findNode':
             findValue = True
         else:
             findValue = False
+        routingTable = self._routingTables.get(layerID)
+        adaptive = constants.adaptiveLookups and not parallel_calls and routingTable is not None
+        if adaptive:
+            alpha = routingTable.lookupConcurrency()
+        else:
+            alpha = parallel_calls or constants.alpha
         shortlist = []
         if startupShortlist is None:
-            shortlist = self._routingTables[layerID].findCloseNodes(key, parallel_calls or constants.alpha)
+            shortlist = self._routingTables[layerID].findCloseNodes(key, alpha)
             if key != self.layers[layerID]:
                 # Update the "last accessed" timestamp for the appropriate k-bucket
                 self._routingTables[layerID].touchKBucket(key)
@@ -1625,6 +1650,9 @@ class MultiLayerNode(Node):
         # List of active queries; len() indicates number of active probes
         # - using lists for these variables, because Python doesn't allow binding a new value to a name in an enclosing (non-global) scope
         activeProbes = []
+        # Sending time of every active probe, and the probes which did not respond in expected time
+        probesStarted = {}
+        lateProbes = set()
         # List of contact IDs that have already been queried
         alreadyContacted = []
         # Probes that were active during the previous iteration
@@ -1636,8 +1664,54 @@ class MultiLayerNode(Node):
         findValueResult = {
             'values': [],
         }
+        # Number of received responses for every distinct (value, revision) pair
+        valueVotes = {}
         slowNodeCount = [0]
 
+        def distanceToKey(cont):
+            return self._routingTables[layerID].distance(cont.id, key)
+
+        def quorumReached():
+            return bool(valueVotes) and max(valueVotes.values()) >= quorum
+
+        def isValid(value):
+            if validator is None:
+                return True
+            try:
+                return bool(validator(value))
+            except:
+                return False
+
+        def finishLookup():
+            while len(pendingIterationCalls):
+                call = pendingIterationCalls.pop(0)
+                if call.active():
+                    call.cancel()
+            if outerDf.called:
+                return
+            activeContacts.sort(key=distanceToKey)
+            if findValue:
+                findValueResult['activeContacts'] = activeContacts
+                outerDf.callback(findValueResult)
+            else:
+                outerDf.callback(activeContacts)
+
+        def nextIterationDelay(now):
+            if not adaptive:
+                return constants.iterativeLookupDelay
+            hedgeDelay = routingTable.hedgeDelay()
+            # Wake up when the first of the pending probes becomes late...
+            pending = [started + hedgeDelay - now for started in probesStarted.values() if now - started < hedgeDelay]
+            if pending:
+                return max(min(pending), constants.minHedgeDelay)
+            # ...or give late probes same amount of time as non-adaptive lookup does
+            return max(max(probesStarted.values()) + constants.iterativeLookupDelay - now, constants.minHedgeDelay)
+
+        def probeFinished(result, probeID):
+            probesStarted.pop(probeID, None)
+            lateProbes.discard(probeID)
+            return result
+
         def extendShortlist(responseTuple):
             """ @type responseMsg: kademlia.msgtypes.ResponseMessage """
             # The "raw response" tuple contains the response message, and the originating address info
@@ -1646,6 +1720,9 @@ class MultiLayerNode(Node):
             # Make sure the responding node is valid, and abort the operation if it isn't
             if _Debug:
                 print('[DHT NODE]        responseTuple:', responseTuple)
+            if outerDf.called:
+                # The lookup is already finished, late responses are ignored
+                return responseMsg.nodeID
             if responseMsg.nodeID in activeContacts or responseMsg.nodeID == self.layers[layerID]:
                 if _Debug:
                     if responseMsg.nodeID == self.layers[layerID]:
@@ -1672,16 +1749,28 @@ class MultiLayerNode(Node):
             # If we are looking for a value, first see if this result is the value
             # we are looking for before treating it as a list of contact triples
             if findValue and isinstance(result, dict):
+                if not isValid(result.get(key)):
+                    if _Debug:
+                        print('[DHT NODE]            value from %r is not valid' % aContact)
+                    return responseMsg.nodeID
                 # We have found the value
+                revision = result.get('revision', 0)
                 findValueResult[key] = result[key]
                 findValueResult['values'].append((
                     result[key],
-                    result.get('revision', 0),
+                    revision,
                     responseMsg.nodeID,
                     originAddress,
                 ))
                 if 'expireSeconds' in result:
                     findValueResult['expireSeconds'] = result['expireSeconds']
+                vote = (result[key], revision)
+                valueVotes[vote] = valueVotes.get(vote, 0) + 1
+                if not deep and quorumReached():
+                    if _Debug:
+                        print('[DHT NODE]    ++++++++++++++ DONE (findValue quorum of %d reached) +++++++++++++++\n\n' % quorum)
+                    # Enough equal values were received, no need to wait for other probes
+                    finishLookup()
             else:
                 if findValue:
                     # We are looking for a value, and the remote node didn't have it
@@ -1712,7 +1801,7 @@ class MultiLayerNode(Node):
 
         def cancelActiveProbe(contactID):
             activeProbes.pop()
-            if len(activeProbes) <= int((parallel_calls or constants.alpha)/2.0) and len(pendingIterationCalls):
+            if len(activeProbes) <= int(alpha/2.0) and len(pendingIterationCalls):
                 # Force the iteration
                 if not pendingIterationCalls[0].called:
                     pendingIterationCalls[0].cancel()
@@ -1723,27 +1812,47 @@ class MultiLayerNode(Node):
 
         # Send parallel, asynchronous FIND_NODE RPCs to the shortlist of contacts
         def searchIteration():
+            if outerDf.called:
+                return
             if not self._routingTables or layerID not in self._routingTables:
                 if _Debug:
                     print('[DHT NODE]    ++++++++++++++ searchIteration INTERRUPTED +++++++++++++++\n\n')
                 return
             slowNodeCount[0] = len(activeProbes)
             # Sort the discovered active nodes from closest to furthest
-            activeContacts.sort(key=lambda cont: self._routingTables[layerID].distance(cont.id, key))
+            activeContacts.sort(key=distanceToKey)
             if _Debug:
                 print('[DHT NODE]    ==> searchIteration %r' % activeContacts)
             # This makes sure a returning probe doesn't force calling this function by mistake
             while len(pendingIterationCalls):
                 del pendingIterationCalls[0]
+            now = time.time()
+            candidates = [contact for contact in shortlist if contact.id not in alreadyContacted]
+            freshProbes = len(activeProbes)
+            budget = alpha
+            if adaptive:
+                # Probes which did not respond in expected time are not counted, extra RPCs are sent instead of them
+                hedgeDelay = routingTable.hedgeDelay()
+                for probeID, started in probesStarted.items():
+                    if now - started >= hedgeDelay and probeID not in lateProbes:
+                        lateProbes.add(probeID)
+                        routingTable.failedRPC(probeID)
+                freshProbes = len(probesStarted) - len(lateProbes)
+                budget = max(0, alpha - freshProbes)
+                # Kademlia lookup converges only after the k closest contacts are queried
+                candidates.sort(key=distanceToKey)
+                closestCandidates = [contact for contact in sorted(shortlist, key=distanceToKey)[:constants.k] if contact.id not in alreadyContacted]
             # See if should continue the search
-            if key in findValueResult and not deep:
+            if findValue and not deep and quorumReached():
                 if _Debug:
                     print('[DHT NODE]    ++++++++++++++ DONE (findValue found) +++++++++++++++\n\n')
-                findValueResult['activeContacts'] = activeContacts
-                outerDf.callback(findValueResult)
+                finishLookup()
                 return
             if len(activeContacts) and findValue == False:
-                if (len(activeContacts) >= constants.k) or (activeContacts[0] == prevClosestNode[0] and len(activeProbes) == slowNodeCount[0]):
+                noImprovement = activeContacts[0] == prevClosestNode[0] and len(activeProbes) == slowNodeCount[0]
+                if adaptive:
+                    noImprovement = noImprovement and freshProbes == 0 and not closestCandidates
+                if (len(activeContacts) >= constants.k) or noImprovement:
                     # TODO: Re-send the FIND_NODEs to all of the k closest nodes not already queried
                     # Ok, we're done; either we have accumulated k active contacts or no improvement in closestNode has been noted
                     if len(activeContacts) >= constants.k:
@@ -1752,43 +1861,46 @@ class MultiLayerNode(Node):
                     else:
                         if _Debug:
                             print('[DHT NODE]    ++++++++++++++ DONE (test for closest node) +++++++++++++++\n\n')
-                    if findValue:
-                        findValueResult['activeContacts'] = activeContacts
-                        outerDf.callback(findValueResult)
-                    else:
-                        outerDf.callback(activeContacts)
+                    finishLookup()
                     return
             # The search continues...
             if len(activeContacts):
                 prevClosestNode[0] = activeContacts[0]
             contactedNow = 0
-            activeContacts.sort(key=lambda cont: self._routingTables[layerID].distance(cont.id, key))
+            if adaptive:
+                # Among the closest not yet queried contacts the fastest are contacted first
+                candidates = sorted(candidates[:budget*2], key=lambda cont: routingTable.expectedRTT(cont.id))
             # Store the current shortList length before contacting other nodes
             prevShortlistLength = len(shortlist)
-            for contact in shortlist:
-                if contact.id not in alreadyContacted:
-                    activeProbes.append(contact.id)
-                    rpcMethod = getattr(contact, rpc)
-                    if _Debug:
-                        print('[DHT NODE] calling RPC method %r with key=%r layerID=%d at %r' % (rpc, key, layerID, contact))
-                    df = rpcMethod(
-                        key,
-                        rawResponse=True,
-                        layerID=layerID,
-                    )
-                    df.addCallback(extendShortlist)
-                    df.addErrback(removeFromShortlist)
-                    df.addCallback(cancelActiveProbe)
-                    alreadyContacted.append(contact.id)
-                    contactedNow += 1
-                if contactedNow == (parallel_calls or constants.alpha):
+            for contact in candidates:
+                if contactedNow >= budget:
                     break
+                activeProbes.append(contact.id)
+                probesStarted[contact.id] = now
+                rpcMethod = getattr(contact, rpc)
+                if _Debug:
+                    print('[DHT NODE] calling RPC method %r with key=%r layerID=%d at %r' % (rpc, key, layerID, contact))
+                df = rpcMethod(
+                    key,
+                    rawResponse=True,
+                    layerID=layerID,
+                )
+                df.addBoth(probeFinished, contact.id)
+                df.addCallback(extendShortlist)
+                df.addErrback(removeFromShortlist)
+                df.addCallback(cancelActiveProbe)
+                alreadyContacted.append(contact.id)
+                contactedNow += 1
+            if outerDf.called:
+                return
+            waitForProbes = adaptive and len(probesStarted) > 0 and (len(probesStarted) > len(lateProbes) or now - max(probesStarted.values()) < constants.iterativeLookupDelay)
             if len(activeProbes) > slowNodeCount[0] \
-                    or (len(shortlist) < constants.k and len(activeContacts) < len(shortlist) and len(activeProbes) > 0):
+                    or (len(shortlist) < constants.k and len(activeContacts) < len(shortlist) and len(activeProbes) > 0) \
+                    or waitForProbes:
                 if _Debug:
                     print('[DHT NODE]    ----------- scheduling next call -------------')
                 # Schedule the next iteration if there are any active calls (Kademlia uses loose parallelism)
-                call = twisted.internet.reactor.callLater(constants.iterativeLookupDelay, searchIteration)  # IGNORE:E1101  @UndefinedVariable
+                call = twisted.internet.reactor.callLater(nextIterationDelay(now), searchIteration)  # IGNORE:E1101  @UndefinedVariable
                 pendingIterationCalls.append(call)
             # Check for a quick contact response that made an update to the shortList
             elif prevShortlistLength < len(shortlist):
@@ -1798,11 +1910,7 @@ class MultiLayerNode(Node):
                 if _Debug:
                     print('[DHT NODE]    ++++++++++++++ DONE (logically) +++++++++++++\n\n')
                 # If no probes were sent, there will not be any improvement, so we're done
-                if findValue:
-                    findValueResult['activeContacts'] = activeContacts
-                    outerDf.callback(findValueResult)
-                else:
-                    outerDf.callback(activeContacts)
+                finishLookup()
 
         outerDf = defer.Deferred()
         # Start the iterations
@@ -1902,30 +2010,28 @@ class MultiLayerNode(Node):
         if _Debug:
             print('[DHT NODE]    republishData called, node: %r' % self.layers[layerID])
         expiredKeys = []
-        for key in self._dataStores[layerID].keys():
+        for itemData in self._dataStores[layerID].iterItems():
+            key = itemData['key']
             if _Debug:
                 print('[DHT NODE]        %r' % key)
             # Filter internal variables stored in the datastore
-            if key == 'nodeState':
+            if key == 'nodeState' or key == self.nodeStateKey:
                 continue
 
             now = int(time.time())
-            itemData = self._dataStores[layerID].getItem(key)
             originallyPublished = itemData['originallyPublished']
             originalPublisherID = itemData['originalPublisherID']
             lastPublished = itemData['lastPublished']
-            expireSeconds = itemData['expireSeconds']
             age = now - originallyPublished
             if originalPublisherID == self.layers[layerID]:
                 # This node is the original publisher; it has to republish
                 # the data before it expires (24 hours in basic Kademlia)
                 if age >= constants.dataExpireTimeout:
                     twisted.internet.reactor.callFromThread(  # @UndefinedVariable
-                        self.iterativeStore,
-                        key=key,
-                        value=itemData['value'],
-                        expireSeconds=expireSeconds,
+                        self._scheduleRepublish,
+                        itemData,
                         layerID=layerID,
+                        original=True,
                     )
             else:
                 # This node needs to replicate the data at set intervals,
@@ -1938,16 +2044,37 @@ class MultiLayerNode(Node):
                 elif now - lastPublished >= constants.replicateInterval:
                     # ...data has not yet expired, and we need to replicate it
                     twisted.internet.reactor.callFromThread(  # @UndefinedVariable
-                        self.iterativeStore,
-                        key=key,
-                        value=self._dataStore[key],
-                        originalPublisherID=originalPublisherID,
-                        age=age,
-                        expireSeconds=expireSeconds,
+                        self._scheduleRepublish,
+                        itemData,
                         layerID=layerID,
+                        original=False,
                     )
-        for key in expiredKeys:
-            del self._dataStores[layerID][key]
+        with self._dataStores[layerID].transaction():
+            for key in expiredKeys:
+                del self._dataStores[layerID][key]
+
+    def _scheduleRepublish(self, itemData, layerID=0, original=False):
+        """
+        Passes the record to the republishing scheduler if the node has one,
+        otherwise stores it on the closest nodes right away.
+        """
+        if self.republisher:
+            return self.republisher.schedule(itemData, layerID=layerID, original=original)
+        if original:
+            return self.iterativeStore(
+                key=itemData['key'],
+                value=itemData['value'],
+                expireSeconds=itemData['expireSeconds'],
+                layerID=layerID,
+            )
+        return self.iterativeStore(
+            key=itemData['key'],
+            value=itemData['value'],
+            originalPublisherID=itemData['originalPublisherID'],
+            age=int(time.time()) - itemData['originallyPublished'],
+            expireSeconds=itemData['expireSeconds'],
+            layerID=layerID,
+        )
 
 if __name__ == '__main__':
     import sys
@@ -437,6 +437,30 @@ class KademliaProtocol(protocol.DatagramProtocol):
 class KademliaMultiLayerProtocol(KademliaProtocol):
     def __init__(self, node, msgEncoder=encoding.Bencode(), msgTranslator=msgformat.MultiLayerFormat()):
         KademliaProtocol.__init__(self, node, msgEncoder=msgEncoder, msgTranslator=msgTranslator)
+        # When set, the version is advertised in every message and enables binary encoding between peers
+        self.protocolVersion = None
+        self._binaryEncoder = encoding.Binary()
+        self._peerVersions = {}
+
+    def _encodeMessage(self, msg, address):
+        """
+        Translate and encode the message for the given remote address: peers
+        which advertised recent enough protocol version are receiving binary
+        encoded messages.
+        """
+        msgPrimitive = self._translator.toPrimitive(msg)
+        if self.protocolVersion:
+            msgPrimitive[self._translator.headerVersion] = self.protocolVersion
+            if self._peerVersions.get(address, 0) >= constants.binaryEncodingVersion:
+                return self._binaryEncoder.encode(msgPrimitive, encoding='utf-8')
+        return self._encoder.encode(msgPrimitive, encoding='utf-8')
+
+    def _rememberPeerVersion(self, address, version):
+        if not self.protocolVersion or not isinstance(version, six.integer_types):
+            return
+        if address not in self._peerVersions and len(self._peerVersions) >= constants.peerVersionsLimit:
+            self._peerVersions.clear()
+        self._peerVersions[address] = version
 
     def _write(self, data, address):
         self._node.bytes_out += len(data)
@@ -448,8 +472,7 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
             msg = msgtypes.QuestionMessage(self._node.layers[layerID], method, args, layerID=layerID)
         else:
             msg = msgtypes.RequestMessage(self._node.layers[layerID], method, args, layerID=layerID)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive, encoding='utf-8')
+        encodedMsg = self._encodeMessage(msg, (contact.address, contact.port))
         df = defer.Deferred()
         if rawResponse:
             df._rpcRawResponse = True
@@ -458,7 +481,8 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
         if self._counter:
             self._counter('sendRPC')
         timeoutCall = reactor.callLater(constants.rpcTimeout*3, self._msgTimeout, msg.id)  # IGNORE:E1101
-        self._sentMessages[msg.id] = (contact.id, df, timeoutCall, method)
+        # Sending time and layer are kept to measure round-trip time of the contact when response arrives
+        self._sentMessages[msg.id] = (contact.id, df, timeoutCall, method, time.time(), layerID, (contact.address, contact.port))
         self._send(encodedMsg, msg.id, (contact.address, contact.port))
         if layerID not in self._node.packets_out:
             self._node.packets_out[layerID] = 0
@@ -468,10 +492,11 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
     def dispatch(self, datagram, address):
         if _Debug:
             print('[DHT PROTO]    dispatch datagram of %d bytes to dispatch from %r' % (len(datagram), address))
-        msgPrimitive = self._encoder.decode(datagram, encoding='utf-8')
+        msgPrimitive = encoding.decoderFor(datagram).decode(datagram, encoding='utf-8')
         if _Debug:
             print('[DHT PROTO]                 msgPrimitive: %r' % msgPrimitive)
         message = self._translator.fromPrimitive(msgPrimitive)
+        self._rememberPeerVersion(address, msgPrimitive.get(self._translator.headerVersion))
         layerID = message.layerID
         if layerID not in self._node.layers:
             # TODO: add protection here
@@ -544,9 +569,10 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
             # Find the message that triggered this response
             if message.id in self._sentMessages:
                 # Cancel timeout timer for this RPC
-                df, timeoutCall, method = self._sentMessages[message.id][1:4]
+                remoteContactID, df, timeoutCall, method, sentTime, rpcLayerID = self._sentMessages[message.id][0:6]
                 timeoutCall.cancel()
                 del self._sentMessages[message.id]
+                self._node.contactResponded(remoteContactID, time.time() - sentTime, layerID=rpcLayerID)
 
                 if layerID not in self._node.rpc_responses:
                     self._node.rpc_responses[layerID] = {}
@@ -594,8 +620,7 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
         """
         layerID = contact.layerID
         msg = msgtypes.ResponseMessage(rpcID, self._node.layers[layerID], response, layerID=layerID)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive, encoding='utf-8')
+        encodedMsg = self._encodeMessage(msg, (contact.address, contact.port))
         if _Debug:
             print('[DHT PROTO]             _sendResponse', (contact.address, contact.port), rpcID, response)
         if self._counter:
@@ -608,8 +633,7 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
         """
         layerID = contact.layerID
         msg = msgtypes.ErrorMessage(rpcID, self._node.layers[layerID], exceptionType, exceptionMessage, layerID=layerID)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive, encoding='utf-8')
+        encodedMsg = self._encodeMessage(msg, (contact.address, contact.port))
         if _Debug:
             print('[DHT PROTO]              _sendError', (contact.address, contact.port), rpcID, exceptionType, exceptionMessage)
         if self._counter:
@@ -695,13 +719,17 @@ class KademliaMultiLayerProtocol(KademliaProtocol):
                         return
                 # Reset the RPC timeout timer
                 timeoutCall = reactor.callLater(constants.rpcTimeout*3, self._msgTimeout, messageID)  # IGNORE:E1101
-                self._sentMessages[messageID] = (remoteContactID, df, timeoutCall, method)
+                self._sentMessages[messageID] = (remoteContactID, df, timeoutCall) + self._sentMessages[messageID][3:]
                 if _Debug:
                     print('[DHT PROTO]              reset timeout for', messageID)
                 return
+            rpcLayerID, address = self._sentMessages[messageID][5:7]
             del self._sentMessages[messageID]
+            # The peer may have been downgraded, fall back to bencode until it advertise its version again
+            self._peerVersions.pop(address, None)
             # The message's destination node is now considered to be dead;
             # raise an (asynchronous) TimeoutError exception and update the host node
+            self._node.contactFailed(remoteContactID, layerID=rpcLayerID)
             self._node.removeContact(remoteContactID)
             df.errback(failure.Failure(TimeoutError(remoteContactID)))
         else:
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# republisher.py
+#
+# Copyright (C) 2007-2008 Francois Aucamp, Meraka Institute, CSIR
+# See AUTHORS for all authors and contact information.
+#
+# License: GNU Lesser General Public License, version 3 or later; see COPYING
+#          included in this archive for details.
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from __future__ import absolute_import
+from __future__ import print_function
+import heapq
+import random
+
+import twisted.internet.reactor
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+
+from . import constants  # @UnresolvedImport
+
+_Debug = False
+
+#: Rough size of a single RPC message without the value itself (in bytes)
+messageOverhead = 120
+
+
+class RepublishScheduler(object):
+    """
+    Republishes the stored records in the background instead of firing all
+    of them at once every time the node refreshes a layer.
+
+    Records are queued with a random delay so the nodes holding the same keys
+    do not republish them at the same moment, records which are about to
+    expire and more important records (see C{priorityFunc}) go first. The
+    traffic is limited by a global budget of UDP packets and bytes per second.
+    Before replicating a record the scheduler looks it up in the network and
+    skips it when enough other nodes already hold the same value.
+    """
+    def __init__(self, node, priorityFunc=None, packetsPerSecond=None, bytesPerSecond=None, concurrency=None, freshReplicas=None, jitter=None, urgency=None, clock=None):
+        """
+        @param node: The node which owns the data stores being republished
+        @type node: entangled.kademlia.node.MultiLayerNode
+        @param priorityFunc: Optional callable C{priorityFunc(key, value, layerID)}
+                             which returns the importance of the record, records
+                             with higher importance are republished first
+        @param clock: The reactor (or C{twisted.internet.task.Clock}) to schedule calls on
+        """
+        self._node = node
+        self._priorityFunc = priorityFunc
+        self.packetsPerSecond = packetsPerSecond or constants.republishPacketsPerSecond
+        self.bytesPerSecond = bytesPerSecond or constants.republishBytesPerSecond
+        self.concurrency = concurrency or constants.republishConcurrency
+        self.freshReplicas = constants.republishFreshReplicas if freshReplicas is None else freshReplicas
+        self.jitter = constants.republishJitter if jitter is None else jitter
+        self.urgency = constants.republishUrgency if urgency is None else urgency
+        self._clock = clock or twisted.internet.reactor
+        self._jobs = {}
+        # Heap of (deadline, seq, jobID) for the jobs waiting for their deadline
+        self._queue = []
+        # Heap of (-importance, expiresAt, seq, jobID) for the jobs which are due
+        self._ready = []
+        self._inFlight = {}
+        self._seq = 0
+        self._packets = float(self.packetsPerSecond)
+        self._bytes = float(self.bytesPerSecond)
+        self._lastRefill = None
+        self._task = None
+        self._lagTotal = 0.0
+        self.counters = {
+            'scheduled': 0,
+            'deduplicated': 0,
+            'republished': 0,
+            'skipped_fresh': 0,
+            'failed': 0,
+            'dropped': 0,
+            'throttled': 0,
+            'packets_spent': 0,
+            'bytes_spent': 0,
+            'lag_max': 0.0,
+        }
+
+    def start(self, interval=1.0):
+        if self._task and self._task.running:
+            return
+        self._task = LoopingCall(self.tick)
+        self._task.clock = self._clock
+        self._task.start(interval, now=False)
+
+    def stop(self):
+        if self._task and self._task.running:
+            self._task.stop()
+        self._task = None
+
+    def schedule(self, itemData, layerID=0, original=False):
+        """
+        Queue the record for republishing, the record value is not kept in
+        the queue and will be read again from the data store when the record
+        is due.
+
+        @return: C{True} if the record was queued, C{False} if it is already
+                 waiting in the queue or being republished right now
+        """
+        jobID = (layerID, itemData['key'])
+        if jobID in self._jobs or jobID in self._inFlight:
+            self.counters['deduplicated'] += 1
+            return False
+        now = self._clock.seconds()
+        value = itemData['value']
+        expiresAt = itemData['originallyPublished'] + itemData['expireSeconds']
+        if expiresAt - now <= self.urgency:
+            deadline = now
+        else:
+            deadline = now + random.uniform(0, self.jitter)
+        importance = 0
+        if self._priorityFunc:
+            try:
+                importance = self._priorityFunc(itemData['key'], value, layerID)
+            except:
+                importance = 0
+        self._seq += 1
+        self._jobs[jobID] = {
+            'seq': self._seq,
+            'original': original,
+            'deadline': deadline,
+            'expiresAt': expiresAt,
+            'importance': importance,
+            'size': len(value) if isinstance(value, (bytes, str)) else len(str(value)),
+            'lastPublished': itemData['lastPublished'],
+        }
+        heapq.heappush(self._queue, (deadline, self._seq, jobID))
+        self.counters['scheduled'] += 1
+        if _Debug:
+            print('[DHT REPUBLISHER] scheduled %r in %.1f seconds, importance %r' % (jobID, deadline - now, importance))
+        return True
+
+    def cost(self, job):
+        """
+        Estimated traffic of a single republishing: the lookup which checks
+        the replicas and the STORE RPCs sent to the closest nodes.
+        """
+        packets = constants.k + 2*constants.alpha
+        return packets, packets*messageOverhead + job['size']*constants.k
+
+    def tick(self):
+        now = self._clock.seconds()
+        self._refill(now)
+        while self._queue and self._queue[0][0] <= now:
+            _, seq, jobID = heapq.heappop(self._queue)
+            job = self._jobs[jobID]
+            heapq.heappush(self._ready, (-job['importance'], job['expiresAt'], seq, jobID))
+        while self._ready and len(self._inFlight) < self.concurrency:
+            if self._packets <= 0 or self._bytes <= 0:
+                # The budget is exhausted, the single large record is still allowed to take
+                # more than is left - the debt is paid back before anything else is sent
+                self.counters['throttled'] += 1
+                break
+            _, _, _, jobID = heapq.heappop(self._ready)
+            job = self._jobs.pop(jobID)
+            if job['expiresAt'] <= now:
+                self.counters['dropped'] += 1
+                continue
+            packets, size = self.cost(job)
+            self._packets -= packets
+            self._bytes -= size
+            self.counters['packets_spent'] += packets
+            self.counters['bytes_spent'] += size
+            lag = max(0.0, now - job['deadline'])
+            self._lagTotal += lag
+            self.counters['lag_max'] = max(self.counters['lag_max'], lag)
+            self._inFlight[jobID] = job
+            d = defer.maybeDeferred(self._republish, jobID, job)
+            d.addCallback(self._onFinished, jobID)
+            d.addErrback(self._onFailed, jobID)
+
+    def stats(self):
+        now = self._clock.seconds()
+        started = self.counters['republished'] + self.counters['skipped_fresh'] + self.counters['failed'] + len(self._inFlight)
+        result = dict(self.counters)
+        result.update({
+            'backlog': len(self._ready),
+            'waiting': len(self._queue),
+            'in_flight': len(self._inFlight),
+            'lag_current': max([0.0] + [now - job['deadline'] for job in self._jobs.values() if job['deadline'] <= now]),
+            'lag_avg': (self._lagTotal/started) if started else 0.0,
+        })
+        return result
+
+    def _refill(self, now):
+        if self._lastRefill is not None:
+            elapsed = max(0.0, now - self._lastRefill)
+            self._packets = min(float(self.packetsPerSecond), self._packets + elapsed*self.packetsPerSecond)
+            self._bytes = min(float(self.bytesPerSecond), self._bytes + elapsed*self.bytesPerSecond)
+        self._lastRefill = now
+
+    def _republish(self, jobID, job):
+        layerID, key = jobID
+        dataStore = self._node._dataStores.get(layerID)
+        item = dataStore.getItem(key) if dataStore is not None else None
+        if not item:
+            return defer.succeed('dropped')
+        if job['original']:
+            # The original publisher always refreshes the record on the closest nodes
+            d = self._node.iterativeStore(
+                key=key,
+                value=item['value'],
+                expireSeconds=item['expireSeconds'],
+                layerID=layerID,
+            )
+            d.addCallback(lambda _: self._touch(item, layerID, originallyPublished=int(self._clock.seconds())))
+            d.addCallback(lambda _: 'republished')
+            return d
+        if item['lastPublished'] > job['lastPublished']:
+            # Somebody has already stored the record again while it was waiting in the queue
+            return defer.succeed('fresh')
+        if self.freshReplicas <= 0:
+            return self._replicate(item, layerID, {})
+        d = self._node.iterativeFindValue(
+            key,
+            layerID=layerID,
+            quorum=self.freshReplicas,
+            validator=lambda value: value == item['value'],
+        )
+        d.addCallback(self._onReplicasFound, item, layerID)
+        return d
+
+    def _onReplicasFound(self, result, item, layerID):
+        holders = set()
+        if isinstance(result, dict):
+            for value in result.get('values', []):
+                if value[0] == item['value'] and value[2] != self._node.layers.get(layerID):
+                    holders.add(value[2])
+        if len(holders) >= self.freshReplicas:
+            self._touch(item, layerID)
+            return 'fresh'
+        return self._replicate(item, layerID, result, holders)
+
+    def _replicate(self, item, layerID, result, holders=()):
+        now = int(self._clock.seconds())
+        age = now - item['originallyPublished']
+        contacts = []
+        if isinstance(result, dict):
+            contacts = [c for c in result.get('activeContacts', [])[:constants.k] if c.id not in holders]
+        if not contacts:
+            d = self._node.iterativeStore(
+                key=item['key'],
+                value=item['value'],
+                originalPublisherID=item['originalPublisherID'],
+                age=age,
+                expireSeconds=item['expireSeconds'],
+                layerID=layerID,
+            )
+        else:
+            l = []
+            for contact in contacts:
+                l.append(contact.store(item['key'], item['value'], item['originalPublisherID'], age, item['expireSeconds'], layerID=layerID))
+            d = defer.DeferredList(l, consumeErrors=True)
+        d.addCallback(lambda _: self._touch(item, layerID))
+        d.addCallback(lambda _: 'republished')
+        return d
+
+    def _touch(self, item, layerID, originallyPublished=None):
+        dataStore = self._node._dataStores.get(layerID)
+        if dataStore is None:
+            return
+        dataStore.setItem(
+            item['key'],
+            item['value'],
+            int(self._clock.seconds()),
+            item['originallyPublished'] if originallyPublished is None else originallyPublished,
+            item['originalPublisherID'],
+            expireSeconds=item['expireSeconds'],
+            revision=item['revision'],
+        )
+
+    def _onFinished(self, result, jobID):
+        self._inFlight.pop(jobID, None)
+        if result == 'fresh':
+            self.counters['skipped_fresh'] += 1
+        elif result == 'dropped':
+            self.counters['dropped'] += 1
+        else:
+            self.counters['republished'] += 1
+        if _Debug:
+            print('[DHT REPUBLISHER] %r : %s' % (jobID, result))
+        return result
+
+    def _onFailed(self, err, jobID):
+        self._inFlight.pop(jobID, None)
+        self.counters['failed'] += 1
+        if _Debug:
+            print('[DHT REPUBLISHER] %r failed : %r' % (jobID, err))
+        return None
@@ -17,6 +17,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import time
+import math
 import random
 
 from . import constants  # @UnresolvedImport
@@ -26,6 +27,51 @@ from .protocol import TimeoutError  # @UnresolvedImport
 _Debug = False
 
 
+class RTTEstimator(object):
+    """
+    Smoothed round-trip time and failure rate of RPC calls, the estimation
+    follows the TCP retransmission timer algorithm (RFC 6298).
+    """
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.failureRate = 0.0
+        self.samples = 0
+        self.lastUpdated = 0
+
+    def __repr__(self, *args, **kwargs):
+        return '<RTT %r/%r failures=%r>' % (self.srtt, self.rttvar, self.failureRate)
+
+    def update(self, rtt):
+        """
+        Registers a successful RPC call which took C{rtt} seconds.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2.0
+        else:
+            self.rttvar = (1.0 - constants.rttSmoothing*2.0)*self.rttvar + constants.rttSmoothing*2.0*abs(self.srtt - rtt)
+            self.srtt = (1.0 - constants.rttSmoothing)*self.srtt + constants.rttSmoothing*rtt
+        self.failureRate = (1.0 - constants.rttSmoothing)*self.failureRate
+        self.samples += 1
+        self.lastUpdated = time.time()
+
+    def fail(self):
+        """
+        Registers a failed RPC call: timed out or did not respond in expected time.
+        """
+        self.failureRate = (1.0 - constants.rttSmoothing)*self.failureRate + constants.rttSmoothing
+        self.lastUpdated = time.time()
+
+    def deadline(self):
+        """
+        Returns amount of seconds after which an RPC call is considered to be late, or None if nothing was measured yet.
+        """
+        if self.srtt is None:
+            return None
+        return self.srtt + 4.0*self.rttvar
+
+
 class RoutingTable(object):
     """
     Interface for RPC message translators/formatters.
@@ -131,6 +177,17 @@ class RoutingTable(object):
         @type key: str
         """
 
+    def updateRTT(self, contactID, rtt):
+        """
+        Register a response from the given contact which was received C{rtt}
+        seconds after the RPC was sent.
+        """
+
+    def failedRPC(self, contactID):
+        """
+        Register an RPC to the given contact which timed out or was late.
+        """
+
 
 class TreeRoutingTable(RoutingTable):
     """
@@ -160,6 +217,9 @@ class TreeRoutingTable(RoutingTable):
         ]
         self._parentNodeID = parentNodeID
         self._layerID = kwargs.get('layerID', 0)
+        # Round-trip time statistics of remote contacts and of all RPC calls made within that routing table
+        self._rtt = {}
+        self._rttTotal = RTTEstimator()
 
     def __repr__(self, *args, **kwargs):
         return str(self)
@@ -382,6 +442,91 @@ class TreeRoutingTable(RoutingTable):
         bucketIndex = self._kbucketIndex(key)
         self._buckets[bucketIndex].lastAccessed = int(time.time())
 
+    def updateRTT(self, contactID, rtt):
+        """
+        Register a response from the given contact which was received C{rtt}
+        seconds after the RPC was sent.
+
+        @param contactID: The node ID of the responded contact
+        @type contactID: str
+        @param rtt: The round-trip time of the RPC call (in seconds)
+        @type rtt: float
+        """
+        self._contactRTT(contactID).update(rtt)
+        self._rttTotal.update(rtt)
+
+    def failedRPC(self, contactID):
+        """
+        Register an RPC to the given contact which timed out or was late.
+
+        @param contactID: The node ID of the contact
+        @type contactID: str
+        """
+        self._contactRTT(contactID).fail()
+        self._rttTotal.fail()
+
+    def expectedRTT(self, contactID):
+        """
+        Returns expected time (in seconds) the given contact needs to respond
+        to an RPC; used to prefer fast contacts during iterative lookups.
+
+        Contacts which were never measured are expected to be as fast as an
+        average contact, each failure makes the contact look slower.
+        """
+        stats = self._rtt.get(contactID)
+        srtt = self._rttTotal.srtt
+        if stats is not None and stats.srtt is not None:
+            srtt = stats.srtt
+        if srtt is None:
+            srtt = constants.iterativeLookupDelay
+        if stats is not None:
+            srtt += stats.failureRate*constants.rpcTimeout
+        return srtt
+
+    def hedgeDelay(self):
+        """
+        Returns delay (in seconds) after which a pending RPC is considered to be
+        late and an extra (hedged) RPC should be sent to another contact.
+        """
+        deadline = self._rttTotal.deadline()
+        if deadline is None:
+            return constants.iterativeLookupDelay
+        return min(max(deadline, constants.minHedgeDelay), constants.iterativeLookupDelay)
+
+    def lookupConcurrency(self):
+        """
+        Returns the degree of parallelism for iterative lookups: C{alpha} is
+        increased when many RPC calls are failing, so that enough responses
+        are still received in each iteration.
+        """
+        successRate = max(1.0 - self._rttTotal.failureRate, 0.25)
+        return int(min(max(constants.alphaMax, constants.alpha), math.ceil(constants.alpha/successRate)))
+
+    def rttStats(self):
+        """
+        Returns summary of collected round-trip time statistics.
+        """
+        return {
+            'srtt': self._rttTotal.srtt,
+            'rttvar': self._rttTotal.rttvar,
+            'failure_rate': self._rttTotal.failureRate,
+            'samples': self._rttTotal.samples,
+            'contacts': len(self._rtt),
+            'hedge_delay': self.hedgeDelay(),
+            'alpha': self.lookupConcurrency(),
+        }
+
+    def _contactRTT(self, contactID):
+        stats = self._rtt.get(contactID)
+        if stats is None:
+            if len(self._rtt) >= constants.rttTrackedContacts:
+                # Forget half of the contacts which were not seen for the longest time
+                oldest = sorted(self._rtt.keys(), key=lambda cid: self._rtt[cid].lastUpdated)
+                for cid in oldest[:int(len(oldest)/2)]:
+                    del self._rtt[cid]
+            stats = self._rtt[contactID] = RTTEstimator()
+        return stats
+
     def _kbucketIndex(self, key):
         """
         Calculate the index of the k-bucket which is responsible for the
@@ -0,0 +1,117 @@
+from unittest import TestCase
+
+from bitdust.logs import lg
+
+from bitdust.lib import serialization
+
+from bitdust.main import listeners
+
+from bitdust.interface import api_web_socket
+
+
+class FakeTransport(object):
+
+    def __init__(self, buffer_size=None):
+        self.written = []
+        self.written_size = 0
+        self.buffer_size = buffer_size
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def write(self, data):
+        self.written.append(data)
+        self.written_size += len(data)
+        if self.buffer_size is not None and self.written_size > self.buffer_size:
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.written_size = 0
+        self.producer.resumeProducing()
+
+    def messages(self):
+        return [serialization.BytesToDict(raw, keys_to_text=True, values_to_text=True, encoding='utf-8') for raw in self.written]
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        self.connections = {}
+
+    def tearDown(self):
+        api_web_socket._WebSocketConnections.clear()
+        api_web_socket._WebSocketTransports.clear()
+        if api_web_socket._SnapshotsFlushTask and api_web_socket._SnapshotsFlushTask.active():
+            api_web_socket._SnapshotsFlushTask.cancel()
+        api_web_socket._SnapshotsFlushTask = None
+        api_web_socket._PendingSnapshots.clear()
+
+    def _connect(self, port, buffer_size=None):
+        key = ('TCP', '127.0.0.1', port)
+        transport = FakeTransport(buffer_size=buffer_size)
+        connection = api_web_socket.WebSocketConnection(key, transport)
+        transport.registerProducer(connection, True)
+        api_web_socket._WebSocketTransports[key] = transport
+        api_web_socket._WebSocketConnections[key] = connection
+        return key, transport
+
+    def test_subscriptions(self):
+        key1, transport1 = self._connect(1001)
+        _, transport2 = self._connect(1002)
+        self.assertTrue(api_web_socket.do_process_incoming_message({
+            'command': 'subscribe',
+            'events': ['some-event'],
+            'models': ['message'],
+        }, key=key1))
+        api_web_socket.push({'type': 'event', 'payload': {'event_id': 'some-event', 'data': {}}})
+        api_web_socket.push({'type': 'event', 'payload': {'event_id': 'another-event', 'data': {}}})
+        api_web_socket.push({'type': 'model', 'payload': {'name': 'message', 'id': 1}})
+        api_web_socket.push({'type': 'model', 'payload': {'name': 'key', 'id': 2}})
+        self.assertEqual(len(transport1.written), 2)
+        self.assertEqual(len(transport2.written), 4)
+        api_web_socket.push({'type': 'api_call', 'payload': {'call_id': 1, 'response': {}}}, key=key1)
+        self.assertEqual(len(transport1.written), 3)
+        self.assertEqual(len(transport2.written), 4)
+
+    def test_snapshots_coalescing(self):
+        _, transport = self._connect(1001)
+        total_snapshots = 10000
+        for i in range(total_snapshots):
+            snap = listeners.Snapshot('remote_version', snap_id='backup_%d' % (i % 100), data={'i': i})
+            api_web_socket.on_model_changed(snap)
+        sent = api_web_socket.flush_snapshots()
+        self.assertEqual(sent, 100)
+        messages = transport.messages()
+        self.assertEqual(len(messages), 100)
+        self.assertEqual(messages[0]['payload']['id'], 'backup_0')
+        self.assertEqual(messages[0]['payload']['data']['i'], total_snapshots - 100)
+        self.assertEqual(messages[-1]['payload']['data']['i'], total_snapshots - 1)
+
+    def test_slow_connection_resync(self):
+        _, fast_transport = self._connect(1001)
+        slow_key, slow_transport = self._connect(1002, buffer_size=1024)
+        connection = api_web_socket._WebSocketConnections[slow_key]
+        api_web_socket.MAX_CONNECTION_BUFFER_SIZE, old_limit = 10*1024, api_web_socket.MAX_CONNECTION_BUFFER_SIZE
+        try:
+            for i in range(1000):
+                api_web_socket.push({'type': 'event', 'payload': {'event_id': 'some-event', 'data': {'i': i}}})
+                if i % 100 == 0:
+                    api_web_socket.on_stream_message({'id': 'message_%d' % i})
+            api_web_socket.push({'type': 'api_call', 'payload': {'call_id': 1, 'response': {}}}, key=slow_key)
+        finally:
+            api_web_socket.MAX_CONNECTION_BUFFER_SIZE = old_limit
+        self.assertEqual(len(fast_transport.written), 1010)
+        self.assertTrue(connection.paused)
+        self.assertTrue(connection.resync_required)
+        self.assertLessEqual(connection.pending_size, 10*1024)
+        written_before = len(slow_transport.written)
+        slow_transport.drain()
+        self.assertFalse(connection.resync_required)
+        messages = slow_transport.messages()[written_before:]
+        stream_messages = [m['payload']['id'] for m in slow_transport.messages() if m['type'] == 'stream_message']
+        self.assertEqual(stream_messages, ['message_%d' % i for i in range(0, 1000, 100)])
+        self.assertEqual(messages[-2]['type'], 'api_call')
+        self.assertEqual(messages[-1]['type'], 'resync')
+        self.assertGreater(messages[-1]['payload']['dropped'], 0)
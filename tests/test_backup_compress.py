@@ -0,0 +1,144 @@
+import os
+import io
+import time
+import json
+import random
+import shutil
+import tarfile
+
+from unittest import TestCase, skipUnless
+
+from bitdust.storage import backup_compress
+from bitdust.storage import tar_file
+
+_tmp_dir = '/tmp/.bitdust_tmp_backup_compress'
+
+_benchmark_part_size = 8*1024*1024
+
+
+def _text_data(rnd, size):
+    lines = []
+    total = 0
+    while total < size:
+        line = json.dumps({
+            'id': rnd.randrange(10**9),
+            'name': 'file_%d.txt' % rnd.randrange(10**4),
+            'tags': rnd.sample(['photo', 'music', 'work', 'home', 'backup', 'shared'], 3),
+            'size': rnd.randrange(10**7),
+        }) + '\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+class _Sink(object):
+
+    def __init__(self):
+        self.data = io.BytesIO()
+
+    def write(self, data):
+        self.data.write(data)
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+        os.makedirs(_tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    def _roundtrip(self, codec, data, block_size=backup_compress.BLOCK_SIZE):
+        sink = _Sink()
+        w = backup_compress.CompressWriter(sink, codec=codec, block_size=block_size)
+        for pos in range(0, len(data), 300000):
+            w.write(data[pos:pos + 300000])
+        info = w.close()
+        source_path = os.path.join(_tmp_dir, 'stream')
+        output_path = os.path.join(_tmp_dir, 'output')
+        with open(source_path, 'wb') as f:
+            f.write(sink.data.getvalue())
+        self.assertEqual(backup_compress.detect(source_path), info['codec'])
+        self.assertEqual(backup_compress.decompress_file(source_path, output_path), len(data))
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(info['stored'], len(sink.data.getvalue()))
+        return info
+
+    def test_codecs(self):
+        rnd = random.Random(1)
+        data = _text_data(rnd, 3*1024*1024) + rnd.randbytes(2*1024*1024) + b'\x00'*100
+        for codec in backup_compress.available_codecs():
+            info = self._roundtrip(codec, data, block_size=256*1024)
+            self.assertEqual(info['raw'], len(data))
+            if codec == 'none':
+                self.assertEqual(info['skipped'], info['blocks'])
+                continue
+            # random part is stored as it is, the text part is compressed
+            self.assertEqual(info['skipped'], 8)
+            self.assertLess(info['stored'], len(data)*0.75)
+        self.assertEqual(backup_compress.resolve('unknown'), 'gzip')
+        self.assertIn(backup_compress.resolve('auto'), ('zstd', 'lz4', 'gzip'))
+        self.assertIsNone(backup_compress.detect(__file__))
+
+    def test_truncated(self):
+        data = _text_data(random.Random(2), 1024*1024)
+        sink = _Sink()
+        w = backup_compress.CompressWriter(sink, codec='gzip', block_size=64*1024)
+        w.write(data)
+        w.close()
+        source_path = os.path.join(_tmp_dir, 'stream')
+        with open(source_path, 'wb') as f:
+            f.write(sink.data.getvalue()[:-20])
+        with self.assertRaises(ValueError):
+            backup_compress.decompress_file(source_path, os.path.join(_tmp_dir, 'output'))
+
+    def test_wrap(self):
+        sink = _Sink()
+        # not compressed data is written as a regular ".tar" stream
+        self.assertIs(backup_compress.wrap(sink, codec='none'), sink)
+        w = backup_compress.wrap(sink, codec='gzip')
+        self.assertIsInstance(w, backup_compress.CompressWriter)
+        self.assertEqual(w.info()['codec'], 'gzip')
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_compression_benchmark(self):
+        rnd = random.Random(3)
+        source_dir = os.path.join(_tmp_dir, 'source')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'documents.json'), 'wb') as f:
+            f.write(_text_data(rnd, _benchmark_part_size))
+        with open(os.path.join(source_dir, 'video.mp4'), 'wb') as f:
+            f.write(rnd.randbytes(_benchmark_part_size))
+        with open(os.path.join(source_dir, 'disk.img'), 'wb') as f:
+            f.write((b'\x00'*4096 + rnd.randbytes(4096))*(_benchmark_part_size//8192))
+        raw = io.BytesIO()
+        tar_file.writetar(source_dir, fileobj=raw, compression='none')
+        raw_size = len(raw.getvalue())
+        # the ".tar.bz2" stream made by "tarfile" module itself, as it was before
+        t = time.time()
+        out = io.BytesIO()
+        tar_file.writetar(source_dir, fileobj=out, compression='bz2')
+        baseline = time.time() - t
+        results = {}
+        for codec in backup_compress.available_codecs():
+            if codec == 'auto':
+                continue
+            sink = _Sink()
+            t = time.time()
+            w = backup_compress.CompressWriter(sink, codec=codec)
+            tar_file.writetar(source_dir, fileobj=w, compression='none')
+            info = w.close()
+            duration = time.time() - t
+            source_path = os.path.join(_tmp_dir, 'stream.' + codec)
+            with open(source_path, 'wb') as f:
+                f.write(sink.data.getvalue())
+            backup_compress.decompress_file(source_path, os.path.join(_tmp_dir, 'output.tar'))
+            with tarfile.open(os.path.join(_tmp_dir, 'output.tar'), 'r:') as tar:
+                self.assertEqual(sorted(tar.getnames()), ['source', 'source/disk.img', 'source/documents.json', 'source/video.mp4'])
+            results[codec] = (duration, info['stored']/raw_size)
+        # incompressible blocks are skipped, so even bz2 is faster than the plain "tarfile" stream
+        self.assertLess(results['bz2'][0], baseline)
+        self.assertLess(results['gzip'][0], baseline)
+        self.assertLess(results['gzip'][1], 0.8)
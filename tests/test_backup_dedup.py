@@ -0,0 +1,143 @@
+import os
+import random
+import shutil
+import hashlib
+
+from unittest import TestCase, skipUnless
+
+from bitdust.storage import backup_dedup
+from bitdust.storage import backup_fs
+from bitdust.storage import tar_file
+
+_tmp_dir = '/tmp/.bitdust_tmp_backup_dedup'
+
+_scope = 'master$alice@127.0.0.1_8084:1/2'
+
+_benchmark_files = 8
+_benchmark_file_size = 4*1024*1024
+_benchmark_days = 5
+_benchmark_churn = 0.01
+
+
+class _Sink(object):
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+        os.makedirs(_tmp_dir)
+        self.index = backup_dedup.ChunkIndex(os.path.join(_tmp_dir, 'chunks.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    def _write_version(self, version, data, output=None):
+        pack_path = os.path.join(_tmp_dir, version + '.pack')
+        with open(pack_path, 'wb') as f:
+            w = backup_dedup.DedupWriter(output or f, _scope + '/' + version, self.index)
+            for pos in range(0, len(data), 100000):
+                w.write(data[pos:pos + 100000])
+            info = w.close()
+        return pack_path, info
+
+    def test_chunker(self):
+        data = random.Random(1).randbytes(3*1024*1024)
+        chunker = backup_dedup.Chunker()
+        chunks = [bytes(c) for pos in range(0, len(data), 70000) for c in chunker.feed(data[pos:pos + 70000])]
+        chunks += [bytes(c) for c in chunker.flush()]
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(len(c) <= backup_dedup.CHUNK_MAX_SIZE for c in chunks))
+        self.assertTrue(all(len(c) >= backup_dedup.CHUNK_MIN_SIZE for c in chunks[:-1]))
+        self.assertLess(abs(len(data)/len(chunks) - backup_dedup.CHUNK_AVG_SIZE), backup_dedup.CHUNK_AVG_SIZE/2)
+        # inserting a few bytes at the beginning must not change the rest of the boundaries
+        shifted = backup_dedup.Chunker()
+        shifted_chunks = [bytes(c) for c in shifted.feed(b'12345' + data)] + [bytes(c) for c in shifted.flush()]
+        self.assertGreater(len(set(chunks) & set(shifted_chunks)), len(chunks) - 3)
+
+    def test_versions(self):
+        rnd = random.Random(2)
+        first = rnd.randbytes(2*1024*1024)
+        second = first[:500000] + rnd.randbytes(1000) + first[500000:] + first[:300000]
+        pack1, info1 = self._write_version('F1', first)
+        self.assertEqual(info1['versions'], ['F1'])
+        self.assertEqual(info1['stored'], len(first))
+        # the first version is not completed yet, only repeated chunks of the same version are reused
+        _, info = self._write_version('F2', second, output=_Sink())
+        self.assertGreaterEqual(info['reused'], 2)
+        self.assertEqual(info['versions'], ['F2'])
+        self.assertEqual(self.index.cleanup_incomplete(), 2)
+        self.assertEqual(self.index.stats()['chunks'], 0)
+        pack1, _ = self._write_version('F1', first)
+        self.index.commit_version(_scope, 'F1')
+        pack2, info2 = self._write_version('F2', second)
+        self.assertEqual(info2['versions'], ['F2', 'F1'])
+        self.assertLess(info2['stored'], 300*1024)
+        self.assertEqual(info2['size'], len(second))
+        manifest = backup_dedup.read_manifest(pack2)
+        self.assertEqual(manifest['versions'], ['F2', 'F1'])
+        self.assertEqual(sum(e[2] for e in manifest['entries']), len(second))
+        self.assertIsNone(backup_dedup.read_manifest(os.path.join(os.path.dirname(__file__), '..', 'setup.py')))
+        output_path = os.path.join(_tmp_dir, 'F2.tar')
+        backup_dedup.assemble(pack2, {'F1': pack1}, output_path)
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), second)
+        with self.assertRaises(ValueError):
+            backup_dedup.assemble(pack2, {}, output_path)
+        first_chunk = hashlib.sha256(first[:manifest['entries'][0][2]]).digest()
+        self.assertEqual(self.index.lookup(_scope, first_chunk), ('F1', 0, manifest['entries'][0][2]))
+        self.index.forget_version(_scope, 'F1')
+        self.assertIsNone(self.index.lookup(_scope, first_chunk))
+        self.index.forget_scope(_scope)
+        self.assertEqual(self.index.stats()['chunks'], 0)
+
+    def test_version_refs(self):
+        item = backup_fs.FSItemInfo(name='cat.png', path_id='1/2', typ=backup_fs.FILE)
+        for version in ('F1', 'F2', 'F3'):
+            item.add_version(version)
+        item.set_version_refs('F3', ['F1'])
+        self.assertTrue(item.is_version_referenced('F1'))
+        self.assertFalse(item.is_version_referenced('F2'))
+        src = item.serialize(to_json=True)
+        self.assertEqual([v.get('r') for v in src['v']], [None, None, ['F1']])
+        item2 = backup_fs.FSItemInfo()
+        item2.unserialize(src, from_json=True)
+        self.assertEqual(item2.get_version_refs('F3'), ['F1'])
+        item2.delete_version('F3')
+        self.assertFalse(item2.is_version_referenced('F1'))
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_incremental_benchmark(self):
+        rnd = random.Random(3)
+        source_dir = os.path.join(_tmp_dir, 'source')
+        os.makedirs(source_dir)
+        contents = [bytearray(rnd.randbytes(_benchmark_file_size)) for _ in range(_benchmark_files)]
+        total_stored = 0
+        for day in range(_benchmark_days):
+            if day:
+                # every day a small part of the data set is changed in random places
+                for content in contents:
+                    for _ in range(int(len(content)*_benchmark_churn/4096)):
+                        pos = rnd.randrange(len(content) - 4096)
+                        content[pos:pos + 4096] = rnd.randbytes(4096)
+            for i, content in enumerate(contents):
+                with open(os.path.join(source_dir, 'file%d' % i), 'wb') as f:
+                    f.write(content)
+            version = 'F%d' % (day + 1)
+            sink = _Sink()
+            w = backup_dedup.DedupWriter(sink, _scope + '/' + version, self.index)
+            tar_file.writetar(source_dir, fileobj=w, compression='none')
+            info = w.close()
+            self.index.commit_version(_scope, version)
+            total_stored += info['stored']
+            if day:
+                self.assertLess(info['stored'], info['size']*0.35)
+        full_size = _benchmark_files*_benchmark_file_size*_benchmark_days
+        self.assertLess(total_stored, full_size*0.5)
@@ -1,8 +1,12 @@
 import os
+import time
+
+from unittest import skipUnless
 
 from twisted.trial.unittest import TestCase
 from twisted.internet import reactor  # @UnresolvedImport
 from twisted.internet.defer import Deferred
+from twisted.internet.task import LoopingCall
 from twisted.internet.base import DelayedCall
 
 DelayedCall.debug = True
@@ -25,6 +29,8 @@ from bitdust.raid import raid_worker
 from bitdust.storage import backup_tar
 from bitdust.storage import backup
 from bitdust.storage import restore_worker
+from bitdust.storage import restore_monitor
+from bitdust.storage import backup_dedup
 
 from bitdust.userid import my_id
 
@@ -120,7 +126,8 @@ class Test(TestCase):
         settings.shutdown()
         bpio.rmdir_recursive('/tmp/.bitdust_tmp')
         bpio.rmdir_recursive('/tmp/_some_folder')
-        os.remove('/tmp/random_file')
+        if os.path.isfile('/tmp/random_file'):
+            os.remove('/tmp/random_file')
 
     def test_backup_restore(self):
         test_ecc_map = 'ecc/2x2'
@@ -172,3 +179,98 @@ class Test(TestCase):
         reactor.callLater(0.5, job.automat, 'start')  # @UndefinedVariable
 
         return test_done
+
+    def test_incremental_backup_restore(self):
+        test_done = Deferred()
+        customerPath = 'master$alice@127.0.0.1_8084:1'
+        backupsDir = '/tmp/.bitdust_tmp/default/backups/master$alice@127.0.0.1_8084/1'
+        os.makedirs(backupsDir + '/F1')
+        os.makedirs(backupsDir + '/F2')
+        backup_dedup.init('/tmp/.bitdust_tmp/chunks.db')
+        first = os.urandom(3*1024*1024)
+        second = first[:1024*1024] + os.urandom(4096) + first[1024*1024:]
+        with open('/tmp/_some_folder/random_file', 'wb') as fout:
+            fout.write(first)
+        manifests = {}
+
+        def _backup(version, callback):
+            backupID = customerPath + '/' + version
+            backupPipe = backup_tar.backuptardir_thread(
+                '/tmp/_some_folder/',
+                compress='none',
+                wrapper=lambda p: backup_dedup.DedupWriter(p, backupID, backup_dedup.index(), finished_callback=lambda _, info: manifests.update({version: info})),
+            )
+            job = backup.backup(backupID, backupPipe, blockSize=1024*1024, ecc_map=eccmap.Current())
+            job.addStateChangedCallback(lambda *a, **k: reactor.callLater(0.1, callback), oldstate=None, newstate='DONE')  # @UndefinedVariable
+            job.automat('start')
+
+        def _first_done():
+            backup_dedup.index().commit_version(customerPath, 'F1')
+            with open('/tmp/_some_folder/random_file', 'wb') as fout:
+                fout.write(second)
+            _backup('F2', _second_done)
+
+        def _second_done():
+            backup_dedup.index().commit_version(customerPath, 'F2')
+            self.assertEqual(manifests['F2']['versions'], ['F2', 'F1'])
+            self.assertLess(manifests['F2']['stored'], len(second)/2)
+            restore_monitor.Start(customerPath + '/F2', '/tmp/', callback=_restored)
+
+        def _restored(backupID, result):
+            try:
+                self.assertEqual(result, 'restore done')
+                self.assertEqual(bpio.ReadBinaryFile('/tmp/random_file'), second)
+            except Exception as exc:
+                test_done.errback(exc)
+            else:
+                test_done.callback(True)
+            backup_dedup.shutdown()
+            reactor.callLater(0, raid_worker.A, 'shutdown')  # @UndefinedVariable
+
+        reactor.callWhenRunning(raid_worker.A, 'init')  # @UndefinedVariable
+        reactor.callLater(0.5, _backup, 'F1', _first_done)  # @UndefinedVariable
+        return test_done
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_backup_responsiveness(self):
+        test_ecc_map = 'ecc/2x2'
+        test_done = Deferred()
+        backupID = 'master$alice@127.0.0.1_8084:1/F1234'
+        block_size = 8*1024*1024
+        data_size = 24*1024*1024
+        with open('/tmp/_some_folder/random_file', 'wb') as fout:
+            fout.write(os.urandom(data_size))
+        # how long the main thread would be blocked by a single block if it was encrypted there
+        fileno, filename = tmpfile.make('raid', extension='.raid')
+        t = time.time()
+        backup.encrypt_block(my_id.getIDURL(), backupID, 0, False, os.urandom(block_size), None, fileno)
+        encrypt_time = time.time() - t
+        tmpfile.throw_out(filename, 'test')
+        lags = []
+        last_tick = [None]
+
+        def _tick():
+            now = time.time()
+            if last_tick[0] is not None:
+                lags.append(now - last_tick[0] - 0.01)
+            last_tick[0] = now
+
+        ticker = LoopingCall(_tick)
+        backupPipe = backup_tar.backuptardir_thread('/tmp/_some_folder/', compress='none')
+
+        def _bk_closed(job):
+            ticker.stop()
+            self.assertLess(max(lags), encrypt_time)
+            reactor.callLater(0, raid_worker.A, 'shutdown')  # @UndefinedVariable
+            reactor.callLater(0.5, test_done.callback, True)  # @UndefinedVariable
+
+        reactor.callWhenRunning(raid_worker.A, 'init')  # @UndefinedVariable
+
+        def _start():
+            ticker.start(0.01)
+            job.automat('start')
+
+        job = backup.backup(backupID, backupPipe, blockSize=block_size, ecc_map=eccmap.eccmap(test_ecc_map))
+        job.addStateChangedCallback(lambda *a, **k: _bk_closed(job), oldstate=None, newstate='DONE')
+        reactor.callLater(0.5, _start)  # @UndefinedVariable
+        return test_done
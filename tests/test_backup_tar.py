@@ -0,0 +1,124 @@
+import os
+import sys
+import shutil
+import hashlib
+import subprocess
+
+from unittest import skipUnless
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet.defer import Deferred
+
+from bitdust.storage import backup_tar
+
+_tmp_dir = '/tmp/.bitdust_tmp_backup_tar'
+
+_benchmark_files = 4
+_benchmark_file_size = 512*1024*1024
+
+_benchmark_script = '''
+import sys
+import time
+import hashlib
+import resource
+from twisted.internet import reactor
+from bitdust.storage import backup_tar
+total = [0, ]
+h = hashlib.sha1()
+started = time.time()
+def _read(p):
+    p.read_defer(4*1024*1024).addCallback(_done, p)
+def _peak_rss():
+    # ru_maxrss of a child process starts from the RSS of the parent at the moment of fork
+    try:
+        with open('/proc/self/status') as f:
+            return int([l for l in f if l.startswith('VmHWM:')][0].split()[1])
+    except:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+def _done(chunk, p):
+    if not chunk:
+        print(total[0], h.hexdigest(), time.time() - started, _peak_rss())
+        reactor.stop()
+        return
+    total[0] += len(chunk)
+    h.update(chunk)
+    # the reader is slower than tar, like encryption and RAID are
+    reactor.callLater(0.01, _read, p)
+reactor.callWhenRunning(lambda: _read(backup_tar.backuptardir_thread(sys.argv[1], compress='none')))
+reactor.run()
+'''
+
+
+class Test(TestCase):
+
+    timeout = 600
+
+    def setUp(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+        os.makedirs(_tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    def test_read_chunks(self):
+        p = backup_tar.BytesLoop(b'abc')
+        p._write(b'defgh')
+        p._write(b'ijklmnop')
+        self.assertEqual(p.state(), backup_tar.BYTES_LOOP_READY2READ)
+        self.assertEqual(p.read(2), b'ab')
+        self.assertEqual(p.read(4), b'cdef')
+        self.assertEqual(p.read(3), b'ghi')
+        self.assertEqual(p.read(0), b'')
+        self.assertEqual(p.read(5), b'jklmn')
+        self.assertEqual(p.read(), b'op')
+        self.assertEqual(p.read(), b'')
+        p.mark_finished()
+        self.assertEqual(p.state(), backup_tar.BYTES_LOOP_CLOSED)
+
+    def test_back_pressure(self):
+        high_water_mark = 4*1024*1024
+        chunk_size = 1024*1024
+        p = backup_tar.BytesLoop(high_water_mark=high_water_mark)
+        source = [os.urandom(chunk_size) for _ in range(20)]
+        received = []
+        pending = []
+        test_done = Deferred()
+
+        def _produce():
+            for chunk in source:
+                p.write(chunk)
+            reactor.callFromThread(p.mark_finished)  # @UndefinedVariable
+
+        def _read():
+            pending.append(p._pending)
+            p.read_defer(int(chunk_size*1.5)).addCallback(_on_chunk)
+
+        def _on_chunk(chunk):
+            if not chunk:
+                self.assertEqual(b''.join(received), b''.join(source))
+                self.assertLessEqual(max(pending), high_water_mark + chunk_size)
+                self.assertEqual(p.state(), backup_tar.BYTES_LOOP_CLOSED)
+                test_done.callback(True)
+                return
+            received.append(chunk)
+            reactor.callLater(0.02, _read)  # @UndefinedVariable
+
+        reactor.callInThread(_produce)  # @UndefinedVariable
+        reactor.callLater(0.2, _read)  # @UndefinedVariable
+        return test_done
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_backup_benchmark(self):
+        source_dir = os.path.join(_tmp_dir, 'source')
+        os.makedirs(source_dir)
+        for i in range(_benchmark_files):
+            with open(os.path.join(source_dir, 'file%d' % i), 'wb') as f:
+                f.truncate(_benchmark_file_size)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        output = subprocess.check_output([sys.executable, '-c', _benchmark_script, source_dir], env=env)
+        total_bytes, digest, _, peak_rss = output.decode().strip().split('\n')[-1].split()
+        self.assertGreater(int(total_bytes), _benchmark_files*_benchmark_file_size)
+        self.assertLess(int(peak_rss), 256*1024)
+        self.assertNotEqual(digest, hashlib.sha1(b'').hexdigest())
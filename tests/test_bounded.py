@@ -0,0 +1,181 @@
+import os
+import time
+import tracemalloc
+from unittest import TestCase, skipUnless
+
+from twisted.internet.defer import Deferred
+
+from bitdust.lib import bounded
+from bitdust.main import events
+from bitdust.stream import message
+
+
+class TestRingBuffer(TestCase):
+
+    def test_cursors(self):
+        rb = bounded.RingBuffer(capacity=5)
+        rb.append('skipped')
+        rb.subscribe('a')
+        rb.append(1)
+        rb.subscribe('b')
+        rb.append(2)
+        rb.append(3)
+        self.assertEqual(rb.read('a'), [1, 2, 3])
+        self.assertEqual(rb.read('b'), [2, 3])
+        self.assertEqual(rb.read('c'), [])
+        rb.commit('a')
+        self.assertEqual(rb.pending_count('a'), 0)
+        self.assertEqual(rb.pending_count('b'), 2)
+        rb.commit('b')
+        self.assertEqual(len(rb), 0)
+        self.assertEqual(rb.items.count(None), 5)
+
+    def test_overrun(self):
+        rb = bounded.RingBuffer(capacity=3)
+        rb.subscribe('slow')
+        rb.subscribe('fast')
+        for i in range(5):
+            rb.append(i)
+            rb.commit('fast')
+        self.assertTrue(rb.is_overrun('slow'))
+        self.assertFalse(rb.is_overrun('fast'))
+        self.assertEqual(rb.read('slow'), [2, 3, 4])
+        rb.unsubscribe('slow')
+        self.assertEqual(rb.consumers(), ['fast'])
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_many_consumers_benchmark(self):
+        consumers = 1000
+        events = 100
+        event = {'type': 'event', 'id': 'some-event', 'data': {'a': 'b'*100}, 'time': 0}
+
+        tracemalloc.start()
+        t = time.time()
+        queues = {}
+        for c in range(consumers):
+            queues[c] = []
+        for _ in range(events):
+            for c in range(consumers):
+                queues[c].append(dict(event))
+        lists_time = time.time() - t
+        lists_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del queues
+
+        tracemalloc.start()
+        t = time.time()
+        rb = bounded.RingBuffer(capacity=events*2)
+        for c in range(consumers):
+            rb.subscribe(c)
+        for _ in range(events):
+            rb.append(dict(event))
+        for c in range(consumers):
+            self.assertEqual(len(rb.read(c)), events)
+        ring_time = time.time() - t
+        ring_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        self.assertLess(ring_memory, lists_memory)
+        self.assertLess(ring_time, lists_time)
+
+
+class TestMessageConsumers(TestCase):
+
+    def tearDown(self):
+        for consumer_id in message.message_queue().consumers():
+            message.stop_consumer(consumer_id)
+
+    def _push(self, i):
+        return message.push_message('incoming', 'private_message', 'alice@id-a_8084', 'bob@id-b_8084', 'packet_%d' % i, None, {'i': i})
+
+    def test_callback_failed(self):
+        received = []
+        results = [None, Exception('failed'), True]
+
+        def _consume(json_messages):
+            received.append([m['data']['i'] for m in json_messages])
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        message.consume_messages('test_consumer', callback=_consume)
+        self._push(1)
+        self._push(2)
+        self._push(3)
+        # failed messages are delivered again together with the new one
+        self.assertEqual(received, [[1], [1, 2], [1, 2, 3]])
+        self.assertEqual(message.message_queue().pending_count('test_consumer'), 0)
+        self.assertIn('test_consumer', message.consumers_callbacks())
+
+    def test_deferred_released(self):
+        d1 = message.consume_messages('test_poll')
+        self.assertEqual(self._push(1), 1)
+        self.assertEqual([m['data']['i'] for m in d1.result], [1])
+        # consumer is not listening at the moment, but messages are kept until it is back
+        self._push(2)
+        self._push(3)
+        d2 = message.consume_messages('test_poll')
+        self.assertEqual([m['data']['i'] for m in d2.result], [2, 3])
+        for i in range(message.MAX_PENDING_MESSAGES_PER_CONSUMER + 1):
+            self._push(i)
+        self.assertNotIn('test_poll', message.message_queue().consumers())
+
+
+class TestEventConsumers(TestCase):
+
+    def tearDown(self):
+        events.consumers_callbacks().pop('test_events', None)
+        events.event_queue().unsubscribe('test_events')
+
+    def test_overrun_with_callback(self):
+        events.consumers_callbacks()['test_events'] = []
+        events.event_queue().subscribe('test_events')
+        for i in range(events.event_queue().capacity + 10):
+            events.event_queue().append({'type': 'event', 'id': 'some-event', 'data': {'i': i}, 'time': 0})
+        self.assertTrue(events.event_queue().is_overrun('test_events'))
+        d = Deferred()
+        events.consumers_callbacks()['test_events'].append(d)
+        events.pop_event()
+        # consumer is still listening, so only the oldest events are missed
+        self.assertEqual(len(d.result), events.event_queue().capacity)
+        self.assertIn('test_events', events.consumers_callbacks())
+        self.assertTrue(events.event_queue().is_subscribed('test_events'))
+
+
+class TestExpiringSet(TestCase):
+
+    def test_max_size(self):
+        es = bounded.ExpiringSet(max_size=3)
+        for i in range(5):
+            es.add(i)
+        self.assertEqual(len(es), 3)
+        self.assertNotIn(0, es)
+        self.assertNotIn(1, es)
+        self.assertIn(4, es)
+
+    def test_max_age(self):
+        es = bounded.ExpiringSet(max_size=10, max_age=60)
+        es.add('a')
+        es.add('b')
+        es.items['a'] -= 120
+        self.assertNotIn('a', es)
+        self.assertIn('b', es)
+        self.assertEqual(len(es), 1)
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_lookup_benchmark(self):
+        ids = ['packet_%d' % i for i in range(1000)]
+        recent_list = list(ids)
+        es = bounded.ExpiringSet(max_size=1000, max_age=600)
+        for i in ids:
+            es.add(i)
+        t = time.time()
+        for i in range(10000):
+            ('packet_%d' % (i % 2000)) in recent_list
+        list_time = time.time() - t
+        t = time.time()
+        for i in range(10000):
+            ('packet_%d' % (i % 2000)) in es
+        set_time = time.time() - t
+        self.assertLess(set_time, list_time)
@@ -1,6 +1,7 @@
 import os
+import time
 
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 
 from bitdust.logs import lg
 
@@ -162,3 +163,69 @@ class Test(TestCase):
             raw1 = p1.Serialize()
             p2 = signed.Unserialize(raw1)
             self.assertTrue(p2.Valid())
+
+    def _make_broadcast(self):
+        return signed.Packet(
+            'Identity',
+            my_id.getIDURL(),
+            my_id.getIDURL(),
+            signed.BROADCAST_PACKET_ID_PREFIX + 'propagate:1',
+            my_id.getLocalIdentity().serialize(as_text=False),
+            my_id.getIDURL(),
+        )
+
+    def test_broadcast_not_expected(self):
+        key.InitMyKey()
+        # my identity does not announce "identity-broadcast" capability
+        envelope = self._make_broadcast().Envelope(self.bob_ident.getIDURL())
+        self.assertFalse(signed.Unserialize(envelope.Serialize()).Valid())
+        self.assertRaises(Exception, envelope.Valid, raise_signature_invalid=True)
+
+    def test_broadcast_envelope(self):
+        key.InitMyKey()
+        my_id.getLocalIdentity().setVersion('1.0.0 sources caps:' + signed.BROADCAST_CAPABILITY)
+        my_id.getLocalIdentity().sign()
+        self.assertEqual(my_id.getLocalIdentity().getCapabilities(), [signed.BROADCAST_CAPABILITY])
+        self.assertFalse(self.bob_ident.hasCapability(signed.BROADCAST_CAPABILITY))
+        payload = my_id.getLocalIdentity().serialize(as_text=False)
+        broadcast = signed.Packet(
+            'Identity',
+            my_id.getIDURL(),
+            my_id.getIDURL(),
+            signed.BROADCAST_PACKET_ID_PREFIX + 'propagate:1',
+            payload,
+            my_id.getIDURL(),
+        )
+        self.assertTrue(broadcast.IsBroadcast())
+        envelope = broadcast.Envelope(self.bob_ident.getIDURL())
+        self.assertEqual(envelope.RemoteID, self.bob_ident.getIDURL())
+        self.assertEqual(envelope.Signature, broadcast.Signature)
+        self.assertTrue(signed.Unserialize(envelope.Serialize()).Valid())
+        direct = signed.Packet(
+            'Data',
+            my_id.getIDURL(),
+            my_id.getIDURL(),
+            signed.BROADCAST_PACKET_ID_PREFIX + 'propagate:2',
+            payload,
+            my_id.getIDURL(),
+        )
+        self.assertFalse(direct.IsBroadcast())
+        self.assertRaises(Exception, direct.Envelope, self.bob_ident.getIDURL())
+        direct.RemoteID = self.bob_ident.getIDURL()
+        self.assertFalse(direct.Valid())
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_broadcast_benchmark(self):
+        key.InitMyKey()
+        recipients = 200
+        payload = my_id.getLocalIdentity().serialize(as_text=False)
+        t = time.time()
+        for i in range(recipients):
+            signed.Packet('Identity', my_id.getIDURL(), my_id.getIDURL(), 'propagate:%d' % i, payload, self.bob_ident.getIDURL())
+        sign_time = time.time() - t
+        t = time.time()
+        broadcast = signed.Packet('Identity', my_id.getIDURL(), my_id.getIDURL(), signed.BROADCAST_PACKET_ID_PREFIX + 'propagate', payload, my_id.getIDURL())
+        for i in range(recipients):
+            broadcast.Envelope(self.bob_ident.getIDURL())
+        envelope_time = time.time() - t
+        self.assertLess(envelope_time, sign_time)
@@ -0,0 +1,110 @@
+from unittest import TestCase
+import os
+import time
+import shutil
+
+from twisted.internet.defer import Deferred, succeed
+
+from bitdust.logs import lg
+
+from bitdust.lib import jsn
+
+from bitdust.system import local_fs
+
+from bitdust.dht import dht_cache
+from bitdust.dht import dht_service
+
+_tmp_dir = '/tmp/.bitdust_tmp_dht_cache'
+_db_path = os.path.join(_tmp_dir, 'cache.db')
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+        os.makedirs(_tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    def test_store_evict_reload(self):
+        base = int(time.time()) - 100
+        c = dht_cache.DHTCache(_db_path, max_records=10)
+        for i in range(15):
+            c.store('key%d' % i, {'i': i}, layer_id=i % 2, timestamp=base + i)
+        self.assertEqual(len(c), 10)
+        self.assertIsNone(c.get('key0', layer_id=0))
+        self.assertEqual(c.read('key5', layer_id=1), (True, {'i': 5}))
+        c.store('key15', {'i': 15}, layer_id=1, timestamp=base + 15)
+        self.assertIsNotNone(c.get('key5', layer_id=1))
+        self.assertIsNone(c.get('key6', layer_id=0))
+        self.assertEqual(c.read('key7', layer_id=1, cache_ttl=60, now=base + 100), (False, None))
+        self.assertEqual(c.count(layer_id=1), 6)
+        c.close()
+        c = dht_cache.DHTCache(_db_path, max_records=10)
+        self.assertEqual(len(c), 10)
+        c.max_age = 50
+        self.assertEqual(c.sweep(now=base + 60), 4)
+        self.assertEqual(sorted(k[1] for k in c.records.keys()), ['key10', 'key11', 'key12', 'key13', 'key14', 'key15'])
+        c.close()
+
+    def test_negative_and_coalescing(self):
+        c = dht_cache.DHTCache(_db_path, negative_ttl=60)
+        c.remember_missing('abc', now=1000)
+        self.assertEqual(c.read('abc', now=1030), (True, None))
+        self.assertEqual(c.read('abc', now=1100), (False, None))
+        results = []
+        waiters = [Deferred() for _ in range(5)]
+        started = [c.start_lookup('abc', 0, d) for d in waiters]
+        self.assertEqual(started, [True, False, False, False, False])
+        for d in waiters:
+            d.addCallback(results.append)
+        c.finish_lookup({'value': 1}, 'abc', 0)
+        self.assertEqual(results, [{'value': 1}]*5)
+        self.assertEqual(c.lookups, {})
+        stats = c.stats()
+        self.assertEqual(stats['coalesced'], 4)
+        self.assertEqual(stats['lookups'], 1)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        c.store('abc', {'value': 1})
+        self.assertEqual(c.missing, {})
+        c.close()
+
+    def test_legacy_import(self):
+        legacy_dir = os.path.join(_tmp_dir, 'cache')
+        for layer_id in (0, 3):
+            os.makedirs(os.path.join(legacy_dir, str(layer_id)))
+            for i in range(3):
+                local_fs.WriteTextFile(os.path.join(legacy_dir, str(layer_id), 'key%d' % i), jsn.dumps({'v': {'i': i}, 't': 1000}))
+        c = dht_cache.DHTCache(_db_path)
+        self.assertEqual(c.import_legacy_dir(legacy_dir), 6)
+        self.assertFalse(os.path.isdir(legacy_dir))
+        self.assertEqual(c.get('key2', layer_id=3)['v'], {'i': 2})
+        c.close()
+
+    def test_failed_lookup_not_cached(self):
+        dht_cache._Cache = dht_cache.DHTCache(_db_path)
+        results = []
+        errors = []
+        try:
+            # DHT service is off, lookup fails and the key must not be remembered as missing
+            dht_service.get_cached_json_value('some_key').addCallbacks(results.append, errors.append)
+            self.assertEqual(len(errors), 1)
+            self.assertFalse(dht_cache.cache().is_missing(dht_service.key_to_hash('some_key')))
+            self.assertEqual(dht_cache.cache().lookups, {})
+            # the next call goes back to the network
+            _get_value = dht_service.get_value
+            dht_service.get_value = lambda *a, **kw: succeed([])
+            try:
+                dht_service.get_cached_json_value('some_key').addCallbacks(results.append, errors.append)
+            finally:
+                dht_service.get_value = _get_value
+            self.assertEqual(results, [[]])
+            self.assertEqual(len(errors), 1)
+            self.assertTrue(dht_cache.cache().is_missing(dht_service.key_to_hash('some_key')))
+            self.assertEqual(dht_cache.cache().stats()['lookups_failed'], 1)
+        finally:
+            dht_cache._Cache.close()
+            dht_cache._Cache = None
@@ -0,0 +1,108 @@
+from unittest import TestCase, skipUnless
+import os
+import json
+import time
+import sqlite3
+
+from bitdust_forks.entangled.kademlia.datastore import SQLiteVersionedJsonDataStore  # @UnresolvedImport
+
+_db_path = '/tmp/.bitdust_tmp_dht_datastore.db'
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self._remove()
+
+    def tearDown(self):
+        self._remove()
+
+    def _remove(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(_db_path + suffix):
+                os.remove(_db_path + suffix)
+
+    def _create_old_db(self, rows):
+        old_db = sqlite3.connect(_db_path)
+        old_db.execute('CREATE TABLE data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision)')
+        old_db.executemany('INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        old_db.commit()
+        return old_db
+
+    def test_set_get_expire(self):
+        ds = SQLiteVersionedJsonDataStore(dbFile=_db_path)
+        ds.setItem(b'key1', 'value1', 1000, 1000, b'node1', expireSeconds=100)
+        ds.setItem('key1', 'value2', 1010, 1010, b'node1', expireSeconds=100)
+        ds.setItem('key2', 'value3', 1000, 1000, None, expireSeconds=500, revision=7)
+        ds.setItem('state', 'value4', 1000, 1000, None, expireSeconds=10)
+        item = ds.getItem('key1')
+        self.assertEqual(item['value'], 'value2')
+        self.assertEqual(item['revision'], 2)
+        self.assertEqual(item['lastPublished'], 1010)
+        self.assertEqual(ds.revision('key2'), 7)
+        self.assertEqual(ds.expireSeconds('key2'), 500)
+        self.assertTrue(b'key2' in ds)
+        self.assertFalse('key3' in ds)
+        self.assertIsNone(ds.getItem('key3'))
+        self.assertEqual(len(ds), 3)
+        self.assertEqual([i['key'] for i in ds.iterItems(batchSize=2)], ['key1', 'key2', 'state'])
+        self.assertEqual(ds.removeExpired(now=1200, excludeKeys=['state']), ['key1'])
+        self.assertEqual(sorted(ds.keys()), ['key2', 'state'])
+        with ds.transaction():
+            for i in range(10):
+                ds.setItem('key%d' % i, i, 1000, 1000, None, expireSeconds=10)
+        self.assertEqual(len(ds), 11)
+        self.assertEqual(ds.getItem('key2')['revision'], 8)
+        ds._db.close()
+
+    def test_upgrade_old_schema(self):
+        self._create_old_db([
+            ('key1', json.dumps({'k': 'key1', 'd': 'a', 'v': 1}), 1000, 1000, 'node1', 100, 1),
+            ('key2', json.dumps({'k': 'key2', 'd': 'b', 'v': 1}), 1000, 1000, 'node1', 100, 1),
+            ('key1', json.dumps({'k': 'key1', 'd': 'c', 'v': 1}), 1100, 1100, 'node1', 100, 2),
+        ]).close()
+        ds = SQLiteVersionedJsonDataStore(dbFile=_db_path)
+        self.assertEqual(len(ds), 2)
+        self.assertEqual(ds.getItem('key1')['value'], 'c')
+        self.assertEqual(ds.getItem('key1')['revision'], 2)
+        self.assertEqual(ds.removeExpired(now=1150), ['key2'])
+        ds._db.close()
+        ds = SQLiteVersionedJsonDataStore(dbFile=_db_path)
+        self.assertEqual(ds.keys(), ['key1'])
+        ds._db.close()
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_million_keys_benchmark(self):
+        total_keys = 1000000
+        now = int(time.time())
+        old_db = self._create_old_db((
+            ('%040x' % i, '{"k":"%040x","d":"value %d","v":1}' % (i, i), now, now - (i % 1000), 'node1', 900, 1) for i in range(total_keys)
+        ))
+        t = time.time()
+        for i in range(10):
+            key = '%040x' % (i*1000)
+            old_db.execute('SELECT key FROM data WHERE key=?', (key, )).fetchone()
+            old_db.execute('UPDATE data SET lastPublished=? WHERE key=?', (now, key))
+            old_db.commit()
+        old_store_time = (time.time() - t)/10.0
+        old_db.close()
+        ds = SQLiteVersionedJsonDataStore(dbFile=_db_path)
+        t = time.time()
+        for i in range(1000):
+            ds.setItem('%040x' % (i*1000), 'new value %d' % i, now, now, 'node1', expireSeconds=900)
+        store_time = (time.time() - t)/1000.0
+        with ds.transaction():
+            for i in range(1000):
+                ds.setItem('%040x' % (i*1000 + 1), 'new value %d' % i, now, now, 'node1', expireSeconds=900)
+        for i in range(1000):
+            self.assertIsNotNone(ds.getItem('%040x' % (i*1000 + 2)))
+        republished = 0
+        for item in ds.iterItems():
+            if item['lastPublished']:
+                republished += 1
+        expired = ds.removeExpired(now=now)
+        self.assertEqual(republished, total_keys)
+        self.assertEqual(len(expired), total_keys*99/1000)
+        self.assertEqual(len(ds), total_keys - len(expired))
+        self.assertLess(store_time, old_store_time)
+        ds._db.close()
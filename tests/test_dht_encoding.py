@@ -0,0 +1,127 @@
+from unittest import TestCase, skipUnless
+import os
+import time
+import json
+import hashlib
+
+from bitdust_forks.entangled.kademlia import encoding  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia import msgtypes  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia import msgformat  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.node import MultiLayerNode  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.contact import LayeredContact  # @UnresolvedImport
+
+
+def _sha1(i):
+    return hashlib.sha1(b'%d' % i).hexdigest()
+
+
+class _Transport(object):
+
+    def __init__(self):
+        self.datagrams = []
+
+    def write(self, data, address):
+        self.datagrams.append((data, address))
+
+
+class Test(TestCase):
+
+    def _messages(self):
+        translator = msgformat.MultiLayerFormat()
+        json_value = json.dumps({
+            'type': 'suppliers',
+            'timestamp': 1700000000,
+            'revision': 12,
+            'customer_idurl': 'http://127.0.0.1:8084/alice.xml',
+            'ecc_map': 'ecc/4x4',
+            'suppliers': ['http://127.0.0.1:8084/supplier%d.xml' % i for i in range(4)],
+        }, sort_keys=True, separators=(',', ':'))
+        store_request = msgtypes.RequestMessage(_sha1(1), 'store', [_sha1(2), json_value, _sha1(1), 0, 43200], layerID=0)
+        find_node_response = msgtypes.ResponseMessage(_sha1(3), _sha1(4), [[_sha1(10 + i), '192.168.%d.%d' % (i, i), 14441 + i] for i in range(8)], layerID=2)
+        find_value_response = msgtypes.ResponseMessage(_sha1(5), _sha1(6), {_sha1(2): json_value, 'expireSeconds': 43200, 'originallyPublished': 1700000000, 'revision': 12}, layerID=3)
+        messages = []
+        for msg in (store_request, find_node_response, find_value_response):
+            msg_primitive = translator.toPrimitive(msg)
+            msg_primitive[translator.headerVersion] = 7
+            messages.append(msg_primitive)
+        return messages
+
+    def test_same_result(self):
+        bencode = encoding.Bencode()
+        binary = encoding.Binary()
+        samples = self._messages() + [
+            {
+                'a': None,
+                'b': (1, -1, 200, -70000, 2**40, 2**70, -2**70),
+                'e': ['x'*300, list(range(300))],
+                'f': _sha1(7).upper(),
+                'g': 1.5,
+                1: {'nested': [{}, []]},
+            },
+        ]
+        for sample in samples:
+            for enc in ('utf-8', None):
+                expected = bencode.decode(bencode.encode(sample), encoding=enc)
+                encoded = binary.encode(sample)
+                self.assertIs(encoding.decoderFor(encoded), encoding._BinaryEncoding)
+                self.assertEqual(binary.decode(encoded, encoding=enc), expected)
+        self.assertEqual(binary.decode(binary.encode([b'\x00\xff', 'текст']), encoding=None), [b'\x00\xff', 'текст'.encode('utf-8')])
+        self.assertIsNone(binary.decode(binary.encode(samples[0])[:-3]))
+        self.assertIsNone(binary.encode({'x': object()}))
+        self.assertIs(encoding.decoderFor(bencode.encode(samples[0])), encoding._Bencode)
+
+    def test_negotiation(self):
+        nodes = []
+        for i in range(3):
+            node = MultiLayerNode(udpPort=14441 + i)
+            node._protocol.transport = _Transport()
+            node._protocol.protocolVersion = 7 if i < 2 else None
+            nodes.append(node)
+        addresses = [('127.0.0.1', n.port) for n in nodes]
+
+        def _exchange(sender, receiver):
+            contact = LayeredContact(nodes[receiver].layers[0], addresses[receiver][0], addresses[receiver][1], nodes[sender]._protocol)
+            nodes[sender]._protocol.sendRPC(contact, 'ping', [])
+            request = nodes[sender]._protocol.transport.datagrams.pop()[0]
+            nodes[receiver]._protocol.datagramReceived(request, addresses[sender])
+            response = nodes[receiver]._protocol.transport.datagrams.pop()[0]
+            nodes[sender]._protocol.datagramReceived(response, addresses[receiver])
+            return request[46:47], response[46:47]
+
+        try:
+            self.assertEqual(_exchange(0, 1), (b'd', encoding.Binary.marker))
+            self.assertEqual(_exchange(0, 1), (encoding.Binary.marker, encoding.Binary.marker))
+            self.assertEqual(_exchange(1, 0), (encoding.Binary.marker, encoding.Binary.marker))
+            self.assertEqual(_exchange(0, 2), (b'd', b'd'))
+            self.assertEqual(_exchange(0, 2), (b'd', b'd'))
+            self.assertEqual(_exchange(2, 1), (b'd', b'd'))
+            self.assertEqual(nodes[0]._routingTables[0].rttStats()['samples'], 4)
+        finally:
+            for node in nodes:
+                for msg in node._protocol._sentMessages.values():
+                    msg[2].cancel()
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_encoding_benchmark(self):
+        bencode = encoding.Bencode()
+        binary = encoding.Binary()
+        names = ['store request', 'find node response', 'find value response']
+        loops = 3000
+        bencode_total = 0
+        binary_total = 0
+        for name, msg_primitive in zip(names, self._messages()):
+            results = {}
+            for codec_name, codec in (('bencode', bencode), ('binary', binary)):
+                t = time.time()
+                for _ in range(loops):
+                    data = codec.encode(msg_primitive, encoding='utf-8')
+                encode_time = time.time() - t
+                t = time.time()
+                for _ in range(loops):
+                    codec.decode(data, encoding='utf-8')
+                decode_time = time.time() - t
+                results[codec_name] = (len(data), loops/encode_time, loops/decode_time)
+            self.assertLess(results['binary'][0], results['bencode'][0])
+            bencode_total += 1.0/results['bencode'][1] + 1.0/results['bencode'][2]
+            binary_total += 1.0/results['binary'][1] + 1.0/results['binary'][2]
+        self.assertLess(binary_total, bencode_total)
@@ -0,0 +1,149 @@
+import os
+import time
+import random
+
+from unittest import skipUnless
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet.defer import DeferredList
+
+from bitdust_forks.entangled.kademlia import constants  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.node import MultiLayerNode  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.contact import LayeredContact  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.protocol import KademliaMultiLayerProtocol  # @UnresolvedImport
+
+_NodesCount = 200
+_DeadNodesCount = 40
+_KnownContacts = 20
+_KeysCount = 40
+
+
+class SimulatedProtocol(KademliaMultiLayerProtocol):
+
+    """
+    Delivers datagrams over loopback with a simulated per-node latency, "dead" nodes never send anything.
+    """
+
+    latency = 0.0
+    dead = False
+    delayed_writes = None
+
+    def _write(self, data, address):
+        if self.dead:
+            return False
+        if self.delayed_writes is None:
+            self.delayed_writes = []
+        self.delayed_writes = [call for call in self.delayed_writes if call.active()]
+        self.delayed_writes.append(reactor.callLater(self.latency, KademliaMultiLayerProtocol._write, self, data, address))  # @UndefinedVariable
+        return True
+
+
+class Test(TestCase):
+
+    timeout = 300
+
+    def setUp(self):
+        self.adaptive = constants.adaptiveLookups
+        rnd = random.Random(1)
+        self.nodes = []
+        self.ports = []
+        for i in range(_NodesCount):
+            n = MultiLayerNode(udpPort=0, networkProtocol=SimulatedProtocol)
+            n._protocol.latency = rnd.uniform(0.005, 0.15)
+            n._protocol.dead = i >= _NodesCount - _DeadNodesCount
+            self.ports.append(reactor.listenUDP(0, n._protocol, interface='127.0.0.1'))  # @UndefinedVariable
+            n.port = self.ports[-1].getHost().port
+            self.nodes.append(n)
+        for n in self.nodes:
+            routing_table = n._routingTables[0]
+            others = [o for o in self.nodes if o is not n]
+            rnd.shuffle(others)
+            for o in others[:_KnownContacts]:
+                contact = LayeredContact(o.layers[0], '127.0.0.1', o.port, n._protocol, layerID=0)
+                bucket_index = routing_table._kbucketIndex(contact.id)
+                bucket = routing_table._buckets[bucket_index]
+                if len(bucket) < constants.k or bucket.keyInRange(routing_table._parentNodeID):
+                    routing_table.addContact(contact)
+        self.keys = []
+        now = int(time.time())
+        for i in range(_KeysCount):
+            key = self.nodes[0]._generateID()
+            self.keys.append(key)
+            closest = sorted(self.nodes, key=lambda n: int(n.layers[0], 16) ^ int(key, 16))
+            for n in closest[:constants.k]:
+                n._dataStores[0].setItem(key, 'value %d' % i, now, now, n.layers[0], expireSeconds=600, revision=1)
+
+    def tearDown(self):
+        constants.adaptiveLookups = self.adaptive
+        for n in self.nodes:
+            # cancel timeouts of RPC calls which are still waiting for response
+            for msg in n._protocol._sentMessages.values():
+                if msg[2].active():
+                    msg[2].cancel()
+            n._protocol._sentMessages.clear()
+            for call in n._protocol.delayed_writes or []:
+                if call.active():
+                    call.cancel()
+        return DeferredList([p.stopListening() for p in self.ports])
+
+    def _lookups(self, adaptive, results):
+        constants.adaptiveLookups = adaptive
+        latencies = []
+        found = []
+        lookups = []
+        for i, key in enumerate(self.keys):
+            origin = self.nodes[(i*7) % (_NodesCount - _DeadNodesCount)]
+
+            def _done(result, started, index):
+                latencies.append(time.time() - started)
+                if isinstance(result, dict) and result.get('values'):
+                    found.append(result['values'][0][0] == 'value %d' % index)
+                return result
+
+            d = origin.iterativeFindValue(key)
+            d.addCallback(_done, time.time(), i)
+            lookups.append(d)
+
+        def _finished(_):
+            results['adaptive' if adaptive else 'fixed'] = (latencies, found)
+            return results
+
+        return DeferredList(lookups).addCallback(_finished)
+
+    def _warm_up(self):
+        return DeferredList([n.iterativeFindNode(n._generateID(), parallel_calls=constants.alphaMax) for n in self.nodes[:_NodesCount - _DeadNodesCount]])
+
+    def _report(self, results):
+        fixed_latencies, fixed_found = results['fixed']
+        adaptive_latencies, adaptive_found = results['adaptive']
+        self.assertEqual(len(fixed_found), _KeysCount)
+        self.assertEqual(len(adaptive_found), _KeysCount)
+        self.assertTrue(all(fixed_found))
+        self.assertTrue(all(adaptive_found))
+        self.assertLess(sum(adaptive_latencies), sum(fixed_latencies))
+
+    def test_rtt_estimation(self):
+        routing_table = self.nodes[0]._routingTables[0]
+        fast, slow = self.nodes[1].layers[0], self.nodes[2].layers[0]
+        self.assertEqual(routing_table.hedgeDelay(), constants.iterativeLookupDelay)
+        for _ in range(10):
+            routing_table.updateRTT(fast, 0.01)
+            routing_table.updateRTT(slow, 0.2)
+        self.assertLess(routing_table.expectedRTT(fast), routing_table.expectedRTT(slow))
+        self.assertLess(routing_table.hedgeDelay(), constants.iterativeLookupDelay)
+        self.assertEqual(routing_table.lookupConcurrency(), constants.alpha)
+        for _ in range(10):
+            routing_table.failedRPC(fast)
+        self.assertGreater(routing_table.expectedRTT(fast), routing_table.expectedRTT(slow))
+        self.assertGreater(routing_table.lookupConcurrency(), constants.alpha)
+        self.assertLessEqual(routing_table.lookupConcurrency(), constants.alphaMax)
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_lookups_benchmark(self):
+        results = {}
+        d = self._warm_up()
+        d.addCallback(lambda _: self._lookups(False, results))
+        d.addCallback(lambda _: self._lookups(True, results))
+        d.addCallback(self._report)
+        return d
@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+
+from bitdust_forks.entangled.kademlia.datastore import DictDataStore  # @UnresolvedImport
+from bitdust_forks.entangled.kademlia.republisher import RepublishScheduler  # @UnresolvedImport
+
+
+class _Contact(object):
+
+    def __init__(self, node, contact_id):
+        self.node = node
+        self.id = contact_id
+
+    def store(self, key, value, originalPublisherID, age, expireSeconds, **kwargs):
+        self.node.stored.append((self.id, key))
+        return defer.succeed('OK')
+
+
+class _Node(object):
+
+    """
+    Answers lookups from a table of "remote" replicas: key -> list of node IDs holding the value.
+    """
+
+    def __init__(self):
+        self.layers = {0: 'me'}
+        self._dataStores = {0: DictDataStore()}
+        self.replicas = {}
+        self.lookups = []
+        self.stored = []
+
+    def iterativeFindValue(self, key, layerID=0, quorum=1, validator=None):
+        self.lookups.append(key)
+        value = self._dataStores[layerID][key]
+        holders = self.replicas.get(key, [])
+        return defer.succeed({
+            key: value,
+            'values': [(value, 0, node_id, ('127.0.0.1', 14441)) for node_id in holders + ['me']],
+            'activeContacts': [_Contact(self, 'node%d' % i) for i in range(4)],
+        })
+
+    def iterativeStore(self, key, value, originalPublisherID=None, age=0, expireSeconds=0, layerID=0, **kwargs):
+        self.stored.append(('iterativeStore', key))
+        return defer.succeed([])
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(100000)
+        self.node = _Node()
+
+    def _add(self, key, value, expire_seconds=10000, original=False, scheduler=None):
+        now = int(self.clock.seconds())
+        self.node._dataStores[0].setItem(key, value, now - 3600, now - 3600, 'me' if original else 'other', expireSeconds=expire_seconds)
+        if scheduler:
+            scheduler.schedule(self.node._dataStores[0].getItem(key), layerID=0, original=original)
+
+    def test_priority_and_jitter(self):
+        importance = {'low': 0, 'high': 5, 'urgent': 0}
+        s = RepublishScheduler(self.node, priorityFunc=lambda key, value, layerID: importance[key[:-1]], jitter=100, urgency=600, freshReplicas=0, packetsPerSecond=1000, bytesPerSecond=10**6, clock=self.clock)
+        for i in range(3):
+            self._add('low%d' % i, 'x', scheduler=s)
+            self._add('high%d' % i, 'x', scheduler=s)
+        self._add('urgent0', 'x', expire_seconds=4000, scheduler=s)
+        self.assertFalse(s.schedule(self.node._dataStores[0].getItem('low0'), layerID=0))
+        self.assertEqual(s.stats()['deduplicated'], 1)
+        deadlines = [job['deadline'] - self.clock.seconds() for job in s._jobs.values()]
+        self.assertEqual(min(deadlines), 0)
+        self.assertTrue(all(0 <= d <= 100 for d in deadlines))
+        self.assertEqual(len(set(deadlines)), 7)
+        s.tick()
+        self.assertEqual(self.node.stored, [('iterativeStore', 'urgent0')])
+        self.clock.advance(100)
+        s.tick()
+        self.assertEqual([k for _, k in self.node.stored[1:]], ['high0', 'high1', 'high2', 'low0', 'low1', 'low2'])
+        self.assertEqual(s.stats()['republished'], 7)
+        self.assertEqual(s._jobs, {})
+
+    def test_budget_and_lag(self):
+        s = RepublishScheduler(self.node, jitter=0, freshReplicas=0, concurrency=100, clock=self.clock)
+        packets, size = s.cost({'size': 1000})
+        s.packetsPerSecond = packets*2
+        s.bytesPerSecond = size*10
+        s._packets, s._bytes = s.packetsPerSecond, s.bytesPerSecond
+        for i in range(10):
+            self._add('key%d' % i, 'x'*1000, scheduler=s)
+        s.tick()
+        self.assertEqual(len(self.node.stored), 2)
+        self.assertEqual(s.stats()['throttled'], 1)
+        self.assertEqual(s.stats()['backlog'], 8)
+        for _ in range(4):
+            self.clock.advance(1)
+            s.tick()
+        stats = s.stats()
+        self.assertEqual(len(self.node.stored), 10)
+        self.assertEqual(stats['republished'], 10)
+        self.assertEqual(stats['packets_spent'], packets*10)
+        self.assertEqual(stats['lag_max'], 4)
+        self.assertEqual(stats['lag_avg'], (0 + 0 + 1 + 1 + 2 + 2 + 3 + 3 + 4 + 4)/10.0)
+        self.assertEqual(stats['lag_current'], 0)
+
+    def test_skip_fresh_replicas(self):
+        s = RepublishScheduler(self.node, jitter=0, freshReplicas=2, packetsPerSecond=1000, bytesPerSecond=10**6, clock=self.clock)
+        self.node.replicas = {'fresh': ['node0', 'node1'], 'stale': ['node1']}
+        self._add('fresh', 'v1', scheduler=s)
+        self._add('stale', 'v2', scheduler=s)
+        self._add('mine', 'v3', original=True, scheduler=s)
+        s.tick()
+        stats = s.stats()
+        self.assertEqual(stats['skipped_fresh'], 1)
+        self.assertEqual(stats['republished'], 2)
+        self.assertEqual(sorted(self.node.lookups), ['fresh', 'stale'])
+        self.assertEqual(sorted(self.node.stored), [('iterativeStore', 'mine'), ('node0', 'stale'), ('node2', 'stale'), ('node3', 'stale')])
+        for key in ('fresh', 'stale', 'mine'):
+            self.assertEqual(self.node._dataStores[0].getItem(key)['lastPublished'], int(self.clock.seconds()))
+        self.assertEqual(self.node._dataStores[0].getItem('mine')['originallyPublished'], int(self.clock.seconds()))
+        self.assertEqual(self.node._dataStores[0].getItem('stale')['originallyPublished'], int(self.clock.seconds()) - 3600)
@@ -14,6 +14,8 @@ from bitdust.lib import strng
 from bitdust.userid import id_url
 from bitdust.userid import identity
 
+from bitdust.contacts import contactsdb
+
 alice_bin = b'http://127.0.0.1:8084/alice.xml'
 alice_text = 'http://127.0.0.1:8084/alice.xml'
 bob = 'http://127.0.0.1/bob.xml'
@@ -673,6 +675,63 @@ class TestIDURL(TestCase):
         self.assertEqual(id_url.field(hans2).original(), strng.to_bin(hans2))
         self.assertEqual(id_url.field(hans3).original(), strng.to_bin(hans3))
 
+    def test_interned_fields(self):
+        self._cache_identity('hans1')
+        idurl_hans1 = id_url.field(hans1)
+        self.assertIsNot(id_url.field(hans1), idurl_hans1)
+        self.assertEqual('=%r=' % id_url.field(hans1), '={http://first.com/hans.xml}=')
+        idurl_hans1.refresh(replace_original=True)
+        self.assertEqual(id_url.field(hans1).original(), strng.to_bin(hans1))
+        self._cache_identity('hans2')
+        self.assertEqual('=%r=' % id_url.field(hans1), '={*http://second.net/hans.xml}=')
+        self._cache_identity('hans3')
+        self.assertEqual('=%r=' % id_url.field(hans1), '={*http://third.org/hans.xml}=')
+        self.assertEqual(id_url.field(hans1).original(), strng.to_bin(hans1))
+        self.assertEqual(id_url.field(hans3), id_url.field(hans1))
+
+    def test_keys_set(self):
+        self._cache_identity('alice')
+        self._cache_identity('bob')
+        self._cache_identity('hans1')
+        keys = id_url.keys_set([alice_text, id_url.field(bob), hans1, '', ethan_not_exist])
+        self.assertEqual(len(keys), 5)
+        self.assertTrue(id_url.is_in_keys(alice_bin, keys))
+        self.assertTrue(id_url.is_in_keys(id_url.field(alice_text), keys))
+        self.assertTrue(id_url.is_in_keys(bob, keys))
+        self.assertTrue(id_url.is_in_keys(None, keys))
+        self.assertTrue(id_url.is_in_keys(ethan_not_exist, keys))
+        self.assertFalse(id_url.is_in_keys(carl, keys))
+        self.assertTrue(id_url.is_in_keys(hans2, keys))
+        self.assertFalse(id_url.is_in_keys(hans3, keys))
+        self._cache_identity('hans2')
+        self._cache_identity('hans3')
+        self.assertTrue(id_url.is_in_keys(hans3, keys))
+        self.assertTrue(id_url.is_in(hans3, [alice_text, hans1]))
+        self.assertTrue(id_url.is_in(id_url.field(hans3), [id_url.field(hans1)]))
+        self.assertFalse(id_url.is_in(hans3, [alice_text, bob]))
+        with self.assertRaises(KeyError):
+            id_url.is_in(alice_text, [bob, carl])
+
+    def test_contacts_keys(self):
+        self._cache_identity('alice')
+        self._cache_identity('hans1')
+        generation = id_url.keys_generation()
+        contactsdb.set_customers([alice_text, hans1])
+        self.assertTrue(contactsdb.is_customer(alice_bin))
+        self.assertTrue(contactsdb.is_customer(id_url.field(hans1)))
+        self.assertFalse(contactsdb.is_customer(bob))
+        self.assertFalse(contactsdb.is_customer(''))
+        keys = contactsdb.contacts_keys('customers', contactsdb.customers())
+        self.assertIs(contactsdb.contacts_keys('customers', contactsdb.customers()), keys)
+        self._cache_identity('hans2')
+        self.assertGreater(id_url.keys_generation(), generation)
+        self.assertIsNot(contactsdb.contacts_keys('customers', contactsdb.customers()), keys)
+        self.assertTrue(contactsdb.is_customer(hans2))
+        contactsdb.set_customers([alice_text])
+        self.assertFalse(contactsdb.is_customer(hans1))
+        contactsdb.clear_customers()
+        self.assertFalse(contactsdb.is_customer(alice_text))
+
 
 if __name__ == '__main__':
     unittest.main()
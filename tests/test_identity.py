@@ -1,4 +1,4 @@
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 import os
 
 from bitdust.logs import lg
@@ -101,3 +101,62 @@ class Test(TestCase):
         broken_identity = identity.identity(xmlsrc=_broken_identity_xml)
         self.assertTrue(broken_identity.isCorrect())
         self.assertFalse(broken_identity.Valid())
+
+    def test_identity_xml_codec_same_as_minidom(self):
+        import random
+        from xml.dom import minidom
+        from bitdust.userid import identity
+        rnd = random.Random(1234)
+        alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789 :/._-&<>\'éф'
+
+        def _rand_text(min_len=0, max_len=40):
+            return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(min_len, max_len))).strip()
+
+        for _ in range(200):
+            ident = identity.identity(xmlsrc=_some_identity_xml)
+            ident.setSources(['http://%s.com:%d/alice.xml' % (''.join(rnd.choice('abcdefgh') for _ in range(8)), rnd.randint(1, 65535)) for _ in range(rnd.randint(1, 3))])
+            ident.setContacts([_rand_text(1) for _ in range(rnd.randint(0, 4))])
+            ident.setCertificates([_rand_text() for _ in range(rnd.randint(0, 2))])
+            ident.setScrubbers([_rand_text() for _ in range(rnd.randint(0, 2))])
+            ident.setDate(_rand_text())
+            ident.setVersion(_rand_text())
+            ident.setPostage(str(rnd.randint(0, 10)))
+            ident.setRevision(rnd.randint(0, 1000))
+            ident.setSignature(_rand_text())
+            root, _ = ident.todom()
+            minidom_src = root.ownerDocument.toprettyxml(indent='  ', newl='\n', encoding='utf-8').strip()
+            self.assertEqual(ident.serialize(), minidom_src)
+            from_etree = identity.identity(xmlsrc=minidom_src)
+            from_dom = identity.identity()
+            from_dom.unserialize_object(minidom.parseString(minidom_src).documentElement)
+            self.assertEqual(from_etree.serialize_json(), from_dom.serialize_json())
+            self.assertEqual(from_etree.makehash(), from_dom.makehash())
+            self.assertEqual(from_etree.serialize(), from_dom.serialize())
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_identity_xml_codec_benchmark(self):
+        import time
+        from xml.dom import minidom
+        from bitdust.userid import identity
+        some_identity = identity.identity(xmlsrc=_some_identity_xml)
+        src = some_identity.serialize()
+        loops = 1000
+        t = time.time()
+        for _ in range(loops):
+            identity.identity(xmlsrc=src)
+        fast_parse = time.time() - t
+        t = time.time()
+        for _ in range(loops):
+            i = identity.identity()
+            i.unserialize_object(minidom.parseString(src).documentElement)
+        dom_parse = time.time() - t
+        t = time.time()
+        for _ in range(loops):
+            some_identity.serialize()
+        fast_serialize = time.time() - t
+        t = time.time()
+        for _ in range(loops):
+            some_identity.todom()[1].toprettyxml(indent='  ', newl='\n', encoding='utf-8').strip()
+        dom_serialize = time.time() - t
+        self.assertLess(fast_parse, dom_parse)
+        self.assertLess(fast_serialize, dom_serialize)
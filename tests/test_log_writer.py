@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import shutil
+import threading
+
+from unittest import TestCase, skipUnless
+
+from bitdust.logs import lg
+from bitdust.logs import log_writer
+
+_tmp_dir = '/tmp/.bitdust_tmp_log_writer'
+
+_benchmark_calls = 100000
+
+
+class _SlowStream(object):
+
+    def __init__(self):
+        self.data = []
+        self.writes = 0
+        self.threads = set()
+
+    def write(self, data):
+        time.sleep(0.001)
+        self.writes += 1
+        self.threads.add(threading.current_thread().name)
+        self.data.append(data)
+
+    def flush(self):
+        pass
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+        os.makedirs(_tmp_dir)
+        self.stdout = sys.stdout
+        lg.set_debug_level(10)
+        lg.open_log_file(os.path.join(_tmp_dir, 'stdout.log'))
+        lg._RecentEntries.clear()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        lg.set_rate_limit(0)
+        lg._Sampling.clear()
+        lg.close_log_file()
+        lg._LogFileName = None
+        lg.set_debug_level(0)
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    def test_writer(self):
+        stream = _SlowStream()
+        sys.stdout = stream
+        lg.start_writer(rotate_size=2000, rotate_count=2)
+        t = time.time()
+        for i in range(200):
+            lg.out(4, 'message number %d' % i)
+        lg.out(4, 'packet number 1', log_name='packet')
+        # the calling thread does not wait for the slow console
+        self.assertLess(time.time() - t, 0.1)
+        self.assertTrue(lg.flush())
+        for i in range(200, 300):
+            lg.out(4, 'message number %d' % i)
+        try:
+            raise ValueError('test')
+        except:
+            lg.exc()
+        self.assertTrue(lg.flush())
+        self.assertEqual(stream.threads, {'log_writer'})
+        self.assertLess(stream.writes, 20)
+        console = ''.join(stream.data)
+        self.assertIn('message number 299', console)
+        self.assertLess(console.index('message number 10'), console.index('message number 11'))
+        self.assertTrue(lg.stop_writer())
+        self.assertIsNotNone(lg.log_file())
+        lg.out(4, 'message after writer stopped')
+        files = sorted(os.listdir(_tmp_dir))
+        self.assertEqual(files, ['exception_test.log', 'packet.log', 'stdout.log', 'stdout.log.1', 'stdout.log.2'])
+        with open(os.path.join(_tmp_dir, 'stdout.log')) as f:
+            last = f.read()
+        self.assertIn('message after writer stopped', last)
+        with open(os.path.join(_tmp_dir, 'stdout.log.1')) as f:
+            self.assertIn('message number 299', f.read())
+        with open(os.path.join(_tmp_dir, 'exception_test.log')) as f:
+            self.assertIn('ValueError', f.read())
+        w = log_writer.LogWriter(queue_limit=2)
+        self.assertTrue(w.write(stream, 'a'))
+        self.assertTrue(w.write(stream, 'b'))
+        self.assertFalse(w.write(stream, 'c'))
+        w.stop()
+        self.assertEqual(w.stats()['dropped'], 1)
+        self.assertEqual(stream.data[-1], 'ab')
+
+    def test_rate_limit(self):
+        sys.stdout = _SlowStream()
+        lg.set_rate_limit(10, burst=20)
+        for i in range(100):
+            lg.out(4, 'flood %d' % i)
+        lg.err('error is never suppressed')
+        entries = lg.recent_entries(limit=1000)
+        self.assertEqual(len([e for e in entries if e['message'].startswith('flood')]), 20)
+        self.assertIn('error is never suppressed', entries[-1]['message'])
+        self.assertEqual(lg.logs_stats()['suppressed'], {__name__: 80})
+        lg._Limiters[__name__][0] = 1
+        lg.out(4, 'flood again')
+        entries = lg.recent_entries(limit=2)
+        self.assertEqual([e['message'] for e in entries], ['80 log messages from %s were suppressed' % __name__, 'flood again'])
+        self.assertEqual(lg.logs_stats()['suppressed'], {})
+        lg.set_rate_limit(0)
+        lg.set_sampling(__name__, 10)
+        for i in range(100):
+            lg.args(4, i=i)
+        self.assertEqual(len([e for e in lg.recent_entries(limit=1000) if 'test_rate_limit(i=' in e['message']]), 10)
+        self.assertEqual(lg.recent_entries(limit=1, log_name='packet'), [])
+        self.assertEqual(lg.recent_entries(limit=1, level=0)[0]['level'], 0)
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_lazy_formatting_benchmark(self):
+        lg.set_debug_level(4)
+        t = time.perf_counter()
+        for i in range(_benchmark_calls):
+            lg.args(10, i=i, data=self)
+        skipped = (time.perf_counter() - t)/_benchmark_calls
+        sys.stdout = _SlowStream()
+        lg.set_debug_level(10)
+        lg.start_writer()
+        t = time.perf_counter()
+        for i in range(_benchmark_calls//10):
+            lg.args(10, i=i)
+        printed = (time.perf_counter() - t)/(_benchmark_calls//10)
+        lg.stop_writer()
+        sys.stdout = self.stdout
+        self.assertEqual(len(lg.recent_entries(limit=_benchmark_calls)), lg._RecentEntries.maxlen)
+        self.assertLess(skipped, 0.000002)
+        self.assertLess(printed, 0.0001)
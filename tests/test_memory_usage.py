@@ -0,0 +1,106 @@
+import time
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet.defer import inlineCallbacks
+
+from bitdust.logs import memory_usage
+
+_items_count = 20000
+
+
+class _Item(object):
+
+    def __init__(self, i):
+        self.path = '/some/folder/file_%d.txt' % i
+        self.payload = b'x'*(100 + i%100)
+        self.versions = {'F%d' % v: [v, i] for v in range(3)}
+
+
+_Catalog = {}
+_Shared = []
+
+
+class _Ticker(object):
+
+    def __init__(self):
+        self.ticks = 0
+        self.max_gap = 0.0
+        self.last = time.perf_counter()
+        self.running = True
+        reactor.callLater(0, self.tick)  # @UndefinedVariable
+
+    def tick(self):
+        now = time.perf_counter()
+        self.max_gap = max(self.max_gap, now - self.last)
+        self.last = now
+        self.ticks += 1
+        if self.running:
+            reactor.callLater(0, self.tick)  # @UndefinedVariable
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        for i in range(_items_count):
+            _Catalog['ID%d' % i] = _Item(i)
+        _Shared.extend(list(_Catalog.values())[:100])
+        memory_usage.STRUCTURES['test.catalog'] = (__name__, '_Catalog')
+        memory_usage.STRUCTURES['test.shared'] = (__name__, '_Shared')
+        memory_usage.STRUCTURES['test.not_loaded'] = ('bitdust.not_existing_module', '_Data')
+        self.sample_items = memory_usage.SAMPLE_ITEMS
+
+    def tearDown(self):
+        _Catalog.clear()
+        del _Shared[:]
+        memory_usage.STRUCTURES.pop('test.catalog')
+        memory_usage.STRUCTURES.pop('test.shared')
+        memory_usage.STRUCTURES.pop('test.not_loaded')
+        memory_usage.SAMPLE_ITEMS = self.sample_items
+        memory_usage.trace_stop()
+
+    @inlineCallbacks
+    def test_collect(self):
+        memory_usage.SAMPLE_ITEMS = _items_count*2
+        exact = yield memory_usage.collect(names=['test.catalog', 'test.shared'])
+        exact_size = exact['structures']['test.catalog']['size']
+        memory_usage.SAMPLE_ITEMS = 1000
+        ticker = _Ticker()
+        d1 = memory_usage.collect(names=['test.catalog', 'test.shared', 'test.not_loaded'])
+        d2 = memory_usage.collect()
+        result = yield d1
+        ticker.running = False
+        result2 = yield d2
+        # the second caller joined the running collection
+        self.assertIs(result, result2)
+        self.assertIs(memory_usage.last_result(), result)
+        self.assertEqual(list(result['structures'].keys()), ['test.catalog', 'test.shared'])
+        info = result['structures']['test.catalog']
+        self.assertEqual(info['count'], _items_count)
+        self.assertEqual(info['sampled'], 1000)
+        self.assertEqual(exact['structures']['test.catalog']['sampled'], _items_count)
+        self.assertLess(abs(info['size'] - exact_size)/float(exact_size), 0.1)
+        self.assertGreater(info['objects'], _items_count*10)
+        # items are already counted in the catalog
+        self.assertLess(exact['structures']['test.shared']['size'], 2000)
+        self.assertGreater(ticker.ticks, 5)
+        self.assertLess(ticker.max_gap, 0.1)
+        if result['rss'] is not None:
+            self.assertGreater(result['rss'], exact_size)
+
+    @inlineCallbacks
+    def test_trace(self):
+        self.assertTrue(memory_usage.trace_start())
+        self.assertFalse(memory_usage.trace_start())
+        first = yield memory_usage.trace_snapshot(limit=5)
+        self.assertFalse(first['compared'])
+        data = [b'y'*1000 + str(i).encode() for i in range(2000)]
+        second = yield memory_usage.trace_snapshot(limit=5)
+        self.assertTrue(second['compared'])
+        top = second['top'][0]
+        self.assertIn('test_memory_usage.py', top['source'])
+        self.assertGreater(top['size_diff'], 1000*len(data))
+        self.assertGreaterEqual(top['count_diff'], len(data))
+        self.assertTrue(memory_usage.trace_stop())
+        self.assertFalse(memory_usage.trace_stop())
+        self.assertRaises(Exception, memory_usage.trace_snapshot)
@@ -0,0 +1,138 @@
+import os
+import time
+import random
+
+from unittest import skipUnless
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import reactor  # @UnresolvedImport
+from twisted.internet.defer import Deferred
+
+from bitdust.automats import automat
+from bitdust.logs import metrics
+
+_benchmark_events = 100000
+
+
+class _Switch(automat.Automat):
+
+    def A(self, event, *args, **kwargs):
+        if self.state == 'OFF':
+            if event == 'turn-on':
+                self.state = 'ON'
+        elif self.state == 'ON':
+            if event == 'turn-off':
+                self.state = 'OFF'
+            elif event == 'fail':
+                raise Exception('failed')
+        return None
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.shutdown()
+        metrics.reset()
+
+    def test_histogram(self):
+        rnd = random.Random(1)
+        values = sorted(rnd.lognormvariate(-7, 2) for _ in range(20000))
+        h = metrics.Histogram()
+        for v in values:
+            h.record(v)
+        self.assertEqual(h.count, len(values))
+        self.assertAlmostEqual(h.total, sum(values), places=6)
+        self.assertEqual(h.max, values[-1])
+        for q in metrics.QUANTILES:
+            expected = values[int(q*len(values)) - 1]
+            # values below 16 microseconds are stored precisely, others with relative error below 12.5%
+            self.assertLessEqual(abs(h.percentile(q) - expected), max(expected*0.125, 0.000002))
+        for value in range(100000):
+            index = metrics._bucket_index(value)
+            self.assertLess(value, metrics._bucket_upper_bound(index))
+            if index:
+                self.assertGreaterEqual(value, metrics._bucket_upper_bound(index - 1))
+        self.assertEqual(metrics._bucket_index(10**12), metrics._BUCKETS - 1)
+        self.assertEqual(metrics.Histogram().percentile(0.5), 0.0)
+
+    def test_automat_events(self):
+        metrics.init(probe=False, reactor_calls=False)
+        sw = _Switch('switch', 'OFF')
+        sw.event('turn-on')
+        sw.event('turn-on')
+        sw.event('fail')
+        sw.event('turn-off')
+        sw.destroy()
+        snapshot = metrics.snapshot()
+        events = {h['labels']['event']: h['count'] for h in snapshot['histograms'] if h['name'] == 'automat_event_seconds'}
+        self.assertEqual(events, {'turn-on': 2, 'fail': 1, 'turn-off': 1})
+        transitions = {(c['labels']['from'], c['labels']['to']): c['value'] for c in snapshot['counters']}
+        self.assertEqual(transitions, {('OFF', 'ON'): 1, ('ON', 'OFF'): 1})
+        metrics.on_packet('in', 'Data', 1000)
+        metrics.on_packet('in', 'Data', 24)
+        text = metrics.prometheus_text()
+        self.assertIn('# TYPE bitdust_automat_event_seconds summary', text)
+        self.assertIn('bitdust_automat_event_seconds_count{automat="_Switch",event="turn-on"} 2', text)
+        self.assertIn('bitdust_automat_transitions_total{automat="_Switch",from="OFF",to="ON"} 1', text)
+        self.assertIn('bitdust_packets_payload_bytes_total{direction="in",command="Data"} 1024', text)
+        self.assertIn('bitdust_automat_event_seconds{automat="_Switch",event="fail",quantile="0.99"}', text)
+        metrics.shutdown()
+        metrics.on_packet('in', 'Data', 1)
+        self.assertIsNone(automat._EventCallback)
+        self.assertEqual(metrics._Counters[('packets_total', ('in', 'Data'))], 2)
+
+    def test_reactor(self):
+        original_call_later = reactor.callLater  # @UndefinedVariable
+        metrics.PROBE_INTERVAL, probe_interval = 0.05, metrics.PROBE_INTERVAL
+        metrics.init()
+        test_done = Deferred()
+
+        def _busy():
+            time.sleep(0.1)
+
+        def _check():
+            try:
+                snapshot = metrics.snapshot()
+                calls = {h['labels']['callable']: h for h in snapshot['histograms'] if h['name'] == 'reactor_call_seconds'}
+                self.assertGreaterEqual(calls[metrics.callable_name(_busy)]['p50'], 0.1)
+                lag = [h for h in snapshot['histograms'] if h['name'] == 'reactor_lag_seconds'][0]
+                self.assertGreaterEqual(lag['count'], 2)
+                self.assertGreaterEqual(lag['max'], 0.04)
+                metrics.shutdown()
+                self.assertEqual(reactor.callLater, original_call_later)  # @UndefinedVariable
+            finally:
+                metrics.PROBE_INTERVAL = probe_interval
+            test_done.callback(True)
+
+        self.assertTrue(metrics.callable_name(_busy).endswith('test_metrics.Test.test_reactor.<locals>._busy'))
+        self.assertEqual(metrics.callable_name(Deferred().callback), 'twisted.internet.defer.Deferred.callback')
+        reactor.callLater(0.07, _busy)  # @UndefinedVariable
+        reactor.callLater(0.4, _check)  # @UndefinedVariable
+        return test_done
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_overhead_benchmark(self):
+        sw = _Switch('switch', 'OFF')
+        events = ['turn-on', 'turn-off']*(_benchmark_events//2)
+        t = time.perf_counter()
+        for event in events:
+            sw.event(event)
+        baseline = time.perf_counter() - t
+        metrics.init(probe=False, reactor_calls=False)
+        t = time.perf_counter()
+        for event in events:
+            sw.event(event)
+        measured = time.perf_counter() - t
+        metrics.shutdown()
+        sw.destroy()
+        h = metrics.Histogram()
+        t = time.perf_counter()
+        for i in range(_benchmark_events):
+            h.record(i*0.000001)
+        record = time.perf_counter() - t
+        overhead = (measured - baseline)/_benchmark_events
+        self.assertLess(overhead, 0.000005)
+        self.assertLess(record/_benchmark_events, 0.000002)
@@ -0,0 +1,124 @@
+import os
+import time
+
+from unittest import TestCase, skipUnless
+
+from bitdust.logs import lg
+
+from bitdust.p2p import handshaker
+from bitdust.p2p import online_status
+
+from bitdust.userid import id_url
+
+
+class _Session(object):
+
+    def __init__(self):
+        self.events = []
+
+    def automat(self, event, *args, **kwargs):
+        self.events.append(event)
+
+
+class Test(TestCase):
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        self.instances = []
+        self._find_active_sessions = online_status.find_active_sessions
+        self._handshaker_ping = handshaker.ping
+
+    def tearDown(self):
+        online_status.find_active_sessions = self._find_active_sessions
+        handshaker.ping = self._handshaker_ping
+        del online_status._PresenceQueue[:]
+        for o_status in self.instances:
+            o_status.destroy()
+
+    def _create(self, count, state='OFFLINE'):
+        for i in range(count):
+            o_status = online_status.OnlineStatus(
+                idurl='http://127.0.0.1/user%d.xml' % i,
+                name='online_user%d' % i,
+                state=state,
+            )
+            o_status.keep_alive = True
+            self.instances.append(o_status)
+        return self.instances
+
+    def test_next_check(self):
+        o_status = self._create(1)[0]
+        self.assertEqual(o_status.getNextCheck(1000), (1000 + online_status.FIRST_OFFLINE_CHECK_DELAY, 'offline-check'))
+        self.assertEqual(o_status.getNextCheck(1000, checked=True), (1000 + online_status.OFFLINE_CHECK_INTERVAL, 'offline-check'))
+        o_status.latest_inbox_time = 990
+        self.assertEqual(o_status.getNextCheck(1000), (1000 + online_status.RECENT_INBOX_CHECK_INTERVAL, 'offline-check'))
+        o_status.state = 'CONNECTED'
+        self.assertEqual(o_status.getNextCheck(1000), (1000 + online_status.CONNECTED_CHECK_INTERVAL, 'timer-1min'))
+        o_status.state = 'PING?'
+        self.assertEqual(o_status.getNextCheck(1000), (1000 + online_status.PING_TIMEOUT, 'timer-20sec'))
+        o_status.state = 'CLOSED'
+        self.assertEqual(o_status.getNextCheck(1000), (None, None))
+
+    def test_probes_limit(self):
+        instances = self._create(100)
+        for o_status in instances:
+            online_status.schedule_check(o_status, 1000, 'offline-check')
+        instances[0].check_generation += 1
+        due = online_status.pop_due_checks(now=1000, max_probes=10)
+        self.assertEqual(len(due), 10)
+        self.assertNotIn(instances[0], [o_status for o_status, _ in due])
+        self.assertEqual(len(online_status._PresenceQueue), 99)
+        fired = set(due)
+        while True:
+            due = online_status.pop_due_checks(now=1001, max_probes=10)
+            if not due:
+                break
+            fired.update(due)
+        self.assertEqual(len(fired), 99)
+        self.assertEqual(online_status._PresenceQueue[0][0], 1000 + online_status.OFFLINE_CHECK_INTERVAL)
+        instances[1].keep_alive = False
+        instances[2].state = 'PING?'
+        online_status.schedule_check(instances[1], 1002, 'offline-check')
+        online_status.schedule_check(instances[2], 1002, 'timer-20sec')
+        self.assertEqual(len(online_status.pop_due_checks(now=1002, max_probes=0)), 2)
+
+    def test_keep_alive_fallback(self):
+        o_status = self._create(1, state='CONNECTED')[0]
+        o_status.idurl = id_url.field(o_status.idurl)
+        session = _Session()
+        pings = []
+        online_status.find_active_sessions = lambda idurl: [session]
+        handshaker.ping = lambda **kwargs: pings.append(kwargs['channel'])
+        for i in range(online_status.MAX_KEEP_ALIVES_WITHOUT_INBOX):
+            o_status.event('timer-1min')
+        self.assertEqual(session.events, ['send-keep-alive']*online_status.MAX_KEEP_ALIVES_WITHOUT_INBOX)
+        self.assertEqual(pings, [])
+        # no inbox traffic after all those keep-alive packets, must verify remote node with a real handshake
+        o_status.event('timer-1min')
+        self.assertEqual(len(session.events), online_status.MAX_KEEP_ALIVES_WITHOUT_INBOX)
+        self.assertEqual(pings, ['idle_ping'])
+        o_status.keep_alives_sent = 0
+        o_status.event('timer-1min')
+        self.assertEqual(len(session.events), online_status.MAX_KEEP_ALIVES_WITHOUT_INBOX + 1)
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_many_contacts_benchmark(self):
+        contacts = 10000
+        ticks = 600
+        instances = self._create(contacts, state='CONNECTED')
+        for i, o_status in enumerate(instances):
+            online_status.schedule_check(o_status, i*(online_status.CONNECTED_CHECK_INTERVAL - 1)/float(contacts), 'timer-1min')
+        t = time.time()
+        fired = 0
+        for tick in range(ticks):
+            fired += len(online_status.pop_due_checks(now=tick + 0.5, max_probes=contacts))
+        queue_time = time.time() - t
+        t = time.time()
+        for tick in range(ticks):
+            for o_status in instances:
+                if o_status.state != 'CONNECTED':
+                    continue
+        walk_time = time.time() - t
+        self.assertLess(queue_time, walk_time)
+        self.assertEqual(fired, contacts*ticks/online_status.CONNECTED_CHECK_INTERVAL)
+        self.assertEqual(len(online_status._PresenceQueue), contacts)
@@ -0,0 +1,168 @@
+from unittest import TestCase, skipUnless
+import os
+import shutil
+
+from twisted.internet import defer
+from twisted.internet import task
+
+from bitdust.logs import lg
+
+from bitdust.stream import p2p_queue
+
+_log_dir = '/tmp/.bitdust_tmp_p2p_queue_log'
+
+
+class Test(TestCase):
+
+    queue_id = 'group_abc&alice@host.net&bob@host.net'
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        shutil.rmtree(_log_dir, ignore_errors=True)
+        self.received = {}
+        self.calls = 0
+        self.results = []
+
+    def tearDown(self):
+        for queue_id in list(p2p_queue.queue().keys()):
+            p2p_queue.close_queue(queue_id, remove_empty_consumers=True, remove_empty_producers=True)
+        for consumer_id in list(p2p_queue.consumer().keys()):
+            p2p_queue.remove_consumer(consumer_id)
+        for producer_id in list(p2p_queue.producer().keys()):
+            p2p_queue.remove_producer(producer_id)
+        shutil.rmtree(_log_dir, ignore_errors=True)
+
+    def _on_notify(self, message_info):
+        self.calls += 1
+        consumer_id = message_info['consumer_id']
+        if 'messages' in message_info:
+            self.received[consumer_id] = self.received.get(consumer_id, 0) + len(message_info['messages'])
+        else:
+            self.received[consumer_id] = self.received.get(consumer_id, 0) + 1
+        return defer.succeed(True)
+
+    def _on_notify_later(self, message_info):
+        self.calls += 1
+        self.results.append(defer.Deferred())
+        return self.results[-1]
+
+    def _start(self, consumers, batched, log_dir=None, callback=None):
+        p2p_queue.open_queue(self.queue_id, log_dir=log_dir)
+        p2p_queue.add_producer('carl@host.net')
+        p2p_queue.connect_producer('carl@host.net', self.queue_id)
+        for i in range(consumers):
+            consumer_id = 'user%d@host.net' % i
+            p2p_queue.add_consumer(consumer_id)
+            p2p_queue.add_callback_method(consumer_id, callback or self._on_notify, batched=batched)
+            p2p_queue.subscribe_consumer(consumer_id, self.queue_id)
+
+    def test_cursors(self):
+        self._start(consumers=2, batched=False)
+        p2p_queue.write_message('carl@host.net', self.queue_id, {'i': 0})
+        p2p_queue.add_consumer('late@host.net')
+        p2p_queue.add_callback_method('late@host.net', self._on_notify)
+        p2p_queue.subscribe_consumer('late@host.net', self.queue_id)
+        p2p_queue.write_message('carl@host.net', self.queue_id, {'i': 1})
+        message_ids = list(p2p_queue.queue(self.queue_id).keys())
+        self.assertEqual(p2p_queue.lookup_pending_messages('user0@host.net', self.queue_id), message_ids)
+        self.assertEqual(p2p_queue.lookup_pending_messages('late@host.net', self.queue_id), message_ids[1:])
+        self.assertEqual(p2p_queue.consumer('late@host.net').cursors[self.queue_id], message_ids[0])
+        p2p_queue.unsubscribe_consumer('user1@host.net', self.queue_id)
+        self.assertEqual(p2p_queue.queue(self.queue_id)[message_ids[0]].consumers, set(['user0@host.net']))
+        while p2p_queue.do_consume():
+            pass
+        self.assertEqual(self.received, {'user0@host.net': 2, 'late@host.net': 1})
+        self.assertEqual(len(p2p_queue.queue(self.queue_id)), 0)
+
+    def test_batch_limits(self):
+        self._start(consumers=1, batched=True)
+        for i in range(p2p_queue.MAX_QUEUE_LENGTH):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i, 'data': 'x'*1000})
+        p2p_queue.do_consume()
+        self.assertEqual(self.received['user0@host.net'], p2p_queue.MAX_NOTIFICATION_BATCH_SIZE)
+        old_limit = p2p_queue.MAX_NOTIFICATION_BATCH_BYTES
+        p2p_queue.MAX_NOTIFICATION_BATCH_BYTES = 10*1024
+        try:
+            p2p_queue.do_consume()
+        finally:
+            p2p_queue.MAX_NOTIFICATION_BATCH_BYTES = old_limit
+        self.assertEqual(self.calls, 2)
+        self.assertLess(self.received['user0@host.net'], p2p_queue.MAX_NOTIFICATION_BATCH_SIZE + 11)
+
+    def test_batch_pending_released(self):
+        self._start(consumers=1, batched=True, callback=self._on_notify_later)
+        for i in range(3):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+        p2p_queue.do_consume()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 1)
+        # message was removed while the batch was still in progress
+        p2p_queue.pull_message(self.queue_id, list(p2p_queue.queue(self.queue_id).keys())[0])
+        self.results[0].callback(True)
+        self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 0)
+        self.assertEqual(len(p2p_queue.queue(self.queue_id)), 0)
+        p2p_queue.write_message('carl@host.net', self.queue_id, {'i': 3})
+        p2p_queue.do_consume()
+        self.assertEqual(self.calls, 2)
+
+    def test_notification_removed_and_timeout(self):
+        clock = task.Clock()
+        original_reactor = p2p_queue.reactor
+        p2p_queue.reactor = clock
+        try:
+            self._start(consumers=1, batched=False, callback=self._on_notify_later)
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': 0})
+            p2p_queue.do_consume()
+            self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 1)
+            p2p_queue.pull_message(self.queue_id, list(p2p_queue.queue(self.queue_id).keys())[0])
+            self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 0)
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': 1})
+            p2p_queue.do_consume()
+            self.assertEqual(self.calls, 2)
+            self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 1)
+            # consumer never responded
+            clock.advance(p2p_queue.NOTIFICATION_TIMEOUT)
+            self.assertEqual(p2p_queue.consumer('user0@host.net').pending[self.queue_id], 0)
+            self.assertEqual(p2p_queue.consumer('user0@host.net').failed_notifications, 1)
+            self.assertEqual(len(p2p_queue.queue(self.queue_id)), 0)
+            # late response is ignored
+            self.results[-1].callback(True)
+        finally:
+            p2p_queue.reactor = original_reactor
+
+    def test_offsets_saved_later(self):
+        clock = task.Clock()
+        original_reactor = p2p_queue.reactor
+        p2p_queue.reactor = clock
+        try:
+            self._start(consumers=2, batched=False, log_dir=_log_dir)
+            for i in range(5):
+                p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+            while p2p_queue.do_consume():
+                pass
+            self.assertEqual(self.received, {'user0@host.net': 5, 'user1@host.net': 5})
+            queue_log = p2p_queue.queue_log(self.queue_id)
+            # offsets of all delivered messages are written to the disk at once
+            self.assertTrue(queue_log.offsets_modified)
+            self.assertFalse(os.path.isfile(os.path.join(_log_dir, 'offsets')))
+            clock.advance(p2p_queue.QUEUE_LOG_OFFSETS_SAVE_DELAY)
+            self.assertFalse(queue_log.offsets_modified)
+            self.assertTrue(os.path.isfile(os.path.join(_log_dir, 'offsets')))
+            self.assertEqual(queue_log.committed('user0@host.net'), queue_log.next_offset())
+        finally:
+            p2p_queue.reactor = original_reactor
+
+    @skipUnless(os.environ.get('BITDUST_BENCHMARKS'), 'set BITDUST_BENCHMARKS=1 to run benchmarks')
+    def test_many_consumers_benchmark(self):
+        consumers = 1000
+        messages = 1000
+        self._start(consumers=consumers, batched=True, log_dir=_log_dir)
+        for i in range(messages):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+        ticks = 0
+        while p2p_queue.do_consume():
+            ticks += 1
+        delivered = sum(self.received.values())
+        self.assertEqual(delivered, consumers*messages)
+        self.assertLessEqual(ticks, messages/p2p_queue.MAX_NOTIFICATION_BATCH_SIZE*2)
+        self.assertEqual(len(p2p_queue.queue(self.queue_id)), 0)
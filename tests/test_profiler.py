@@ -0,0 +1,66 @@
+import time
+import json
+import threading
+
+from unittest import TestCase
+
+from bitdust.logs import profiler
+
+
+def _busy_loop(seconds):
+    finish = time.time() + seconds
+    x = 0
+    while time.time() < finish:
+        x += sum(i*i for i in range(1000))
+    return x
+
+
+def _sleeping_worker(stop_event):
+    stop_event.wait(10)
+
+
+class Test(TestCase):
+
+    def tearDown(self):
+        profiler.shutdown()
+
+    def test_sampling(self):
+        stop_event = threading.Event()
+        worker = threading.Thread(target=_sleeping_worker, args=(stop_event, ), name='raid_worker_test')
+        worker.start()
+        self.assertTrue(profiler.start(hz=200, duration=60, threads=['MainThread', 'raid_worker_test']))
+        self.assertFalse(profiler.start())
+        _busy_loop(0.5)
+        self.assertTrue(profiler.stop())
+        stop_event.set()
+        worker.join()
+        status = profiler.status()
+        self.assertFalse(status['running'])
+        self.assertGreater(status['samples'], 50)
+        self.assertEqual(status['threads'], ['MainThread', 'raid_worker_test'])
+        self.assertLess(status['overhead'], 0.05)
+        p = profiler.profiler()
+        top = p.top(limit=5)
+        self.assertTrue(any(t['function'].startswith('_busy_loop ') or t['function'].startswith('<genexpr> ') for t in top[:2]))
+        collapsed = p.collapsed()
+        busy_line = [l for l in collapsed.splitlines() if l.startswith('MainThread;') and '_busy_loop (test_profiler.py:' in l][0]
+        self.assertGreater(int(busy_line.rsplit(' ', 1)[1]), 0)
+        self.assertTrue(any(l.startswith('raid_worker_test;') and '_sleeping_worker' in l for l in collapsed.splitlines()))
+        speedscope = json.loads(json.dumps(p.speedscope()))
+        self.assertEqual(speedscope['$schema'], 'https://www.speedscope.app/file-format-schema.json')
+        names = [f['name'] for f in speedscope['shared']['frames']]
+        self.assertIn('_busy_loop', names)
+        for prof in speedscope['profiles']:
+            self.assertEqual(prof['type'], 'sampled')
+            self.assertEqual(len(prof['samples']), len(prof['weights']))
+            self.assertTrue(all(0 <= i < len(names) for stack in prof['samples'] for i in stack))
+
+    def test_duration(self):
+        self.assertEqual(profiler.status(), {'running': False})
+        profiler.start(hz=50, duration=0.2, threads=['MainThread'])
+        time.sleep(0.5)
+        status = profiler.status()
+        self.assertFalse(status['running'])
+        self.assertLess(status['elapsed'], 0.4)
+        self.assertEqual(status['threads'], ['MainThread'])
+        self.assertFalse(profiler.stop())
@@ -0,0 +1,189 @@
+from unittest import TestCase
+import os
+import shutil
+
+from twisted.internet import defer
+
+from bitdust.logs import lg
+
+from bitdust.lib import segmented_log
+
+from bitdust.stream import p2p_queue
+
+_log_dir = '/tmp/.bitdust_tmp_segmented_log'
+
+
+class TestSegmentedLog(TestCase):
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        shutil.rmtree(_log_dir, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(_log_dir, ignore_errors=True)
+
+    def test_append_read(self):
+        log = segmented_log.SegmentedLog(_log_dir, max_segment_size=1024)
+        for i in range(100):
+            self.assertEqual(log.append(b'record %d' % i, timestamp=i), i)
+        self.assertGreater(len(log.segments), 1)
+        records = log.read(45, limit=10)
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[0], (45, 45.0, b'record 45'))
+        self.assertEqual(records[-1][0], 54)
+        self.assertEqual(len(log.read(95, limit=10)), 5)
+        self.assertEqual(log.read(100), [])
+        log.close()
+        log = segmented_log.SegmentedLog(_log_dir, max_segment_size=1024)
+        self.assertEqual(len(log), 100)
+        self.assertEqual(log.append(b'record 100'), 100)
+        log.close()
+
+    def test_retention(self):
+        log = segmented_log.SegmentedLog(_log_dir, max_segment_size=1024, max_size=4096)
+        for i in range(1000):
+            log.append(b'x'*50, timestamp=i)
+        self.assertLessEqual(log.total_size(), 4096 + 1024 + 100)
+        self.assertGreater(log.first_offset(), 0)
+        self.assertEqual(log.next_offset(), 1000)
+        self.assertEqual(log.read(0, limit=1)[0][0], log.first_offset())
+        self.assertEqual(log.retention(now=1000000), 0)
+        log.max_age = 60
+        log.retention(now=1000000)
+        self.assertEqual(len(log.segments), 1)
+        log.close()
+
+    def test_crash_recovery(self):
+        log = segmented_log.SegmentedLog(_log_dir)
+        for i in range(10):
+            log.append(b'record %d' % i)
+        log.commit('alice@host.net', 5)
+        log.close()
+        segment_path = log.segments[-1].filepath
+        full_size = os.path.getsize(segment_path)
+        with open(segment_path, 'ab') as f:
+            f.write(b'\x00\x01\x02 partially written record')
+        log = segmented_log.SegmentedLog(_log_dir)
+        self.assertEqual(len(log), 10)
+        self.assertEqual(os.path.getsize(segment_path), full_size)
+        self.assertEqual(log.committed('alice@host.net'), 5)
+        self.assertEqual(log.append(b'record 10'), 10)
+        log.close()
+        with open(segment_path, 'r+b') as f:
+            f.seek(full_size - 3)
+            f.write(b'zzz')
+        log = segmented_log.SegmentedLog(_log_dir)
+        self.assertEqual(len(log), 9)
+        self.assertEqual(log.read(8)[0][2], b'record 8')
+        self.assertEqual(log.append(b'record 9'), 9)
+        log.close()
+
+    def test_sync(self):
+        log = segmented_log.SegmentedLog(_log_dir, max_segment_size=1024, max_age=60, sync_interval=3600)
+        for i in range(100):
+            log.append(b'record %d' % i, timestamp=i)
+        synced = log.last_sync_time
+        log.append(b'record 100', timestamp=100)
+        self.assertEqual(log.last_sync_time, synced)
+        log.last_sync_time -= 3600
+        log.append(b'record 101', timestamp=101)
+        self.assertGreater(log.last_sync_time, synced)
+        # expired segments are also removed without rolling a new segment
+        self.assertEqual(len(log.segments), 1)
+        log.commit('alice@host.net', 102)
+        log.last_sync_time = 0
+        self.assertTrue(log.save_offsets())
+        self.assertGreater(log.last_sync_time, 0)
+        log.close()
+
+
+class TestDurableQueue(TestCase):
+
+    queue_id = 'group_abc&alice@host.net&bob@host.net'
+
+    def setUp(self):
+        lg.set_debug_level(0)
+        shutil.rmtree(_log_dir, ignore_errors=True)
+        self.received = []
+
+    def tearDown(self):
+        for queue_id in list(p2p_queue.queue().keys()):
+            p2p_queue.close_queue(queue_id, remove_empty_consumers=True, remove_empty_producers=True)
+        shutil.rmtree(_log_dir, ignore_errors=True)
+
+    def _on_notify(self, message_info):
+        self.received.append(message_info['payload']['i'])
+        return defer.succeed(True)
+
+    def _on_notify_failed(self, message_info):
+        self.failed.append(message_info['payload']['i'])
+        return defer.succeed(False)
+
+    def _start(self, failing_consumer=False):
+        p2p_queue.open_queue(self.queue_id, log_dir=_log_dir)
+        p2p_queue.add_producer('carl@host.net')
+        p2p_queue.connect_producer('carl@host.net', self.queue_id)
+        p2p_queue.add_consumer('dave@host.net')
+        p2p_queue.add_callback_method('dave@host.net', self._on_notify)
+        p2p_queue.subscribe_consumer('dave@host.net', self.queue_id)
+        if failing_consumer:
+            p2p_queue.add_consumer('erin@host.net')
+            p2p_queue.add_callback_method('erin@host.net', self._on_notify_failed)
+            p2p_queue.subscribe_consumer('erin@host.net', self.queue_id)
+
+    def _stop(self):
+        p2p_queue.close_queue(self.queue_id, remove_empty_consumers=True, remove_empty_producers=True)
+
+    def test_window_and_restart(self):
+        self._start()
+        for i in range(300):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+        self.assertEqual(len(p2p_queue.queue(self.queue_id)), p2p_queue.MAX_QUEUE_LENGTH)
+        for _ in range(120):
+            p2p_queue.do_consume()
+        self.assertEqual(self.received, list(range(120)))
+        self._stop()
+        self._start()
+        while p2p_queue.do_consume():
+            pass
+        self.assertEqual(self.received, list(range(300)))
+        self.assertEqual(p2p_queue.queue_log(self.queue_id).committed('dave@host.net'), 300)
+        self._stop()
+
+    def test_failed_consumer_not_committed(self):
+        self.failed = []
+        self._start(failing_consumer=True)
+        for i in range(10):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+        while p2p_queue.do_consume():
+            pass
+        p2p_queue.do_cleanup()
+        self.assertEqual(self.received, list(range(10)))
+        self.assertEqual(self.failed, list(range(10)))
+        self.assertEqual(p2p_queue.queue_log(self.queue_id).committed('dave@host.net'), 10)
+        self.assertEqual(p2p_queue.queue_log(self.queue_id).committed('erin@host.net'), 0)
+        self._stop()
+        # after restart messages are only delivered to the consumer who did not receive them
+        self.failed = []
+        self._start(failing_consumer=True)
+        while p2p_queue.do_consume():
+            pass
+        self.assertEqual(self.received, list(range(10)))
+        self.assertEqual(self.failed, list(range(10)))
+        self._stop()
+
+    def test_commit_stops_at_pending_message(self):
+        self._start()
+        for i in range(5):
+            p2p_queue.write_message('carl@host.net', self.queue_id, {'i': i})
+        messages = list(p2p_queue.queue(self.queue_id).values())
+        # the second message is delivered first, but the first one is still pending
+        messages[1].state = 'SENT'
+        messages[1].success_notifications.add('dave@host.net')
+        p2p_queue.do_cleanup()
+        self.assertEqual(p2p_queue.queue_log(self.queue_id).committed('dave@host.net'), 0)
+        messages[0].state = 'SENT'
+        messages[0].success_notifications.add('dave@host.net')
+        p2p_queue.do_cleanup()
+        self.assertEqual(p2p_queue.queue_log(self.queue_id).committed('dave@host.net'), 1)
+        self._stop()